@@ -0,0 +1,237 @@
+# encoding: utf-8
+"""
+bandwidth.py
+
+Sharing of the uplink of a transfer node between the depositors that run on it at the same time.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import errno
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_REGISTRY = os.path.join(tempfile.gettempdir(), 'empiar_depositor_bandwidth.json')
+# Seconds between the updates of the registry by a running transfer
+HEARTBEAT_INTERVAL = 10
+# Transfers that have not updated the registry for this number of seconds are considered finished
+STALE_AFTER = 6 * HEARTBEAT_INTERVAL
+# The relative change of the share that is worth restarting the transfer
+REBALANCE_THRESHOLD = 0.1
+# The minimum number of seconds between the restarts of a transfer because of the changes of its share
+MIN_RESTART_INTERVAL = 60
+MIN_RATE = 1
+
+
+def is_process_running(pid):
+    """
+    :param pid: process ID on this host
+    :return: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # The process exists but belongs to another user
+        return e.errno == errno.EPERM
+    return True
+
+
+class BandwidthScheduler:
+    """
+    The :class:`BandwidthScheduler <BandwidthScheduler>` object splits the total rate of the host between the active
+    transfers in proportion to their priorities. The transfers of all depositors on the host are kept in a registry
+    file that is locked while it is read and updated, so no broker process is needed. Transfers of processes that
+    have exited or stopped updating the registry are dropped from it.
+    """
+
+    def __init__(self, total_rate, priority=1, registry=DEFAULT_REGISTRY):
+        """
+        :param total_rate: the rate in Mbps that is shared by all transfers on the host
+        :param priority: the weight of the transfers of this depositor
+        :param registry: the location of the registry file that is shared by the depositors
+        """
+        self.total_rate = total_rate
+        self.priority = priority
+        self.registry = registry
+
+    @staticmethod
+    def is_available():
+        """
+        :return: True if the registry file can be locked on this platform
+        """
+        return fcntl is not None
+
+    @contextmanager
+    def locked_transfers(self):
+        """
+        Lock the registry and read the active transfers. The transfers are written back when the block ends
+        :return: dictionary of the active transfers by their ID
+        """
+        try:
+            fd = os.open(self.registry, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+            # The depositors of the other users on the host have to be able to update the registry despite the umask
+            os.fchmod(fd, 0o666)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            fd = os.open(self.registry, os.O_RDWR)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                try:
+                    transfers = json.loads(f.read() or '{}')
+                except ValueError:
+                    transfers = {}
+
+                now = time.time()
+                for transfer_id in list(transfers):
+                    transfer = transfers[transfer_id]
+                    if now - transfer.get('heartbeat', 0) > STALE_AFTER or \
+                            not is_process_running(transfer.get('pid', 0)):
+                        del transfers[transfer_id]
+
+                yield transfers
+
+                f.seek(0)
+                f.truncate()
+                json.dump(transfers, f)
+                f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def get_share(self, transfers, transfer_id, total_rate=None):
+        """
+        :param transfers: dictionary of the active transfers
+        :param transfer_id: the ID of the transfer
+        :param total_rate: the rate in Mbps that is shared, the total rate of the scheduler by default
+        :return: the rate of the transfer in Mbps
+        """
+        total_priority = sum(transfer['priority'] for transfer in transfers.values())
+        share = (total_rate or self.total_rate) * transfers[transfer_id]['priority'] / float(total_priority)
+        return max(MIN_RATE, int(share))
+
+    def register(self, log=None):
+        """
+        Add a transfer to the registry
+        :param log: function that reports the errors
+        :return: the ID of the transfer and its rate in Mbps. If the registry cannot be used the ID is None and the
+        transfer gets the total rate
+        """
+        transfer_id = uuid.uuid4().hex
+        try:
+            with self.locked_transfers() as transfers:
+                transfers[transfer_id] = {'pid': os.getpid(), 'priority': self.priority, 'heartbeat': time.time()}
+                return transfer_id, self.get_share(transfers, transfer_id)
+        except (IOError, OSError) as e:
+            if log is not None:
+                log("Could not register the transfer in the bandwidth registry, the host rate is not shared: %s\n" %
+                    e, error=True)
+            return None, self.total_rate
+
+    def heartbeat(self, transfer_id, total_rate=None):
+        """
+        Confirm that the transfer is still running
+        :param transfer_id: the ID of the transfer
+        :param total_rate: the rate in Mbps that is shared at the moment, the total rate of the scheduler by default
+        :return: the current rate of the transfer in Mbps
+        """
+        with self.locked_transfers() as transfers:
+            transfers[transfer_id] = {'pid': os.getpid(), 'priority': self.priority, 'heartbeat': time.time()}
+            return self.get_share(transfers, transfer_id, total_rate)
+
+    def unregister(self, transfer_id, log=None):
+        """
+        Remove the transfer from the registry so that its share goes to the other transfers. A transfer that cannot be
+        removed is dropped from the registry once it stops updating it
+        :param transfer_id: the ID of the transfer
+        :param log: function that reports the errors
+        """
+        try:
+            with self.locked_transfers() as transfers:
+                transfers.pop(transfer_id, None)
+        except (IOError, OSError) as e:
+            if log is not None:
+                log("Could not update the bandwidth registry: %s\n" % e, error=True)
+
+    @staticmethod
+    def needs_restart(current_rate, new_rate, restarted, now=None):
+        """
+        Decide whether a running transfer is to be restarted with its new rate. Small changes and frequent restarts
+        cost more than they gain, but a transfer is paused and resumed at once
+        :param current_rate: the rate the transfer runs with
+        :param new_rate: the current rate of the transfer, 0 if it is to be paused
+        :param restarted: the time the transfer has been started with its current rate
+        :param now: current time as seconds since epoch
+        :return: True if the transfer is to be restarted
+        """
+        if now is None:
+            now = time.time()
+        if new_rate != current_rate and 0 in (new_rate, current_rate):
+            return True
+        return abs(new_rate - current_rate) > REBALANCE_THRESHOLD * current_rate and \
+            now - restarted >= MIN_RESTART_INTERVAL
+
+
+class TransferMonitor(threading.Thread):
+    """
+    The :class:`TransferMonitor <TransferMonitor>` thread checks the rate a running transfer is allowed to use and
+    interrupts the transfer when the rate has changed enough to restart it with the new rate or to pause it
+    """
+
+    def __init__(self, get_rate, rate, interrupt, log):
+        """
+        :param get_rate: function that returns the current rate in Mbps, 0 if the transfer is to be paused
+        :param rate: the rate in Mbps the transfer runs with
+        :param interrupt: function that stops the transfer
+        :param log: function that reports the errors
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.get_rate = get_rate
+        self.rate = rate
+        self.interrupt = interrupt
+        self.log = log
+        self.started = time.time()
+        self.new_rate = None
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(HEARTBEAT_INTERVAL):
+            try:
+                rate = self.get_rate()
+            except (IOError, OSError) as e:
+                self.log("Could not update the bandwidth registry: %s\n" % e, error=True)
+                continue
+
+            if BandwidthScheduler.needs_restart(self.rate, rate, self.started):
+                self.new_rate = rate
+                self.interrupt()
+                return
+
+    def finish(self):
+        """
+        Stop the monitoring once the transfer has ended
+        """
+        self.finished.set()
+        self.join()
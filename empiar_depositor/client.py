@@ -0,0 +1,183 @@
+# encoding: utf-8
+"""
+client.py
+
+Thin command line client of the resident EMPIAR depositor (see daemon.py). It only talks to the daemon over a Unix
+socket, so it starts quickly and does not import the heavy modules used for the deposition itself.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from getpass import getpass
+
+DEFAULT_SOCKET = os.environ.get('EMPIAR_DEPOSITOR_SOCKET') or \
+    os.path.join(os.path.expanduser('~'), '.empiar_depositor', 'daemon.sock')
+
+# Job states after which the job will not run again unless it is resumed
+DONE_STATES = ('finished', 'failed', 'cancelled', 'paused')
+
+
+def send_request(socket_path, request):
+    """
+    Send a request to the daemon and read its reply
+    :param socket_path: the location of the Unix socket of the daemon
+    :param request: a dictionary with the 'command' key and the command arguments
+    :return: the reply of the daemon as a dictionary
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + '\n').encode('utf8'))
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    finally:
+        sock.close()
+
+    return json.loads(reply.decode('utf8'))
+
+
+def format_job(job):
+    """
+    :param job: job description as returned by the daemon
+    :return: one line summary of the job
+    """
+    return "%s\t%s\tentry ID: %s\tentry directory: %s\treturn code: %s\n" % (
+        job['id'], job['state'], job['entry_id'], job['entry_directory'], job['return_code'])
+
+
+def wait_for_job(socket_path, job_id, poll_interval=2.0):
+    """
+    Print the output of the job until it stops running
+    :param socket_path: the location of the Unix socket of the daemon
+    :param job_id: job ID
+    :param poll_interval: number of seconds between the requests to the daemon
+    :return: the return code of the job
+    """
+    offset = 0
+    while True:
+        reply = send_request(socket_path, {'command': 'log', 'job_id': job_id, 'offset': offset})
+        if not reply['ok']:
+            sys.stdout.write(reply['error'] + '\n')
+            return 1
+
+        for line in reply['lines']:
+            sys.stdout.write(line)
+        sys.stdout.flush()
+        offset = reply['offset']
+
+        if reply['job']['state'] in DONE_STATES:
+            return_code = reply['job']['return_code']
+            return return_code if return_code is not None else 1
+        time.sleep(poll_interval)
+
+
+def main(args=None):
+    """
+    Send a command to the resident EMPIAR depositor
+    """
+    parser = argparse.ArgumentParser(prog="empiar-depositor-client",
+                                     description="Submit depositions to the resident EMPIAR depositor and control "
+                                                 "them. Start the daemon with empiar-depositor-daemon.")
+    parser.add_argument("--socket", action="store", default=DEFAULT_SOCKET, dest="socket",
+                        help="The location of the Unix socket of the daemon.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a deposition. The arguments are the same as for "
+                                                         "empiar-depositor.")
+    submit_parser.add_argument("--wait", action="store_true", default=False,
+                               help="Print the output of the deposition and wait for it to finish.")
+    submit_parser.add_argument("--ask-password", action="store_true", default=False, dest="ask_password",
+                               help="Prompt for the EMPIAR password, which is then used for basic authentication.")
+    submit_parser.add_argument("deposition_args", nargs=argparse.REMAINDER,
+                               help="empiar-depositor arguments, e.g. -a ASCP EMPIAR_TOKEN JSON_INPUT DATA")
+
+    status_parser = subparsers.add_parser("status", help="Show the state of one or all jobs.")
+    status_parser.add_argument("job_id", nargs="?", default=None)
+
+    for command, help_text in (("log", "Print the output of the job."),
+                               ("wait", "Print the output of the job and wait for it to finish."),
+                               ("pause", "Pause the job. A running transfer is stopped and continues from where it "
+                                         "stopped once the job is resumed."),
+                               ("resume", "Resume a paused job."),
+                               ("cancel", "Cancel the job.")):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument("job_id")
+
+    subparsers.add_parser("shutdown", help="Stop the daemon once the running jobs have been stopped.")
+
+    if args is None:
+        args = sys.argv[1:]
+    args = parser.parse_args(args)
+
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    request = {'command': args.command}
+    if args.command == 'submit':
+        deposition_args = args.deposition_args
+        if deposition_args and deposition_args[0] == '--':
+            deposition_args = deposition_args[1:]
+        request['args'] = deposition_args
+        request['cwd'] = os.getcwd()
+        request['transfer_pass'] = os.environ.get('EMPIAR_TRANSFER_PASS')
+        if args.ask_password:
+            request['password'] = getpass('Please enter your EMPIAR password to continue:\n')
+    elif args.command == 'wait':
+        try:
+            return wait_for_job(args.socket, args.job_id)
+        except (IOError, OSError) as e:
+            sys.stdout.write("Could not connect to the EMPIAR depositor daemon at %s: %s\n" % (args.socket, e))
+            return 1
+    elif getattr(args, 'job_id', None):
+        request['job_id'] = args.job_id
+
+    try:
+        reply = send_request(args.socket, request)
+    except (IOError, OSError) as e:
+        sys.stdout.write("Could not connect to the EMPIAR depositor daemon at %s: %s\n" % (args.socket, e))
+        return 1
+
+    if not reply['ok']:
+        sys.stdout.write(reply['error'] + '\n')
+        return 1
+
+    if args.command == 'submit':
+        sys.stdout.write("Submitted job %s\n" % reply['job']['id'])
+        if args.wait:
+            return wait_for_job(args.socket, reply['job']['id'])
+    elif args.command == 'log':
+        for line in reply['lines']:
+            sys.stdout.write(line)
+    elif 'jobs' in reply:
+        for job in reply['jobs']:
+            sys.stdout.write(format_job(job))
+    elif 'job' in reply:
+        sys.stdout.write(format_job(reply['job']))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,452 @@
+# encoding: utf-8
+"""
+compress.py
+
+Lossless compression of MRC and TIFF movies into compressed TIFF ahead of the transfer.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import collections
+import json
+import multiprocessing
+import os
+import re
+import struct
+
+from empiar_depositor.watch import get_local_directory, is_within, list_files
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+
+# Compression methods and the Python modules they require. Deflate is supported by tifffile itself, LZW and Zstandard
+# require imagecodecs.
+COMPRESSION_METHODS = {
+    'deflate': ('zlib', ()),
+    'lzw': ('lzw', ('imagecodecs',)),
+    'zstd': ('zstd', ('imagecodecs',)),
+}
+MRC_EXTENSIONS = ('.mrc', '.mrcs')
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+MOVIE_EXTENSIONS = MRC_EXTENSIONS + TIFF_EXTENSIONS
+# MRC modes that are stored without loss in TIFF
+MRC_MODES = {0: 'i1', 1: 'i2', 2: 'f4', 6: 'u2', 12: 'f2'}
+MRC_HEADER_SIZE = 1024
+# Private TIFF tag that keeps the MRC header and extended header of a converted movie
+MRC_HEADER_TAG = 65000
+# Larger files are written as BigTIFF as they may not fit into 4 GB if they do not compress well
+BIGTIFF_SIZE = 2 ** 31
+# Image set data and header formats: 'T1' - MRC, 'T2' - MRCS, 'T3' - TIFF
+MOVIE_FORMATS = ('T1', 'T2', 'T3')
+TIFF_FORMAT = "('T3', '')"
+
+
+def compression_available(method):
+    """
+    :param method: compression method, one of COMPRESSION_METHODS
+    :return: None if the method can be used, otherwise the list of missing Python modules
+    """
+    required = ['numpy', 'tifffile'] + list(COMPRESSION_METHODS[method][1])
+    missing = []
+    for module in required:
+        try:
+            __import__(module)
+        except ImportError:
+            missing.append(module)
+    return missing or None
+
+
+def format_code(value):
+    """
+    :param value: image set format from the deposition JSON, e.g. "('T1', '')"
+    :return: the format code, e.g. 'T1', or None
+    """
+    match = re.match(r"\('(\w+)'", value or '')
+    return match.group(1) if match else None
+
+
+def is_movie_imageset(imageset):
+    """
+    :param imageset: image set from the deposition JSON
+    :return: True if the image set consists of MRC or TIFF movies
+    """
+    return format_code(imageset.get('data_format')) in MOVIE_FORMATS and (imageset.get('frames_per_image') or 1) > 1
+
+
+def can_convert(path):
+    """
+    :param path: the location of an MRC or TIFF movie
+    :return: True if the movie is a TIFF once it has been uploaded, either as it is or compressed
+    """
+    if os.path.splitext(path)[1].lower() in TIFF_EXTENSIONS:
+        return True
+    try:
+        Movie(path).close()
+    except (ValueError, IOError, OSError):
+        return False
+    return True
+
+
+def update_imageset_formats(json_input, data, json_output):
+    """
+    Write a copy of the deposition JSON in which the formats of the movie image sets within the data are TIFF. An
+    image set is changed only if all of its MRC movies can be converted, the others are uploaded as they are
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :param json_output: the location of the updated JSON
+    :return: the local directories of the updated image sets
+    """
+    data = os.path.abspath(data)
+    with open(json_input) as f:
+        deposition = json.load(f)
+
+    directories = []
+    for imageset in deposition.get('imagesets') or []:
+        if not imageset.get('directory') or not is_movie_imageset(imageset):
+            continue
+        local_directory = get_local_directory(imageset['directory'], data)
+        if is_within(local_directory, data):
+            directory = local_directory
+        elif is_within(data, local_directory):
+            directory = data
+        else:
+            continue
+
+        movies = [path for path in list_files(directory) if os.path.splitext(path)[1].lower() in MOVIE_EXTENSIONS] \
+            if os.path.exists(directory) else []
+        if all(can_convert(path) for path in movies):
+            imageset['data_format'] = TIFF_FORMAT
+            if format_code(imageset.get('header_format')) in MOVIE_FORMATS:
+                imageset['header_format'] = TIFF_FORMAT
+            directories.append(directory)
+
+    directory = os.path.dirname(json_output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(json_output, 'w') as f:
+        json.dump(deposition, f, indent=2)
+    return directories
+
+
+class Movie:
+    """
+    The :class:`Movie <Movie>` object reads the frames of an uncompressed MRC or TIFF movie one at a time
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the location of the movie
+        :raises ValueError: if the file is not an uncompressed MRC or TIFF movie
+        """
+        self.path = path
+        self.tiff = None
+        self.mrc = None
+        # The MRC header with its extended header and the pixel size in Å
+        self.mrc_header = None
+        self.pixel_size = None
+        extension = os.path.splitext(path)[1].lower()
+        if extension in MRC_EXTENSIONS:
+            self.mrc = self.open_mrc(path)
+            self.mrc_header, self.pixel_size = self.read_mrc_metadata(path)
+        elif extension in TIFF_EXTENSIONS:
+            self.tiff = tifffile.TiffFile(path)
+            if any(page.compression != 1 for page in self.tiff.pages):
+                self.close()
+                raise ValueError("%s is already compressed" % path)
+        else:
+            raise ValueError("%s is not an MRC or TIFF file" % path)
+
+    @staticmethod
+    def open_mrc(path):
+        with open(path, 'rb') as f:
+            header = f.read(MRC_HEADER_SIZE)
+        if len(header) < MRC_HEADER_SIZE:
+            raise ValueError("%s is too short for an MRC file" % path)
+
+        # The machine stamp is 0x11 0x11 for big-endian and 0x44 0x41 or 0x44 0x44 for little-endian data
+        byte_order = '>' if header[212:213] == b'\x11' else '<'
+        nx, ny, nz, mode = struct.unpack(byte_order + '4i', header[:16])
+        extended_header_size = struct.unpack(byte_order + 'i', header[92:96])[0]
+        if mode not in MRC_MODES:
+            raise ValueError("MRC mode %d of %s is not supported" % (mode, path))
+
+        dtype = numpy.dtype(byte_order + MRC_MODES[mode])
+        offset = MRC_HEADER_SIZE + extended_header_size
+        if extended_header_size < 0 or os.path.getsize(path) < offset + nx * ny * nz * dtype.itemsize:
+            raise ValueError("%s is shorter than its MRC header specifies" % path)
+        return numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(nz, ny, nx))
+
+    @staticmethod
+    def read_mrc_metadata(path):
+        """
+        :param path: the location of an MRC file whose header has been checked by open_mrc
+        :return: the MRC header with its extended header and the pixel size in Å or None if the header has no cell
+        """
+        with open(path, 'rb') as f:
+            header = f.read(MRC_HEADER_SIZE)
+            byte_order = '>' if header[212:213] == b'\x11' else '<'
+            header += f.read(struct.unpack(byte_order + 'i', header[92:96])[0])
+
+        # The size of the cell in Å divided by the number of pixels along it
+        sampling = struct.unpack(byte_order + '3i', header[28:40])
+        cell = struct.unpack(byte_order + '3f', header[40:52])
+        pixel_size = None
+        if all(m > 0 for m in sampling) and all(c > 0 for c in cell):
+            pixel_size = [float(c) / m for c, m in zip(cell, sampling)]
+        return header, pixel_size
+
+    def tiff_metadata(self):
+        """
+        :return: the arguments of TiffWriter.write that keep the metadata of an MRC movie in the first page of the TIFF:
+        the pixel size as the resolution and in the description and the MRC header in a private tag
+        """
+        if self.mrc_header is None:
+            return {}
+        metadata = {'description': json.dumps({'mrc': {'pixel_size': self.pixel_size}}),
+                    'extratags': [(MRC_HEADER_TAG, 7, len(self.mrc_header), self.mrc_header, True)]}
+        if self.pixel_size:
+            # Pixels per centimetre
+            metadata['resolution'] = (1e8 / self.pixel_size[0], 1e8 / self.pixel_size[1])
+            metadata['resolutionunit'] = 'CENTIMETER'
+        return metadata
+
+    def __len__(self):
+        if self.mrc is not None:
+            return self.mrc.shape[0]
+        return len(self.tiff.pages)
+
+    def frame(self, i):
+        """
+        :param i: frame number
+        :return: numpy array of the frame in native byte order
+        """
+        if self.mrc is not None:
+            frame = self.mrc[i]
+        else:
+            frame = self.tiff.pages[i].asarray()
+        return frame.astype(frame.dtype.newbyteorder('='), copy=False)
+
+    def close(self):
+        if self.tiff is not None:
+            self.tiff.close()
+        self.mrc = None
+
+
+def compress_file(source, destination, compression='zlib'):
+    """
+    Compress an MRC or TIFF movie into a compressed TIFF frame by frame, so that only one frame is kept in memory, and
+    check that the frames of the compressed file are identical to the original ones. The MRC header and the pixel
+    size are kept in the first page of the TIFF
+    :param source: the location of the movie
+    :param destination: the location of the compressed TIFF
+    :param compression: tifffile compression
+    :return: (source size, destination size) or None if the file is not an uncompressed MRC or TIFF movie
+    """
+    try:
+        movie = Movie(source)
+    except ValueError:
+        return None
+
+    source_size = os.path.getsize(source)
+    directory = os.path.dirname(destination)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker has created it
+            pass
+
+    part_destination = destination + '.part'
+    try:
+        with tifffile.TiffWriter(part_destination, bigtiff=source_size >= BIGTIFF_SIZE) as tiff:
+            for i in range(len(movie)):
+                tiff.write(movie.frame(i), compression=compression, metadata=None, maxworkers=1,
+                           **(movie.tiff_metadata() if i == 0 else {}))
+
+        with tifffile.TiffFile(part_destination) as tiff:
+            if len(tiff.pages) != len(movie) or \
+                    not all(numpy.array_equal(tiff.pages[i].asarray(), movie.frame(i)) for i in range(len(movie))):
+                raise ValueError("The compressed frames of %s differ from the original ones" % source)
+    except Exception:
+        if os.path.exists(part_destination):
+            os.remove(part_destination)
+        raise
+    finally:
+        movie.close()
+
+    os.rename(part_destination, destination)
+    return source_size, os.path.getsize(destination)
+
+
+def set_niceness(niceness):
+    """
+    Lower the CPU priority of the compression workers so that they do not slow down the acquisition
+    :param niceness: the increment of the niceness
+    """
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+
+
+class CompressionStage:
+    """
+    The :class:`CompressionStage <CompressionStage>` object compresses the movies in a pool of processes and passes
+    the compressed files on to the next stages in batches as soon as they are ready, so that the data is never staged
+    in full. At most two files per worker are compressed or waiting for the transfer at any time, in addition to the
+    current batch, which bounds both memory and disk use. The compressed files are removed once they have been
+    uploaded.
+    """
+
+    def __init__(self, directories, staging_dir, method='deflate', workers=None, niceness=10, batch_size=20):
+        """
+        :param directories: the directories of the movie image sets
+        :param staging_dir: the directory for the compressed files that corresponds to the data directory of the entry
+        :param method: compression method, one of COMPRESSION_METHODS
+        :param workers: the number of compression processes, half of the CPUs by default
+        :param niceness: the increment of the niceness of the compression processes
+        :param batch_size: the number of compressed files transferred together
+        """
+        self.directories = directories
+        self.staging_dir = staging_dir
+        self.method = method
+        self.compression = COMPRESSION_METHODS[method][0]
+        self.workers = workers or max(1, multiprocessing.cpu_count() // 2)
+        self.niceness = niceness
+        self.batch_size = max(1, batch_size)
+        self.max_pending = 2 * self.workers
+
+    def is_movie(self, path):
+        return os.path.splitext(path)[1].lower() in MOVIE_EXTENSIONS and \
+            any(is_within(path, directory) for directory in self.directories)
+
+    def staged_path(self, depositor, path, base=None):
+        """
+        :return: the location of the compressed file in the staging directory
+        """
+        relative_path = os.path.relpath(path, base or depositor.data_base)
+        root, extension = os.path.splitext(relative_path)
+        if extension.lower() in MRC_EXTENSIONS:
+            relative_path = root + '.tif'
+        return os.path.join(self.staging_dir, relative_path)
+
+    def flush(self, staged, originals, forward, force=False):
+        """
+        Pass the compressed files and the originals that could not be compressed on to the next stages once there are
+        enough of them
+        :return: 0 if the upload has been successful or has not been needed
+        """
+        if staged and (force or len(staged) >= self.batch_size):
+            try:
+                upload_code = forward(list(staged), self.staging_dir)
+            finally:
+                for path in staged:
+                    if os.path.exists(path):
+                        os.remove(path)
+                del staged[:]
+            if upload_code != 0:
+                return upload_code
+
+        if originals and (force or len(originals) >= self.batch_size):
+            upload_code = forward(list(originals))
+            del originals[:]
+            if upload_code != 0:
+                return upload_code
+
+        return 0
+
+    def collect(self, depositor, pending_file, staged, originals, forward):
+        """
+        Wait for the compression of a file and add it to the batch
+        :return: 0 if the upload of a full batch has been successful or has not been needed
+        """
+        path, destination, result = pending_file
+        try:
+            sizes = result.get()
+            error = "not an uncompressed movie"
+        except Exception as e:
+            sizes = None
+            error = e
+
+        if sizes is None:
+            if os.path.splitext(path)[1].lower() in MRC_EXTENSIONS:
+                # The deposition declares the image set as TIFF, so the original MRC file cannot take its place
+                depositor.log("Could not compress %s (%s). Its image set has been declared as TIFF in the deposition, "
+                              "so the upload is stopped.\n" % (path, error), error=True)
+                return 1
+            depositor.log("Could not compress %s (%s). The file will be uploaded as it is.\n" % (path, error))
+            originals.append(path)
+        else:
+            source_size, destination_size = sizes
+            depositor.log("Compressed %s: %d -> %d bytes (%.1fx)\n" %
+                          (path, source_size, destination_size, float(source_size) / max(1, destination_size)))
+            staged.append(destination)
+
+        return self.flush(staged, originals, forward)
+
+    def upload_files(self, depositor, paths, forward, base=None):
+        """
+        Compress the movies among the files and pass the compressed files and the other files on to the next stages
+        :param depositor: EmpiarDepositor object
+        :param paths: the locations of the files within the data
+        :param forward: function that uploads files through the next stages, given the files and optionally the local
+        directory that corresponds to the data directory of the entry
+        :param base: the local directory that corresponds to the data directory of the entry, the parent directory of
+        the data by default
+        :return: 0 if all files have been uploaded
+        """
+        movies = [path for path in paths if self.is_movie(path)]
+        others = [path for path in paths if not self.is_movie(path)]
+        if others:
+            upload_code = forward(others)
+            if upload_code != 0:
+                return upload_code
+        if not movies:
+            return 0
+
+        depositor.log("Compressing %d movies with %s in %d processes...\n" % (len(movies), self.method, self.workers))
+        pool = multiprocessing.Pool(self.workers, initializer=set_niceness, initargs=(self.niceness,))
+        pending = collections.deque()
+        staged = []
+        originals = []
+        try:
+            for path in movies:
+                while len(pending) >= self.max_pending:
+                    upload_code = self.collect(depositor, pending.popleft(), staged, originals, forward)
+                    if upload_code != 0:
+                        return upload_code
+                if depositor.stop_event.is_set():
+                    return 1
+
+                destination = self.staged_path(depositor, path, base)
+                pending.append((path, destination,
+                                pool.apply_async(compress_file, (path, destination, self.compression))))
+
+            while pending:
+                upload_code = self.collect(depositor, pending.popleft(), staged, originals, forward)
+                if upload_code != 0:
+                    return upload_code
+
+            return self.flush(staged, originals, forward, force=True)
+        finally:
+            pool.terminate()
+            pool.join()
+            # Files of an interrupted compression or transfer
+            for path, destination, result in pending:
+                staged.extend([destination, destination + '.part'])
+            for path in staged:
+                if os.path.exists(path):
+                    os.remove(path)
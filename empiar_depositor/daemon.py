@@ -0,0 +1,444 @@
+# encoding: utf-8
+"""
+daemon.py
+
+Resident EMPIAR depositor. Runs the depositions submitted by empiar-depositor-client over a Unix socket and keeps the
+HTTP sessions, Globus login, ascp checks and transfer workers warm between them.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import argparse
+import collections
+import json
+import os
+import shlex
+import socket
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+import requests
+from empiar_depositor.client import DEFAULT_SOCKET
+from empiar_depositor.empiar_depositor import EmpiarDepositor, Toolchain, get_parser, plan_transfer, \
+    prepare_deposition, write_result_json
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+class Job:
+    """
+    The :class:`Job <Job>` object describes one deposition submitted to the daemon and keeps the last lines of its
+    output
+    """
+
+    def __init__(self, job_id, args, cwd, transfer_pass=None, password=None, max_output_lines=10000):
+        self.id = job_id
+        self.args = args
+        self.cwd = cwd
+        self.transfer_pass = transfer_pass
+        self.password = password
+        self.state = QUEUED
+        self.return_code = None
+        self.entry_id = None
+        self.entry_directory = None
+        self.depositor = None
+        self.result = None
+        self.pause_requested = False
+        self.cancel_requested = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.lines = collections.deque(maxlen=max_output_lines)
+        self.line_count = 0
+        self.partial_line = ''
+        self.output_lock = threading.Lock()
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf8', 'replace')
+        with self.output_lock:
+            text = self.partial_line + text
+            lines = text.split('\n')
+            self.partial_line = lines.pop()
+            for line in lines:
+                self.lines.append(line + '\n')
+                self.line_count += 1
+
+    def flush(self):
+        pass
+
+    def log(self, offset=0):
+        """
+        :param offset: the number of the lines that the caller has already seen
+        :return: the lines after the offset that are still kept and the new offset
+        """
+        with self.output_lock:
+            first_kept = self.line_count - len(self.lines)
+            start = max(offset, first_kept) - first_kept
+            return list(self.lines)[start:], self.line_count
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'return_code': self.return_code,
+            'entry_id': self.entry_id,
+            'entry_directory': self.entry_directory,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+        }
+
+
+class JobManager:
+    """
+    The :class:`JobManager <JobManager>` object queues the submitted depositions and runs them in a fixed pool of
+    worker threads. All jobs share the cached checks of the transfer tools, each worker keeps its own HTTP session and
+    the output of each job goes to that job
+    """
+
+    def __init__(self, workers=2, toolchain_ttl=3600):
+        self.toolchain = Toolchain(cache_ttl=toolchain_ttl)
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.next_id = 1
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.work, name='empiar-depositor-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def parse_args(self, job):
+        """
+        Parse the deposition arguments of the job, resolving the paths relative to the directory of the client
+        :param job: Job object
+        :return: parsed arguments
+        """
+        args = get_parser().parse_args(job.args)
+        for name in ('json_input', 'data', 'ascp', 'entry_thumbnail', 'manifest', 'compress_dir',
+                     'pack_dir', 'bandwidth_registry', 'state_dir', 'result_json'):
+            value = getattr(args, name, None)
+            if value and value != '-' and not os.path.isabs(os.path.expanduser(value)):
+                setattr(args, name, os.path.join(job.cwd, value))
+        if getattr(args, 'stage_mappings', None):
+            args.stage_mappings = [(os.path.join(job.cwd, os.path.expanduser(source)), directory)
+                                   for source, directory in args.stage_mappings]
+        if getattr(args, 'hsm_recall_command', None):
+            # A command given by its path rather than found in PATH
+            argv = shlex.split(args.hsm_recall_command)
+            if argv and os.path.sep in argv[0] and not os.path.isabs(os.path.expanduser(argv[0])):
+                argv[0] = os.path.normpath(os.path.join(job.cwd, argv[0]))
+                args.hsm_recall_command = ' '.join(quote(arg) for arg in argv)
+
+        if args.password is True:
+            args.password = job.password
+        if job.entry_id and job.entry_directory:
+            # The deposition has been created before the job was paused
+            args.resume = [job.entry_id, job.entry_directory]
+        return args
+
+    def submit(self, args, cwd, transfer_pass=None, password=None):
+        """
+        Queue a deposition
+        :param args: empiar-depositor command line arguments
+        :param cwd: the directory relative to which the paths in the arguments are resolved
+        :param transfer_pass: EMPIAR transfer password
+        :param password: EMPIAR password for basic authentication
+        :return: Job object
+        """
+        with self.lock:
+            job = Job(str(self.next_id), args, cwd, transfer_pass=transfer_pass, password=password)
+            self.next_id += 1
+
+        try:
+            parsed_args = get_parser().parse_args(args)
+        except SystemExit:
+            raise ValueError("Invalid deposition arguments: %s" % ' '.join(args))
+        # The password cannot be asked for in the daemon, so it has to come with the job
+        if parsed_args.password is True and not password:
+            raise ValueError("Please use --ask-password to provide the EMPIAR password to the daemon")
+
+        with self.lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def get_job(self, job_id):
+        with self.lock:
+            if job_id not in self.jobs:
+                raise ValueError("There is no job %s" % job_id)
+            return self.jobs[job_id]
+
+    def pause(self, job_id):
+        job = self.get_job(job_id)
+        with self.lock:
+            if job.state == QUEUED:
+                job.state = PAUSED
+            elif job.state == RUNNING:
+                job.pause_requested = True
+                if job.depositor is not None:
+                    job.depositor.stop()
+            else:
+                raise ValueError("Job %s cannot be paused as it is %s" % (job_id, job.state))
+        return job
+
+    def resume(self, job_id):
+        job = self.get_job(job_id)
+        with self.lock:
+            if job.state != PAUSED:
+                raise ValueError("Job %s cannot be resumed as it is %s" % (job_id, job.state))
+            job.state = QUEUED
+            job.pause_requested = False
+            job.return_code = None
+        self.queue.put(job)
+        return job
+
+    def cancel(self, job_id):
+        job = self.get_job(job_id)
+        with self.lock:
+            if job.state in (QUEUED, PAUSED):
+                job.state = CANCELLED
+            elif job.state == RUNNING:
+                job.cancel_requested = True
+                if job.depositor is not None:
+                    job.depositor.stop()
+            else:
+                raise ValueError("Job %s cannot be cancelled as it is %s" % (job_id, job.state))
+        return job
+
+    def stop_all(self):
+        with self.lock:
+            for job in self.jobs.values():
+                if job.state == RUNNING:
+                    job.pause_requested = True
+                    if job.depositor is not None:
+                        job.depositor.stop()
+                elif job.state == QUEUED:
+                    job.state = PAUSED
+
+    def work(self):
+        session = requests.Session()
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+            self.run(job, session)
+
+    def run(self, job, session=None):
+        """
+        Run the deposition of the job in the current thread
+        :param job: Job object
+        :param session: requests Session of the worker, a new one by default
+        """
+        if session is None:
+            session = requests.Session()
+
+        result = 1
+        try:
+            args = self.parse_args(job)
+            if args.plan:
+                # Only the plan is made, nothing is created on the server
+                emp_dep = plan_transfer(args, session=session, output=job)
+            else:
+                emp_dep = prepare_deposition(args, toolchain=self.toolchain, session=session,
+                                             transfer_pass=job.transfer_pass, output=job)
+            if isinstance(emp_dep, EmpiarDepositor):
+                with self.lock:
+                    job.depositor = emp_dep
+                    if job.pause_requested or job.cancel_requested:
+                        emp_dep.stop()
+                deposition_result = emp_dep.deposit()
+                job.result = deposition_result.to_dict()
+                result = deposition_result.return_value
+                job.entry_id = emp_dep.entry_id
+                job.entry_directory = emp_dep.entry_directory
+                if args.result_json:
+                    write_result_json(deposition_result, args.result_json, output=job)
+            else:
+                result = emp_dep
+        except requests.exceptions.RequestException as e:
+            job.write(str(e) + '\n')
+        except Exception as e:
+            # A failed job must not stop the worker
+            job.write("Unexpected error: %r\n" % e)
+
+        with self.lock:
+            job.depositor = None
+            job.finished = time.time()
+            job.return_code = 0 if isinstance(result, tuple) else result
+            if job.cancel_requested:
+                job.state = CANCELLED
+            elif job.pause_requested:
+                job.state = PAUSED
+            elif job.return_code == 0:
+                job.state = FINISHED
+            else:
+                job.state = FAILED
+
+    def handle(self, request):
+        """
+        Handle a request from the client
+        :param request: a dictionary with the 'command' key and the command arguments
+        :return: the reply as a dictionary
+        """
+        command = request.get('command')
+        try:
+            if command == 'submit':
+                job = self.submit(request.get('args') or [], request.get('cwd') or os.getcwd(),
+                                  transfer_pass=request.get('transfer_pass'), password=request.get('password'))
+                return {'ok': True, 'job': job.to_dict()}
+            elif command == 'status':
+                if request.get('job_id'):
+                    return {'ok': True, 'job': self.get_job(request['job_id']).to_dict()}
+                with self.lock:
+                    return {'ok': True, 'jobs': [job.to_dict() for job in self.jobs.values()]}
+            elif command == 'log':
+                job = self.get_job(request.get('job_id'))
+                lines, offset = job.log(request.get('offset', 0))
+                return {'ok': True, 'job': job.to_dict(), 'lines': lines, 'offset': offset}
+            elif command in ('pause', 'resume', 'cancel'):
+                job = getattr(self, command)(request.get('job_id'))
+                return {'ok': True, 'job': job.to_dict()}
+            else:
+                return {'ok': False, 'error': "Unknown command %s" % command}
+        except ValueError as e:
+            return {'ok': False, 'error': str(e)}
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Read one JSON request per connection and write the JSON reply
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode('utf8'))
+        except ValueError:
+            reply = {'ok': False, 'error': "The request is not a valid JSON"}
+        else:
+            if request.get('command') == 'shutdown':
+                self.server.manager.stop_all()
+                threading.Thread(target=self.server.shutdown).start()
+                reply = {'ok': True}
+            else:
+                reply = self.server.manager.handle(request)
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf8'))
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, manager):
+        self.manager = manager
+        socketserver.UnixStreamServer.__init__(self, socket_path, DaemonRequestHandler)
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # Only the owner can connect. The socket is not listening yet, so nobody can connect before the change
+        os.chmod(self.server_address, 0o600)
+
+
+def remove_stale_socket(socket_path):
+    """
+    Remove the socket left by a daemon that is no longer running
+    :param socket_path: the location of the Unix socket
+    :return: True if the socket can be created, False if another daemon is listening on it
+    """
+    if not os.path.exists(socket_path):
+        return True
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError, OSError):
+        os.unlink(socket_path)
+        return True
+    finally:
+        sock.close()
+    return False
+
+
+def main(args=None):
+    """
+    Run the resident EMPIAR depositor
+    """
+    parser = argparse.ArgumentParser(prog="empiar-depositor-daemon",
+                                     description="Resident EMPIAR depositor. Submit depositions to it with "
+                                                 "empiar-depositor-client.")
+    parser.add_argument("--socket", action="store", default=DEFAULT_SOCKET, dest="socket",
+                        help="The location of the Unix socket the daemon listens on.")
+    parser.add_argument("--workers", action="store", type=int, default=2, dest="workers",
+                        help="The number of depositions that run at the same time.")
+    parser.add_argument("--toolchain-ttl", action="store", type=int, default=3600, dest="toolchain_ttl",
+                        help="For how many seconds the successful ascp checks, Globus login and endpoint activations "
+                             "are reused.")
+
+    if args is None:
+        args = sys.argv[1:]
+    args = parser.parse_args(args)
+
+    socket_dir = os.path.dirname(args.socket)
+    if socket_dir and not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+
+    if not remove_stale_socket(args.socket):
+        sys.stdout.write("Another EMPIAR depositor daemon is already listening on %s\n" % args.socket)
+        return 1
+
+    manager = JobManager(workers=args.workers, toolchain_ttl=args.toolchain_ttl)
+    server = DaemonServer(args.socket, manager)
+
+    sys.stdout.write("EMPIAR depositor daemon is listening on %s\n" % args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        manager.stop_all()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
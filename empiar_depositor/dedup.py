@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+dedup.py
+
+Detection of files with the same content in several places of the data, such as gain references repeated in each image
+set, so that they are transferred only once.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import collections
+import hashlib
+import os
+from multiprocessing.pool import ThreadPool
+
+from empiar_depositor.pack import file_sha256
+
+# warn only reports the duplicates, once transfers each content once and lists the duplicates in DUPLICATES_FILE
+DEDUP_MODES = ('warn', 'once')
+# The list of the duplicates that have not been transferred, uploaded into the data directory of the entry
+DUPLICATES_FILE = 'empiar_depositor_duplicates.tsv'
+# The number of bytes at the beginning and at the end of the files that are compared before their whole content
+PARTIAL_HASH_SIZE = 64 * 1024
+# Smaller files are not worth the reads
+DEFAULT_MIN_SIZE = 64 * 1024
+
+
+def partial_hash(path, size):
+    """
+    :param path: the location of the file
+    :param size: the size of the file
+    :return: hex digest of SHA-256 of the beginning and the end of the file, of the whole file if it is small
+    """
+    with open(path, 'rb') as f:
+        if size <= 2 * PARTIAL_HASH_SIZE:
+            return file_sha256(f)
+        sha256 = hashlib.sha256(f.read(PARTIAL_HASH_SIZE))
+        f.seek(size - PARTIAL_HASH_SIZE)
+        sha256.update(f.read(PARTIAL_HASH_SIZE))
+        return sha256.hexdigest()
+
+
+def full_hash(path, size):
+    """
+    :param path: the location of the file
+    :param size: the size of the file
+    :return: hex digest of SHA-256 of the whole file
+    """
+    with open(path, 'rb') as f:
+        return file_sha256(f)
+
+
+def group_by_hash(pool, hash_function, groups):
+    """
+    Split the groups of candidates by the hashes of the files, all files are hashed in parallel
+    :param pool: ThreadPool object
+    :param hash_function: function of the path and the size of a file
+    :param groups: list of lists of (path, size) tuples
+    :return: the lists of the files with the same hash that have more than one file
+    """
+    def hash_file(f):
+        try:
+            return hash_function(*f)
+        except (IOError, OSError):
+            return None
+
+    files = [f for group in groups for f in group]
+    hashes = pool.map(hash_file, files, chunksize=4)
+    split = collections.OrderedDict()
+    group_ids = [i for i, group in enumerate(groups) for f in group]
+    for group_id, f, digest in zip(group_ids, files, hashes):
+        # Files that cannot be read are not duplicates of any other file
+        split.setdefault((group_id, digest if digest is not None else f[0]), []).append(f)
+    return [group for group in split.values() if len(group) > 1]
+
+
+def find_duplicates(files, min_size=DEFAULT_MIN_SIZE, workers=16):
+    """
+    Find the files with the same content. Only files of the same size are candidates, so most files are ruled out by
+    their size alone. The candidates are compared by a hash of their beginning and end and only the remaining ones
+    are read completely
+    :param files: list of (path, size, mtime) tuples
+    :param min_size: the size of the smallest files that are compared
+    :param workers: the number of threads that read the files
+    :return: sorted list of the groups of the paths of files with the same content, each sorted, and the size of
+    their files
+    """
+    sizes = collections.defaultdict(list)
+    for path, size, mtime in files:
+        if size >= max(min_size, 1):
+            sizes[size].append((path, size))
+    groups = [group for group in sizes.values() if len(group) > 1]
+    if not groups:
+        return []
+
+    pool = ThreadPool(workers)
+    try:
+        groups = group_by_hash(pool, partial_hash, groups)
+        # The partial hash of small files covers their whole content
+        complete = [group for group in groups if group[0][1] <= 2 * PARTIAL_HASH_SIZE]
+        groups = complete + group_by_hash(pool, full_hash,
+                                          [group for group in groups if group[0][1] > 2 * PARTIAL_HASH_SIZE])
+    finally:
+        pool.close()
+        pool.join()
+    return sorted((sorted(path for path, size in group), group[0][1]) for group in groups)
+
+
+def write_duplicates(f, duplicates, base):
+    """
+    Write the list of the duplicates that have not been transferred, each with the file that has the same content
+    :param f: file object
+    :param duplicates: the groups of duplicates as returned by find_duplicates
+    :param base: the local directory that corresponds to the data directory of the entry
+    """
+    f.write('# duplicate\toriginal\n')
+    for paths, size in duplicates:
+        original = os.path.relpath(paths[0], base).replace(os.path.sep, '/')
+        for path in paths[1:]:
+            f.write('%s\t%s\n' % (os.path.relpath(path, base).replace(os.path.sep, '/'), original))
+
+
+def count_by_imageset(duplicates, base, directories):
+    """
+    :param duplicates: the groups of duplicates as returned by find_duplicates
+    :param base: the local directory that corresponds to the data directory of the entry
+    :param directories: the image set directories relative to the data directory of the entry
+    :return: ordered dictionary of the image set directories, or None for the other files, and the numbers and sizes
+    of the duplicates in them. The first file of each group is not counted as a duplicate
+    """
+    counts = collections.OrderedDict()
+    directories = sorted(directories, key=len, reverse=True)
+    for paths, size in duplicates:
+        for path in paths[1:]:
+            path = os.path.relpath(path, base).replace(os.path.sep, '/')
+            directory = next((d for d in directories if path.startswith(d + '/')), None)
+            count, total = counts.get(directory, (0, 0))
+            counts[directory] = (count + 1, total + size)
+    return counts
@@ -67,27 +67,77 @@ __author__ = 'Andrii Iudin'
 __email__ = 'andrii@ebi.ac.uk'
 __date__ = '2018-02-13'
 
+import collections
 import copy
+import io
 import json
 import os.path
+import re
 import requests
-import subprocess
+import shutil
+import socket
 import sys
 import argparse
+import tempfile
+import threading
+import time
 from getpass import getpass
 from requests.auth import HTTPBasicAuth
 from requests.models import Response
-
-
-def run_shell_command(command):
-    """
-    Run shell command
-    :param command: the command that will be executed
-    :return: process return code
-    """
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    p_out, p_err = process.communicate()
-    return p_out, p_err, process.returncode
+from empiar_depositor.bandwidth import DEFAULT_REGISTRY, BandwidthScheduler, TransferMonitor
+from empiar_depositor.compress import COMPRESSION_METHODS, CompressionStage, compression_available, \
+    is_movie_imageset, update_imageset_formats
+from empiar_depositor.results import DepositionResult, deposition_step
+from empiar_depositor.resume import DEFAULT_RESUME_LEVEL, RESUME_LEVELS, ResumePolicy
+from empiar_depositor.retry import IdempotencyJournal, RetryPolicy, get_host
+from empiar_depositor.dedup import DEDUP_MODES, DEFAULT_MIN_SIZE, DUPLICATES_FILE, count_by_imageset, \
+    find_duplicates, write_duplicates
+from empiar_depositor.filelist import get_file_pairs, index_files, scan_index, scan_tree, write_file_pair_list
+from empiar_depositor.hsm import DEFAULT_SHARD_SIZE, RecallStage, get_recall_command
+from empiar_depositor.hybrid import HybridTransfer
+from empiar_depositor.integrity import DEFAULT_READ_BUDGET, UNCHECKED, check_files
+from empiar_depositor.jsonstream import JsonArrayReader
+from empiar_depositor.manifest import Manifest, UploadSnapshot
+from empiar_depositor.metadata import UNSUPPORTED_STATUS_CODES, MetadataSnapshot, diff_sections, gzip_payload
+from empiar_depositor.nodes import AsperaNode, rank_nodes
+from empiar_depositor.pack import PackingStage, parse_size
+from empiar_depositor.plan import PROBE_SIZE, RateCache, format_duration, format_plan, format_size, make_plan
+from empiar_depositor.process import Process, run_command
+from empiar_depositor.schedule import SCHEDULE_POLL_INTERVAL, RateSchedule, RateWindow
+from empiar_depositor.selection import Selection, get_selected_paths
+from empiar_depositor.staging import STAGING_MODES, Staging, parse_mapping
+from empiar_depositor.supervisor import FATAL, STABLE_RUN, STALLED, UNKNOWN, UNKNOWN_MAX_RESTARTS, StallDetector, \
+    classify_ascp_failure
+from empiar_depositor.thumbnail import prepare_thumbnail, thumbnail_available
+from empiar_depositor.watch import DataWatcher, get_imageset_directories, get_watched_paths
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+ASCP_COMPLETED_RE = re.compile(r'Completed: (\d+)K bytes transferred')
+ASPERA_DESTINATION = 'emp_dep@hx-fasp-1.ebi.ac.uk'
+# Target rate of Aspera transfers in Mbps
+ASPERA_TARGET_RATE = 200
+# Destination of the rate probe on the upload server, which discards the data instead of writing it
+ASPERA_PROBE_DESTINATION = 'faux://'
+# The number of the last lines of the output of ascp that are checked for the errors
+ASCP_OUTPUT_LINES = 50
+# Delays in seconds before the restarts of ascp after transient errors
+ASCP_RESTART_DELAY = 10
+ASCP_MAX_RESTART_DELAY = 600
+GLOBUS_DESTINATION = 'd50a0618-6d04-11e5-ba46-22000b92c6ec'
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.empiar_depositor')
+# Seconds after which the globus commands other than the wait for a transfer are terminated
+GLOBUS_COMMAND_TIMEOUT = 600
+# Logging in to Globus may wait for the user to authorise the CLI in the browser
+GLOBUS_LOGIN_TIMEOUT = 1800
+# Only the start and the end of the listings of globus are kept for the messages
+GLOBUS_LISTING_OUTPUT = 8192
+ASCP_CHECK_TIMEOUT = 60
+# The number of the files with problems found by the integrity check that are listed
+MAX_REPORTED_PROBLEMS = 20
 
 
 def check_json_response(response):
@@ -113,7 +163,14 @@ class EmpiarDepositor:
     def __init__(self, empiar_token, json_input, data, ascp=None, globus=None, globus_data=None,
                  globus_force_login=False, ignore_certificate=False, entry_thumbnail=None, entry_id=None,
                  entry_directory=None, stop_submit=False, dev=False, dev_local=False, password=None,
-                 output_id_dir=False, grant_rights_usernames=None, grant_rights_emails=None, grant_rights_orcids=None):
+                 output_id_dir=False, grant_rights_usernames=None, grant_rights_emails=None, grant_rights_orcids=None,
+                 max_retries=5, state_dir=None, session=None, transfer_pass=None, quiet=False, watcher=None,
+                 compressor=None, packer=None, bandwidth=None, rate_schedule=None, aspera_nodes=None, hybrid=None,
+                 ascp_max_restarts=5, ascp_stall_timeout=900, ascp_file_list=False, resume_check=None,
+                 redeposit_data='auto', patch_metadata=False, full_metadata=False, gzip_requests=False, staging=None,
+                 selection=None, integrity_check=False, integrity_read_budget=DEFAULT_READ_BUDGET, dedup=None,
+                 dedup_min_size=DEFAULT_MIN_SIZE, auto_thumbnail=False, recaller=None, output=None,
+                 force_create=False):
 
         if dev:
             self.server_root = "https://wwwdev.ebi.ac.uk/pdbe/emdb/external_test/master"
@@ -162,32 +219,110 @@ class EmpiarDepositor:
         self.grant_rights_usernames = self.prepare_rights_data(grant_rights_usernames)
         self.grant_rights_emails = self.prepare_rights_data(grant_rights_emails)
         self.grant_rights_orcids = self.prepare_rights_data(grant_rights_orcids)
+        self.state_dir = state_dir
+        self.retry_policy = RetryPolicy(max_attempts=max_retries, log=self.log)
+        journal_path = os.path.join(state_dir, 'pending_depositions.json') if state_dir else None
+        self.idempotency_journal = IdempotencyJournal(journal_path)
+        self.force_create = force_create
+        self.rate_cache = RateCache(os.path.join(state_dir, 'transfer_rates.json') if state_dir else None)
+        self.session = session
+        self.transfer_pass = transfer_pass
+        self.stop_event = threading.Event()
+        # The steps of the deposition may run in several threads, each with its own current step and ascp process
+        self.thread_state = threading.local()
+        self.processes = {}
+        self.globus_task_id = None
+        self.quiet = quiet
+        self.output = output
+        self.results = []
+        self.deposition_errors = []
+        self.empiar_id = None
+        self.watcher = watcher
+        self.compressor = compressor
+        self.packer = packer
+        self.bandwidth = bandwidth
+        self.rate_schedule = rate_schedule
+        self.aspera_nodes = aspera_nodes or [AsperaNode.parse(ASPERA_DESTINATION)]
+        self.aspera_node_order = None
+        self.aspera_node_lock = threading.Lock()
+        self.hybrid = hybrid
+        self.ascp_max_restarts = ascp_max_restarts
+        self.ascp_stall_timeout = ascp_stall_timeout
+        self.ascp_file_list = ascp_file_list
+        self.resume_check = resume_check
+        self.resume_policy = None
+        self.resume_policy_lock = threading.Lock()
+        self.redeposit_data = redeposit_data
+        # The files of the data as the upload has listed them, which are recorded in the upload snapshot
+        self.listed_files = None
+        self.patch_metadata = patch_metadata
+        self.full_metadata = full_metadata
+        self.gzip_requests = gzip_requests
+        self.staging = staging
+        self.selection = selection
+        self.integrity_check = integrity_check
+        self.integrity_read_budget = integrity_read_budget
+        self.dedup = dedup
+        self.dedup_min_size = dedup_min_size
+        self.auto_thumbnail = auto_thumbnail
+        self.recaller = recaller
+        self.ascp_restart_policy = RetryPolicy(max_attempts=ascp_max_restarts, backoff_base=ASCP_RESTART_DELAY,
+                                               backoff_max=ASCP_MAX_RESTART_DELAY, log=self.log)
+
+    @property
+    def current_step(self):
+        """
+        :return: StepResult object of the step that runs in the current thread
+        """
+        return getattr(self.thread_state, 'current_step', None)
 
-    @staticmethod
-    def globus_upload_wait(task_id):
+    @current_step.setter
+    def current_step(self, step):
+        self.thread_state.current_step = step
+
+    @property
+    def stages(self):
         """
-        Wait for the Globus upload to finish
+        :return: the enabled stages that process the files before the transfer
         """
-        sys.stdout.write("Transfer in progress, waiting on task %s to complete\n" % task_id)
-        command_tr_wait = ['globus task wait -vvv --format json %s' % task_id]
+        return [stage for stage in (self.recaller, self.compressor, self.packer) if stage is not None]
 
-        process = subprocess.Popen(command_tr_wait, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    @property
+    def data_base(self):
+        """
+        :return: the local directory that corresponds to the data directory of the entry
+        """
+        return os.path.dirname(os.path.abspath(self.data))
 
-        # Poll process for new output until finished
-        while True:
-            next_line = process.stdout.readline()
-            if next_line == b'' and process.poll() is not None:
-                break
+    @property
+    def destination_dir(self):
+        """
+        :return: the location of the data directory of the entry on the upload server
+        """
+        return os.path.join(self.upload_dir, self.entry_directory, 'data')
 
-            sys.stdout.write(next_line)
-            sys.stdout.flush()
+    @staticmethod
+    def globus_upload_wait(task_id, log=None, stop_event=None):
+        """
+        Wait for the Globus upload to finish
+        :param task_id: Globus task ID
+        :param log: function that reports the progress, sys.stdout.write by default
+        :param stop_event: threading.Event that stops the wait once it is set
+        """
+        if log is None:
+            log = sys.stdout.write
+        log("Transfer in progress, waiting on task %s to complete\n" % task_id)
+        process = Process(['globus', 'task', 'wait', '-vvv', '--format', 'json', task_id], stop_event=stop_event,
+                          merge_stderr=True)
 
-        out_tr_wait, err_tr_wait = process.communicate()
-        retcode_tr_wait = process.returncode
+        # Report the output as it arrives until the wait has finished
+        for next_line in process.lines():
+            log(next_line.decode('utf-8', 'replace'))
 
-        if retcode_tr_wait != 0 or err_tr_wait:
-            sys.stdout.write("Error while waiting for the transfer to finish. Return code: %s.\nOutput:%s\nError "
-                             "message: %s\n" % (retcode_tr_wait, out_tr_wait, err_tr_wait))
+        retcode_tr_wait = process.close()
+        if retcode_tr_wait != 0:
+            log("Error while waiting for the transfer to finish. Return code: %s.\nOutput:%s\n" %
+                (retcode_tr_wait, process.output()))
 
         return retcode_tr_wait
 
@@ -206,184 +341,834 @@ class EmpiarDepositor:
                 return data_ready
         return None
 
+    def log(self, message, error=False):
+        """
+        Report the progress of the deposition. The message is kept in the result of the current step and is written
+        to the output, stdout by default, unless the depositor is quiet
+        :param message: the message
+        :param error: True if the message describes an error
+        """
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+
+        if self.current_step is not None:
+            if error:
+                self.current_step.errors.append(message.strip())
+            else:
+                self.current_step.messages.append(message.rstrip('\n'))
+        elif error:
+            self.deposition_errors.append(message.strip())
+
+        if not self.quiet:
+            output = self.output or sys.stdout
+            output.write(message)
+            output.flush()
+
+    def record_response(self, response, response_json=None):
+        """
+        Keep the reply of the server in the result of the current step
+        :param response: Response object of requests Python module
+        :param response_json: the decoded JSON of the response
+        """
+        if self.current_step is not None:
+            self.current_step.record_response(response, response_json)
+
     def make_request(self, request_method, *args, **kwargs):
         """
-        Make a request - either using Basic Authentication or Token
+        Make a request - either using Basic Authentication or Token. The request is repeated according to the retry
+        policy if the server is overloaded or the connection fails
         :param request_method: the method of request, such as requests.get or requests.post
         :param args: additional arguments for the request
+        :param idempotent: False if the request must not be repeated once it might have reached the server
+        :param files: the files of a multipart request, or a function that opens them, which is called for every
+        attempt so that a repeated request does not send files that have already been read to the end
         :return: the response from the request
         """
+        idempotent = kwargs.pop('idempotent', True)
         if self.password:
-            response = request_method(*args, auth=HTTPBasicAuth(self.username, self.password), **kwargs)
+            kwargs['auth'] = HTTPBasicAuth(self.username, self.password)
+
+        if self.session is not None:
+            request_method = getattr(self.session, request_method.__name__)
+
+        open_files = kwargs.get('files')
+        if callable(open_files):
+            def send():
+                files = open_files()
+                try:
+                    return request_method(*args, **dict(kwargs, files=files))
+                finally:
+                    for name, value in files.values():
+                        value.close()
         else:
-            response = request_method(*args, **kwargs)
-        return response
+            def send():
+                return request_method(*args, **kwargs)
+
+        url = args[0] if args else kwargs.get('url')
+        return self.retry_policy.call(send, url=url, idempotent=idempotent)
 
+    def send_json(self, request_method, url, json_bytes, headers=None, idempotent=True):
+        """
+        Send a deposition JSON, compressed with gzip if enabled. If the server does not accept the compressed JSON,
+        it is sent again uncompressed
+        :param request_method: the method of request, such as requests.post or requests.put
+        :param url: the URL of the request
+        :param json_bytes: the encoded JSON
+        :param headers: the headers of the request, the deposition headers by default
+        :param idempotent: False if the request must not be repeated once it might have reached the server
+        :return: the response from the request
+        """
+        headers = dict(headers or self.deposition_headers)
+        if self.gzip_requests:
+            gzip_headers = dict(headers)
+            gzip_headers['Content-Encoding'] = 'gzip'
+            payload = gzip_payload(json_bytes)
+            self.current_step.bytes = len(payload)
+            response = self.make_request(request_method, url, data=payload, headers=gzip_headers,
+                                         verify=self.ignore_certificate, idempotent=idempotent)
+            if getattr(response, 'status_code', None) != 415:
+                return response
+            self.log("The server does not accept compressed requests, sending the JSON uncompressed\n")
+
+        self.current_step.bytes = len(json_bytes)
+        return self.make_request(request_method, url, data=json_bytes, headers=headers,
+                                 verify=self.ignore_certificate, idempotent=idempotent)
+
+    def get_metadata_snapshot(self):
+        """
+        :return: MetadataSnapshot object of the entry, kept in the state directory for each server, as the same entry
+        ID may exist on several servers
+        """
+        if not self.state_dir or not self.entry_id:
+            return MetadataSnapshot(None)
+        host = re.sub(r'[^\w.-]', '_', get_host(self.server_root))
+        return MetadataSnapshot(os.path.join(self.state_dir, 'metadata', host, '%s.json' % self.entry_id))
+
+    def read_deposition_json(self):
+        """
+        :return: the deposition JSON without the entry ID, which is not part of the metadata
+        """
+        with open(self.json_input, 'rb') as f:
+            document = json.loads(f.read().decode('utf-8'))
+        document.pop('entry_id', None)
+        return document
+
+    @deposition_step('create_deposition')
     def create_new_deposition(self):
         """
-        Create a new EMPIAR deposition
+        Create a new EMPIAR deposition. The request is not repeated after a timeout or a gateway error, as the
+        server may already have created the entry. Its idempotency key is kept until the server replies and, while it is
+        kept, the deposition of the same JSON stops instead of creating a possible duplicate unless the creation is
+        forced
         """
-        deposition_response = self.make_request(requests.post, self.deposition_url, data=open(self.json_input, 'rb'),
-                                                headers=self.deposition_headers, verify=self.ignore_certificate)
+        with open(self.json_input, 'rb') as f:
+            json_bytes = f.read()
+
+        deposition_hash = IdempotencyJournal.deposition_hash(self.server_root, json_bytes)
+        if self.idempotency_journal.is_pending(deposition_hash):
+            if not self.force_create:
+                self.log("A previous attempt to create this deposition has not received a reply from the server, "
+                         "which may have created the entry. Please check your EMPIAR depositions and either resume "
+                         "the entry with --resume ENTRY_ID ENTRY_DIR or, if it has not been created, run the "
+                         "deposition again with --force-create\n", error=True)
+                return 1
+            self.log("A previous attempt to create this deposition has not received a reply from the server. "
+                     "Creating it again as requested\n")
+
+        headers = dict(self.deposition_headers)
+        headers['Idempotency-Key'] = self.idempotency_journal.get_key(deposition_hash)
+        deposition_response = self.send_json(requests.post, self.deposition_url, json_bytes, headers=headers,
+                                             idempotent=False)
 
+        self.record_response(deposition_response)
         if check_json_response(deposition_response):
+            # The server has processed the request, whatever the result, so the key is no longer needed
+            self.idempotency_journal.complete(deposition_hash)
             deposition_response_json = deposition_response.json()
+            self.record_response(deposition_response, deposition_response_json)
 
             if 'deposition' in deposition_response_json and deposition_response_json['deposition'] is True and \
                     deposition_response_json['directory'] and deposition_response_json['entry_id']:
                 if not isinstance(deposition_response_json['entry_id'], int):
-                    sys.stdout.write("Error occurred while trying to create an EMPIAR deposition. Returned entry id is "
-                                     "not an integer number\n")
+                    self.log("Error occurred while trying to create an EMPIAR deposition. Returned entry id is "
+                             "not an integer number\n", error=True)
                     return 1
 
                 self.entry_id = deposition_response_json['entry_id']
                 self.entry_directory = deposition_response_json['directory']
-                sys.stdout.write("EMPIAR deposition was successfully created. Your entry ID is %s and unique data "
-                                 "directory is %s\n" % (deposition_response_json['entry_id'],
-                                                        deposition_response_json['directory']))
+                self.save_metadata_snapshot()
+                self.log("EMPIAR deposition was successfully created. Your entry ID is %s and unique data "
+                         "directory is %s\n" % (deposition_response_json['entry_id'],
+                                                deposition_response_json['directory']))
 
                 return 0
 
             else:
-                sys.stdout.write("The creation of an EMPIAR deposition was not successful. Returned response: %s\n"
-                                 "Status code: %s\n" % (str(deposition_response_json), deposition_response.status_code))
+                self.log("The creation of an EMPIAR deposition was not successful. Returned response: %s\n"
+                         "Status code: %s\n" % (str(deposition_response_json), deposition_response.status_code),
+                         error=True)
 
         return 1
 
+    @deposition_step('redeposit')
     def redeposit(self):
         """
-        Re-deposit the data into EMPIAR. Updates an existing deposition
+        Re-deposit the data into EMPIAR. Updates an existing deposition. If the last deposition JSON accepted for the
+        entry is known, the update is skipped when nothing has changed and, if enabled, only the changed sections are
+        sent. The whole JSON is always sent if the full metadata is requested
         """
-        with open(self.json_input, 'rb') as f:
-            data_dict = json.load(f)
-
-        data_dict['entry_id'] = self.entry_id
-        json_obj = json.dumps(data_dict, ensure_ascii=False).encode('utf8')
-        redeposition_response = self.make_request(requests.put, self.redeposition_url, data=json_obj,
-                                                  headers=self.deposition_headers, verify=self.ignore_certificate)
-
+        document = self.read_deposition_json()
+        snapshot = self.get_metadata_snapshot()
+        previous = snapshot.load() if not self.full_metadata else None
+        changed = diff_sections(previous, document) if previous is not None else None
+        if changed == []:
+            self.log("The metadata of the entry has not changed since it was last accepted, skipping its update\n")
+            return 0
+
+        redeposition_response = None
+        if self.patch_metadata and changed:
+            self.log("Updating the changed sections of the metadata: %s\n" % ', '.join(changed))
+            data_dict = dict((key, document.get(key)) for key in changed)
+            data_dict['entry_id'] = self.entry_id
+            redeposition_response = self.send_json(requests.patch, self.redeposition_url,
+                                                   json.dumps(data_dict, ensure_ascii=False).encode('utf8'))
+            if getattr(redeposition_response, 'status_code', None) in UNSUPPORTED_STATUS_CODES:
+                self.log("The server does not support partial updates, sending the whole metadata\n")
+                redeposition_response = None
+
+        if redeposition_response is None:
+            data_dict = dict(document)
+            data_dict['entry_id'] = self.entry_id
+            redeposition_response = self.send_json(requests.put, self.redeposition_url,
+                                                   json.dumps(data_dict, ensure_ascii=False).encode('utf8'))
+
+        self.record_response(redeposition_response)
         if check_json_response(redeposition_response):
             redeposition_response_json = redeposition_response.json()
+            self.record_response(redeposition_response, redeposition_response_json)
 
             if 'deposition' in redeposition_response_json and redeposition_response_json['deposition'] is True and \
                     redeposition_response_json['directory'] and redeposition_response_json['entry_id']:
                 if not isinstance(redeposition_response_json['entry_id'], int):
-                    sys.stdout.write("Error occurred while trying to update an EMPIAR deposition. Returned entry id is "
-                                     "not an integer number\n")
+                    self.log("Error occurred while trying to update an EMPIAR deposition. Returned entry id is "
+                             "not an integer number\n", error=True)
                     return 1
 
                 self.entry_id = redeposition_response_json['entry_id']
                 self.entry_directory = redeposition_response_json['directory']
-                sys.stdout.write("EMPIAR deposition was successfully updated. Your entry ID is %s and unique data "
-                                 "directory is %s\n" % (redeposition_response_json['entry_id'],
-                                                        redeposition_response_json['directory']))
+                self.save_metadata_snapshot(document)
+                self.log("EMPIAR deposition was successfully updated. Your entry ID is %s and unique data "
+                         "directory is %s\n" % (redeposition_response_json['entry_id'],
+                                                redeposition_response_json['directory']))
 
                 return 0
 
             else:
-                sys.stdout.write("The update of an EMPIAR deposition was not successful. Returned response: %s\nStatus "
-                                 "code: %s" % (str(redeposition_response_json), redeposition_response.status_code))
+                self.log("The update of an EMPIAR deposition was not successful. Returned response: %s\nStatus "
+                         "code: %s" % (str(redeposition_response_json), redeposition_response.status_code), error=True)
 
-        sys.stdout.write("The update of the entry was not successful.\n")
+        self.log("The update of the entry was not successful.\n", error=True)
         return 1
 
+    def save_metadata_snapshot(self, document=None):
+        """
+        Keep the deposition JSON that EMPIAR has accepted for the entry
+        :param document: the deposition JSON without the entry ID, read from the JSON input by default
+        """
+        snapshot = self.get_metadata_snapshot()
+        if snapshot.path:
+            snapshot.save(document if document is not None else self.read_deposition_json())
+
+    @deposition_step('aspera_upload')
     def aspera_upload(self):
         """
         Upload the data via Aspera ascp command
         """
-        sys.stdout.write("Initiating the Aspera upload...\n")
+        self.log("Initiating the Aspera upload...\n")
+        self.log('data: ' + str(self.data) + '\n')
+        self.log('ED: ' + self.entry_directory + '\n')
+
+        if self.resume_check or (self.ascp_file_list and os.path.isdir(self.data)):
+            # ascp would walk the whole data again on every start and restart and the resume policy decides per file
+            started = time.time()
+            files = self.scan_data()
+            self.log("Listed %d files, %s, in %s\n" % (len(files), format_size(sum(f[1] for f in files)),
+                                                        format_duration(time.time() - started)))
+            return self.run_ascp_file_pairs(get_file_pairs([f[0] for f in files], self.data_base))
+
+        return self.run_ascp([self.data])
+
+    @deposition_step('aspera_upload')
+    def aspera_upload_file_pairs(self, pairs):
+        """
+        Upload files from anywhere via Aspera ascp command
+        :param pairs: list of (source, destination) tuples, the destinations are relative to the data directory of
+        the entry
+        """
+        self.log("Initiating the Aspera upload of %d files...\n" % len(pairs))
+        return self.run_ascp_file_pairs(pairs)
 
-        transfer_pass = os.environ.get('EMPIAR_TRANSFER_PASS')
-        if transfer_pass:
-            os.environ['ASPERA_SCP_PASS'] = transfer_pass
-        sys.stdout.write('data: ' + str(self.data) + '\n')
-        sys.stdout.write('ED: ' + self.entry_directory + '\n')
+    @deposition_step('aspera_upload')
+    def aspera_upload_files(self, paths, base=None, node=None):
+        """
+        Upload a list of files via Aspera ascp command. The files keep their location relative to the parent directory
+        of the data, so they end up in the same place as if the whole data had been uploaded
+        :param paths: the locations of the files within the data
+        :param base: the local directory that corresponds to the data directory of the entry, if the files are not
+        located within the data
+        :param node: AsperaNode object to use only this node
+        """
+        self.log("Initiating the Aspera upload of %d files...\n" % len(paths))
+        return self.run_ascp_file_pairs(get_file_pairs(paths, base or self.data_base), node=node)
 
-        command = ['"' + self.ascp + '" -QT -l 200M -P 33001 -L- -k3 ' + self.data +
-                   ' emp_dep@hx-fasp-1.ebi.ac.uk:' + os.path.join(self.upload_dir, self.entry_directory, 'data')]
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    def run_ascp_file_pairs(self, pairs, node=None):
+        """
+        Run ascp with a file pair list that gives the location of each file in the data directory of the entry. With
+        a resume policy the files that have already been uploaded are skipped and the others are transferred in
+        chunks, each with its own way of resuming
+        :param pairs: list of (source, destination) tuples, the destinations are relative to the data directory of
+        the entry
+        :param node: AsperaNode object to use only this node
+        :return: ascp return code
+        """
+        resume_policy = self.get_resume_policy()
+        if resume_policy is None:
+            return self.run_ascp_file_pair_list(pairs, node=node)
+
+        files = []
+        for source, destination in pairs:
+            st = os.stat(source)
+            files.append((source, destination, st.st_size, st.st_mtime))
+        chunks, skipped = resume_policy.plan(files)
+        if skipped:
+            self.log("Skipping %d files, %s, that have already been uploaded\n" %
+                     (len(skipped), format_size(sum(f[2] for f in skipped))))
+
+        for level, chunk in chunks:
+            returncode = self.run_ascp_file_pair_list([(f[0], f[1]) for f in chunk], node=node, resume_level=level)
+            if returncode != 0:
+                return returncode
+            resume_policy.record(chunk)
+        return 0
 
-        # Poll process for new output until finished
-        while True:
-            next_line = process.stdout.readline()
-            if next_line == b'' and process.poll() is not None:
-                break
+    def run_ascp_file_pair_list(self, pairs, node=None, resume_level=DEFAULT_RESUME_LEVEL):
+        """
+        Write the file pair list and run ascp with it. The list is written once and used by all restarts of ascp
+        :param pairs: list of (source, destination) tuples
+        :param node: AsperaNode object to use only this node
+        :param resume_level: the value of the -k option of ascp
+        :return: ascp return code
+        """
+        file_list_fd, file_list = tempfile.mkstemp(prefix='empiar_depositor_', suffix='.txt')
+        try:
+            with os.fdopen(file_list_fd, 'w') as f:
+                write_file_pair_list(f, pairs)
+
+            return self.run_ascp(['-d', '--file-pair-list=%s' % file_list], node=node, resume_level=resume_level)
+        finally:
+            os.remove(file_list)
 
-            sys.stdout.write(next_line.decode("utf-8"))
-            sys.stdout.flush()
+    def get_resume_policy(self):
+        """
+        Get the resume policy of the entry. Its journal is kept in the state directory, one per data directory of an
+        entry
+        :return: ResumePolicy object or None if the transfers always resume with a full checksum
+        """
+        if not self.resume_check:
+            return None
+        with self.resume_policy_lock:
+            if self.resume_policy is None:
+                journal_path = os.path.join(self.state_dir, 'journals', self.entry_directory + '.jsonl') \
+                    if self.state_dir else None
+                self.resume_policy = ResumePolicy(Manifest(journal_path), check=self.resume_check)
+            return self.resume_policy
+
+    def run_ascp(self, sources, destination=None, node=None, resume_level=DEFAULT_RESUME_LEVEL):
+        """
+        Run ascp to upload the sources into the data directory of the entry. If the transfer to the best Aspera node
+        keeps failing with transient errors, it is resumed on the next node
+        :param sources: list of the ascp arguments that specify what is to be uploaded
+        :param destination: the location on the upload server, the data directory of the entry by default
+        :param node: AsperaNode object to use only this node
+        :param resume_level: the value of the -k option of ascp
+        :return: ascp return code
+        """
+        if node is not None:
+            return self.run_ascp_on_node(sources, destination, node, resume_level)[0]
+
+        nodes = self.get_aspera_nodes()
+        for i, node in enumerate(nodes):
+            returncode, failure = self.run_ascp_on_node(sources, destination, node, resume_level)
+            if returncode == 0 or failure == FATAL or self.stop_event.is_set() or i == len(nodes) - 1:
+                return returncode
+            self.log("The Aspera transfer via %s was not successful, continuing via %s\n" % (node, nodes[i + 1]),
+                     error=True)
+            self.demote_aspera_node(node)
+
+    def run_ascp_on_node(self, sources, destination, node, resume_level=DEFAULT_RESUME_LEVEL):
+        """
+        Run ascp to upload the sources to an Aspera node under supervision. After a transient error or a stall ascp is
+        restarted with an increasing delay and resumes the transfer of the files, up to the limit of restarts. If the
+        rate depends on the rate schedule or on the share of the host rate, ascp is also restarted with its new rate
+        whenever the rate changes considerably. While the schedule pauses the transfers ascp does not run
+        :param sources: list of the ascp arguments that specify what is to be uploaded
+        :param destination: the location on the upload server, the data directory of the entry if None
+        :param node: AsperaNode object
+        :param resume_level: the value of the -k option of ascp
+        :return: ascp return code and the kind of the failure, None if the transfer has been successful
+        """
+        transfer_id = None
+        restarts = 0
+        try:
+            while True:
+                if not self.wait_for_transfer_window():
+                    return 1, None
+                if self.bandwidth is not None and transfer_id is None:
+                    transfer_id = self.bandwidth.register(log=self.log)[0]
+                rate = self.get_aspera_rate(transfer_id)
+                if rate == 0:
+                    continue
+
+                monitor = None
+                if self.bandwidth is not None or self.rate_schedule is not None:
+                    self.log("Aspera transfer rate: %d Mbps\n" % rate)
+                    thread_id = threading.current_thread().ident
+                    monitor = TransferMonitor(lambda: self.get_aspera_rate(transfer_id), rate,
+                                              lambda: self.terminate_process(thread_id), self.log)
+                    monitor.start()
+                started = time.time()
+                try:
+                    returncode, failure, reason = self.run_ascp_process(sources, destination, rate, node, resume_level)
+                finally:
+                    if monitor is not None:
+                        monitor.finish()
+
+                if returncode == 0 or self.stop_event.is_set():
+                    return returncode, None
+                if monitor is not None and monitor.new_rate is not None:
+                    if monitor.new_rate == 0:
+                        if transfer_id is not None:
+                            # The share of a paused transfer goes to the other transfers
+                            self.bandwidth.unregister(transfer_id, log=self.log)
+                            transfer_id = None
+                    else:
+                        self.log("The transfer rate has changed, restarting the Aspera transfer with %d Mbps\n" %
+                                 monitor.new_rate)
+                    continue
+
+                if failure == FATAL:
+                    if reason:
+                        self.log("The Aspera transfer has failed: %s\n" % reason, error=True)
+                    return returncode, failure
+
+                # A transfer that has run for a while has made progress, so its restarts start anew
+                restarts = 1 if time.time() - started >= STABLE_RUN else restarts + 1
+                # The errors that are not recognised may well be permanent, so they are restarted fewer times
+                max_restarts = min(self.ascp_max_restarts, UNKNOWN_MAX_RESTARTS) if failure == UNKNOWN \
+                    else self.ascp_max_restarts
+                if restarts > max_restarts:
+                    self.log("The Aspera transfer has failed %d times in a row, giving up\n" % restarts, error=True)
+                    return returncode, failure
+                delay = self.ascp_restart_policy.backoff(restarts)
+                self.log("The Aspera transfer has %s (%s), resuming in %.0f s, restart %d of %d\n" %
+                         ({STALLED: 'stalled', UNKNOWN: 'failed'}.get(failure, 'been interrupted'),
+                          reason or "no output", delay, restarts, max_restarts), error=True)
+                if self.stop_event.wait(delay):
+                    return returncode, None
+        finally:
+            if transfer_id is not None:
+                self.bandwidth.unregister(transfer_id, log=self.log)
+
+    def get_aspera_rate(self, transfer_id=None):
+        """
+        Get the rate of an Aspera transfer. The rate schedule sets the rate of the transfer or, if the host rate is
+        shared, the rate of the host
+        :param transfer_id: the ID of the transfer in the bandwidth registry, None if it is not registered
+        :return: the rate in Mbps, 0 if the transfer is to be paused
+        """
+        scheduled_rate = self.rate_schedule.get_rate() if self.rate_schedule is not None else None
+        if scheduled_rate == 0:
+            return 0
+        if self.bandwidth is None:
+            return scheduled_rate or ASPERA_TARGET_RATE
+        if transfer_id is None:
+            # The registry cannot be used, so the transfer does not share the rate of the host
+            return scheduled_rate or self.bandwidth.total_rate
+        return self.bandwidth.heartbeat(transfer_id, total_rate=scheduled_rate)
+
+    def wait_for_transfer_window(self):
+        """
+        Wait while the rate schedule pauses the transfers
+        :return: False if the deposition has been stopped while waiting
+        """
+        if self.rate_schedule is None or not self.rate_schedule.is_paused():
+            return True
 
-        process.communicate()
+        next_change = self.rate_schedule.next_change()
+        self.log("The transfers are paused by the rate schedule%s\n" %
+                 (time.strftime(" until %a %H:%M", time.localtime(next_change)) if next_change else ""))
+        paused = time.time()
+        try:
+            while self.rate_schedule.is_paused():
+                if self.stop_event.wait(SCHEDULE_POLL_INTERVAL):
+                    return not self.is_stopped()
+        finally:
+            if self.current_step is not None:
+                self.current_step.paused += time.time() - paused
+        self.log("Resuming the transfers\n")
+        return True
+
+    def run_ascp_process(self, sources, destination, rate, node, resume_level=DEFAULT_RESUME_LEVEL):
+        """
+        Run ascp once with the given rate
+        :param sources: list of the ascp arguments that specify what is to be uploaded
+        :param destination: the location on the upload server, the data directory of the entry if None
+        :param rate: the target rate in Mbps
+        :param node: AsperaNode object
+        :param resume_level: the value of the -k option of ascp
+        :return: ascp return code, the kind of the failure and the line of the output that tells the error
+        """
+        env = os.environ.copy()
+        transfer_pass = self.transfer_pass or os.environ.get('EMPIAR_TRANSFER_PASS')
+        if transfer_pass:
+            env['ASPERA_SCP_PASS'] = transfer_pass
+
+        command = [self.ascp, '-QT', '-l', '%dM' % rate, '-P', str(node.port), '-L-', '-k%d' % resume_level] + \
+            sources + [node.destination + ':' + (destination or self.destination_dir)]
+        process = Process(command, env=env, merge_stderr=True)
+        thread_id = threading.current_thread().ident
+        self.processes[thread_id] = process
+        transferred = self.current_step.bytes or 0
+        output = collections.deque(maxlen=ASCP_OUTPUT_LINES)
+        stall_detector = None
+        if self.ascp_stall_timeout:
+            stall_detector = StallDetector(self.ascp_stall_timeout, lambda: self.terminate_process(thread_id))
+            stall_detector.start()
+
+        # Follow the output until the process has finished
+        try:
+            for next_line in process.lines():
+                if stall_detector is not None:
+                    stall_detector.touch()
+                next_line = next_line.decode("utf-8", "replace")
+                output.append(next_line)
+                completed = ASCP_COMPLETED_RE.search(next_line)
+                if completed:
+                    self.current_step.bytes = transferred + int(completed.group(1)) * 1024
+                self.log(next_line)
+        finally:
+            process.close()
+            self.processes.pop(thread_id, None)
+            if stall_detector is not None:
+                stall_detector.finish()
+
+        if process.returncode == 0:
+            self.record_rate('aspera', node.rate_key)
+            return 0, None, None
+        if stall_detector is not None and stall_detector.stalled:
+            return process.returncode, STALLED, "no output for %d s" % self.ascp_stall_timeout
+        failure, reason = classify_ascp_failure(process.returncode, output)
+        return process.returncode, failure, reason
+
+    def record_rate(self, backend, node_key=None):
+        """
+        Keep the rate of the transfer of the current step for the transfer planner
+        :param backend: 'aspera' or 'globus'
+        :param node_key: the key of the rates of the Aspera node that has been used
+        """
+        step = self.current_step
+        duration = time.time() - step.started - step.paused
+        rate = self.rate_cache.record(backend, step.bytes, duration)
+        if node_key:
+            self.rate_cache.record(node_key, step.bytes, duration)
+        if rate:
+            self.log("Transfer rate: %s/s\n" % format_size(rate))
+
+    def get_aspera_nodes(self):
+        """
+        Get the Aspera nodes from the best to the worst. If there are several nodes, they are probed the first time
+        :return: list of AsperaNode objects
+        """
+        with self.aspera_node_lock:
+            if self.aspera_node_order is None:
+                if len(self.aspera_nodes) > 1:
+                    self.log("Probing %d Aspera nodes...\n" % len(self.aspera_nodes))
+                    ranking = rank_nodes(self.aspera_nodes, self.rate_cache)
+                    for n in ranking:
+                        self.log("%s: %s, %s\n" % (
+                            n['node'], 'latency %.0f ms' % (n['latency'] * 1000) if n['latency'] is not None else
+                            'not reachable', 'rate %s/s' % format_size(n['rate']) if n['rate'] else 'rate not known'))
+                    self.aspera_node_order = [n['node'] for n in ranking]
+                else:
+                    self.aspera_node_order = list(self.aspera_nodes)
+            return list(self.aspera_node_order)
 
-        return process.returncode
+    def demote_aspera_node(self, node):
+        """
+        Move a node that has failed to the end of the order of the nodes
+        :param node: AsperaNode object
+        """
+        with self.aspera_node_lock:
+            if self.aspera_node_order and node in self.aspera_node_order:
+                self.aspera_node_order.remove(node)
+                self.aspera_node_order.append(node)
 
+    def probe_aspera(self, size=PROBE_SIZE):
+        """
+        Measure the rate of Aspera transfers by uploading a file of random data to the upload server, which discards
+        the data. Globus is not probed, as a Globus task takes too long to start
+        :param size: the size of the probe file in bytes
+        :return: the rate in bytes per second or None if the probe has failed
+        """
+        probe_dir = tempfile.mkdtemp(prefix='empiar_depositor_')
+        probe_file = os.path.join(probe_dir, 'probe_%s_%d' % (socket.gethostname(), os.getpid()))
+        try:
+            # The file is written before the measurement starts
+            with open(probe_file, 'wb') as f:
+                for i in range(0, size, 1024 ** 2):
+                    f.write(os.urandom(min(1024 ** 2, size - i)))
+            return self.upload_probe(probe_file, size)
+        finally:
+            shutil.rmtree(probe_dir)
+
+    @deposition_step('rate_probe')
+    def upload_probe(self, probe_file, size):
+        """
+        Upload the probe file to a destination of the upload server that is not written to disk, so nothing is left
+        on the server
+        :param probe_file: the location of the probe file
+        :param size: the size of the probe file in bytes
+        :return: the rate in bytes per second or None if the probe has failed
+        """
+        self.log("Measuring the Aspera transfer rate with %s of data...\n" % format_size(size))
+        started = time.time()
+        if self.run_ascp([probe_file], ASPERA_PROBE_DESTINATION) != 0:
+            self.log("The measurement of the Aspera transfer rate was not successful.\n", error=True)
+            return None
+        return size / max(time.time() - started, 0.001)
+
+    @deposition_step('globus_upload')
     def globus_upload(self):
         """
         Upload the data via globus-cli command
         """
-        sys.stdout.write("Initiating the Globus upload...\n")
+        self.log("Initiating the Globus upload...\n")
 
         # Initialise the data transfer
-        command_tr_init = ["globus transfer --format json %s %s:%s d50a0618-6d04-11e5-ba46-22000b92c6ec:%s" %
-                           (self.globus_data['is_dir'], self.globus, self.data,
-                            os.path.join(self.upload_dir, self.entry_directory, 'data', self.globus_data['obj_name']))]
+        command_tr_init = ['globus', 'transfer', '--format', 'json'] + \
+            (['--recursive'] if self.globus_data['is_dir'] else []) + \
+            ['%s:%s' % (self.globus, self.data),
+             '%s:%s' % (GLOBUS_DESTINATION, os.path.join(self.destination_dir, self.globus_data['obj_name']))]
+
+        return self.run_globus_transfer(command_tr_init)
+
+    @deposition_step('globus_upload')
+    def globus_upload_files(self, paths, base=None):
+        """
+        Upload a list of files via globus-cli command in a single batch transfer. The files keep their location
+        relative to the parent directory of the data
+        :param paths: the locations of the files within the data
+        :param base: the local directory that corresponds to the data directory of the entry, if the files are not
+        located within the data
+        """
+        self.log("Initiating the Globus upload of %d files...\n" % len(paths))
+        return self.run_globus_file_pairs(get_file_pairs(paths, base or self.data_base), base or self.data_base)
+
+    @deposition_step('globus_upload')
+    def globus_upload_file_pairs(self, pairs):
+        """
+        Upload files from anywhere via globus-cli command in a single batch transfer
+        :param pairs: list of (source, destination) tuples, the destinations are relative to the data directory of
+        the entry
+        """
+        self.log("Initiating the Globus upload of %d files...\n" % len(pairs))
+        base = os.path.commonprefix([os.path.dirname(source) + os.path.sep for source, destination in pairs])
+        return self.run_globus_file_pairs(pairs, os.path.dirname(base) or os.path.sep)
+
+    def run_globus_file_pairs(self, pairs, base):
+        """
+        Run a Globus batch transfer of a list of files
+        :param pairs: list of (source, destination) tuples
+        :param base: the directory on the source endpoint that contains all sources
+        :return: 0 if the transfer has been successful
+        """
+        batch_fd, batch_file = tempfile.mkstemp(prefix='empiar_depositor_', suffix='.txt')
+        try:
+            with os.fdopen(batch_fd, 'w') as f:
+                for source, destination in pairs:
+                    f.write('%s %s\n' % (quote(os.path.relpath(source, base)), quote(destination)))
+
+            command_tr_init = ['globus', 'transfer', '--format', 'json', '--batch', '%s:%s' % (self.globus, base),
+                               '%s:%s' % (GLOBUS_DESTINATION, self.destination_dir)]
+            return self.run_globus_transfer(command_tr_init, batch_file)
+        finally:
+            os.remove(batch_file)
+
+    def run_globus_transfer(self, command_tr_init, batch_file=None):
+        """
+        Initiate a Globus transfer and wait for it to finish. If the rate schedule pauses the transfers, the task is
+        cancelled and submitted again once the pause is over, skipping the files that have already been transferred
+        :param command_tr_init: argv of the globus transfer command
+        :param batch_file: the location of the list of the files of a batch transfer
+        :return: 0 if the transfer has been successful
+        """
+        if self.rate_schedule is None:
+            return self.run_globus_task(command_tr_init, batch_file)
+
+        while True:
+            if not self.wait_for_transfer_window():
+                return 1
 
-        out_tr_init, err_tr_init, retcode_tr_init = run_shell_command(command_tr_init)
+            monitor = TransferMonitor(lambda: 0 if self.rate_schedule.is_paused() else 1, 1, self.cancel_globus_task,
+                                      self.log)
+            monitor.start()
+            try:
+                retcode = self.run_globus_task(command_tr_init, batch_file)
+            finally:
+                monitor.finish()
+
+            if monitor.new_rate is None or self.stop_event.is_set():
+                return retcode
+            if '--sync-level' not in command_tr_init:
+                command_tr_init = command_tr_init[:2] + ['--sync-level', 'mtime'] + command_tr_init[2:]
+
+    def run_globus_task(self, command_tr_init, batch_file=None):
+        """
+        Submit a Globus transfer task and wait for it to finish
+        :param command_tr_init: argv of the globus transfer command
+        :param batch_file: the location of the list of the files of a batch transfer, which the command reads
+        :return: 0 if the transfer has been successful
+        """
+        if batch_file is not None:
+            with open(batch_file) as f:
+                out_tr_init, err_tr_init, retcode_tr_init = run_command(command_tr_init, GLOBUS_COMMAND_TIMEOUT,
+                                                                        stdin=f)
+        else:
+            out_tr_init, err_tr_init, retcode_tr_init = run_command(command_tr_init, GLOBUS_COMMAND_TIMEOUT)
         success_tr_init = b'The transfer has been accepted and a task has been created and queued for execution'
         if err_tr_init or retcode_tr_init != 0 or not out_tr_init or success_tr_init not in out_tr_init:
-            sys.stdout.write(
+            self.log(
                 "Globus transfer initiation was not successful. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                (retcode_tr_init, out_tr_init, err_tr_init))
+                (retcode_tr_init, out_tr_init, err_tr_init), error=True)
             return 1
 
         # Get task ID
         try:
             tr_init_json = json.loads(out_tr_init)
         except ValueError:
-            sys.stdout.write("Error while processing transfer initiation result - the string does not contain a valid "
-                             "JSON. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                             (retcode_tr_init, out_tr_init, err_tr_init))
+            self.log("Error while processing transfer initiation result - the string does not contain a valid "
+                     "JSON. Return code: %s.\nOutput:%s\nError message: %s\n" %
+                     (retcode_tr_init, out_tr_init, err_tr_init), error=True)
             return 1
 
         if 'task_id' not in tr_init_json or not tr_init_json['task_id']:
-            sys.stdout.write("Globus JSON transfer initiation result does not have a valid structure of "
-                             "JSON['task_id']. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                             (retcode_tr_init, out_tr_init, err_tr_init))
+            self.log("Globus JSON transfer initiation result does not have a valid structure of "
+                     "JSON['task_id']. Return code: %s.\nOutput:%s\nError message: %s\n" %
+                     (retcode_tr_init, out_tr_init, err_tr_init), error=True)
             return 1
         else:
             task_id = tr_init_json['task_id']
 
-        return self.globus_upload_wait(task_id)
+        self.globus_task_id = task_id
+        retcode = self.globus_upload_wait(task_id, log=self.log, stop_event=self.stop_event)
+        self.globus_task_id = None
+
+        if retcode == 0:
+            out_show, err_show, retcode_show = run_command(['globus', 'task', 'show', '--format', 'json', task_id],
+                                                           GLOBUS_COMMAND_TIMEOUT)
+            try:
+                self.current_step.bytes = json.loads(out_show).get('bytes_transferred')
+            except (TypeError, ValueError, AttributeError):
+                pass
+            self.record_rate('globus')
+        return retcode
+
+    def stop(self):
+        """
+        Stop the deposition: terminate the running transfer and do not proceed to the next steps. The deposition can
+        be resumed later with the entry ID and the entry directory
+        """
+        self.stop_event.set()
+        self.terminate_process()
+        self.cancel_globus_task()
+
+    def terminate_process(self, thread_id=None):
+        """
+        Terminate the running ascp processes
+        :param thread_id: the ID of the thread whose process is terminated, all processes by default
+        """
+        for process_thread_id, process in list(self.processes.items()):
+            if (thread_id is None or process_thread_id == thread_id) and process.poll() is None:
+                process.terminate()
+
+    def cancel_globus_task(self):
+        """
+        Cancel the running Globus task
+        """
+        if self.globus_task_id:
+            run_command(['globus', 'task', 'cancel', self.globus_task_id], GLOBUS_COMMAND_TIMEOUT)
+
+    def is_stopped(self):
+        """
+        :return: True if the deposition has been asked to stop, in which case a message is written
+        """
+        if self.stop_event.is_set():
+            self.log("The deposition has been stopped.\n")
+            return True
+        return False
 
+    @deposition_step('thumbnail_upload')
     def thumbnail_upload(self):
         """
-        Upload the thumbnail image that will represent the entry on EMPIAR pages
+        Upload the thumbnail image that will represent the entry on EMPIAR pages. The thumbnail is made from the data
+        if none has been provided, and a provided image is converted to a PNG of the accepted size if needed
         """
-        sys.stdout.write("Initiating the upload of the thumbnail image...\n")
-        f = open(self.entry_thumbnail, 'rb')
-        files = {'file': (self.entry_thumbnail, f)}
+        self.log("Initiating the upload of the thumbnail image...\n")
+        try:
+            png = prepare_thumbnail(self.entry_thumbnail, self.json_input, self.data)
+        except (ValueError, IOError, OSError) as e:
+            if self.entry_thumbnail:
+                self.log("The thumbnail cannot be converted: %s\n" % e, error=True)
+                return 1
+            self.log("The thumbnail cannot be made from the data, the image from the related EMDB entry will be "
+                     "used: %s\n" % e)
+            return 0
+
+        # The file is opened again for every attempt of the request
+        if png is None:
+            self.current_step.bytes = os.path.getsize(self.entry_thumbnail)
+            open_files = lambda: {'file': (self.entry_thumbnail, open(self.entry_thumbnail, 'rb'))}
+        else:
+            self.log("Made a PNG thumbnail of %s\n" % format_size(len(png)))
+            self.current_step.bytes = len(png)
+            name = os.path.splitext(self.entry_thumbnail)[0] if self.entry_thumbnail else 'entry_thumbnail'
+            open_files = lambda: {'file': (name + '.png', io.BytesIO(png))}
         thumbnail_response = self.make_request(requests.post, self.thumbnail_url, data={"entry_id": self.entry_id},
-                                               files=files, headers=self.auth_header, verify=self.ignore_certificate)
-        f.close()
+                                               files=open_files, headers=self.auth_header,
+                                               verify=self.ignore_certificate)
 
+        self.record_response(thumbnail_response)
         if check_json_response(thumbnail_response):
             thumbnail_response_json = thumbnail_response.json()
+            self.record_response(thumbnail_response, thumbnail_response_json)
 
             if 'thumbnail_upload' in thumbnail_response_json and thumbnail_response_json['thumbnail_upload'] is True:
-                sys.stdout.write("Successfully uploaded the thumbnail for EMPIAR deposition.\n")
+                self.log("Successfully uploaded the thumbnail for EMPIAR deposition.\n")
                 return 0
             else:
-                sys.stdout.write("The upload of the thumbnail for EMPIAR deposition was not successful. Returned "
-                                 "response: %s\nStatus code: %s\n" % (str(thumbnail_response_json),
-                                                                      thumbnail_response.status_code))
+                self.log("The upload of the thumbnail for EMPIAR deposition was not successful. Returned "
+                         "response: %s\nStatus code: %s\n" % (str(thumbnail_response_json),
+                                                              thumbnail_response.status_code), error=True)
 
-        sys.stdout.write("The upload of the thumbnail was not successful.\n")
+        self.log("The upload of the thumbnail was not successful.\n", error=True)
         return 1
 
+    @deposition_step('grant_rights')
     def grant_rights(self):
         """
         Grant rights to users
         """
-        sys.stdout.write("Initiating the granting rights to the deposition...\n")
+        self.log("Initiating the granting rights to the deposition...\n")
         if self.entry_id:
             data_list = []
             grant_rights_successes = {}
@@ -411,92 +1196,374 @@ class EmpiarDepositor:
                     headers=self.deposition_headers, verify=self.ignore_certificate
                 )
 
+                self.record_response(grant_rights_response)
                 if check_json_response(grant_rights_response):
                     grant_rights_response_json = grant_rights_response.json()
+                    self.record_response(grant_rights_response, grant_rights_response_json)
                     for user_result in grant_rights_response_json:
                         if user_result and user_result in grant_rights_successes:
                             grant_rights_successes[user_result] = True
 
                     if grant_rights_response.status_code == 200:
-                        sys.stdout.write(
+                        self.log(
                             "Successfully granted rights {data_dict} EMPIAR deposition {entry_id}.\n".format(
                                 data_dict=data_dict,
                                 entry_id=self.entry_id
                             )
                         )
                     else:
-                        sys.stdout.write("The granting rights for EMPIAR deposition for %s was not successful. Returned "
-                                         "response: %s\nStatus code: %s\n" % (data_dict,
-                                                                              grant_rights_response_json,
-                                                                              grant_rights_response.status_code))
+                        self.log("The granting rights for EMPIAR deposition for %s was not successful. Returned "
+                                 "response: %s\nStatus code: %s\n" % (data_dict,
+                                                                      grant_rights_response_json,
+                                                                      grant_rights_response.status_code), error=True)
 
             if not grant_rights_successes or False in grant_rights_successes.values():
-                sys.stdout.write("The granting rights for EMPIAR deposition was not successful.")
+                self.log("The granting rights for EMPIAR deposition was not successful.", error=True)
                 if grant_rights_successes:
-                    sys.stdout.write(
+                    self.log(
                         "The following user(s) did not have rights granted: {grant_rights_successes}".format(
                             grant_rights_successes=grant_rights_successes
-                        )
+                        ),
+                        error=True
                     )
                 return 1
         else:
-            sys.stdout.write("Please provide an entry ID.")
+            self.log("Please provide an entry ID.", error=True)
             return 1
 
         return 0
 
+    @deposition_step('submit_deposition')
     def submit_deposition(self):
         """
         Submit the deposition for annotation
         """
-        sys.stdout.write("Initiating the submission of the deposition...\n")
+        self.log("Initiating the submission of the deposition...\n")
 
         submission_response = self.make_request(requests.post, self.submission_url,
                                                 data='{"entry_id": "%s"}' % self.entry_id,
-                                                headers=self.deposition_headers, verify=self.ignore_certificate)
+                                                headers=self.deposition_headers, verify=self.ignore_certificate,
+                                                idempotent=False)
 
+        self.record_response(submission_response)
         if check_json_response(submission_response):
             submission_response_json = submission_response.json()
+            self.record_response(submission_response, submission_response_json)
             if 'submission' in submission_response_json and submission_response_json['submission'] is True and \
                     submission_response_json['empiar_id']:
-                sys.stdout.write("Your submission was successful. The accession code that can be cited in paper is %s\n"
-                                 % submission_response_json['empiar_id'])
+                self.empiar_id = submission_response_json['empiar_id']
+                self.log("Your submission was successful. The accession code that can be cited in paper is %s\n"
+                         % submission_response_json['empiar_id'])
                 if self.output_id_dir:
                     return self.entry_id, self.entry_directory
                 return 0
             else:
-                sys.stdout.write("The submission of an EMPIAR deposition was not successful. Returned response: %s\n"
-                                 "Status code: %s\n" % (str(submission_response_json), submission_response.status_code))
+                self.log("The submission of an EMPIAR deposition was not successful. Returned response: %s\n"
+                         "Status code: %s\n" % (str(submission_response_json), submission_response.status_code),
+                         error=True)
 
-        sys.stdout.write("The submission of the entry was not successful.\n")
+        self.log("The submission of the entry was not successful.\n", error=True)
         return 1
 
+    @deposition_step('check_integrity')
+    def check_integrity(self):
+        """
+        Check that the files to upload are not empty and that MRC, TIFF and EER files are not truncated, before
+        anything is created or transferred
+        :return: 0 if no problems have been found
+        """
+        started = time.time()
+        if self.staging is not None:
+            paths = [source for source, destination in self.staging.file_pairs()
+                     if self.selection is None or self.selection.matches(destination)]
+        else:
+            files = scan_tree(self.data)
+            if self.selection is not None:
+                files = self.selection.select(files, self.data_base)[0]
+            paths = [f[0] for f in files]
+
+        problems = check_files(paths, read_budget=self.integrity_read_budget)
+        unchecked = [p for p in problems if p[1] == UNCHECKED]
+        problems = [p for p in problems if p[1] != UNCHECKED]
+        self.log("Checked %d files in %s\n" % (len(paths), format_duration(time.time() - started)))
+        if unchecked:
+            self.log("%d files have more headers than the read budget of %s and have not been checked completely\n" %
+                     (len(unchecked), format_size(self.integrity_read_budget)))
+        for path, status, description in problems[:MAX_REPORTED_PROBLEMS]:
+            self.log("%s is %s: %s\n" % (path, status, description), error=True)
+        if len(problems) > MAX_REPORTED_PROBLEMS:
+            self.log("... and %d more files with problems\n" % (len(problems) - MAX_REPORTED_PROBLEMS), error=True)
+        if problems:
+            self.log("Please replace or exclude the files with problems before the deposition\n", error=True)
+            return 1
+        return 0
+
+    def upload_data(self):
+        """
+        Upload the data with Aspera, falling back to Globus if Aspera fails, or with both at the same time
+        :return: 0 if the upload has been successful
+        """
+        if self.staging is not None:
+            return self.upload_staged_data()
+        if self.selection is not None or self.dedup is not None:
+            return self.upload_selected_data()
+        if self.stages or self.hybrid is not None:
+            return self.upload_files([f[0] for f in self.scan_data()])
+
+        upload_code = -1
+        if self.ascp:
+            upload_code = self.aspera_upload()
+            if upload_code != 0 and self.globus and not self.stop_event.is_set():
+                self.log("Error while uploading the data with Aspera. Trying to use Globus instead...\n")
+
+        if upload_code != 0 and self.globus and self.globus_data and not self.stop_event.is_set():
+            upload_code = self.globus_upload()
+
+        return upload_code
+
+    def upload_changed_data(self, redeposit=False):
+        """
+        Upload the data unless the whole data, or its selected files, has already been uploaded to the entry and has
+        not changed since. The files of the data are recorded once the upload has been successful, from the list the
+        upload has made if it has made one
+        :param redeposit: True if the data is uploaded into an existing entry
+        :return: 0 if the upload has been successful or has not been needed
+        """
+        snapshot = self.get_upload_snapshot()
+        if snapshot.path is None:
+            return self.upload_data()
+
+        index = None
+        if redeposit and self.redeposit_data == 'auto' and os.path.isfile(snapshot.path):
+            started = time.time()
+            index = scan_index(self.data, self.data_base, selection=self.selection)
+            if len(index) and snapshot.matches(index):
+                self.log("The data has not changed since it was uploaded to the entry, checked %d files in %s. "
+                         "Skipping the upload of the data\n" % (len(index), format_duration(time.time() - started)))
+                return 0
+
+        self.listed_files = None
+        upload_code = self.upload_data()
+        if upload_code == 0:
+            if self.listed_files is not None:
+                index = index_files(self.listed_files, self.data_base, selection=self.selection)
+            elif index is None:
+                # ascp or Globus has walked the data itself
+                index = scan_index(self.data, self.data_base, selection=self.selection)
+            snapshot.save(index)
+        return upload_code
+
+    def scan_data(self):
+        """
+        List the files of the data and keep the list for the upload snapshot
+        :return: sorted list of (path, size, mtime) tuples
+        """
+        self.listed_files = scan_tree(self.data)
+        return self.listed_files
+
+    def get_upload_snapshot(self):
+        """
+        :return: UploadSnapshot object of the entry, kept in the state directory
+        """
+        return UploadSnapshot(os.path.join(self.state_dir, 'uploads', self.entry_directory + '.idx')
+                              if self.state_dir else None)
+
+    def upload_selected_data(self):
+        """
+        Upload the files of the data that are selected by the image set directories and the include and exclude
+        patterns, leaving out the duplicates if they are transferred only once
+        :return: 0 if the upload has been successful
+        """
+        selected = self.scan_data()
+        if self.selection is not None:
+            selected, excluded = self.selection.select(selected, self.data_base)
+            self.log("Selected %d files, %s, excluded %d files, %s\n" %
+                     (len(selected), format_size(sum(f[1] for f in selected)), len(excluded),
+                      format_size(sum(f[1] for f in excluded))))
+        if not selected:
+            self.log("There are no files to upload\n", error=True)
+            return 1
+        if self.dedup is None:
+            return self.upload_files([f[0] for f in selected])
+
+        duplicates = self.find_duplicates(selected)
+        if self.dedup == 'warn' or not duplicates:
+            return self.upload_files([f[0] for f in selected])
+
+        skipped = set(path for paths, size in duplicates for path in paths[1:])
+        upload_code = self.upload_files([f[0] for f in selected if f[0] not in skipped])
+        if upload_code != 0:
+            return upload_code
+        return self.upload_duplicates_list(duplicates)
+
+    def find_duplicates(self, files):
+        """
+        Find the files with the same content and report them per image set
+        :param files: list of (path, size, mtime) tuples
+        :return: the groups of duplicates as returned by find_duplicates
+        """
+        started = time.time()
+        duplicates = find_duplicates(files, min_size=self.dedup_min_size)
+        self.log("Compared %d files in %s\n" % (len(files), format_duration(time.time() - started)))
+        if not duplicates:
+            self.log("There are no duplicate files\n")
+            return duplicates
+
+        counts = count_by_imageset(duplicates, self.data_base, get_selected_paths(self.json_input))
+        self.log("Found %d duplicate files, %s, with the same content as other files\n" %
+                 (sum(c[0] for c in counts.values()), format_size(sum(c[1] for c in counts.values()))))
+        for directory, (count, size) in counts.items():
+            self.log("  %s: %d duplicate files, %s\n" % (directory or 'files outside the image sets', count,
+                                                         format_size(size)))
+        for paths, size in duplicates[:MAX_REPORTED_PROBLEMS]:
+            self.log("  %s\n" % ' = '.join(os.path.relpath(path, self.data_base) for path in paths))
+        if len(duplicates) > MAX_REPORTED_PROBLEMS:
+            self.log("  ... and %d more groups of duplicate files\n" % (len(duplicates) - MAX_REPORTED_PROBLEMS))
+        if self.dedup == 'once':
+            self.log("The duplicate files are not transferred, they are listed in %s in the entry instead\n" %
+                     DUPLICATES_FILE)
+        return duplicates
+
+    def upload_duplicates_list(self, duplicates):
+        """
+        Upload the list of the duplicates that have not been transferred into the data directory of the entry
+        :param duplicates: the groups of duplicates as returned by find_duplicates
+        :return: 0 if the upload has been successful
+        """
+        list_dir = tempfile.mkdtemp(prefix='empiar_depositor_')
+        try:
+            path = os.path.join(list_dir, DUPLICATES_FILE)
+            with open(path, 'w') as f:
+                write_duplicates(f, duplicates, self.data_base)
+            return self.transfer_files([path], list_dir)
+        finally:
+            shutil.rmtree(list_dir)
+
+    def upload_staged_data(self):
+        """
+        Upload the staged data, either as the tree of links in the staging directory or as a list of the locations of
+        the files
+        :return: 0 if the upload has been successful
+        """
+        pairs = self.staging.file_pairs()
+        self.log("Staged %d files from %d locations\n" % (len(pairs), len(self.staging.mappings)))
+        if self.selection is not None:
+            pairs = [(source, destination) for source, destination in pairs if self.selection.matches(destination)]
+            self.log("Selected %d of the staged files\n" % len(pairs))
+        if not pairs:
+            self.log("There are no files to upload\n", error=True)
+            return 1
+        if self.staging.mode != 'pairs':
+            return self.transfer_files(self.staging.link(pairs), self.staging.root)
+        return self.transfer_file_pairs(pairs)
+
+    def transfer_file_pairs(self, pairs):
+        """
+        Transfer files from anywhere with Aspera, falling back to Globus if Aspera fails
+        :param pairs: list of (source, destination) tuples, the destinations are relative to the data directory of
+        the entry
+        :return: 0 if the transfer has been successful
+        """
+        upload_code = -1
+        if self.ascp:
+            upload_code = self.aspera_upload_file_pairs(pairs)
+            if upload_code != 0 and self.globus and not self.stop_event.is_set():
+                self.log("Error while uploading the files with Aspera. Trying to use Globus instead...\n")
+
+        if upload_code != 0 and self.globus and not self.stop_event.is_set():
+            upload_code = self.globus_upload_file_pairs(pairs)
+
+        return upload_code
+
+    def upload_files(self, paths, stage=0, base=None):
+        """
+        Upload a list of files from the data, passing them through the enabled stages, such as compression and
+        packing. Each stage transfers the files it has processed or passes them on to the next stage together with the
+        rest
+        :param paths: the locations of the files within the data
+        :param stage: the number of the stage the files are passed to
+        :param base: the local directory that corresponds to the data directory of the entry, the parent directory of
+        the data by default
+        :return: 0 if the upload has been successful
+        """
+        if stage < len(self.stages):
+            return self.stages[stage].upload_files(
+                self, paths, lambda others, others_base=base: self.upload_files(others, stage + 1, others_base),
+                base=base)
+        return self.transfer_files(paths, base)
+
+    def transfer_files(self, paths, base=None):
+        """
+        Transfer a list of files with Aspera, falling back to Globus if Aspera fails, or with both at the same time
+        :param paths: the locations of the files
+        :param base: the local directory that corresponds to the data directory of the entry, the parent directory of
+        the data by default
+        :return: 0 if the transfer has been successful
+        """
+        if self.hybrid is not None:
+            return self.hybrid.transfer_files(self, paths, base)
+
+        upload_code = -1
+        if self.ascp:
+            upload_code = self.aspera_upload_files(paths, base)
+            if upload_code != 0 and self.globus and not self.stop_event.is_set():
+                self.log("Error while uploading the files with Aspera. Trying to use Globus instead...\n")
+
+        if upload_code != 0 and self.globus and not self.stop_event.is_set():
+            upload_code = self.globus_upload_files(paths, base)
+
+        return upload_code
+
+    def deposit(self):
+        """
+        Create, upload and submit a deposition to EMPIAR
+        :return: DepositionResult object with the results of all steps that have been run
+        """
+        self.results = []
+        self.deposition_errors = []
+        try:
+            return_value = self.deposit_data()
+        except (requests.exceptions.RequestException, IOError, OSError) as e:
+            # The step that has failed keeps the error in its result
+            self.log("The deposition of the entry was not successful: %s\n" % e, error=True)
+            return_value = 1
+        return DepositionResult(list(self.results), return_value, entry_id=self.entry_id,
+                                entry_directory=self.entry_directory, empiar_id=self.empiar_id,
+                                errors=list(self.deposition_errors))
+
     def deposit_data(self):
         """
         Create, upload and submit a deposition to EMPIAR
         """
-        upload_code = -1
-        if not (self.entry_id and self.entry_directory):
+        if self.integrity_check and self.check_integrity() != 0:
+            self.log("The deposition of the entry was not successful.\n", error=True)
+            return 1
+
+        redeposit = bool(self.entry_id and self.entry_directory)
+        if not redeposit:
             dep_code = self.create_new_deposition()
         else:
             dep_code = self.redeposit()
 
-        if dep_code == 0:
-            if self.entry_thumbnail:
+        if dep_code == 0 and not self.is_stopped():
+            if self.entry_thumbnail or self.auto_thumbnail:
                 thumb_result = self.thumbnail_upload()
                 if thumb_result != 0:
                     return thumb_result
 
-            if self.ascp:
-                upload_code = self.aspera_upload()
-                if upload_code != 0 and self.globus:
-                    sys.stdout.write("Error while uploading the data with Aspera. Trying to use Globus instead...\n")
+            if self.watcher is not None:
+                upload_code = self.watcher.upload(self)
+            elif redeposit and self.redeposit_data == 'skip':
+                self.log("Skipping the upload of the data, only the metadata of the entry has been updated\n")
+                upload_code = 0
+            else:
+                upload_code = self.upload_changed_data(redeposit)
 
-            if upload_code != 0 and self.globus and self.globus_data:
-                upload_code = self.globus_upload()
+            if self.is_stopped():
+                return 1
 
             if upload_code == 0:
-                sys.stdout.write("Finished uploading the data.\n")
+                self.log("Finished uploading the data.\n")
 
                 grant_rights_exist = self.grant_rights_usernames or self.grant_rights_emails or self.grant_rights_orcids
                 grant_rights_result = 0
@@ -513,18 +1580,288 @@ class EmpiarDepositor:
                         submit_result = self.submit_deposition()
                         return submit_result
 
-        sys.stdout.write("The deposition of the entry was not successful.\n")
+        self.log("The deposition of the entry was not successful.\n", error=True)
         return 1
 
 
-def main(args=None):
+def check_ascp(ascp, log=None):
     """
-    Deposit the data into EMPIAR
+    Check that the specified ascp exists and works
+    :param ascp: the location of the ascp executable
+    :param log: function that reports the progress, sys.stdout.write by default
+    :return: True if ascp can be used for the transfer, False otherwise
+    """
+    if log is None:
+        log = sys.stdout.write
+    aspera_okay = True
+    aspera_exists = os.path.isfile(ascp)
+    if aspera_exists:
+        ascp_specified = ascp.endswith("ascp") or ascp.endswith("ascp.exe")
+        if ascp_specified:
+            p_out, p_err, returncode = run_command([ascp], ASCP_CHECK_TIMEOUT)
+
+            if not p_out or p_err:
+                log("Error while trying to check ascp. Returned output:\n" + str(p_out) + "\n" +
+                    str(p_err) + "\n")
+                aspera_okay = False
+
+            ascp_is_working = b'Usage: ascp' in p_out and returncode == 112
+            if not ascp_is_working:
+                log("The specified ascp does not work. Returned output:\n" + str(p_out) + "\n")
+                aspera_okay = False
+        else:
+            log(
+                "Please specify the correct path to ascp executable. By default it is installed in "
+                "~/.aspera/connect/bin directory on Linux machines, in ~/Applications/Aspera\\ Connect.app/"
+                "Contents/Resources directory on Macs and in C:\\Users\\<username>\\AppData\\Local\\Programs\\Aspera"
+                "\\Aspera Connect\\bin on Windows\n")
+            aspera_okay = False
+    else:
+        log("The specified Aspera executable does not exist\n")
+        aspera_okay = False
+
+    return aspera_okay
+
+
+def globus_login(force_login=False, log=None):
     """
+    Log in to Globus
+    :param force_login: login even if the globus-cli already has valid login credentials
+    :param log: function that reports the progress, sys.stdout.write by default
+    :return: True if logged in successfully, False otherwise
+    """
+    if log is None:
+        log = sys.stdout.write
+    log("Logging in to Globus...\n")
+    command_login = ['globus', 'login']
+    if force_login:
+        command_login.append('--force')
+
+    out_login, err_login, retcode_login = run_command(command_login, GLOBUS_LOGIN_TIMEOUT)
+    success_login = b'You have successfully logged in to the Globus CLI' in out_login or \
+                    b'You are already logged in' in out_login
+    if not success_login or err_login or retcode_login != 0:
+        log(
+            "Error while logging in into Globus. Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_login, out_login, err_login))
+        return False
+    log("Successfully logged in\n")
+    return True
+
+
+def globus_find_endpoint(globus, log=None):
+    """
+    Search for the source endpoint to get its ID and activate it
+    :param globus: Globus endpoint name or ID
+    :param log: function that reports the progress, sys.stdout.write by default
+    :return: endpoint ID or None if the endpoint cannot be found or activated
+    """
+    if log is None:
+        log = sys.stdout.write
+    endpoint_id = None
+    err_es = None
+    valid_structure = True
+    found_endpoints = 0
+    command_es = Process(['globus', 'endpoint', 'search', globus, '--filter-scope', 'my-endpoints', '--format', 'json'],
+                         timeout=GLOBUS_COMMAND_TIMEOUT, merge_stderr=True, output_limit=GLOBUS_LISTING_OUTPUT)
+    # The search stops at the first endpoint that matches the name or the ID
     try:
-        # Handle command line args
-        prog = "empiar-depositor"
-        usage = """
+        for endpoint in JsonArrayReader(command_es.chunks()).items():
+            found_endpoints += 1
+            if not isinstance(endpoint, dict) or 'id' not in endpoint or 'display_name' not in endpoint:
+                valid_structure = False
+                break
+            if endpoint['display_name'] == globus or globus == endpoint['id']:
+                endpoint_id = endpoint['id']
+                break
+        valid_json = True
+    except ValueError:
+        valid_json = False
+    retcode_es = command_es.close(drain=not valid_json)
+    out_es = command_es.output()
+
+    if retcode_es not in (0, None):
+        log("Error while searching for an endpoint. Return code: %s.\nOutput:%s\nError message: "
+            "%s\n" % (retcode_es, out_es, err_es))
+        return None
+
+    if not valid_json:
+        log(
+            "Error while processing endpoint search result - the string does not contain a valid JSON."
+            " Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_es, out_es, err_es))
+        return None
+
+    if not valid_structure or not found_endpoints:
+        log(
+            "Globus JSON endpoint search result does not have a valid structure of JSON['DATA']['id']."
+            " Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_es, out_es, err_es))
+        return None
+
+    if not endpoint_id:
+        log(
+            "Globus endpoint could not be found. Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_es, out_es, err_es))
+        return None
+
+    # Activate the source endpoint
+    command_activate = ['globus', 'endpoint', 'activate', endpoint_id, '--format', 'json']
+    out_activate, err_activate, retcode_activate = run_command(command_activate, GLOBUS_COMMAND_TIMEOUT)
+    success_activation = b'Endpoint is already activated' in out_activate or \
+                         b'Autoactivation succeeded' in out_activate
+    if err_activate or retcode_activate != 0 or not success_activation:
+        log(
+            "Globus endpoint cannot be activated. Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_activate, out_activate, err_activate))
+        return None
+
+    return endpoint_id
+
+
+def globus_check_data(endpoint_id, data, log=None):
+    """
+    Check that the source endpoint contains the specified data and determine if the data is a file or a directory
+    :param endpoint_id: source endpoint ID
+    :param data: the location of the data on the source endpoint
+    :param log: function that reports the progress, sys.stdout.write by default
+    :return: a dictionary with 'is_dir' and 'obj_name' keys or None if the data cannot be found
+    """
+    if log is None:
+        log = sys.stdout.write
+    globus_data = {'is_dir': '-r'}
+    dir_path, _, globus_data['obj_name'] = data.rpartition(os.path.sep)
+    err_ls = None
+    # The listing of a directory is not read beyond its start, which is enough to know that the directory exists
+    command_ls = Process(['globus', 'ls', '%s:%s' % (endpoint_id, data), '--format', 'json'],
+                         timeout=GLOBUS_COMMAND_TIMEOUT, merge_stderr=True, output_limit=GLOBUS_LISTING_OUTPUT)
+    try:
+        found = JsonArrayReader(command_ls.chunks()).find()
+    except ValueError:
+        found = False
+    retcode_ls = command_ls.close(drain=not found)
+    out_ls = command_ls.output()
+
+    if not found and retcode_ls == 1 and ('\'%s\' is not a directory' % data).encode('utf-8') in out_ls:
+        globus_data['is_dir'] = False
+        command_ls = Process(['globus', 'ls', '%s:%s' % (endpoint_id, dir_path), '--filter',
+                              '=' + globus_data['obj_name'], '--format', 'json'],
+                             timeout=GLOBUS_COMMAND_TIMEOUT, merge_stderr=True, output_limit=GLOBUS_LISTING_OUTPUT)
+        try:
+            found = next(JsonArrayReader(command_ls.chunks()).items(), None) is not None
+        except ValueError:
+            found = False
+        retcode_ls = command_ls.close(drain=not found)
+        out_ls = command_ls.output()
+
+    if not found or retcode_ls not in (0, None):
+        log("Error while checking the existence of the object that is to be uploaded. Make sure "
+            "that the path to the upload corresponds to the directory sharing settings in Globus. "
+            "Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_ls, out_ls, err_ls))
+        return None
+
+    return globus_data
+
+
+def globus_activate_destination(endpoint_id, transfer_pass=None, log=None):
+    """
+    Activate the destination endpoint
+    :param endpoint_id: endpoint ID
+    :param transfer_pass: EMPIAR transfer password
+    :param log: function that reports the progress, sys.stdout.write by default
+    :return: True if the endpoint has been activated, False otherwise
+    """
+    if log is None:
+        log = sys.stdout.write
+    command_activate = ['globus', 'endpoint', 'activate', '--format', 'json', '--myproxy', '--myproxy-username',
+                        'emp_dep']
+    if transfer_pass:
+        command_activate += ['--myproxy-password', transfer_pass]
+    command_activate.append(endpoint_id)
+    out_activate, err_activate, retcode_activate = run_command(command_activate, GLOBUS_COMMAND_TIMEOUT)
+    success_activation = b'Endpoint is already activated' in out_activate or \
+                         b'Endpoint activated successfully' in out_activate
+    if err_activate or retcode_activate != 0 or not success_activation:
+        log(
+            "Globus endpoint cannot be activated. Return code: %s.\nOutput:%s\nError message: %s\n" %
+            (retcode_activate, out_activate, err_activate))
+        return False
+
+    return True
+
+
+class Toolchain:
+    """
+    The :class:`Toolchain <Toolchain>` object runs the checks of the transfer tools. With a positive cache_ttl the
+    successful results are reused for that many seconds, which lets a long-running process skip ascp probing and
+    Globus login for every deposition
+    """
+
+    def __init__(self, cache_ttl=0):
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def cached(self, key, function, *args):
+        """
+        Run the check unless its successful result is in the cache
+        :param key: cache key
+        :param function: the check
+        :param args: arguments of the check
+        :return: the result of the check
+        """
+        now = time.time()
+        with self.lock:
+            if key in self.cache and now - self.cache[key][0] < self.cache_ttl:
+                return self.cache[key][1]
+
+        result = function(*args)
+        if result and self.cache_ttl > 0:
+            with self.lock:
+                self.cache[key] = (now, result)
+        return result
+
+    def check_ascp(self, ascp, log=None):
+        return self.cached(('ascp', ascp), check_ascp, ascp, log)
+
+    def globus_login(self, force_login=False, log=None):
+        if force_login:
+            with self.lock:
+                self.cache.pop(('globus_login',), None)
+            return globus_login(force_login, log)
+        return self.cached(('globus_login',), globus_login, False, log)
+
+    def globus_find_endpoint(self, globus, log=None):
+        return self.cached(('globus_endpoint', globus), globus_find_endpoint, globus, log)
+
+    def globus_activate_destination(self, endpoint_id, transfer_pass=None, log=None):
+        return self.cached(('globus_destination', endpoint_id), globus_activate_destination, endpoint_id,
+                           transfer_pass, log)
+
+
+def write_result_json(result, path, output=None):
+    """
+    Write the results of the deposition as JSON
+    :param result: DepositionResult object
+    :param path: the location of the JSON file or '-' for the output
+    :param output: stream that the results are written to if the path is '-', sys.stdout by default
+    """
+    result_str = json.dumps(result.to_dict(), indent=2)
+    if path == '-':
+        (output or sys.stdout).write(result_str + '\n')
+    else:
+        with open(path, 'w') as f:
+            f.write(result_str)
+
+
+def get_parser():
+    """
+    Create the parser of the command line arguments
+    :return: argparse.ArgumentParser object
+    """
+    prog = "empiar-depositor"
+    usage = """
     To deposit the data into EMPIAR please follow these steps:
     1) Create a JSON file according to the structure provided in the example (see https://empiar.org/\
 deposition/json_submission). 
@@ -543,288 +1880,578 @@ registering an EMPIAR user.
 EMPIAR_TOKEN JSON_INPUT DATA
 
     Examples:
-    empiar-depositor -a ~/Applications/Aspera\ Connect.app/Contents/Resources/ascp 0123456789 ~/Documents/empiar_depo\
+    empiar-depositor -a ~/Applications/Aspera\\ Connect.app/Contents/Resources/ascp 0123456789 ~/Documents/empiar_depo\
 sition_1.json ~/Downloads/micrographs
     empiar-depositor -r 10 ABC123 -e ~/Downloads/dep_thumb.png 0123456789 -g 01234567-89a-bcde-fghi-jklmnopqrstu ~/Docu\
 ments/empiar_deposition_1.json ~/Downloads/micrographs
                 """
-        version = "1.6b30"
-
-        possible_rights_help_text = "Rights can be 1 - Owner, 2 - View only, 3 - View and Edit, 4 - View, Edit and " \
-                                    "Submit. There can be only one deposition owner."
-        parser = argparse.ArgumentParser(prog=prog, usage=usage, add_help=False,
-                                         formatter_class=argparse.RawTextHelpFormatter)
-        parser.add_argument("-h", "--help", action="help", help="Show this help message and exit.")
-        parser.add_argument("empiar_token", metavar="EMPIAR_TOKEN", help="EMPIAR API token.")
-        parser.add_argument("json_input", metavar="JSON_INPUT",
-                            help="The location of the JSON with EMPIAR deposition information.")
-        parser.add_argument("data", metavar="DATA",
-                            help="The location of the data that you would like to upload to EMPIAR. It should contain "
-                                 "directories that correspond to the image set directories specified in the JSON file.")
-        parser.add_argument("-p", "-password", action="store", default=None, const=True, nargs="?", dest="password",
-                            help="Use basic authentication (username + password) instead of token authentication. If "
-                                 "no password is provided for this argument, then the user is prompted for a password.")
-        parser.add_argument("-a", "-ascp", action="store", default=False, dest="ascp",
-                            help="The location of the ascp executable. By default it is installed in "
-                                 "~/.aspera/connect/bin directory on Linux machines, in "
-                                 "~/Applications/Aspera\ Connect.app/Contents/Resources directory on Macs and in "
-                                 "C:\\Users\<username>\AppData\Local\Programs\Aspera\Aspera Connect\\bin on Windows.")
-        parser.add_argument("-g", "--globus", action="store", default=False, dest="globus",
-                            help="Use Globus if Aspera is not specified or Aspera transfer fails. Requirement: "
-                                 "globus-cli installed and an endpoint created. Specify your unique user identifier "
-                                 "(UUID) as the input parameter.")
-        parser.add_argument("-f", "--globus-force-login", action="store_true", default=False, dest="globus_force_login",
-                            help="Force login to Globus. Login even if the globus-cli already has valid login "
-                                 "credentials. Any existing credentials will be removed from local storage and globally"
-                                 " revoked.")
-
-        parser.add_argument("-e", "--entry-thumbnail", action="store",
-                            help="Thumbnail image that will represent your deposition on EMPIAR pages. Minimum size is "
-                                 "400 x 400, preferred format is png. If none is provided, then the image from the "
-                                 "related EMDB entry will be used.")
-
-        parser.add_argument("-gu", "--grant-rights-usernames", action="store",
-                            help="Grant rights. Provide a comma separated list of usernames and rights in format "
-                                 "<username>:<rights>. " + possible_rights_help_text)
-        parser.add_argument("-ge", "--grant-rights-emails", action="store",
-                            help="Grant rights. Provide a comma separated list of emails addresses and rights in "
-                                 "format <email_address>:<rights>. " + possible_rights_help_text)
-        parser.add_argument("-go", "--grant-rights-orcids", action="store",
-                            help="Grant rights. Provide a comma separated list of ORCiDs and rights in format "
-                                 "<orcid>:<rights>. " + possible_rights_help_text)
-
-        parser.add_argument("-r", "--resume", action="store", metavar=("ENTRY_ID", "ENTRY_DIR"),
-                            help="Resume Aspera upload. The entry has to be successfully created beforehand as "
-                                 "specifying EMPIAR entry ID and entry directory is required. Aspera transfer will "
-                                 "continue from where it stopped.", nargs=2)
-        parser.add_argument("-s", "--stop-submit", action="store_true", default=False, dest="stop_submit",
-                            help="Do not submit the entry once the upload has finished.")
-        parser.add_argument("-i", "--ignore-certificate", action="store_false", default=True, dest="ignore_certificate",
-                            help="Activate this flag to skip the verification of SSL certificate.")
-        parser.add_argument("-v", "--version", action="version", version=version, help="Show program's version number "
-                                                                                       "and exit.")
-        parser.add_argument("-d", "--development", action="store_true", default=False, help=argparse.SUPPRESS)
-        parser.add_argument("-dl", "--development-local", action="store_true", default=False, help=argparse.SUPPRESS)
-        parser.add_argument("-o", "--output-id-dir", action="store_true", default=False, help=argparse.SUPPRESS)
+    version = "1.6b30"
+
+    possible_rights_help_text = "Rights can be 1 - Owner, 2 - View only, 3 - View and Edit, 4 - View, Edit and " \
+                                "Submit. There can be only one deposition owner."
+    parser = argparse.ArgumentParser(prog=prog, usage=usage, add_help=False,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-h", "--help", action="help", help="Show this help message and exit.")
+    parser.add_argument("empiar_token", metavar="EMPIAR_TOKEN", help="EMPIAR API token.")
+    parser.add_argument("json_input", metavar="JSON_INPUT",
+                        help="The location of the JSON with EMPIAR deposition information.")
+    parser.add_argument("data", metavar="DATA",
+                        help="The location of the data that you would like to upload to EMPIAR. It should contain "
+                             "directories that correspond to the image set directories specified in the JSON file.")
+    parser.add_argument("-p", "-password", action="store", default=None, const=True, nargs="?", dest="password",
+                        help="Use basic authentication (username + password) instead of token authentication. If "
+                             "no password is provided for this argument, then the user is prompted for a password.")
+    parser.add_argument("-a", "-ascp", action="store", default=False, dest="ascp",
+                        help="The location of the ascp executable. By default it is installed in "
+                             "~/.aspera/connect/bin directory on Linux machines, in "
+                             "~/Applications/Aspera\ Connect.app/Contents/Resources directory on Macs and in "
+                             "C:\\Users\<username>\AppData\Local\Programs\Aspera\Aspera Connect\\bin on Windows.")
+    parser.add_argument("-g", "--globus", action="store", default=False, dest="globus",
+                        help="Use Globus if Aspera is not specified or Aspera transfer fails. Requirement: "
+                             "globus-cli installed and an endpoint created. Specify your unique user identifier "
+                             "(UUID) as the input parameter.")
+    parser.add_argument("-f", "--globus-force-login", action="store_true", default=False, dest="globus_force_login",
+                        help="Force login to Globus. Login even if the globus-cli already has valid login "
+                             "credentials. Any existing credentials will be removed from local storage and globally"
+                             " revoked.")
+
+    parser.add_argument("-e", "--entry-thumbnail", action="store",
+                        help="Thumbnail image that will represent your deposition on EMPIAR pages. Minimum size is "
+                             "400 x 400, preferred format is png. If none is provided, then the image from the "
+                             "related EMDB entry will be used. Other images than small PNG are converted to PNG "
+                             "of the accepted size.")
+    parser.add_argument("--auto-thumbnail", action="store_true", default=False, dest="auto_thumbnail",
+                        help="Make the thumbnail from a representative micrograph or tomogram of the image sets if "
+                             "none is provided. Requires numpy, and tifffile for TIFF files.")
+
+    parser.add_argument("-gu", "--grant-rights-usernames", action="store",
+                        help="Grant rights. Provide a comma separated list of usernames and rights in format "
+                             "<username>:<rights>. " + possible_rights_help_text)
+    parser.add_argument("-ge", "--grant-rights-emails", action="store",
+                        help="Grant rights. Provide a comma separated list of emails addresses and rights in "
+                             "format <email_address>:<rights>. " + possible_rights_help_text)
+    parser.add_argument("-go", "--grant-rights-orcids", action="store",
+                        help="Grant rights. Provide a comma separated list of ORCiDs and rights in format "
+                             "<orcid>:<rights>. " + possible_rights_help_text)
+
+    parser.add_argument("-r", "--resume", action="store", metavar=("ENTRY_ID", "ENTRY_DIR"),
+                        help="Resume Aspera upload. The entry has to be successfully created beforehand as "
+                             "specifying EMPIAR entry ID and entry directory is required. Aspera transfer will "
+                             "continue from where it stopped.", nargs=2)
+    parser.add_argument("-s", "--stop-submit", action="store_true", default=False, dest="stop_submit",
+                        help="Do not submit the entry once the upload has finished.")
+    parser.add_argument("-i", "--ignore-certificate", action="store_false", default=True, dest="ignore_certificate",
+                        help="Activate this flag to skip the verification of SSL certificate.")
+    parser.add_argument("--max-retries", action="store", type=int, default=5, dest="max_retries",
+                        help="The maximum number of attempts for each request to EMPIAR API when the server is "
+                             "busy or the connection fails.")
+    parser.add_argument("--state-dir", action="store", default=DEFAULT_STATE_DIR, dest="state_dir",
+                        help="The directory where the depositor keeps its local state between runs, e.g. the "
+                             "depositions whose creation has not been confirmed by the server.")
+    parser.add_argument("--force-create", action="store_true", default=False, dest="force_create",
+                        help="Create the deposition even if a previous attempt to create it has not received a reply "
+                             "from the server. Check your EMPIAR depositions first, as the server may have created "
+                             "the entry.")
+    parser.add_argument("-q", "--quiet", action="store_true", default=False, dest="quiet",
+                        help="Do not report the progress of the deposition.")
+    parser.add_argument("--result-json", action="store", default=None, dest="result_json",
+                        help="Write the results of all deposition steps (status, server replies, timings, bytes and "
+                             "errors) as JSON to this file, or to stdout if '-' is specified.")
+    parser.add_argument("--watch", action="store_true", default=False, dest="watch",
+                        help="Upload the data while the acquisition is still running. The image set directories are "
+                             "watched and the files are uploaded in batches once they have not changed for "
+                             "--watch-settle-time seconds. The entry is submitted after the acquisition has finished "
+                             "and all files have been uploaded.")
+    parser.add_argument("--watch-settle-time", action="store", type=int, default=60, dest="watch_settle_time",
+                        help="The number of seconds a file has to remain unchanged before it is uploaded in watch "
+                             "mode (default 60).")
+    parser.add_argument("--watch-interval", action="store", type=int, default=30, dest="watch_interval",
+                        help="The number of seconds between the scans of the data in watch mode (default 30).")
+    parser.add_argument("--watch-idle-timeout", action="store", type=int, default=3600, dest="watch_idle_timeout",
+                        help="The acquisition is considered finished if no files have appeared or changed for this "
+                             "number of seconds (default 3600).")
+    parser.add_argument("--watch-complete-file", action="store", default=None, dest="watch_complete_file",
+                        help="The name of the file within the data that marks the end of the acquisition.")
+    parser.add_argument("--watch-batch-size", action="store", type=int, default=1000, dest="watch_batch_size",
+                        help="The maximum number of files uploaded in one transfer in watch mode (default 1000).")
+    parser.add_argument("--compress", action="store", nargs="?", const="deflate", default=None,
+                        choices=sorted(COMPRESSION_METHODS), dest="compress",
+                        help="Compress MRC and TIFF movies without loss into TIFF files before the transfer (default "
+                             "deflate, lzw and zstd require imagecodecs). Requires numpy and tifffile. The formats of "
+                             "the movie image sets in the JSON are changed to TIFF accordingly.")
+    parser.add_argument("--compress-dir", action="store", default=None, dest="compress_dir",
+                        help="The directory for the compressed files. By default .empiar_depositor_compressed next "
+                             "to the data. For Globus uploads it has to be shared by the Globus endpoint.")
+    parser.add_argument("--compress-workers", action="store", type=int, default=None, dest="compress_workers",
+                        help="The number of compression processes (default half of the CPUs).")
+    parser.add_argument("--compress-nice", action="store", type=int, default=10, dest="compress_nice",
+                        help="The increment of the niceness of the compression processes (default 10).")
+    parser.add_argument("--compress-batch-size", action="store", type=int, default=20, dest="compress_batch_size",
+                        help="The number of compressed files transferred together (default 20).")
+    parser.add_argument("--pack", action="store_true", default=False, dest="pack",
+                        help="Pack small files into tar shards before the transfer. Each shard holds the files of "
+                             "one directory and is uploaded into that directory together with an index of its "
+                             "contents.")
+    parser.add_argument("--pack-threshold", action="store", type=parse_size, default=parse_size('1M'),
+                        dest="pack_threshold", help="Files smaller than this size are packed (default 1M).")
+    parser.add_argument("--pack-shard-size", action="store", type=parse_size, default=parse_size('1G'),
+                        dest="pack_shard_size", help="The target size of the shards (default 1G).")
+    parser.add_argument("--pack-min-files", action="store", type=int, default=100, dest="pack_min_files",
+                        help="Directories with fewer small files are not packed (default 100).")
+    parser.add_argument("--pack-dir", action="store", default=None, dest="pack_dir",
+                        help="The directory for the shards. By default .empiar_depositor_packed next to the data. "
+                             "For Globus uploads it has to be shared by the Globus endpoint.")
+    parser.add_argument("--manifest", action="store", default=None, dest="manifest",
+                        help="The location of the manifest of the uploaded files in watch mode. By default it is kept "
+                             "in the state directory.")
+    parser.add_argument("--ascp-max-restarts", action="store", type=int, default=5, dest="ascp_max_restarts",
+                        help="The number of times ascp is restarted in a row after transient errors, such as network "
+                             "failures, before the transfer is considered failed (default 5).")
+    parser.add_argument("--ascp-stall-timeout", action="store", type=int, default=900, dest="ascp_stall_timeout",
+                        help="Restart ascp if it has not written anything for this number of seconds (default 900, "
+                             "0 to disable).")
+    parser.add_argument("--ascp-file-list", action="store_true", default=False, dest="ascp_file_list",
+                        help="List the files of the data once with several threads and give ascp the list with the "
+                             "location of each file in the entry, instead of letting ascp walk the data on every "
+                             "start and restart.")
+    parser.add_argument("--resume-policy", action="store", choices=sorted(RESUME_LEVELS), default=None,
+                        dest="resume_check",
+                        help="Keep a journal of the files uploaded with Aspera and skip them when the upload is "
+                             "resumed. The other files are resumed by their attributes, by a sparse checksum or by a "
+                             "full checksum, as ascp always does without this option.")
+    parser.add_argument("--redeposit-data", action="store", choices=['auto', 'skip', 'upload'], default='auto',
+                        dest="redeposit_data",
+                        help="What to do with the data when a deposition is resumed: auto to upload it only if it "
+                             "has changed since it was last uploaded to the entry (default), skip to update only the "
+                             "metadata of the entry or upload to always upload it.")
+    parser.add_argument("--stage", action="append", type=parse_mapping, default=None, dest="stage_mappings",
+                        metavar="SOURCE=DIRECTORY",
+                        help="Upload the files of SOURCE into the image set DIRECTORY, such as data/micrographs, "
+                             "without copying them. Can be specified several times. DATA is then the staging "
+                             "directory and is created if it does not exist.")
+    parser.add_argument("--stage-mode", action="store", choices=STAGING_MODES, default='pairs', dest="stage_mode",
+                        help="How the staged files are uploaded: pairs to give the transfer the location of each "
+                             "file (default), hardlink or symlink to build a tree of links in the staging directory.")
+    parser.add_argument("--imagesets-only", action="store_true", default=False, dest="imagesets_only",
+                        help="Upload only the image set directories and the workflow file of the deposition JSON "
+                             "instead of all files of the data.")
+    parser.add_argument("--include", action="append", default=None, dest="include", metavar="PATTERN",
+                        help="Upload only the files that match the pattern, such as '*.tif'. Patterns with a / match "
+                             "the path relative to the data directory of the entry, such as 'micrographs/*.mrc', the "
+                             "others match the file name. Can be specified several times.")
+    parser.add_argument("--exclude", action="append", default=None, dest="exclude", metavar="PATTERN",
+                        help="Do not upload the files that match the pattern, such as '*.log'. Can be specified "
+                             "several times.")
+    parser.add_argument("--check-integrity", action="store_true", default=False, dest="integrity_check",
+                        help="Before the deposition, check that no file is empty and that the MRC, TIFF and EER files "
+                             "are as long as their headers imply. The deposition stops if any of them is truncated "
+                             "or corrupt.")
+    parser.add_argument("--integrity-read-budget", action="store", type=parse_size, default=DEFAULT_READ_BUDGET,
+                        dest="integrity_read_budget",
+                        help="The number of bytes of headers read from each file by --check-integrity at most "
+                             "(default 4M).")
+    parser.add_argument("--dedup", action="store", choices=DEDUP_MODES, default=None, dest="dedup",
+                        help="Find the files with the same content, such as gain references repeated in several "
+                             "image sets: warn to report them or once to transfer each content only once and list "
+                             "the duplicates in %s in the entry." % DUPLICATES_FILE)
+    parser.add_argument("--dedup-min-size", action="store", type=parse_size, default=DEFAULT_MIN_SIZE,
+                        dest="dedup_min_size",
+                        help="The size of the smallest files compared by --dedup (default 64K).")
+    parser.add_argument("--hsm-recall", action="store_true", default=False, dest="hsm_recall",
+                        help="The data is on a file system with hierarchical storage management (HSM). The files "
+                             "released to tape are recalled in bulk ahead of the transfer, which takes them in shards "
+                             "as they come online. The files on disk are read ahead.")
+    parser.add_argument("--hsm-recall-command", action="store", default=None, dest="hsm_recall_command",
+                        help="The command that recalls the files given as its arguments, such as 'dmget -q' or "
+                             "'lfs hsm_restore'. By default dmget or lfs is used if found, otherwise the files are "
+                             "recalled by reading them.")
+    parser.add_argument("--hsm-shard-size", action="store", type=parse_size, default=DEFAULT_SHARD_SIZE,
+                        dest="hsm_shard_size",
+                        help="The number of bytes recalled and transferred at a time with --hsm-recall (default "
+                             "50 GB).")
+    parser.add_argument("--patch-metadata", action="store_true", default=False, dest="patch_metadata",
+                        help="When a deposition is resumed, send only the sections of the JSON that have changed "
+                             "since it was last accepted. The whole JSON is sent if the server does not support it.")
+    parser.add_argument("--full-metadata", action="store_true", default=False, dest="full_metadata",
+                        help="When a deposition is resumed, send the whole JSON even if it has not changed since it "
+                             "was last accepted.")
+    parser.add_argument("--gzip-requests", action="store_true", default=False, dest="gzip_requests",
+                        help="Compress the deposition JSON with gzip when it is sent to EMPIAR.")
+    parser.add_argument("--aspera-node", action="append", type=AsperaNode.parse, default=None, dest="aspera_nodes",
+                        metavar="USER@HOST[:PORT]",
+                        help="An Aspera node of the upload server, %s by default. Can be specified several times, "
+                             "in which case the nodes are probed and the best one is used. If a transfer to a node "
+                             "fails, it is resumed on the next node." % ASPERA_DESTINATION)
+    parser.add_argument("--aspera-spread", action="store_true", default=False, dest="aspera_spread",
+                        help="Transfer the shards of packed files to all Aspera nodes at the same time.")
+    parser.add_argument("--hybrid", action="store_true", default=False, dest="hybrid",
+                        help="Upload the data with Aspera and Globus at the same time, e.g. when they use separate "
+                             "network paths. Each of them takes the files according to its measured transfer rate "
+                             "and takes over the files of the other one if it fails. Requires both -a and -g.")
+    parser.add_argument("--hybrid-batch-time", action="store", type=int, default=300, dest="hybrid_batch_time",
+                        help="The number of seconds of transfer that Aspera or Globus takes at a time in hybrid mode "
+                             "(default 300).")
+    parser.add_argument("--host-rate", action="store", type=int, default=None, dest="host_rate",
+                        help="The rate in Mbps that is shared by the Aspera transfers of all depositors on this host. "
+                             "Each transfer gets a part of it according to its priority and the parts are rebalanced "
+                             "as the transfers start and finish.")
+    parser.add_argument("--priority", action="store", type=int, default=1, dest="priority",
+                        help="The priority of the transfers of this deposition when the host rate is shared "
+                             "(default 1).")
+    parser.add_argument("--bandwidth-registry", action="store", default=DEFAULT_REGISTRY, dest="bandwidth_registry",
+                        help="The file where the depositors on this host register their transfers to share the host "
+                             "rate (default %s). It has to be writable by all of them." % DEFAULT_REGISTRY)
+    parser.add_argument("--rate-window", action="append", type=RateWindow.parse, default=None, dest="rate_windows",
+                        metavar="'DAYS HH:MM-HH:MM RATE'",
+                        help="The transfer rate in Mbps (or with a G suffix in Gbps) during a period of the week, or "
+                             "pause to stop the transfers, e.g. 'Mon-Fri 08:00-18:00 300' or '* 22:00-06:00 2G'. Can "
+                             "be specified several times, the first window that contains the current local time "
+                             "applies. Running transfers are restarted with the new rate.")
+    parser.add_argument("--plan", action="store_true", default=False, dest="plan",
+                        help="Estimate the size of the data and the duration of the transfer with Aspera and Globus "
+                             "and recommend the settings, without creating the deposition.")
+    parser.add_argument("--plan-probe", action="store_true", default=False, dest="plan_probe",
+                        help="Measure the Aspera transfer rate for the plan even if a recently measured rate is "
+                             "known. Globus is not probed.")
+    parser.add_argument("-v", "--version", action="version", version=version, help="Show program's version number "
+                                                                                   "and exit.")
+    parser.add_argument("-d", "--development", action="store_true", default=False, help=argparse.SUPPRESS)
+    parser.add_argument("-dl", "--development-local", action="store_true", default=False, help=argparse.SUPPRESS)
+    parser.add_argument("-o", "--output-id-dir", action="store_true", default=False, help=argparse.SUPPRESS)
+
+    return parser
+
+
+def plan_transfer(args, session=None, output=None):
+    """
+    Print the transfer plan. Nothing is created on the server
+    :param args: parsed command line arguments
+    :param session: requests Session that is reused for the requests to EMPIAR API
+    :param output: stream that the plan is written to, sys.stdout by default
+    :return: 0 if the plan has been made
+    """
+    log = (output or sys.stdout).write
+    if not os.path.isfile(args.json_input):
+        log("The specified JSON file does not exist\n")
+        return 1
+    if not (os.path.isfile(args.data) or os.path.isdir(args.data)):
+        log("The specified location of the data does not exist\n")
+        return 1
 
-        if args is None:
-            args = sys.argv[1:]
-        args = parser.parse_args(args)
+    emp_dep = EmpiarDepositor(args.empiar_token, args.json_input, args.data, ascp=args.ascp,
+                              dev=args.development, dev_local=args.development_local, state_dir=args.state_dir,
+                              session=session, quiet=args.quiet, aspera_nodes=args.aspera_nodes, output=output)
+    now = time.time()
+    rates = {}
+    for backend, enabled in (('aspera', args.ascp), ('globus', args.globus)):
+        if enabled:
+            cached_rate = emp_dep.rate_cache.get(backend, now)
+            rates[backend] = {'rate': cached_rate['rate'], 'source': 'measured %s ago' %
+                              format_duration(now - cached_rate['measured'])} if cached_rate else None
+
+    if args.ascp and (args.plan_probe or rates['aspera'] is None) and check_ascp(args.ascp, log=log):
+        probe_rate = emp_dep.probe_aspera()
+        if probe_rate:
+            rates['aspera'] = {'rate': probe_rate, 'source': 'probe'}
+
+    if rates.get('aspera'):
+        # ascp does not go faster than its target rate
+        rates['aspera']['rate'] = min(rates['aspera']['rate'], ASPERA_TARGET_RATE * 1000 ** 2 / 8.0)
+
+    plan = make_plan(args.json_input, args.data, rates)
+    if not args.quiet:
+        log(format_plan(plan))
+    if args.result_json:
+        result_str = json.dumps(plan, indent=2)
+        if args.result_json == '-':
+            log(result_str + '\n')
+        else:
+            with open(args.result_json, 'w') as f:
+                f.write(result_str)
+    return 0
+
+
+def prepare_deposition(args, toolchain=None, session=None, transfer_pass=None, output=None):
+    """
+    Check the parsed arguments and the transfer tools and create the depositor
+    :param args: parsed command line arguments
+    :param toolchain: Toolchain object that runs the checks of the transfer tools
+    :param session: requests Session that is reused for the requests to EMPIAR API
+    :param transfer_pass: EMPIAR transfer password, by default taken from EMPIAR_TRANSFER_PASS environment variable
+    :param output: stream that the checks and the depositor write their messages to, sys.stdout by default
+    :return: EmpiarDepositor object or 1 if the deposition cannot proceed
+    """
+    log = (output or sys.stdout).write
+    if toolchain is None:
+        toolchain = Toolchain()
+    if transfer_pass is None:
+        transfer_pass = os.environ.get('EMPIAR_TRANSFER_PASS')
+
+    json_file_exists = os.path.isfile(args.json_input)
+    if not json_file_exists:
+        log("The specified JSON file does not exist\n")
+        return 1
 
-        json_file_exists = os.path.isfile(args.json_input)
-        if not json_file_exists:
-            sys.stdout.write("The specified JSON file does not exist\n")
+    if not (args.ascp or args.globus):
+        log("Please select a tool for the data transfer - either Aspera or Globus\n")
+        return 1
+
+    aspera_okay = True
+    if args.ascp:
+        aspera_okay = toolchain.check_ascp(args.ascp, log=log)
+
+    if not aspera_okay:
+        if args.globus:
+            log("Will try using Globus instead\n")
+        else:
             return 1
 
-        if not (args.ascp or args.globus):
-            sys.stdout.write("Please select a tool for the data transfer - either Aspera or Globus\n")
+    staging = None
+    if args.stage_mappings:
+        if args.compress or args.pack or args.watch:
+            log("The staging cannot be combined with the compression, the packing or the watch mode\n")
+            return 1
+        if args.hybrid and args.stage_mode == 'pairs':
+            log("Hybrid transfers of staged data need a tree of links, please use --stage-mode "
+                "hardlink or symlink\n")
             return 1
+        # The data is the staging directory, which holds the tree of links
+        if not os.path.isdir(args.data):
+            os.makedirs(args.data)
+        staging = Staging(args.stage_mappings, mode=args.stage_mode, root=args.data)
+
+    if args.integrity_check and args.watch:
+        log("The integrity check cannot be combined with the watch mode, where the files are still being "
+            "written\n")
+        return 1
 
-        aspera_okay = True
-        if args.ascp:
-            aspera_exists = os.path.isfile(args.ascp)
-            if aspera_exists:
-                ascp_specified = args.ascp.endswith("ascp") or args.ascp.endswith("ascp.exe")
-                if ascp_specified:
-                    process = subprocess.Popen('"' + args.ascp + '"', shell=True, stdout=subprocess.PIPE,
-                                               stderr=subprocess.STDOUT)
-                    p_out, p_err = process.communicate()
-
-                    if not p_out or p_err:
-                        sys.stdout.write("Error while trying to check ascp. Returned output:\n" + str(p_out) + "\n" +
-                                         str(p_err) + "\n")
-                        aspera_okay = False
-
-                    ascp_is_working = b'Usage: ascp' in p_out and process.returncode == 112
-                    if not ascp_is_working:
-                        sys.stdout.write("The specified ascp does not work. Returned output:\n" + str(p_out) + "\n")
-                        aspera_okay = False
-                else:
-                    sys.stdout.write(
-                        "Please specify the correct path to ascp executable. By default it is installed in "
-                        "~/.aspera/connect/bin directory on Linux machines, in ~/Applications/Aspera\ Connect.app/"
-                        "Contents/Resources directory on Macs and in C:\\Users\<username>\AppData\Local\Programs\Aspera"
-                        "\Aspera Connect\\bin on Windows\n")
-                    aspera_okay = False
-            else:
-                sys.stdout.write("The specified Aspera executable does not exist\n")
-                aspera_okay = False
+    if args.dedup and (args.stage_mappings or args.watch):
+        log("The deduplication cannot be combined with the staging or the watch mode\n")
+        return 1
 
-        if not aspera_okay:
-            if args.globus:
-                sys.stdout.write("Will try using Globus instead\n")
-            else:
+    selection = None
+    if args.imagesets_only or args.include or args.exclude:
+        if args.watch:
+            log("The selection of the files cannot be combined with the watch mode, which uploads the "
+                "image set directories\n")
+            return 1
+        paths = None
+        if args.imagesets_only:
+            paths = get_selected_paths(args.json_input)
+            if not paths:
+                log("There are no image set directories in the deposition JSON\n")
                 return 1
+        selection = Selection(paths, include=args.include, exclude=args.exclude)
 
-        globus_data = {}
-        endpoint_id = None
-        if args.globus:
-            # Log in to Globus
-            sys.stdout.write("Logging in to Globus...\n")
-            command_login_str = 'globus login'
-            if args.globus_force_login:
-                command_login_str += ' --force'
-            command_login = [command_login_str]
-
-            out_login, err_login, retcode_login = run_shell_command(command_login)
-            success_login = b'You have successfully logged in to the Globus CLI' in out_login or \
-                            b'You are already logged in' in out_login
-            if not success_login or err_login or retcode_login != 0:
-                sys.stdout.write(
-                    "Error while logging in into Globus. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                    (retcode_login, out_login, err_login))
-                return 1
-            sys.stdout.write("Successfully logged in\n")
+    globus_data = {}
+    endpoint_id = None
+    if args.globus:
+        # Log in to Globus
+        if not toolchain.globus_login(args.globus_force_login, log=log):
+            return 1
 
-            # Search for the source endpoint to get its ID
-            command_es = ['globus endpoint search %s --filter-scope my-endpoints --format json' % args.globus]
-            out_es, err_es, retcode_es = run_shell_command(command_es)
+        endpoint_id = toolchain.globus_find_endpoint(args.globus, log=log)
+        if not endpoint_id:
+            return 1
 
-            if err_es or retcode_es != 0:
-                sys.stdout.write("Error while searching for an endpoint. Return code: %s.\nOutput:%s\nError message: "
-                                 "%s\n" % (retcode_es, out_es, err_es))
-                return 1
+        args.data = args.data.rstrip(os.path.sep)
+        globus_data = globus_check_data(endpoint_id, args.data, log=log)
+        if globus_data is None:
+            return 1
 
-            try:
-                es_json = json.loads(out_es)
-            except ValueError:
-                sys.stdout.write(
-                    "Error while processing endpoint search result - the string does not contain a valid JSON."
-                    " Return code: %s.\nOutput:%s\nError message: %s\n" %
-                    (retcode_es, out_es, err_es))
-                return 1
+        if not toolchain.globus_activate_destination(endpoint_id, transfer_pass, log=log):
+            return 1
 
-            # Process the results depending on whether Globus endpoint name or its ID has been provided
-            if 'DATA' in es_json and es_json['DATA']:
-                for endpoint in es_json['DATA']:
-                    if 'id' in endpoint and 'display_name' in endpoint:
-                        if endpoint['display_name'] == args.globus or args.globus == endpoint['id']:
-                            endpoint_id = endpoint['id']
+    if args.entry_thumbnail:
+        thumbnail_exists = os.path.isfile(args.entry_thumbnail)
+        if not thumbnail_exists:
+            log("The specified thumbnail file does not exist\n")
+            return 1
 
-                    else:
-                        sys.stdout.write(
-                            "Globus JSON endpoint search result does not have a valid structure of JSON['DATA']['id']."
-                            " Return code: %s.\nOutput:%s\nError message: %s\n" %
-                            (retcode_es, out_es, err_es))
-                        return 1
-                if not endpoint_id:
-                    sys.stdout.write(
-                        "Globus endpoint could not be found. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                        (retcode_es, out_es, err_es))
-                    return 1
+    if args.auto_thumbnail and not args.entry_thumbnail:
+        missing_modules = thumbnail_available()
+        if missing_modules:
+            log("Please install %s to make the thumbnail from the data\n" % ', '.join(missing_modules))
+            return 1
+
+    data_exists = os.path.isfile(args.data) or os.path.isdir(args.data)
+    if not data_exists:
+        log("The specified location of the data does not exist\n")
+        return 1
+
+    compressor = None
+    if args.compress:
+        missing_modules = compression_available(args.compress)
+        if missing_modules:
+            log("Please install %s to use the compression\n" % ', '.join(missing_modules))
+            return 1
+
+        movie_directories = get_imageset_directories(args.json_input, args.data, is_movie_imageset)
+        if movie_directories:
+            compress_dir = args.compress_dir or os.path.join(os.path.dirname(os.path.abspath(args.data)),
+                                                             '.empiar_depositor_compressed')
+            compressed_json = os.path.join(compress_dir, os.path.basename(args.json_input))
+            converted_directories = update_imageset_formats(args.json_input, args.data, compressed_json)
+            if converted_directories:
+                log("The formats of %d movie image sets have been changed to TIFF in %s. The image sets "
+                    "with MRC files that cannot be converted are uploaded as they are\n" %
+                    (len(converted_directories), compressed_json))
+                args.json_input = compressed_json
+                compressor = CompressionStage(converted_directories, compress_dir, method=args.compress,
+                                              workers=args.compress_workers, niceness=args.compress_nice,
+                                              batch_size=args.compress_batch_size)
             else:
-                sys.stdout.write(
-                    "Globus JSON endpoint search result does not have a valid structure of JSON['DATA']['id']."
-                    " Return code: %s.\nOutput:%s\nError message: %s\n" %
-                    (retcode_es, out_es, err_es))
-                return 1
+                log("The movie image sets contain MRC files that cannot be converted to TIFF, the "
+                    "compression will not be used\n")
+        else:
+            log("There are no MRC or TIFF movie image sets in the data, the compression will not be "
+                "used\n")
 
-            # Activate the source endpoint
-            command_activate = ['globus endpoint activate %s --format json' % endpoint_id]
-            out_activate, err_activate, retcode_activate = run_shell_command(command_activate)
-            success_activation = b'Endpoint is already activated' in out_activate or \
-                                 b'Autoactivation succeeded' in out_activate
-            if err_activate or retcode_activate != 0 or not success_activation:
-                sys.stdout.write(
-                    "Globus endpoint cannot be activated. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                    (retcode_activate, out_activate, err_activate))
-                return 1
+    packer = None
+    if args.pack:
+        if not os.path.isdir(args.data):
+            log("The data has to be a directory to pack its files\n")
+            return 1
 
-            # Check that the source endpoint contains the specified data and determine if the data is a file or a
-            # directory
-            args.data = args.data.rstrip(os.path.sep)
-            globus_data['is_dir'] = '-r'
-            dir_path, globus_data['obj_name'] = args.data.rsplit(os.path.sep, 1)
-            command_ls = ['globus ls %s:%s --format json' % (endpoint_id, args.data)]
-            out_ls, err_ls, retcode_ls = run_shell_command(command_ls)
-
-            if retcode_ls == 1 and b'\'' + args.data + b'\' is not a directory' in out_ls:
-                globus_data['is_dir'] = False
-                if os.path.sep in args.data:
-                    command_ls = ['globus ls %s:%s --filter =%s --format json' % (endpoint_id, dir_path,
-                                                                                  globus_data['obj_name'])]
-                else:
-                    command_ls = ['globus ls %s: --filter =%s --format json' % (endpoint_id, args.data)]
+        pack_dir = args.pack_dir or os.path.join(os.path.dirname(os.path.abspath(args.data)),
+                                                 '.empiar_depositor_packed')
+        packer = PackingStage(pack_dir, threshold=args.pack_threshold, shard_size=args.pack_shard_size,
+                              min_files=args.pack_min_files, spread=args.aspera_spread)
 
-                out_ls, err_ls, retcode_ls = run_shell_command(command_ls)
+    bandwidth = None
+    if args.host_rate:
+        if not BandwidthScheduler.is_available():
+            log("The host rate cannot be shared on this platform\n")
+            return 1
+        if args.host_rate < 1 or args.priority < 1:
+            log("The host rate and the priority have to be positive numbers\n")
+            return 1
+        bandwidth = BandwidthScheduler(args.host_rate, priority=args.priority, registry=args.bandwidth_registry)
 
-            if retcode_ls != 0 or err_ls or b'"DATA":' not in out_ls:
-                sys.stdout.write("Error while checking the existence of the object that is to be uploaded. Make sure "
-                                 "that the path to the upload corresponds to the directory sharing settings in Globus. "
-                                 "Return code: %s.\nOutput:%s\nError message: %s\n" %
-                                 (retcode_ls, out_ls, err_ls))
-                return 1
+    rate_schedule = RateSchedule(args.rate_windows) if args.rate_windows else None
 
-            # Activate the destination endpoint
-            myproxy_pass = ''
-            transfer_pass = os.environ.get('EMPIAR_TRANSFER_PASS')
-            if transfer_pass:
-                myproxy_pass = '--myproxy-password %s' % transfer_pass
-
-            command_activate = ['globus endpoint activate --format json --myproxy --myproxy-username emp_dep '
-                                '%s %s' % (myproxy_pass, endpoint_id)]
-            out_activate, err_activate, retcode_activate = run_shell_command(command_activate)
-            success_activation = b'Endpoint is already activated' in out_activate or \
-                                 b'Endpoint activated successfully' in out_activate
-            if err_activate or retcode_activate != 0 or not success_activation:
-                sys.stdout.write(
-                    "Globus endpoint cannot be activated. Return code: %s.\nOutput:%s\nError message: %s\n" %
-                    (retcode_activate, out_activate, err_activate))
-                return 1
+    recaller = None
+    if args.hsm_recall:
+        if args.stage_mappings:
+            log("The recall from the HSM cannot be combined with the staging\n")
+            return 1
+        recaller = RecallStage(get_recall_command(args.hsm_recall_command), shard_size=args.hsm_shard_size)
 
-        if args.entry_thumbnail:
-            thumbnail_exists = os.path.isfile(args.entry_thumbnail)
-            if not thumbnail_exists:
-                sys.stdout.write("The specified thumbnail file does not exist\n")
-                return 1
+    hybrid = None
+    if args.hybrid:
+        if not (args.ascp and args.globus):
+            log("Both Aspera and Globus are required in hybrid mode\n")
+            return 1
+        if aspera_okay:
+            hybrid = HybridTransfer(batch_duration=args.hybrid_batch_time)
 
-        data_exists = os.path.isfile(args.data) or os.path.isdir(args.data)
-        if not data_exists:
-            sys.stdout.write("The specified location of the data does not exist\n")
+    watcher = None
+    if args.watch:
+        if not os.path.isdir(args.data):
+            log("The data has to be a directory in watch mode\n")
             return 1
 
-        entry_id = None
-        entry_directory = None
-        if args.resume:
-            if len(args.resume) == 2:
-                [entry_id, entry_directory] = args.resume
-            else:
-                sys.stdout.write("You have to specify both entry ID and entry directory to be able to resume the "
-                                 "deposition")
-                return 1
+        watcher = DataWatcher(get_watched_paths(args.json_input, args.data), manifest_path=args.manifest,
+                              settle_time=args.watch_settle_time, poll_interval=args.watch_interval,
+                              idle_timeout=args.watch_idle_timeout, complete_file=args.watch_complete_file,
+                              batch_size=args.watch_batch_size)
+
+    entry_id = None
+    entry_directory = None
+    if args.resume:
+        if len(args.resume) == 2:
+            [entry_id, entry_directory] = args.resume
+        else:
+            log("You have to specify both entry ID and entry directory to be able to resume the "
+                "deposition")
+            return 1
+
+    args_clean_pwd = copy.deepcopy(args)
+    if args.password is not None:
+        if args.password is True:
+            args.password = getpass('Please enter your EMPIAR password to continue:\n')
+        args_clean_pwd.password = '****'
+
+    if not args.quiet:
+        log("You are performing the deposition into EMPIAR with following args: %s\n" % args_clean_pwd)
+
+    emp_dep = EmpiarDepositor(
+        empiar_token=args.empiar_token,
+        json_input=args.json_input,
+        data=args.data,
+        ascp=args.ascp,
+        globus=endpoint_id,
+        globus_data=globus_data,
+        globus_force_login=args.globus_force_login,
+        ignore_certificate=args.ignore_certificate,
+        entry_thumbnail=args.entry_thumbnail,
+        entry_id=entry_id,
+        entry_directory=entry_directory,
+        stop_submit=args.stop_submit,
+        dev=args.development,
+        dev_local=args.development_local,
+        password=args.password,
+        output_id_dir=args.output_id_dir,
+        grant_rights_usernames=args.grant_rights_usernames,
+        grant_rights_emails=args.grant_rights_emails,
+        grant_rights_orcids=args.grant_rights_orcids,
+        max_retries=args.max_retries,
+        state_dir=args.state_dir,
+        session=session,
+        transfer_pass=transfer_pass,
+        quiet=args.quiet,
+        watcher=watcher,
+        compressor=compressor,
+        packer=packer,
+        bandwidth=bandwidth,
+        rate_schedule=rate_schedule,
+        aspera_nodes=args.aspera_nodes,
+        hybrid=hybrid,
+        ascp_max_restarts=args.ascp_max_restarts,
+        ascp_stall_timeout=args.ascp_stall_timeout,
+        ascp_file_list=args.ascp_file_list,
+        resume_check=args.resume_check,
+        redeposit_data=args.redeposit_data,
+        patch_metadata=args.patch_metadata,
+        full_metadata=args.full_metadata,
+        gzip_requests=args.gzip_requests,
+        staging=staging,
+        selection=selection,
+        integrity_check=args.integrity_check,
+        integrity_read_budget=args.integrity_read_budget,
+        dedup=args.dedup,
+        dedup_min_size=args.dedup_min_size,
+        auto_thumbnail=args.auto_thumbnail and not args.entry_thumbnail,
+        recaller=recaller,
+        output=output,
+        force_create=args.force_create
+    )
+
+    return emp_dep
+
+
+def main(args=None):
+    """
+    Deposit the data into EMPIAR
+    """
+    try:
+        # Handle command line args
+        parser = get_parser()
+        if args is None:
+            args = sys.argv[1:]
+        args = parser.parse_args(args)
+
+        if args.plan:
+            return plan_transfer(args)
+
+        emp_dep = prepare_deposition(args)
+        if not isinstance(emp_dep, EmpiarDepositor):
+            return emp_dep
 
-        args_clean_pwd = copy.deepcopy(args)
-        if args.password is not None:
-            if args.password is True:
-                args.password = getpass('Please enter your EMPIAR password to continue:\n')
-            args_clean_pwd.password = '****'
-
-        sys.stdout.write("You are performing the deposition into EMPIAR with following args: %s\n" % args_clean_pwd)
-
-        emp_dep = EmpiarDepositor(
-            empiar_token=args.empiar_token,
-            json_input=args.json_input,
-            data=args.data,
-            ascp=args.ascp,
-            globus=endpoint_id,
-            globus_data=globus_data,
-            globus_force_login=args.globus_force_login,
-            ignore_certificate=args.ignore_certificate,
-            entry_thumbnail=args.entry_thumbnail,
-            entry_id=entry_id,
-            entry_directory=entry_directory,
-            stop_submit=args.stop_submit,
-            dev=args.development,
-            dev_local=args.development_local,
-            password=args.password,
-            output_id_dir=args.output_id_dir,
-            grant_rights_usernames=args.grant_rights_usernames,
-            grant_rights_emails=args.grant_rights_emails,
-            grant_rights_orcids=args.grant_rights_orcids
-        )
-
-        dep_result = emp_dep.deposit_data()
-        return dep_result
+        dep_result = emp_dep.deposit()
+        if args.result_json:
+            write_result_json(dep_result, args.result_json)
+        return dep_result.return_value
 
     except requests.exceptions.RequestException as e:
         sys.stdout.write(str(e) + '\n')
@@ -0,0 +1,390 @@
+# encoding: utf-8
+"""
+fileindex.py
+
+Compact index of the files of the data, for datasets with millions of files.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'EDFI'
+VERSION = 1
+HEADER = struct.Struct('<4sI')
+ALIGNMENT = 8
+
+# Sections of the index file: name and type code of the array or None for bytes
+SECTIONS = (
+    ('directories', None),
+    ('directory_offsets', 'Q'),
+    ('file_directories', 'I'),
+    ('name_offsets', 'Q'),
+    ('names', None),
+    ('sizes', 'q'),
+    ('mtimes', 'd'),
+    ('digest_offsets', 'q'),
+    ('digests', None),
+)
+
+
+class FileRecord(object):
+    """
+    A file of the index
+    """
+    __slots__ = ('path', 'size', 'mtime', 'digest')
+
+    def __init__(self, path, size, mtime, digest=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+    def __repr__(self):
+        return 'FileRecord(%r, %d, %r)' % (self.path, self.size, self.mtime)
+
+
+def directory_key(directory):
+    """
+    :param directory: directory relative to the root of the index
+    :return: the key that sorts each directory right before its subdirectories
+    """
+    return tuple(directory.split('/')) if directory else ()
+
+
+def load_column(buf, offset, typecode, count, swap):
+    """
+    :param buf: the contents of the index file
+    :param offset: the offset of the column
+    :param typecode: the type code of the array or None for bytes
+    :param count: the number of items
+    :param swap: True if the file has been written on a machine with the other byte order
+    :return: the column, without a copy if possible
+    """
+    if typecode is None:
+        return buf[offset:offset + count]
+    itemsize = array(typecode).itemsize
+    view = buf[offset:offset + count * itemsize]
+    if not swap and hasattr(view, 'cast'):
+        return view.cast(typecode)
+    column = array(typecode)
+    if hasattr(column, 'frombytes'):
+        column.frombytes(view.tobytes())
+    else:
+        column.fromstring(view.tobytes())
+    if swap:
+        column.byteswap()
+    return column
+
+
+class FileIndex:
+    """
+    The :class:`FileIndex <FileIndex>` object keeps a table of files in a few flat arrays instead of an object per
+    file. The directories are stored once, the names of the files in one buffer and the sizes, modification times and
+    digests in parallel arrays. The files are sorted by directory, with each directory followed by its subdirectories,
+    so the files of an image set directory are a contiguous range. An index can be saved to a file and loaded back by
+    mapping the file into memory, in which case it is read only
+    """
+
+    def __init__(self, root=None, digest_size=32):
+        """
+        :param root: the local directory the paths are relative to
+        :param digest_size: the size of the digests of the files in bytes
+        """
+        self.root = root
+        self.digest_size = digest_size
+        self.directories = []
+        self.directory_ids = {}
+        self.directory_offsets = array('Q', [0])
+        self.file_directories = array('I')
+        self.name_offsets = array('Q', [0])
+        self.names = bytearray()
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.digest_offsets = array('q')
+        self.digests = bytearray()
+        self.sorted = True
+        self.mapping = None
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __iter__(self):
+        return self.iter_range(0, len(self))
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    @property
+    def total_size(self):
+        """
+        :return: the total size of the files in bytes
+        """
+        return sum(self.sizes)
+
+    def intern_directory(self, directory):
+        """
+        :param directory: directory relative to the root
+        :return: the number of the directory
+        """
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self.directories.append(directory)
+            self.directory_ids[directory] = directory_id
+        return directory_id
+
+    def add(self, path, size, mtime, digest=None):
+        """
+        Add a file to the index
+        :param path: the path relative to the root with '/' as the separator
+        :param size: the size of the file
+        :param mtime: the modification time of the file
+        :param digest: the digest of the file or None if it is not known
+        """
+        if self.mapping is not None:
+            raise ValueError("A file index that has been loaded from a file is read only")
+        directory, _, name = path.rpartition('/')
+        self.file_directories.append(self.intern_directory(directory))
+        self.names.extend(name.encode('utf-8'))
+        self.name_offsets.append(len(self.names))
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        if digest is None:
+            self.digest_offsets.append(-1)
+        else:
+            if len(digest) != self.digest_size:
+                raise ValueError("The digest of %s has %d bytes instead of %d" % (path, len(digest), self.digest_size))
+            self.digest_offsets.append(len(self.digests))
+            self.digests.extend(digest)
+        self.sorted = False
+
+    def name(self, i):
+        return bytes(self.names[self.name_offsets[i]:self.name_offsets[i + 1]]).decode('utf-8')
+
+    def path(self, i):
+        directory = self.directories[self.file_directories[i]]
+        return directory + '/' + self.name(i) if directory else self.name(i)
+
+    def record(self, i):
+        """
+        :param i: the position of the file in the index
+        :return: FileRecord object
+        """
+        digest_offset = self.digest_offsets[i]
+        digest = bytes(self.digests[digest_offset:digest_offset + self.digest_size]) if digest_offset >= 0 else None
+        return FileRecord(self.path(i), self.sizes[i], self.mtimes[i], digest)
+
+    def sort(self):
+        """
+        Order the directories and the files so that the files of a directory and of its subdirectories are together
+        """
+        if self.sorted:
+            return
+        directory_order = sorted(range(len(self.directories)), key=lambda d: directory_key(self.directories[d]))
+        rank = array('I', [0] * len(self.directories))
+        for new_id, old_id in enumerate(directory_order):
+            rank[old_id] = new_id
+        # The files are placed by their directories first, which keeps the order of the files within a directory
+        directory_offsets = array('Q', [0] * (len(self.directories) + 1))
+        for directory_id in self.file_directories:
+            directory_offsets[rank[directory_id] + 1] += 1
+        for d in range(len(self.directories)):
+            directory_offsets[d + 1] += directory_offsets[d]
+        positions = array('Q', directory_offsets[:-1])
+        order = array('Q', [0] * len(self))
+        for i, directory_id in enumerate(self.file_directories):
+            order[positions[rank[directory_id]]] = i
+            positions[rank[directory_id]] += 1
+        # and then sorted by their names within each directory, which they usually are already
+        for d in range(len(self.directories)):
+            start, end = directory_offsets[d], directory_offsets[d + 1]
+            keys = [bytes(self.names[self.name_offsets[i]:self.name_offsets[i + 1]]) for i in order[start:end]]
+            if any(keys[k] > keys[k + 1] for k in range(len(keys) - 1)):
+                order[start:end] = array('Q', [i for key, i in sorted(zip(keys, order[start:end]))])
+
+        names = bytearray()
+        name_offsets = array('Q', [0])
+        digests = bytearray()
+        digest_offsets = array('q')
+        file_directories = array('I')
+        for i in order:
+            file_directories.append(rank[self.file_directories[i]])
+            names.extend(self.names[self.name_offsets[i]:self.name_offsets[i + 1]])
+            name_offsets.append(len(names))
+            if self.digest_offsets[i] >= 0:
+                digest_offsets.append(len(digests))
+                digests.extend(self.digests[self.digest_offsets[i]:self.digest_offsets[i] + self.digest_size])
+            else:
+                digest_offsets.append(-1)
+
+        self.directories = [self.directories[d] for d in directory_order]
+        self.directory_ids = dict((directory, d) for d, directory in enumerate(self.directories))
+        self.directory_offsets = directory_offsets
+        self.file_directories = file_directories
+        self.names = names
+        self.name_offsets = name_offsets
+        self.sizes = array('q', (self.sizes[i] for i in order))
+        self.mtimes = array('d', (self.mtimes[i] for i in order))
+        self.digests = digests
+        self.digest_offsets = digest_offsets
+        self.sorted = True
+
+    def find(self, path):
+        """
+        :param path: the path relative to the root
+        :return: the position of the file in the index or None if it is not in the index
+        """
+        self.sort()
+        directory, _, name = path.rpartition('/')
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            return None
+        name = name.encode('utf-8')
+        lo, hi = self.directory_offsets[directory_id], self.directory_offsets[directory_id + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.names[self.name_offsets[mid]:self.name_offsets[mid + 1]]) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.directory_offsets[directory_id + 1] and \
+                bytes(self.names[self.name_offsets[lo]:self.name_offsets[lo + 1]]) == name:
+            return lo
+        return None
+
+    def get(self, path):
+        """
+        :param path: the path relative to the root
+        :return: FileRecord object or None if the file is not in the index
+        """
+        i = self.find(path)
+        return self.record(i) if i is not None else None
+
+    def iter_range(self, start, end):
+        self.sort()
+        for i in range(start, end):
+            yield self.record(i)
+
+    def iter_directory(self, directory):
+        """
+        Iterate over the files of a directory and of its subdirectories, such as an image set directory
+        :param directory: the directory relative to the root
+        :return: generator of FileRecord objects
+        """
+        self.sort()
+        prefix = directory_key(directory.strip('/'))
+        ids = [d for d, name in enumerate(self.directories) if directory_key(name)[:len(prefix)] == prefix]
+        if not ids:
+            return iter([])
+        # The directory and its subdirectories are next to each other
+        return self.iter_range(self.directory_offsets[ids[0]], self.directory_offsets[ids[-1] + 1])
+
+    def same_files(self, other):
+        """
+        :param other: FileIndex object
+        :return: True if both indexes have the same files with the same sizes and modification times
+        """
+        if self.root != other.root or len(self) != len(other):
+            return False
+        self.sort()
+        other.sort()
+        for i in range(len(self)):
+            if self.sizes[i] != other.sizes[i] or self.mtimes[i] != other.mtimes[i] or self.path(i) != other.path(i):
+                return False
+        return True
+
+    def save(self, path):
+        """
+        Write the index into a file. The file is replaced at once, so an interrupted write keeps the previous index
+        :param path: the location of the file
+        """
+        self.sort()
+        columns = {
+            'directories': '\0'.join(self.directories).encode('utf-8'),
+            'directory_offsets': self.directory_offsets,
+            'file_directories': self.file_directories,
+            'name_offsets': self.name_offsets,
+            'names': bytes(self.names),
+            'sizes': self.sizes,
+            'mtimes': self.mtimes,
+            'digest_offsets': self.digest_offsets,
+            'digests': bytes(self.digests),
+        }
+        sections = {}
+        blobs = []
+        offset = 0
+        for name, typecode in SECTIONS:
+            column = columns[name]
+            data = column if typecode is None else (column.tobytes() if hasattr(column, 'tobytes')
+                                                    else column.tostring())
+            padding = -len(data) % ALIGNMENT
+            sections[name] = [offset, len(column)]
+            blobs.append(data + b'\0' * padding)
+            offset += len(data) + padding
+        header = json.dumps({'version': VERSION, 'byteorder': sys.byteorder, 'root': self.root,
+                             'digest_size': self.digest_size, 'directory_count': len(self.directories),
+                             'sections': sections}).encode('utf-8')
+        header += b' ' * (-(HEADER.size + len(header)) % ALIGNMENT)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index by mapping its file into memory, so that only the parts that are used are read
+        :param path: the location of the file
+        :return: FileIndex object
+        """
+        with open(path, 'rb') as f:
+            magic, header_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("%s is not a file index" % path)
+            header = json.loads(f.read(header_size).decode('utf-8'))
+            if header['version'] != VERSION:
+                raise ValueError("Unsupported version of the file index %s: %s" % (path, header['version']))
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+
+        index = cls(header['root'], header['digest_size'])
+        if mapping is None:
+            buf = memoryview(b'')
+        else:
+            try:
+                buf = memoryview(mapping)[HEADER.size + header_size:]
+            except TypeError:
+                # Python 2 cannot map the file without a copy
+                buf = memoryview(mapping[HEADER.size + header_size:])
+        swap = header['byteorder'] != sys.byteorder
+        for name, typecode in SECTIONS:
+            offset, count = header['sections'][name]
+            setattr(index, name, load_column(buf, offset, typecode, count, swap))
+        directories = bytes(index.directories).decode('utf-8')
+        index.directories = directories.split('\0') if header['directory_count'] else []
+        index.directory_ids = dict((directory, d) for d, directory in enumerate(index.directories))
+        index.mapping = mapping
+        return index
@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+filelist.py
+
+Lists of the files for ascp, so that ascp does not have to walk the data itself.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import os
+import stat
+from multiprocessing.pool import ThreadPool
+
+from empiar_depositor.fileindex import FileIndex
+from empiar_depositor.watch import is_temporary
+
+
+def list_directory(directory):
+    """
+    List one directory without descending into its subdirectories. Hidden directories and temporary files are not
+    part of the data
+    :param directory: the directory
+    :return: list of (path, size, mtime) tuples of the files and the list of the subdirectories
+    """
+    files = []
+    subdirectories = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return files, subdirectories
+
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            # The file has been renamed or removed since the directory was listed
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            if not name.startswith('.'):
+                subdirectories.append(path)
+        elif stat.S_ISREG(st.st_mode) and not is_temporary(name):
+            files.append((path, st.st_size, st.st_mtime))
+    return files, subdirectories
+
+
+def walk_tree(data, workers=16):
+    """
+    List all files of the data with several threads, which hides the latency of network file systems such as Lustre
+    :param data: the location of the data
+    :param workers: the number of threads
+    :return: generator of the lists of (path, size, mtime) tuples of each directory
+    """
+    data = os.path.abspath(data)
+    if os.path.isfile(data):
+        st = os.stat(data)
+        yield [(data, st.st_size, st.st_mtime)]
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        # Each level of the directory tree is listed in parallel
+        pending = [data]
+        while pending:
+            next_pending = []
+            for directory_files, subdirectories in pool.map(list_directory, pending):
+                yield directory_files
+                next_pending.extend(subdirectories)
+            pending = next_pending
+    finally:
+        pool.close()
+        pool.join()
+
+
+def scan_tree(data, workers=16):
+    """
+    List all files of the data with several threads
+    :param data: the location of the data
+    :param workers: the number of threads
+    :return: sorted list of (path, size, mtime) tuples
+    """
+    files = []
+    for directory_files in walk_tree(data, workers):
+        files.extend(directory_files)
+    files.sort()
+    return files
+
+
+def scan_index(data, base, workers=16, selection=None):
+    """
+    List all files of the data into a compact index, for data with too many files to keep a tuple for each of them
+    :param data: the location of the data
+    :param base: the local directory that corresponds to the data directory of the entry
+    :param workers: the number of threads
+    :param selection: Selection object to list only the selected files
+    :return: FileIndex object with the paths relative to the data directory of the entry
+    """
+    return index_files((f for directory_files in walk_tree(data, workers) for f in directory_files), base,
+                       selection=selection)
+
+
+def index_files(files, base, selection=None):
+    """
+    Put files that have already been listed into a compact index
+    :param files: iterable of (path, size, mtime) tuples
+    :param base: the local directory that corresponds to the data directory of the entry
+    :param selection: Selection object to index only the selected files
+    :return: FileIndex object with the paths relative to the data directory of the entry
+    """
+    base = os.path.abspath(base)
+    index = FileIndex(base)
+    for path, size, mtime in files:
+        path = os.path.relpath(path, base).replace(os.path.sep, '/')
+        if selection is None or selection.matches(path):
+            index.add(path, size, mtime)
+    index.sort()
+    return index
+
+
+def get_file_pairs(paths, base):
+    """
+    Map the files to their locations in the data directory of the entry. The image set directories of the entry are
+    data/<path>, so each of them ends up in <path> relative to the parent directory of the data
+    :param paths: the locations of the files
+    :param base: the local directory that corresponds to the data directory of the entry
+    :return: list of (source, destination) tuples, the destinations are relative to the data directory of the entry
+    """
+    return [(path, os.path.relpath(path, base).replace(os.path.sep, '/')) for path in paths]
+
+
+def write_file_pair_list(f, pairs):
+    """
+    Write a file pair list of ascp: each source is followed by its destination on the next line
+    :param f: file object
+    :param pairs: list of (source, destination) tuples
+    """
+    for source, destination in pairs:
+        f.write(source + '\n')
+        f.write(destination + '\n')
@@ -0,0 +1,294 @@
+# encoding: utf-8
+"""
+hsm.py
+
+Recall of the data from tape or other cold storage of hierarchical storage management (HSM) file systems in bulk,
+ahead of the transfer, and read-ahead of the data on disk.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import os
+import shlex
+import time
+from multiprocessing.pool import ThreadPool
+from empiar_depositor.process import Process
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+# Bulk recall commands of the common HSM file systems, the first one found is used by default. They get the files as
+# arguments and let the HSM order the recall by tape and position
+RECALL_COMMANDS = (['dmget', '-q'], ['lfs', 'hsm_restore'])
+# The number of files passed to one run of the recall command
+RECALL_COMMAND_FILES = 1000
+# Without a recall command, the first byte of this many files is read at the same time to recall them
+RECALL_READERS = 16
+DEFAULT_SHARD_SIZE = 50 * 1000 ** 3
+# The number of shards ahead of the transfer that are recalled or read ahead
+RECALL_LOOKAHEAD = 2
+RECALL_POLL_INTERVAL = 30
+# Seconds to wait for a file without any other file of the shard coming online
+RECALL_TIMEOUT = 6 * 3600
+# The files that come online are passed to the transfer once there are this many bytes of them or once the first of
+# them has waited this many seconds, as every transfer has a fixed cost of starting ascp and the session
+RECALL_BATCH_SIZE = 5 * 1000 ** 3
+RECALL_BATCH_WAIT = 600
+
+
+def is_offline(st):
+    """
+    :param st: os.stat_result of a file
+    :return: True if the content of the file has been released to tape, leaving no blocks on disk
+    """
+    return st.st_size > 0 and getattr(st, 'st_blocks', None) == 0
+
+
+def get_recall_command(command=None):
+    """
+    :param command: the recall command, such as 'dmget -q', None to find one of RECALL_COMMANDS
+    :return: the argv of the command or None if there is none, in which case the files are recalled by reading them
+    """
+    if command:
+        return shlex.split(command)
+    for argv in RECALL_COMMANDS:
+        if which(argv[0]):
+            return list(argv)
+    return None
+
+
+def advise_will_need(path):
+    """
+    Ask the kernel to read the file ahead of the transfer
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_first_byte(path):
+    """
+    Reading a released file makes the HSM recall it, the read returns once the file is on disk
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.read(1)
+    except (IOError, OSError):
+        pass
+
+
+def split_shards(files, shard_size):
+    """
+    :param files: list of (path, size) tuples
+    :param shard_size: the number of bytes of a shard
+    :return: list of the lists of the files of each shard, in the order of the files
+    """
+    shards = []
+    shard = []
+    total = 0
+    for path, size in files:
+        if shard and total + size > shard_size:
+            shards.append(shard)
+            shard = []
+            total = 0
+        shard.append((path, size))
+        total += size
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+class RecallStage:
+    """
+    The :class:`RecallStage <RecallStage>` object passes the files to the transfer in shards. The released files of
+    the next shards are recalled in bulk while the current shard is transferred, and the files of a shard are passed
+    on in batches as they come online, so the transfer does not wait for a separate recall of each file. The files on
+    disk are read ahead instead
+    """
+
+    def __init__(self, command=None, shard_size=DEFAULT_SHARD_SIZE, lookahead=RECALL_LOOKAHEAD,
+                 poll_interval=RECALL_POLL_INTERVAL, timeout=RECALL_TIMEOUT, batch_size=RECALL_BATCH_SIZE,
+                 batch_wait=RECALL_BATCH_WAIT):
+        """
+        :param command: argv of the bulk recall command or None to recall the files by reading them
+        :param shard_size: the number of bytes passed to the transfer at a time
+        :param lookahead: the number of shards recalled ahead of the transfer
+        :param poll_interval: seconds between the checks of the released files
+        :param timeout: seconds to wait for the next file of a shard to come online
+        :param batch_size: the number of bytes of the files that have come online that are passed on together
+        :param batch_wait: seconds after which the files that have come online are passed on even if there are fewer
+        bytes of them
+        """
+        self.command = command
+        self.shard_size = shard_size
+        self.lookahead = max(1, lookahead)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.processes = []
+        self.readers = None
+        # Files whose recall has finished, which are online even if they are sparse and still have no blocks
+        self.recalled = set()
+
+    def request(self, depositor, shard):
+        """
+        Request the recall of the released files of a shard and read ahead the others
+        :return: the list of the released files
+        """
+        offline = []
+        for path, size in shard:
+            try:
+                if is_offline(os.stat(path)):
+                    offline.append(path)
+                else:
+                    advise_will_need(path)
+            except OSError:
+                pass
+        if not offline:
+            return offline
+
+        depositor.log("Recalling %d files from the HSM...\n" % len(offline))
+        if self.command is None:
+            if self.readers is None:
+                self.readers = ThreadPool(RECALL_READERS)
+            for path in offline:
+                self.readers.apply_async(read_first_byte, (path,), callback=lambda result, path=path:
+                                         self.recalled.add(path))
+            return offline
+
+        for i in range(0, len(offline), RECALL_COMMAND_FILES):
+            paths = offline[i:i + RECALL_COMMAND_FILES]
+            process = Process(self.command + paths, capture=False)
+            if process.error is not None:
+                depositor.log("The recall command %s cannot be run (%s), the files will be recalled by reading "
+                              "them\n" % (self.command[0], process.error))
+                self.command = None
+                return self.request(depositor, shard)
+            self.processes.append((process, paths))
+        return offline
+
+    def reap(self, depositor):
+        """
+        Collect the finished recall commands
+        """
+        for process, paths in list(self.processes):
+            if process.poll() is not None:
+                self.processes.remove((process, paths))
+                if process.returncode != 0:
+                    # The transfer reads the files anyway, which recalls them one by one if needed
+                    depositor.log("The recall command has failed with the return code %d\n" % process.returncode)
+                self.recalled.update(paths)
+
+    def wait_online(self, depositor, paths, deadline=None):
+        """
+        Wait for some of the released files to come online
+        :param deadline: the time at which the wait ends even if no file has come online
+        :return: the files that are online and the files that are still released, None if the wait has timed out or
+        the deposition has been stopped
+        """
+        waited = 0
+        while True:
+            self.reap(depositor)
+            online = []
+            offline = []
+            for path in paths:
+                try:
+                    (offline if path not in self.recalled and is_offline(os.stat(path)) else online).append(path)
+                except OSError:
+                    # The transfer reports the missing file
+                    online.append(path)
+            if online or not offline or (deadline is not None and time.time() >= deadline):
+                return online, offline
+            if waited >= self.timeout:
+                depositor.log("%d files have not been recalled from the HSM in %d s\n" % (len(offline), waited),
+                              error=True)
+                return None
+            interval = self.poll_interval
+            if deadline is not None:
+                interval = max(0, min(interval, deadline - time.time()))
+            if depositor.stop_event.wait(interval):
+                return None
+            waited += interval
+
+    def upload_files(self, depositor, paths, forward, base=None):
+        """
+        Recall and transfer the files shard by shard. The files of a shard that are online are passed on once there
+        are batch_size bytes of them, once the first of them has waited batch_wait seconds or once the whole shard is
+        online
+        :param depositor: EmpiarDepositor object
+        :param paths: the locations of the files within the data
+        :param forward: function that uploads the files that are online
+        :param base: the local directory that corresponds to the data directory of the entry, which forward keeps
+        :return: 0 if all files have been uploaded
+        """
+        files = []
+        for path in paths:
+            try:
+                files.append((path, os.path.getsize(path)))
+            except OSError:
+                files.append((path, 0))
+        shards = split_shards(files, self.shard_size)
+        started = time.time()
+        try:
+            requested = [self.request(depositor, shard) for shard in shards[:self.lookahead]]
+            for i, shard in enumerate(shards):
+                if i + self.lookahead < len(shards):
+                    requested.append(self.request(depositor, shards[i + self.lookahead]))
+
+                offline = set(requested[i])
+                sizes = dict(shard)
+                online = [path for path, size in shard if path not in offline]
+                pending = [path for path, size in shard if path in offline]
+                batch = []
+                batch_started = None
+                while True:
+                    if online and not batch:
+                        batch_started = time.time()
+                    batch.extend(online)
+                    if batch and (not pending or sum(sizes[path] for path in batch) >= self.batch_size or
+                                  time.time() - batch_started >= self.batch_wait):
+                        upload_code = forward(batch)
+                        if upload_code != 0:
+                            return upload_code
+                        batch = []
+                    if not pending:
+                        break
+                    result = self.wait_online(depositor, pending, batch_started + self.batch_wait if batch else None)
+                    if result is None:
+                        return 1
+                    online, pending = result
+            if any(requested):
+                depositor.log("Recalled %d files from the HSM in %d s\n" %
+                              (sum(len(r) for r in requested), time.time() - started))
+            return 0
+        finally:
+            if self.readers is not None:
+                self.readers.terminate()
+                self.readers.join()
+                self.readers = None
+            for process, paths in self.processes:
+                process.close()
+            self.processes = []
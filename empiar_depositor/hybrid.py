@@ -0,0 +1,151 @@
+# encoding: utf-8
+"""
+hybrid.py
+
+Transfer of the data with Aspera and Globus at the same time.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import collections
+import os
+import threading
+
+# Seconds of transfer a backend takes at a time, long enough to hide the start of a Globus task
+BATCH_DURATION = 300
+# Rate in bytes per second assumed for a backend whose rate has not been measured yet
+DEFAULT_RATE = 25 * 1000 ** 2
+MAX_BATCH_FILES = 10000
+
+
+class WorkQueue:
+    """
+    The :class:`WorkQueue <WorkQueue>` object holds the files that are still to be transferred. The backends take
+    batches of files from it as they become free, so a faster backend takes more of them. A batch that a backend fails
+    to transfer goes back to the queue for the other backend. A backend waits for the batches that are being
+    transferred while the queue is empty, as they may come back
+    """
+
+    def __init__(self, files):
+        """
+        :param files: list of (path, size) tuples
+        """
+        self.files = collections.deque(files)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def take(self, max_bytes, max_files=MAX_BATCH_FILES):
+        """
+        Take the next batch of files, at least one file
+        :param max_bytes: the size of the batch in bytes
+        :param max_files: the maximum number of files in the batch
+        :return: list of (path, size) tuples, empty once all files have been transferred
+        """
+        with self.condition:
+            while not self.files and self.in_flight:
+                self.condition.wait()
+            batch = []
+            batch_size = 0
+            while self.files and len(batch) < max_files and (not batch or batch_size + self.files[0][1] <= max_bytes):
+                path, size = self.files.popleft()
+                batch.append((path, size))
+                batch_size += size
+            if batch:
+                self.in_flight += 1
+            return batch
+
+    def finish(self, batch, failed=False):
+        """
+        :param batch: the batch that has been taken from the queue
+        :param failed: True if the batch has not been transferred and goes back to the queue
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if failed:
+                self.files.extendleft(reversed(batch))
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.files)
+
+
+class HybridTransfer:
+    """
+    The :class:`HybridTransfer <HybridTransfer>` object transfers the files with Aspera and Globus at the same time.
+    Each backend takes the files for about the same time of transfer according to its rate, measured by the previous
+    transfers, so both of them stay busy until the end. A backend that fails takes no more files and the other one
+    takes over its files
+    """
+
+    def __init__(self, batch_duration=BATCH_DURATION):
+        """
+        :param batch_duration: the number of seconds of transfer a backend takes at a time
+        """
+        self.batch_duration = batch_duration
+
+    def get_batch_size(self, depositor, backend):
+        """
+        :param depositor: EmpiarDepositor object
+        :param backend: 'aspera' or 'globus'
+        :return: the size of the next batch of the backend in bytes
+        """
+        rate = depositor.rate_cache.get(backend)
+        return int((rate['rate'] if rate else DEFAULT_RATE) * self.batch_duration)
+
+    def transfer_files(self, depositor, paths, base=None):
+        """
+        Transfer a list of files with both backends
+        :param depositor: EmpiarDepositor object
+        :param paths: the locations of the files
+        :param base: the local directory that corresponds to the data directory of the entry, the parent directory of
+        the data by default
+        :return: 0 if all files have been transferred
+        """
+        work = WorkQueue([(path, os.path.getsize(path)) for path in paths])
+        return_codes = {}
+
+        def transfer(backend, upload_files):
+            while not depositor.stop_event.is_set():
+                batch = work.take(self.get_batch_size(depositor, backend))
+                if not batch:
+                    return_codes[backend] = 0
+                    return
+
+                return_code = 1
+                try:
+                    return_code = upload_files([path for path, size in batch], base)
+                finally:
+                    work.finish(batch, failed=return_code != 0)
+                if return_code != 0:
+                    return_codes[backend] = return_code
+                    if not depositor.stop_event.is_set():
+                        depositor.log("Error while uploading the files with %s. Its files are left to the other "
+                                      "transfer.\n" % backend.capitalize(), error=True)
+                    return
+            return_codes[backend] = 1
+
+        workers = [threading.Thread(target=transfer, args=('aspera', depositor.aspera_upload_files)),
+                   threading.Thread(target=transfer, args=('globus', depositor.globus_upload_files))]
+        depositor.log("Uploading %d files with Aspera and Globus at the same time...\n" % len(paths))
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if len(work) == 0 and not depositor.stop_event.is_set():
+            return 0
+        failures = [return_code for return_code in return_codes.values() if return_code != 0]
+        return failures[0] if failures else 1
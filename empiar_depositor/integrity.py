@@ -0,0 +1,256 @@
+# encoding: utf-8
+"""
+integrity.py
+
+Detection of empty, truncated and corrupt MRC, TIFF and EER files before the transfer, from the sizes that their headers
+imply.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import os
+import struct
+from multiprocessing.pool import ThreadPool
+
+OK = 'ok'
+EMPTY = 'empty'
+TRUNCATED = 'truncated'
+CORRUPT = 'corrupt'
+# The file is too large to check within the read budget
+UNCHECKED = 'unchecked'
+
+# The number of bytes of the headers, IFDs and frame tables read from each file at most
+DEFAULT_READ_BUDGET = 4 * 1024 ** 2
+MRC_EXTENSIONS = ('.mrc', '.mrcs', '.st', '.ali', '.rec', '.map')
+# EER files are TIFF files with one IFD per frame
+TIFF_EXTENSIONS = ('.tif', '.tiff', '.eer')
+MRC_HEADER_SIZE = 1024
+# The number of bytes of a voxel of each MRC mode, mode 101 packs two voxels into a byte
+MRC_MODE_SIZES = {0: 1, 1: 2, 2: 4, 3: 4, 4: 8, 6: 2, 12: 2, 101: 0.5}
+# TIFF field types of the offsets and byte counts and their sizes
+TIFF_TYPES = {3: 'H', 4: 'I', 16: 'Q', 18: 'Q'}
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4, 16: 8, 17: 8, 18: 8}
+# Strip and tile offsets and byte counts
+TIFF_DATA_TAGS = {273: 'offsets', 279: 'counts', 324: 'offsets', 325: 'counts'}
+MAX_TIFF_TAGS = 4096
+
+
+class ReadBudgetExceeded(Exception):
+    pass
+
+
+class BudgetReader:
+    """
+    The :class:`BudgetReader <BudgetReader>` object reads parts of a file until it has read its budget of bytes
+    """
+
+    def __init__(self, f, size, budget):
+        self.f = f
+        self.size = size
+        self.budget = budget
+
+    def read(self, offset, length):
+        """
+        :return: the bytes at the offset or None if the file ends before them
+        :raises ReadBudgetExceeded: if the read would exceed the budget
+        """
+        if offset + length > self.size:
+            return None
+        if length > self.budget:
+            raise ReadBudgetExceeded()
+        self.budget -= length
+        self.f.seek(offset)
+        return self.f.read(length)
+
+
+def check_mrc(reader):
+    """
+    :param reader: BudgetReader of the file
+    :return: tuple of the status and the description of the problem
+    """
+    header = reader.read(0, MRC_HEADER_SIZE)
+    if header is None:
+        return TRUNCATED, "shorter than the MRC header"
+
+    # The machine stamp is 0x11 0x11 for big-endian data, some programs leave it empty
+    for byte_order in ('>', '<') if header[212:213] == b'\x11' else ('<', '>'):
+        nx, ny, nz, mode = struct.unpack(byte_order + '4i', header[:16])
+        if mode in MRC_MODE_SIZES and min(nx, ny, nz) >= 0:
+            break
+    else:
+        return CORRUPT, "invalid MRC header"
+
+    extended_header_size = struct.unpack(byte_order + 'i', header[92:96])[0]
+    if extended_header_size < 0:
+        return CORRUPT, "invalid MRC extended header size %d" % extended_header_size
+    if mode == 101:
+        # Each row of 4-bit voxels starts at a byte boundary
+        data_size = (nx + 1) // 2 * ny * nz
+    else:
+        data_size = nx * ny * nz * MRC_MODE_SIZES[mode]
+    expected_size = MRC_HEADER_SIZE + extended_header_size + data_size
+    if reader.size < expected_size:
+        return TRUNCATED, "%d bytes, the MRC header of %d x %d x %d voxels of mode %d implies %d bytes" % \
+            (reader.size, nx, ny, nz, mode, expected_size)
+    return OK, None
+
+
+def get_tiff_field(byte_order, entry, bigtiff):
+    """
+    :param entry: bytes of the IFD entry
+    :return: tuple of the field type, the number of values, the offset of the values or None if they are stored in
+    the entry, and the bytes of the value field of the entry
+    """
+    field_type, count = struct.unpack(byte_order + ('HQ' if bigtiff else 'HI'), entry[2:12 if bigtiff else 8])
+    field = entry[12:20] if bigtiff else entry[8:12]
+    if count * TIFF_TYPE_SIZES.get(field_type, 1) <= len(field):
+        return field_type, count, None, field
+    return field_type, count, struct.unpack(byte_order + ('Q' if bigtiff else 'I'), field)[0], field
+
+
+def read_tiff_values(reader, byte_order, entry, bigtiff):
+    """
+    :param entry: bytes of the IFD entry
+    :return: the list of the values of the entry or None if they are located beyond the end of the file
+    """
+    field_type, count, offset, field = get_tiff_field(byte_order, entry, bigtiff)
+    value_format = TIFF_TYPES.get(field_type)
+    if value_format is None:
+        raise ValueError("unexpected field type %d of tag %d" % (field_type, struct.unpack(byte_order + 'H',
+                                                                                            entry[:2])[0]))
+    length = count * TIFF_TYPE_SIZES[field_type]
+    if offset is None:
+        data = field[:length]
+    else:
+        data = reader.read(offset, length)
+        if data is None:
+            return None
+    return struct.unpack('%s%d%s' % (byte_order, count, value_format), data)
+
+
+def check_tiff(reader):
+    """
+    Follow the chain of the IFDs, one per frame, and check that the file contains the data of all frames
+    :param reader: BudgetReader of the file
+    :return: tuple of the status and the description of the problem
+    """
+    header = reader.read(0, 16) or reader.read(0, 8)
+    if header is None:
+        return TRUNCATED, "shorter than the TIFF header"
+    byte_order = {b'II': '<', b'MM': '>'}.get(header[:2])
+    if byte_order is None:
+        return CORRUPT, "invalid TIFF header"
+    version = struct.unpack(byte_order + 'H', header[2:4])[0]
+    bigtiff = version == 43
+    if bigtiff and len(header) == 16:
+        offset = struct.unpack(byte_order + 'Q', header[8:16])[0]
+    elif version == 42:
+        offset = struct.unpack(byte_order + 'I', header[4:8])[0]
+    else:
+        return CORRUPT, "invalid TIFF header"
+
+    count_format, count_size, entry_size, offset_format = ('Q', 8, 20, 'Q') if bigtiff else ('H', 2, 12, 'I')
+    offset_size = struct.calcsize(offset_format)
+    visited = set()
+    frame = 0
+    while offset:
+        if offset in visited:
+            return CORRUPT, "the IFD of frame %d loops back to an earlier frame" % frame
+        visited.add(offset)
+        data = reader.read(offset, count_size)
+        if data is None:
+            return TRUNCATED, "%d bytes, the IFD of frame %d starts at byte %d" % (reader.size, frame, offset)
+        tag_count = struct.unpack(byte_order + count_format, data)[0]
+        if not 0 < tag_count <= MAX_TIFF_TAGS:
+            return CORRUPT, "invalid IFD of frame %d" % frame
+        data = reader.read(offset + count_size, tag_count * entry_size + offset_size)
+        if data is None:
+            return TRUNCATED, "%d bytes, the IFD of frame %d ends beyond the end of the file" % (reader.size, frame)
+
+        values = {'offsets': [], 'counts': []}
+        for i in range(tag_count):
+            entry = data[i * entry_size:(i + 1) * entry_size]
+            kind = TIFF_DATA_TAGS.get(struct.unpack(byte_order + 'H', entry[:2])[0])
+            if kind is None:
+                # The values of the other tags are not read, only their location is checked
+                field_type, count, value_offset, field = get_tiff_field(byte_order, entry, bigtiff)
+                if value_offset is not None and value_offset + count * TIFF_TYPE_SIZES.get(field_type, 1) > \
+                        reader.size:
+                    return TRUNCATED, "%d bytes, the tags of frame %d end beyond the end of the file" % \
+                        (reader.size, frame)
+                continue
+            try:
+                entry_values = read_tiff_values(reader, byte_order, entry, bigtiff)
+            except ValueError as e:
+                return CORRUPT, "frame %d: %s" % (frame, e)
+            if entry_values is None:
+                return TRUNCATED, "%d bytes, the frame table of frame %d is beyond the end of the file" % \
+                    (reader.size, frame)
+            values[kind].extend(entry_values)
+
+        if len(values['offsets']) != len(values['counts']):
+            return CORRUPT, "frame %d has %d strip offsets and %d byte counts" % \
+                (frame, len(values['offsets']), len(values['counts']))
+        end = max([o + c for o, c in zip(values['offsets'], values['counts'])] or [0])
+        if end > reader.size:
+            return TRUNCATED, "%d bytes, the data of frame %d ends at byte %d" % (reader.size, frame, end)
+
+        offset = struct.unpack(byte_order + offset_format, data[-offset_size:])[0]
+        frame += 1
+    return OK, None
+
+
+def check_file(path, read_budget=DEFAULT_READ_BUDGET):
+    """
+    Check that a file is not empty and that MRC, TIFF and EER files are as long as their headers imply
+    :param path: the location of the file
+    :param read_budget: the number of bytes read from the file at most
+    :return: tuple of the status and the description of the problem or None
+    """
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return EMPTY, "empty file"
+
+        extension = os.path.splitext(path)[1].lower()
+        if extension in MRC_EXTENSIONS:
+            check = check_mrc
+        elif extension in TIFF_EXTENSIONS:
+            check = check_tiff
+        else:
+            return OK, None
+
+        with open(path, 'rb') as f:
+            return check(BudgetReader(f, size, read_budget))
+    except ReadBudgetExceeded:
+        return UNCHECKED, "more than %d bytes of headers" % read_budget
+    except (IOError, OSError) as e:
+        return CORRUPT, str(e)
+
+
+def check_files(paths, workers=16, read_budget=DEFAULT_READ_BUDGET):
+    """
+    Check the files with several threads, which hides the latency of network file systems
+    :param paths: the locations of the files
+    :param workers: the number of threads
+    :param read_budget: the number of bytes read from each file at most
+    :return: list of (path, status, description) tuples of the files that are not OK
+    """
+    pool = ThreadPool(workers)
+    try:
+        results = pool.imap(lambda path: (path,) + check_file(path, read_budget), paths, chunksize=16)
+        return [result for result in results if result[1] != OK]
+    finally:
+        pool.close()
+        pool.join()
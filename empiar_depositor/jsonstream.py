@@ -0,0 +1,146 @@
+# encoding: utf-8
+"""
+jsonstream.py
+
+Incremental reading of the JSON output of globus-cli, which lists all entries of a directory at once.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonArrayReader:
+    """
+    The :class:`JsonArrayReader <JsonArrayReader>` object reads the items of an array in the top level object of a
+    JSON document, such as the 'DATA' array of globus-cli, one at a time. Only the item that is being read and the
+    unread part of the last chunk are kept in memory, so the reading can stop as soon as the answer is known
+    """
+
+    def __init__(self, chunks, key='DATA'):
+        """
+        :param chunks: iterable of bytes with the JSON document
+        :param key: the key of the array in the top level object
+        """
+        self.chunks = iter(chunks)
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+        self.state = 'start'
+
+    def read_more(self):
+        """
+        Append the next chunk to the buffer and drop the part of the buffer that has been read
+        :return: False at the end of the document
+        """
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            self.buffer += self.text_decoder.decode(b'', True)
+            return False
+        self.buffer += self.text_decoder.decode(chunk)
+        return True
+
+    def peek(self):
+        """
+        :return: the next character that is not whitespace or None at the end of the document
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return None
+
+    def expect(self, characters):
+        """
+        Read the next character that is not whitespace
+        :param characters: the characters that are allowed
+        :return: the character
+        """
+        c = self.peek()
+        if c is None or c not in characters:
+            raise ValueError("Expected one of %r at character %d, found %r" % (characters, self.pos, c))
+        self.pos += 1
+        return c
+
+    def decode(self):
+        """
+        Read the next JSON value, reading more chunks until the value is complete
+        :return: the value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self.read_more():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buffer) or self.eof or not self.read_more():
+                self.pos = end
+                return value
+
+    def find(self):
+        """
+        Read up to the start of the array
+        :return: True if the document has the array, False otherwise
+        """
+        if self.state == 'array':
+            return True
+        if self.state == 'start':
+            self.expect('{')
+            self.state = 'object'
+            if self.peek() == '}':
+                self.state = 'end'
+                return False
+        while self.state == 'object':
+            key = self.decode()
+            self.expect(':')
+            if key == self.key and self.peek() == '[':
+                self.pos += 1
+                self.state = 'array'
+                return True
+            self.decode()
+            if self.expect(',}') == '}':
+                self.state = 'end'
+        return False
+
+    def items(self):
+        """
+        Read the items of the array one at a time
+        :return: generator of the items
+        """
+        if not self.find():
+            return
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
@@ -0,0 +1,141 @@
+# encoding: utf-8
+"""
+manifest.py
+
+Manifest of the files that have been uploaded to an EMPIAR entry.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+
+from empiar_depositor.fileindex import FileIndex
+
+
+class Manifest:
+    """
+    The :class:`Manifest <Manifest>` object keeps the list of uploaded files in a JSON lines file, one record per
+    uploaded file. Records are only appended, so the manifest survives interruptions and an upload can continue from
+    where it stopped. A file is considered uploaded if its size and modification time match the last record of it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line may be incomplete if the depositor has been killed while writing it
+                        continue
+                    self.files[record['path']] = record
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def get(self, path):
+        """
+        :param path: the path of the file relative to the upload root
+        :return: the last record of the file or None if it has not been uploaded
+        """
+        with self.lock:
+            return self.files.get(path)
+
+    def is_uploaded(self, path, size, mtime):
+        """
+        :param path: the path of the file relative to the upload root
+        :param size: the current size of the file
+        :param mtime: the current modification time of the file
+        :return: True if this version of the file has been uploaded
+        """
+        record = self.get(path)
+        return record is not None and record['size'] == size and record['mtime'] == mtime
+
+    def add(self, files, batch=None):
+        """
+        Record uploaded files
+        :param files: list of (path, size, mtime) tuples with paths relative to the upload root
+        :param batch: the number of the batch the files have been uploaded in
+        """
+        now = time.time()
+        records = [{'path': path, 'size': size, 'mtime': mtime, 'uploaded': now, 'batch': batch}
+                   for path, size, mtime in files]
+        with self.lock:
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with open(self.path, 'a') as f:
+                    for record in records:
+                        f.write(json.dumps(record) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            for record in records:
+                self.files[record['path']] = record
+
+    @property
+    def size(self):
+        """
+        :return: the total size of the uploaded files in bytes
+        """
+        with self.lock:
+            return sum(record['size'] for record in self.files.values())
+
+
+class UploadSnapshot:
+    """
+    The :class:`UploadSnapshot <UploadSnapshot>` object keeps the index of the files of the data as they were when the
+    whole data was last uploaded to an entry. A redeposit can then tell whether the data has changed since and skip
+    its upload if it has not
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def load(self):
+        """
+        :return: FileIndex object or None if the data has not been uploaded
+        """
+        if not self.path or not os.path.isfile(self.path):
+            return None
+        try:
+            return FileIndex.load(self.path)
+        except (ValueError, KeyError, struct.error):
+            return None
+
+    def save(self, index):
+        """
+        Record the data that has been uploaded
+        :param index: FileIndex object of the data
+        """
+        if self.path:
+            index.save(self.path)
+
+    def matches(self, index):
+        """
+        :param index: FileIndex object of the data
+        :return: True if exactly these files have been uploaded from the same location
+        """
+        snapshot = self.load()
+        return snapshot is not None and snapshot.same_files(index)
@@ -0,0 +1,85 @@
+# encoding: utf-8
+"""
+metadata.py
+
+Snapshots of the deposition JSON accepted by EMPIAR and the changes between them.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import gzip
+import io
+import json
+import os
+
+# Status codes of a server that does not support a way of sending the JSON, after which the plain PUT is used
+UNSUPPORTED_STATUS_CODES = (404, 405, 415, 501)
+
+
+def diff_sections(old, new):
+    """
+    Compare two deposition JSONs section by section
+    :param old: the previous deposition JSON
+    :param new: the current deposition JSON
+    :return: sorted list of the top level keys that have been added, removed or changed
+    """
+    return sorted(key for key in set(old) | set(new) if key not in old or key not in new or old[key] != new[key])
+
+
+def gzip_payload(payload):
+    """
+    :param payload: bytes of the request
+    :return: gzip compressed bytes
+    """
+    buf = io.BytesIO()
+    # A fixed modification time gives the same bytes for the same payload
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(payload)
+    return buf.getvalue()
+
+
+class MetadataSnapshot:
+    """
+    The :class:`MetadataSnapshot <MetadataSnapshot>` object keeps the last deposition JSON of an entry that EMPIAR has
+    accepted, so that an update can be skipped if nothing has changed or limited to the sections that have
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def load(self):
+        """
+        :return: the deposition JSON or None if there is no snapshot
+        """
+        if not self.path or not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def save(self, document):
+        """
+        :param document: the deposition JSON that has been accepted
+        """
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(document, f)
+        os.rename(tmp_path, self.path)
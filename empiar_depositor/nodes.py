@@ -0,0 +1,133 @@
+# encoding: utf-8
+"""
+nodes.py
+
+Aspera nodes of the upload server and the choice between them.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import re
+import socket
+import time
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_PORT = 33001
+PROBE_ATTEMPTS = 3
+PROBE_TIMEOUT = 5
+
+NODE_RE = re.compile(r'^([^@\s:]+)@([^@\s:]+)(?::(\d+))?$')
+
+
+class AsperaNode:
+    """
+    The :class:`AsperaNode <AsperaNode>` object is an Aspera server that accepts the uploads
+    """
+
+    def __init__(self, user, host, port=DEFAULT_PORT):
+        """
+        :param user: the name of the transfer user
+        :param host: the host name of the node
+        :param port: the TCP port of the SSH connection of ascp
+        """
+        self.user = user
+        self.host = host
+        self.port = port
+
+    @classmethod
+    def parse(cls, value):
+        """
+        :param value: node in the form USER@HOST or USER@HOST:PORT
+        :return: AsperaNode object
+        """
+        match = NODE_RE.match(value.strip())
+        if not match:
+            raise ValueError("Invalid Aspera node: %s" % value)
+        user, host, port = match.groups()
+        return cls(user, host, int(port) if port else DEFAULT_PORT)
+
+    @property
+    def destination(self):
+        return '%s@%s' % (self.user, self.host)
+
+    @property
+    def rate_key(self):
+        """
+        :return: the key of the transfer rates of this node in the rate cache
+        """
+        return 'aspera:%s' % self.host
+
+    def __eq__(self, other):
+        return isinstance(other, AsperaNode) and (self.user, self.host, self.port) == \
+            (other.user, other.host, other.port)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.user, self.host, self.port))
+
+    def __str__(self):
+        return '%s:%d' % (self.destination, self.port)
+
+    def __repr__(self):
+        return 'AsperaNode(%s)' % self
+
+
+def probe_latency(node, attempts=PROBE_ATTEMPTS, timeout=PROBE_TIMEOUT):
+    """
+    Measure the time it takes to open the control connection of ascp to the node
+    :param node: AsperaNode object
+    :param attempts: the number of connections
+    :param timeout: the timeout of each connection in seconds
+    :return: the median time of the connections in seconds or None if the node cannot be reached
+    """
+    times = []
+    for i in range(attempts):
+        started = time.time()
+        try:
+            connection = socket.create_connection((node.host, node.port), timeout)
+        except (socket.error, socket.timeout):
+            continue
+        times.append(time.time() - started)
+        connection.close()
+    if not times:
+        return None
+    return sorted(times)[len(times) // 2]
+
+
+def rank_nodes(nodes, rate_cache=None, now=None, probe=probe_latency):
+    """
+    Order the nodes from the best to the worst. The nodes with a known transfer rate go first, the fastest one first,
+    then the other reachable nodes by their latency. The nodes that cannot be reached go last
+    :param nodes: list of AsperaNode objects
+    :param rate_cache: RateCache object with the rates measured by the previous transfers
+    :param now: current time as seconds since epoch
+    :param probe: function that measures the latency of a node
+    :return: list of dictionaries with 'node', 'latency' in seconds and 'rate' in bytes per second
+    """
+    pool = ThreadPool(len(nodes))
+    try:
+        latencies = pool.map(probe, nodes)
+    finally:
+        pool.close()
+        pool.join()
+
+    ranking = []
+    for node, latency in zip(nodes, latencies):
+        cached_rate = rate_cache.get(node.rate_key, now) if rate_cache is not None and latency is not None else None
+        ranking.append({'node': node, 'latency': latency, 'rate': cached_rate['rate'] if cached_rate else None})
+
+    ranking.sort(key=lambda n: (n['latency'] is None, n['rate'] is None, -(n['rate'] or 0), n['latency'] or 0))
+    return ranking
@@ -0,0 +1,370 @@
+# encoding: utf-8
+"""
+pack.py
+
+Packing of small files into tar shards so that the transfer is not dominated by the overhead per file.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tarfile
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+INDEX_SUFFIX = '.index.json'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def parse_size(value):
+    """
+    Parse a size argument such as 512K, 1M or 2G
+    :param value: the number of bytes with an optional K, M, G or T suffix
+    :return: the number of bytes
+    """
+    match = re.match(r'^\s*(\d+)\s*([KMGT]?)i?B?\s*$', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid size: %s" % value)
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+class HashingReader:
+    """
+    File object wrapper that computes SHA-256 of the data that is read through it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class HashingWriter:
+    """
+    File object wrapper that computes SHA-256 and the size of the data that is written through it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def tell(self):
+        return self.size
+
+
+def file_sha256(f, size=None):
+    """
+    :param f: file object
+    :param size: the number of bytes to read, until the end of the file by default
+    :return: hex digest of SHA-256 of the data
+    """
+    sha256 = hashlib.sha256()
+    while size is None or size > 0:
+        data = f.read(HASH_BLOCK_SIZE if size is None else min(HASH_BLOCK_SIZE, size))
+        if not data:
+            break
+        sha256.update(data)
+        if size is not None:
+            size -= len(data)
+    return sha256.hexdigest()
+
+
+def pack_shard(files, directory, shard_path):
+    """
+    Write a tar shard with the files of one directory and its index. Member names are relative to the directory and
+    the tar headers only contain the size and modification time of the files, so that packing the same files always
+    produces the same shard and an interrupted transfer can be resumed.
+    :param files: list of (path, size, mtime) tuples of the files in the directory
+    :param directory: the directory of the files
+    :param shard_path: the location of the shard
+    :return: the index of the shard
+    """
+    members = []
+    with open(shard_path, 'wb') as f:
+        writer = HashingWriter(f)
+        with tarfile.open(fileobj=writer, mode='w', format=tarfile.GNU_FORMAT) as tar:
+            for path, size, mtime in files:
+                tarinfo = tarfile.TarInfo(os.path.relpath(path, directory).replace(os.path.sep, '/'))
+                tarinfo.size = size
+                tarinfo.mtime = int(mtime)
+                tarinfo.mode = 0o644
+                with open(path, 'rb') as source:
+                    reader = HashingReader(source)
+                    tar.addfile(tarinfo, reader)
+                # The data of the member ends the tar written so far, padded to the block size
+                offset = writer.size - -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                members.append({'name': tarinfo.name, 'size': size, 'mtime': mtime, 'offset': offset,
+                                'sha256': reader.sha256.hexdigest()})
+
+    index = {
+        'shard': os.path.basename(shard_path),
+        'size': writer.size,
+        'sha256': writer.sha256.hexdigest(),
+        'members': members,
+    }
+    with open(shard_path + INDEX_SUFFIX, 'w') as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def verify_shard(shard_path, index_path=None):
+    """
+    Check a shard against its index
+    :param shard_path: the location of the shard
+    :param index_path: the location of the index, next to the shard by default
+    :return: list of problems, empty if the shard matches the index
+    """
+    with open(index_path or shard_path + INDEX_SUFFIX) as f:
+        index = json.load(f)
+
+    problems = []
+    if os.path.getsize(shard_path) != index['size']:
+        problems.append("The size of %s is %d instead of %d" % (shard_path, os.path.getsize(shard_path),
+                                                                 index['size']))
+    with open(shard_path, 'rb') as f:
+        if file_sha256(f) != index['sha256']:
+            problems.append("The checksum of %s does not match the index" % shard_path)
+        for member in index['members']:
+            f.seek(member['offset'])
+            if file_sha256(f, member['size']) != member['sha256']:
+                problems.append("The checksum of %s in %s does not match the index" % (member['name'], shard_path))
+    return problems
+
+
+class PackingStage:
+    """
+    The :class:`PackingStage <PackingStage>` object packs the files below the size threshold into tar shards of
+    about the target size. Each shard holds the files of one directory and is placed in that directory together with
+    its index, so the image set layout of the entry is kept. The next shard is packed while the previous one is being
+    transferred and a shard is removed once it has been transferred, so at most two shards are kept on disk. If the
+    shards are spread across the Aspera nodes, each node transfers one shard at a time.
+    """
+
+    def __init__(self, staging_dir, threshold=1024 ** 2, shard_size=1024 ** 3, min_files=100, spread=False):
+        """
+        :param staging_dir: the directory for the shards that corresponds to the data directory of the entry
+        :param threshold: files smaller than this number of bytes are packed
+        :param shard_size: the target size of the shards in bytes
+        :param min_files: directories with fewer small files are not packed
+        :param spread: transfer the shards to all Aspera nodes of the depositor at the same time
+        """
+        self.staging_dir = staging_dir
+        self.threshold = threshold
+        self.shard_size = shard_size
+        self.min_files = min_files
+        self.spread = spread
+
+    def plan_shards(self, depositor, files, base=None):
+        """
+        Group the small files by directory into shards
+        :param depositor: EmpiarDepositor object
+        :param files: list of (path, size, mtime) tuples
+        :param base: the local directory that corresponds to the data directory of the entry, the parent directory of
+        the data by default
+        :return: list of (directory, shard path, files) tuples and the list of the files that are not packed
+        """
+        directories = {}
+        unpacked = []
+        for path, size, mtime in files:
+            if size < self.threshold:
+                directories.setdefault(os.path.dirname(path), []).append((path, size, mtime))
+            else:
+                unpacked.append(path)
+
+        shards = []
+        for directory in sorted(directories):
+            directory_files = sorted(directories[directory])
+            if len(directory_files) < self.min_files:
+                unpacked.extend(path for path, size, mtime in directory_files)
+                continue
+
+            groups = [[]]
+            group_size = 0
+            for path, size, mtime in directory_files:
+                if groups[-1] and group_size + size > self.shard_size:
+                    groups.append([])
+                    group_size = 0
+                groups[-1].append((path, size, mtime))
+                group_size += size
+
+            relative_directory = os.path.relpath(directory, base or depositor.data_base)
+            for group in groups:
+                # The name depends on the files, so the same files always end up in the same shard
+                shard_id = hashlib.sha1(json.dumps([[os.path.basename(path), size, mtime]
+                                                    for path, size, mtime in group]).encode('utf8')).hexdigest()
+                shard_path = os.path.join(self.staging_dir, relative_directory,
+                                          '%s_shard_%s.tar' % (os.path.basename(directory), shard_id[:12]))
+                shards.append((directory, shard_path, group))
+
+        return shards, unpacked
+
+    @staticmethod
+    def remove_shard(shard_path):
+        for path in (shard_path, shard_path + INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def pack_shards(self, depositor, shards, packed, cancel):
+        """
+        Pack the shards one by one, waiting while the packed shard has not been taken for the transfer
+        :param depositor: EmpiarDepositor object
+        :param shards: list of (directory, shard path, files) tuples
+        :param packed: queue of the packed shards, an exception or None at the end
+        :param cancel: event that stops the packing
+        """
+        try:
+            for directory, shard_path, files in shards:
+                if cancel.is_set() or depositor.stop_event.is_set():
+                    break
+                if not os.path.isdir(os.path.dirname(shard_path)):
+                    os.makedirs(os.path.dirname(shard_path))
+                index = pack_shard(files, directory, shard_path)
+                depositor.log("Packed %d files from %s into %s, %d bytes\n" %
+                              (len(files), directory, shard_path, index['size']))
+                packed.put(shard_path)
+        except Exception as e:
+            packed.put(e)
+            return
+        packed.put(None)
+
+    def spread_shards(self, depositor, nodes, packed):
+        """
+        Transfer the packed shards to several Aspera nodes at the same time. Each node takes the next shard once it
+        has transferred the previous one. A node whose transfer fails takes no more shards and the shard is moved to
+        the other nodes
+        :param depositor: EmpiarDepositor object
+        :param nodes: list of AsperaNode objects
+        :param packed: queue of the packed shards, an exception or None at the end
+        :return: list of the shards that no node has transferred
+        """
+        moved = queue.Queue()
+
+        def upload(node):
+            while not depositor.stop_event.is_set():
+                try:
+                    shard_path = moved.get_nowait()
+                except queue.Empty:
+                    shard_path = packed.get()
+                if shard_path is None or isinstance(shard_path, Exception):
+                    # Leave the end of the queue to the other nodes
+                    packed.put(shard_path)
+                    return
+
+                if depositor.aspera_upload_files([shard_path, shard_path + INDEX_SUFFIX], base=self.staging_dir,
+                                                 node=node) == 0:
+                    self.remove_shard(shard_path)
+                    continue
+                moved.put(shard_path)
+                if not depositor.stop_event.is_set():
+                    depositor.log("The transfer of %s via %s was not successful, it is moved to the other nodes\n" %
+                                  (shard_path, node), error=True)
+                    depositor.demote_aspera_node(node)
+                return
+
+        uploaders = [threading.Thread(target=upload, args=(node,)) for node in nodes]
+        for uploader in uploaders:
+            uploader.daemon = True
+            uploader.start()
+        for uploader in uploaders:
+            uploader.join()
+
+        remaining = []
+        while not moved.empty():
+            remaining.append(moved.get_nowait())
+        return remaining
+
+    def upload_files(self, depositor, paths, forward, base=None):
+        """
+        Pack the small files and transfer the shards, pass the other files on
+        :param depositor: EmpiarDepositor object
+        :param paths: the locations of the files within the data
+        :param forward: function that uploads the files that are not packed
+        :param base: the local directory that corresponds to the data directory of the entry, the parent directory of
+        the data by default
+        :return: 0 if all files have been uploaded
+        """
+        files = []
+        for path in paths:
+            st = os.stat(path)
+            files.append((path, st.st_size, st.st_mtime))
+
+        shards, unpacked = self.plan_shards(depositor, files, base)
+        if unpacked:
+            upload_code = forward(unpacked)
+            if upload_code != 0:
+                return upload_code
+        if not shards:
+            return 0
+
+        depositor.log("Packing %d small files into %d shards...\n" % (sum(len(s[2]) for s in shards), len(shards)))
+        packed = queue.Queue(maxsize=1)
+        cancel = threading.Event()
+        packer = threading.Thread(target=self.pack_shards, args=(depositor, shards, packed, cancel))
+        packer.daemon = True
+        packer.start()
+
+        remaining = []
+        nodes = depositor.get_aspera_nodes() if self.spread and depositor.ascp else []
+        if len(nodes) > 1:
+            depositor.log("Spreading the shards across %d Aspera nodes\n" % len(nodes))
+            remaining = self.spread_shards(depositor, nodes, packed)
+
+        # The shards that no node has transferred and the shards that are left once all nodes have failed are
+        # transferred one by one, falling back to Globus
+        upload_code = 0
+        while True:
+            shard_path = remaining.pop(0) if remaining else packed.get()
+            if shard_path is None:
+                break
+            if isinstance(shard_path, Exception):
+                depositor.log("Error while packing the files: %s\n" % shard_path, error=True)
+                upload_code = 1
+                break
+
+            if upload_code == 0 and not depositor.stop_event.is_set():
+                try:
+                    upload_code = depositor.transfer_files([shard_path, shard_path + INDEX_SUFFIX],
+                                                           base=self.staging_dir)
+                finally:
+                    self.remove_shard(shard_path)
+                if upload_code != 0:
+                    # The shards that are already being packed are removed as they arrive
+                    cancel.set()
+            else:
+                self.remove_shard(shard_path)
+
+        for shard_path in remaining:
+            self.remove_shard(shard_path)
+        packer.join()
+        if upload_code == 0 and depositor.stop_event.is_set():
+            return 1
+        return upload_code
@@ -0,0 +1,387 @@
+# encoding: utf-8
+"""
+plan.py
+
+Transfer planner: estimate the size of the data and the duration of the transfer before the deposition is created.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import datetime
+import json
+import os
+import stat
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from empiar_depositor.watch import get_local_directory, is_temporary, is_within
+
+# Transfers shorter than this are dominated by the start of the session and do not tell the rate of the link
+MIN_RATE_BYTES = 50 * 1000 ** 2
+# Measured rates older than this are not used
+RATE_MAX_AGE = 7 * 24 * 3600
+# Weight of the latest measurement in the cached rate
+RATE_WEIGHT = 0.5
+# Approximate time spent on every file in addition to its data, in seconds
+FILE_OVERHEAD = {'aspera': 0.02, 'globus': 0.1}
+# Files smaller than this are counted as small files that would benefit from packing
+SMALL_FILE_SIZE = 1024 ** 2
+MOVIE_EXTENSIONS = ('.mrc', '.mrcs', '.tif', '.tiff')
+# Transfers longer than this are worth scheduling
+LONG_TRANSFER = 8 * 3600
+# The size of the file uploaded to measure the transfer rate
+PROBE_SIZE = 100 * 1000 ** 2
+
+
+def format_size(size):
+    """
+    :param size: the number of bytes
+    :return: human readable size in decimal units
+    """
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if abs(size) < 1000 or unit == 'TB':
+            break
+        size /= 1000.0
+    return ('%d %s' if unit == 'B' else '%.1f %s') % (size, unit)
+
+
+def format_duration(seconds):
+    """
+    :param seconds: duration in seconds
+    :return: human readable duration
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '%d s' % seconds
+    minutes = seconds // 60
+    if minutes < 60:
+        return '%d min' % minutes
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return '%d h %d min' % (hours, minutes)
+    days, hours = divmod(hours, 24)
+    return '%d days %d h' % (days, hours)
+
+
+class RateCache:
+    """
+    The :class:`RateCache <RateCache>` object keeps the transfer rates measured by the previous transfers of each
+    backend in the state directory
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def get(self, backend, now=None):
+        """
+        :param backend: 'aspera' or 'globus'
+        :param now: current time as seconds since epoch
+        :return: dictionary with 'rate' in bytes per second and 'measured' time or None if there is no recent rate
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            rate = self.load().get(backend)
+        if rate and now - rate['measured'] <= RATE_MAX_AGE:
+            return rate
+        return None
+
+    def record(self, backend, size, duration):
+        """
+        Record the rate of a finished transfer
+        :param backend: 'aspera' or 'globus'
+        :param size: the number of bytes transferred
+        :param duration: the duration of the transfer in seconds
+        :return: the measured rate in bytes per second or None if the transfer has been too short to measure it
+        """
+        if not size or size < MIN_RATE_BYTES or not duration or duration <= 0:
+            return None
+
+        rate = size / float(duration)
+        with self.lock:
+            rates = self.load()
+            previous = rates.get(backend)
+            if previous and time.time() - previous['measured'] <= RATE_MAX_AGE:
+                rate = RATE_WEIGHT * rate + (1 - RATE_WEIGHT) * previous['rate']
+            rates[backend] = {'rate': rate, 'measured': time.time()}
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(rates, f)
+                os.rename(tmp_path, self.path)
+        return rate
+
+
+class ScanTotals:
+    """
+    Numbers of files and bytes in a part of the data
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.small_files = 0
+        self.small_bytes = 0
+        self.movies = 0
+
+    def add(self, other):
+        self.files += other.files
+        self.bytes += other.bytes
+        self.small_files += other.small_files
+        self.small_bytes += other.small_bytes
+        self.movies += other.movies
+
+    def to_dict(self):
+        return {'files': self.files, 'bytes': self.bytes, 'small_files': self.small_files,
+                'small_bytes': self.small_bytes, 'movies': self.movies}
+
+
+def scan_directory(directory):
+    """
+    List one directory without descending into its subdirectories
+    :param directory: the directory
+    :return: ScanTotals of the files in the directory and the list of its subdirectories
+    """
+    totals = ScanTotals()
+    subdirectories = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return totals, subdirectories
+
+    for name in names:
+        if is_temporary(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirectories.append(path)
+        elif stat.S_ISREG(st.st_mode):
+            totals.files += 1
+            totals.bytes += st.st_size
+            if st.st_size < SMALL_FILE_SIZE:
+                totals.small_files += 1
+                totals.small_bytes += st.st_size
+            if os.path.splitext(name)[1].lower() in MOVIE_EXTENSIONS:
+                totals.movies += 1
+    return totals, subdirectories
+
+
+def scan_sizes(data, workers=16):
+    """
+    Scan the data with several threads, which hides the latency of network file systems
+    :param data: the location of the data
+    :param workers: the number of threads
+    :return: dictionary of ScanTotals by directory
+    """
+    data = os.path.abspath(data)
+    if os.path.isfile(data):
+        totals = ScanTotals()
+        totals.files = 1
+        totals.bytes = os.path.getsize(data)
+        return {os.path.dirname(data): totals}
+
+    directories = {}
+    pool = ThreadPool(workers)
+    try:
+        # Each level of the directory tree is listed in parallel
+        pending = [data]
+        while pending:
+            results = pool.map(scan_directory, pending)
+            next_pending = []
+            for directory, (totals, subdirectories) in zip(pending, results):
+                directories[directory] = totals
+                next_pending.extend(subdirectories)
+            pending = next_pending
+    finally:
+        pool.close()
+        pool.join()
+    return directories
+
+
+def summarise_imagesets(json_input, data, directories):
+    """
+    Add up the scanned directories by image set. The files are counted in the innermost image set that contains them
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :param directories: dictionary of ScanTotals by directory
+    :return: list of (image set name, local directory, ScanTotals), with None as the name of the files that do not
+    belong to any image set
+    """
+    with open(json_input) as f:
+        deposition = json.load(f)
+
+    imagesets = []
+    for imageset in deposition.get('imagesets') or []:
+        if imageset.get('directory'):
+            imagesets.append((imageset.get('name') or imageset['directory'],
+                              get_local_directory(imageset['directory'], data), ScanTotals()))
+
+    other = ScanTotals()
+    for directory, totals in directories.items():
+        containing = [imageset for imageset in imagesets if is_within(directory, imageset[1])]
+        if containing:
+            max(containing, key=lambda imageset: len(imageset[1]))[2].add(totals)
+        else:
+            other.add(totals)
+
+    summary = [imageset for imageset in imagesets if imageset[2].files]
+    if other.files:
+        summary.append((None, os.path.abspath(data), other))
+    return summary
+
+
+def predict_duration(backend, totals, rate):
+    """
+    :param backend: 'aspera' or 'globus'
+    :param totals: ScanTotals of the data
+    :param rate: transfer rate in bytes per second
+    :return: predicted duration of the transfer in seconds
+    """
+    return totals.bytes / float(rate) + totals.files * FILE_OVERHEAD[backend]
+
+
+def spans_weekend(start, duration):
+    """
+    :param start: datetime of the start of the transfer
+    :param duration: duration of the transfer in seconds
+    :return: True if the transfer runs into Saturday or Sunday
+    """
+    end = start + datetime.timedelta(seconds=duration)
+    day = start
+    while day.date() <= end.date():
+        if day.weekday() >= 5:
+            return True
+        day += datetime.timedelta(days=1)
+    return False
+
+
+def make_plan(json_input, data, rates, now=None, workers=16):
+    """
+    Estimate the size of the data and the duration of its transfer and recommend the settings
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :param rates: dictionary of the transfer rates by backend, each a dictionary with 'rate' in bytes per second and
+    'source' that describes where the rate comes from
+    :param now: datetime of the start of the transfer, now by default
+    :param workers: the number of threads that scan the data
+    :return: dictionary with the plan
+    """
+    if now is None:
+        now = datetime.datetime.now()
+
+    summary = summarise_imagesets(json_input, data, scan_sizes(data, workers))
+    total = ScanTotals()
+    for name, directory, totals in summary:
+        total.add(totals)
+
+    plan = {
+        'data': os.path.abspath(data),
+        'imagesets': [dict(totals.to_dict(), name=name, directory=directory) for name, directory, totals in summary],
+        'total': total.to_dict(),
+        'backends': {},
+        'recommendations': [],
+        'warnings': [],
+    }
+
+    for backend, rate in sorted(rates.items()):
+        if not rate or not rate.get('rate'):
+            plan['backends'][backend] = {'rate': None, 'source': rate.get('source') if rate else None}
+            continue
+        duration = predict_duration(backend, total, rate['rate'])
+        plan['backends'][backend] = {
+            'rate': rate['rate'],
+            'source': rate.get('source'),
+            'duration': duration,
+            'finish': (now + datetime.timedelta(seconds=duration)).strftime('%a %Y-%m-%d %H:%M'),
+        }
+
+    predicted = dict((backend, b) for backend, b in plan['backends'].items() if b.get('duration') is not None)
+    if not predicted:
+        plan['warnings'].append("There is no measured transfer rate. Run the plan with --plan-probe and Aspera to "
+                                "measure it.")
+        return plan
+
+    best = min(predicted, key=lambda backend: predicted[backend]['duration'])
+    plan['recommended_backend'] = best
+    if len(predicted) > 1:
+        plan['recommendations'].append("Use %s, which is predicted to be faster." % best.capitalize())
+
+    best_rate = predicted[best]['rate']
+    small_overhead = total.small_files * FILE_OVERHEAD[best]
+    if total.small_files >= 1000 and small_overhead > 0.1 * predicted[best]['duration']:
+        # A shard should take about a minute to transfer, which keeps the overhead of each shard negligible
+        shard_size = min(4 * 1024 ** 3, max(256 * 1024 ** 2, int(best_rate * 60)))
+        plan['recommendations'].append(
+            "%d small files would spend about %s on the overhead per file. Pack them with --pack "
+            "--pack-threshold 1M --pack-shard-size %dM." %
+            (total.small_files, format_duration(small_overhead), shard_size // 1024 ** 2))
+
+    if total.movies:
+        plan['recommendations'].append(
+            "%d MRC or TIFF files may be movies. If they are uncompressed, --compress can reduce the transfer several "
+            "times." % total.movies)
+
+    duration = predicted[best]['duration']
+    if duration > LONG_TRANSFER:
+        plan['warnings'].append("The transfer is predicted to take %s and to finish on %s." %
+                                (format_duration(duration), predicted[best]['finish']))
+        if spans_weekend(now, duration):
+            plan['warnings'].append("The transfer will run over the weekend when problems may go unnoticed.")
+    return plan
+
+
+def format_plan(plan):
+    """
+    :param plan: dictionary with the plan
+    :return: the plan as text
+    """
+    lines = ["Transfer plan for %s" % plan['data']]
+    for imageset in plan['imagesets']:
+        name = 'Image set "%s"' % imageset['name'] if imageset['name'] is not None else 'Other files'
+        lines.append("  %s (%s): %d files, %s, %d files smaller than %s" %
+                     (name, imageset['directory'], imageset['files'], format_size(imageset['bytes']),
+                      imageset['small_files'], format_size(SMALL_FILE_SIZE)))
+    lines.append("  Total: %d files, %s" % (plan['total']['files'], format_size(plan['total']['bytes'])))
+
+    for backend, prediction in sorted(plan['backends'].items()):
+        if prediction.get('duration') is None:
+            lines.append("%s: the transfer rate is not known" % backend.capitalize())
+        else:
+            lines.append("%s: %s/s (%s), predicted duration %s, finishing on %s" %
+                         (backend.capitalize(), format_size(prediction['rate']), prediction['source'],
+                          format_duration(prediction['duration']), prediction['finish']))
+
+    for title, key in (('Recommendations', 'recommendations'), ('Warnings', 'warnings')):
+        if plan[key]:
+            lines.append("%s:" % title)
+            lines.extend("  - %s" % item for item in plan[key])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,443 @@
+# encoding: utf-8
+"""
+process.py
+
+Running of the external programs, such as ascp and globus: without a shell, in their own process group so that they
+can be stopped together with their children, with timeouts and with their outputs read as they arrive and kept within
+a bounded size.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import errno
+import os
+import re
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+# The number of bytes read from a pipe at a time
+READ_SIZE = 65536
+# The ends of the lines of an output. Progress lines are redrawn in place and end with a carriage return only
+LINE_END_RE = re.compile(b'(\r\n|\r|\n)')
+# The number of bytes of each output that are kept, half from its start and half from its end
+OUTPUT_LIMIT = 1024 ** 2
+# Seconds between asking the process group to terminate and killing it
+KILL_GRACE = 5
+# Seconds between the checks of the timeout and of the stop event while the program writes nothing
+POLL_INTERVAL = 0.5
+# Seconds between the checks of a program that has closed its outputs but has not exited yet
+EXIT_POLL_INTERVAL = 0.01
+# The shells report the programs that cannot be started with this return code
+NOT_STARTED = 127
+# The pipes can be polled on POSIX systems. On Windows each pipe is read by its own thread instead
+POLL_PIPES = os.name == 'posix'
+
+
+def get_group_options():
+    """
+    :return: the keyword arguments of subprocess.Popen that start the process in a new process group
+    """
+    if os.name == 'posix':
+        if sys.version_info >= (3, 2):
+            return {'start_new_session': True}
+        return {'preexec_fn': os.setsid}
+    return {'creationflags': getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)}
+
+
+class BoundedBuffer:
+    """
+    The :class:`BoundedBuffer <BoundedBuffer>` object keeps the start and the end of an output that may be too large to
+    keep in memory
+    """
+
+    def __init__(self, limit=OUTPUT_LIMIT):
+        """
+        :param limit: the number of bytes that are kept
+        """
+        self.head_size = limit // 2
+        self.tail_size = limit - self.head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.omitted = 0
+
+    def write(self, data):
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            excess = len(self.tail) - self.tail_size
+            if excess > 0:
+                del self.tail[:excess]
+                self.omitted += excess
+
+    def getvalue(self):
+        """
+        :return: the kept output, with a note in place of the omitted middle
+        """
+        if self.omitted:
+            return bytes(self.head) + ('\n[%d bytes omitted]\n' % self.omitted).encode('utf-8') + bytes(self.tail)
+        return bytes(self.head + self.tail)
+
+
+class PipeReader:
+    """
+    The :class:`PipeReader <PipeReader>` object waits for the output of the pipes of a process and reads it without
+    blocking on any single pipe
+    """
+
+    def __init__(self, streams):
+        """
+        :param streams: dictionary of the names of the outputs and their pipes
+        """
+        self.names = dict((stream.fileno(), name) for name, stream in streams.items())
+        self.selector = None
+        self.events = None
+        if not POLL_PIPES:
+            self.events = queue.Queue()
+            for fd in self.names:
+                thread = threading.Thread(target=self.read_pipe, args=(fd,))
+                thread.daemon = True
+                thread.start()
+        elif selectors is not None:
+            self.selector = selectors.DefaultSelector()
+            for fd in self.names:
+                self.selector.register(fd, selectors.EVENT_READ)
+
+    def read_pipe(self, fd):
+        while True:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except OSError:
+                data = b''
+            self.events.put((fd, data))
+            if not data:
+                return
+
+    def read(self, timeout):
+        """
+        Wait for the output of any of the pipes
+        :param timeout: the number of seconds to wait
+        :return: list of (name, data) tuples, empty data at the end of an output
+        """
+        if not self.names:
+            return []
+
+        if self.events is not None:
+            try:
+                ready = [self.events.get(timeout=timeout)]
+                while True:
+                    ready.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+        else:
+            try:
+                if self.selector is not None:
+                    fds = [key.fd for key, mask in self.selector.select(timeout)]
+                else:
+                    fds = select.select(list(self.names), [], [], timeout)[0]
+            except (OSError, select.error) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                fds = []
+            ready = []
+            for fd in fds:
+                try:
+                    ready.append((fd, os.read(fd, READ_SIZE)))
+                except OSError:
+                    ready.append((fd, b''))
+
+        outputs = []
+        for fd, data in ready:
+            outputs.append((self.names[fd], data))
+            if not data:
+                del self.names[fd]
+                if self.selector is not None:
+                    self.selector.unregister(fd)
+        return outputs
+
+    def close(self):
+        if self.selector is not None:
+            self.selector.close()
+
+
+class Process:
+    """
+    The :class:`Process <Process>` object runs a program with the given arguments, without a shell, in a new process
+    group. Its standard output and standard error are read as they arrive, which lets the caller follow the progress of
+    the program or stop reading a large output early, and only their start and end are kept. The program is terminated
+    with its children once its time is up or the stop event is set. A program that cannot be started behaves as if a
+    shell had reported it, with the return code 127 and the error in its output
+    """
+
+    def __init__(self, argv, env=None, stdin=None, timeout=None, stop_event=None, merge_stderr=False, capture=True,
+                 output_limit=OUTPUT_LIMIT):
+        """
+        :param argv: list of the program and its arguments, which are passed to the program as they are
+        :param env: the environment of the program, the environment of this process by default
+        :param stdin: file object that the program reads, the standard input of this process by default
+        :param timeout: the number of seconds after which the program is terminated, no limit by default
+        :param stop_event: threading.Event that terminates the program once it is set
+        :param merge_stderr: read the standard error as part of the standard output, in the order it is written
+        :param capture: False to discard the outputs
+        :param output_limit: the number of bytes of each output that are kept
+        """
+        self.argv = list(argv)
+        self.timeout = timeout
+        self.stop_event = stop_event
+        self.started = time.time()
+        self.terminated = None
+        self.exited = None
+        self.timed_out = False
+        self.finished = False
+        self.error = None
+        self.streams = {}
+        self.buffers = {'stdout': BoundedBuffer(output_limit)}
+        if capture and not merge_stderr:
+            self.buffers['stderr'] = BoundedBuffer(output_limit)
+        self.pending = []
+
+        devnull = None
+        if capture:
+            stdout = subprocess.PIPE
+            stderr = subprocess.STDOUT if merge_stderr else subprocess.PIPE
+        else:
+            devnull = open(os.devnull, 'wb')
+            stdout = stderr = devnull
+        try:
+            self.process = subprocess.Popen(self.argv, stdin=stdin, stdout=stdout, stderr=stderr, env=env,
+                                            **get_group_options())
+        except OSError as e:
+            self.process = None
+            self.error = e
+            message = ('%s: %s\n' % (self.argv[0], e.strerror or e)).encode('utf-8', 'replace')
+            name = 'stdout' if merge_stderr or not capture else 'stderr'
+            self.buffers[name].write(message)
+            self.pending.append((name, message))
+        finally:
+            if devnull is not None:
+                devnull.close()
+
+        if self.process is not None and capture:
+            self.streams['stdout'] = self.process.stdout
+            if not merge_stderr:
+                self.streams['stderr'] = self.process.stderr
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    @property
+    def returncode(self):
+        return self.process.returncode if self.process is not None else NOT_STARTED
+
+    def poll(self):
+        """
+        :return: the return code or None if the program is still running
+        """
+        if self.process is None:
+            return NOT_STARTED
+        returncode = self.process.poll()
+        if returncode is not None and self.exited is None:
+            self.exited = time.time()
+        return returncode
+
+    def send_signal(self, sig):
+        """
+        Send a signal to the process group of the program, which reaches the children of the program too
+        """
+        if self.process is None:
+            return
+        if os.name != 'posix':
+            if self.process.poll() is None:
+                self.process.terminate()
+            return
+        # The group outlives the program while its children keep the pipes open
+        if self.process.poll() is None or self.streams:
+            try:
+                os.killpg(self.process.pid, sig)
+            except OSError:
+                pass
+
+    def terminate(self):
+        """
+        Ask the program to terminate, it is killed if it is still running after KILL_GRACE seconds. This method can be
+        called from any thread
+        """
+        if self.terminated is None:
+            self.terminated = time.time()
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+    def check(self):
+        """
+        Terminate the program once its time is up or the stop event is set and kill it if it ignores the termination
+        """
+        now = time.time()
+        if self.terminated is None:
+            if self.stop_event is not None and self.stop_event.is_set():
+                self.terminate()
+            elif self.timeout is not None and now - self.started > self.timeout:
+                self.timed_out = True
+                self.terminate()
+        elif now - self.terminated > KILL_GRACE:
+            self.kill()
+
+    def get_wait_time(self):
+        wait_time = POLL_INTERVAL
+        if self.timeout is not None and self.terminated is None:
+            wait_time = min(wait_time, max(0, self.started + self.timeout - time.time()))
+        return wait_time
+
+    def wait_exit(self, timeout):
+        deadline = time.time() + timeout
+        while self.poll() is None and time.time() < deadline:
+            time.sleep(EXIT_POLL_INTERVAL)
+
+    def outputs(self):
+        """
+        Read the outputs until the program has finished or has been terminated
+        :return: generator of (name, data) tuples, the name is 'stdout' or 'stderr'
+        """
+        while self.pending:
+            yield self.pending.pop(0)
+        if self.process is None or self.finished:
+            self.finished = True
+            return
+
+        reader = PipeReader(self.streams)
+        try:
+            while reader.names or self.poll() is None:
+                if not reader.names:
+                    # The program has closed its outputs and is about to exit
+                    self.wait_exit(self.get_wait_time())
+                for name, data in reader.read(self.get_wait_time()):
+                    if data:
+                        self.buffers[name].write(data)
+                        yield name, data
+                    else:
+                        self.streams.pop(name).close()
+                self.check()
+                if self.poll() is not None and time.time() - self.exited > KILL_GRACE and reader.names:
+                    # The program has left children behind that keep its pipes open
+                    self.kill()
+                    break
+            self.finished = True
+        finally:
+            reader.close()
+
+    def chunks(self):
+        """
+        :return: generator of the chunks of the standard output
+        """
+        for name, data in self.outputs():
+            if name == 'stdout':
+                yield data
+
+    def lines(self):
+        """
+        :return: generator of the lines of the standard output, which end with a line feed, a carriage return or both.
+        Progress lines that are redrawn in place are separate lines. A line longer than READ_SIZE is split
+        """
+        line = b''
+        carriage_return = False
+        for chunk in self.chunks():
+            if carriage_return and chunk.startswith(b'\n'):
+                # The line feed of a carriage return and line feed that have been split between two chunks
+                chunk = chunk[1:]
+            line += chunk
+            parts = LINE_END_RE.split(line)
+            line = parts.pop()
+            for i in range(0, len(parts), 2):
+                yield parts[i] + parts[i + 1]
+            carriage_return = bool(parts) and not line and parts[-1] == b'\r'
+            while len(line) > READ_SIZE:
+                yield line[:READ_SIZE]
+                line = line[READ_SIZE:]
+        if line:
+            yield line
+
+    def output(self, name='stdout'):
+        """
+        :return: the kept start and end of the output
+        """
+        return self.buffers[name].getvalue() if name in self.buffers else None
+
+    def close(self, drain=False):
+        """
+        Wait for the program to finish or kill it if its output has not been read to the end
+        :param drain: read the rest of the output instead of killing the program, such as when the output is an error
+        message
+        :return: the return code or None if the program has been killed
+        """
+        if drain:
+            for name, data in self.outputs():
+                pass
+        if self.process is None:
+            return NOT_STARTED
+        killed = False
+        if not self.finished and self.poll() is None:
+            self.kill()
+            killed = True
+        for stream in self.streams.values():
+            stream.close()
+        self.streams = {}
+        self.process.wait()
+        return None if killed else self.process.returncode
+
+    def communicate(self):
+        """
+        Read the outputs to the end and wait for the program to finish
+        :return: the kept standard output and standard error, None instead of the standard error if it is merged
+        """
+        for name, data in self.outputs():
+            pass
+        self.close()
+        return self.output('stdout'), self.output('stderr')
+
+
+def run_command(argv, timeout=None, env=None, stdin=None, stop_event=None, merge_stderr=True):
+    """
+    Run a program and collect its output
+    :param argv: list of the program and its arguments
+    :param timeout: the number of seconds after which the program is terminated, no limit by default
+    :param env: the environment of the program
+    :param stdin: file object that the program reads
+    :param stop_event: threading.Event that terminates the program once it is set
+    :param merge_stderr: read the standard error as part of the standard output
+    :return: the output, the standard error or None if it is merged, and the return code
+    """
+    process = Process(argv, env=env, stdin=stdin, timeout=timeout, stop_event=stop_event, merge_stderr=merge_stderr)
+    out, err = process.communicate()
+    if process.timed_out:
+        err = (err or b'') + ('%s has not finished in %d s and has been terminated\n' %
+                              (argv[0], timeout)).encode('utf-8')
+    return out, err, process.returncode
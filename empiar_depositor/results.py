@@ -0,0 +1,182 @@
+# encoding: utf-8
+"""
+results.py
+
+Result objects of the deposition steps, which let the depositor be used as a library without parsing its output.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import collections
+import functools
+import time
+
+SUCCESS = 'success'
+FAILED = 'failed'
+STOPPED = 'stopped'
+
+# Long transfers report their progress continuously, only the last messages are kept
+MAX_MESSAGES = 1000
+
+
+class StepResult:
+    """
+    The :class:`StepResult <StepResult>` object describes the outcome of one deposition step: its status, the reply of
+    the server, timings, the number of bytes sent and the errors
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.status = None
+        self.return_code = None
+        self.status_code = None
+        self.response = None
+        self.bytes = None
+        # Seconds the transfer of the step has been paused by the rate schedule
+        self.paused = 0
+        self.started = time.time()
+        self.finished = None
+        self.messages = collections.deque(maxlen=MAX_MESSAGES)
+        self.errors = []
+
+    @property
+    def ok(self):
+        return self.status == SUCCESS
+
+    @property
+    def duration(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def record_response(self, response, response_json=None):
+        """
+        Keep the status code and the JSON reply of the server
+        :param response: Response object of requests Python module
+        :param response_json: the decoded JSON of the response
+        """
+        self.status_code = getattr(response, 'status_code', None)
+        if not isinstance(self.status_code, int):
+            self.status_code = None
+        self.response = response_json
+
+    def finish(self, return_code, stopped=False):
+        """
+        :param return_code: the return code of the step
+        :param stopped: True if the deposition has been asked to stop
+        """
+        self.finished = time.time()
+        self.return_code = return_code
+        if return_code == 0:
+            self.status = SUCCESS
+        elif stopped:
+            self.status = STOPPED
+        else:
+            self.status = FAILED
+
+    def to_dict(self):
+        return {
+            'step': self.step,
+            'status': self.status,
+            'return_code': self.return_code,
+            'status_code': self.status_code,
+            'response': self.response,
+            'bytes': self.bytes,
+            'started': self.started,
+            'finished': self.finished,
+            'duration': self.duration,
+            'paused': self.paused,
+            'messages': list(self.messages),
+            'errors': self.errors,
+        }
+
+
+class DepositionResult:
+    """
+    The :class:`DepositionResult <DepositionResult>` object describes the whole deposition: the results of all steps
+    that have been run and the identifiers of the entry
+    """
+
+    def __init__(self, steps, return_value, entry_id=None, entry_directory=None, empiar_id=None, errors=None):
+        self.steps = steps
+        self.deposition_errors = errors or []
+        self.return_value = return_value
+        self.entry_id = entry_id
+        self.entry_directory = entry_directory
+        self.empiar_id = empiar_id
+
+    @property
+    def return_code(self):
+        return 0 if isinstance(self.return_value, tuple) else self.return_value
+
+    @property
+    def ok(self):
+        return self.return_code == 0
+
+    @property
+    def bytes(self):
+        return sum(step.bytes for step in self.steps if step.bytes)
+
+    @property
+    def errors(self):
+        return [error for step in self.steps for error in step.errors] + self.deposition_errors
+
+    def step(self, name):
+        """
+        :param name: the name of the step
+        :return: the result of the last run of the step or None if the step has not been run
+        """
+        for step_result in reversed(self.steps):
+            if step_result.step == name:
+                return step_result
+        return None
+
+    def to_dict(self):
+        return {
+            'ok': self.ok,
+            'return_code': self.return_code,
+            'entry_id': self.entry_id,
+            'entry_directory': self.entry_directory,
+            'empiar_id': self.empiar_id,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'steps': [step.to_dict() for step in self.steps],
+        }
+
+
+def deposition_step(name):
+    """
+    Decorator of EmpiarDepositor methods that records a StepResult for every run of the method
+    :param name: the name of the step
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            step_result = StepResult(name)
+            self.results.append(step_result)
+            previous_step, self.current_step = self.current_step, step_result
+            try:
+                return_value = method(self, *args, **kwargs)
+            except Exception as e:
+                step_result.errors.append(str(e))
+                step_result.finish(1)
+                raise
+            finally:
+                self.current_step = previous_step
+
+            step_result.finish(0 if isinstance(return_value, tuple) else return_value,
+                               stopped=self.stop_event.is_set())
+            return return_value
+        return wrapper
+    return decorator
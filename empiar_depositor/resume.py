@@ -0,0 +1,110 @@
+# encoding: utf-8
+"""
+resume.py
+
+Choice of how ascp resumes each file, based on the journal of the files that have already been uploaded.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+# Values of the -k option of ascp
+RESUME_LEVELS = {
+    'attributes': 1,
+    'sparse': 2,
+    'full': 3,
+}
+DEFAULT_RESUME_LEVEL = RESUME_LEVELS['full']
+# Value of the -k option of ascp that transfers the whole file again whatever is already on the server
+RETRANSFER_LEVEL = 0
+# Limits of the files transferred by one run of ascp, after which the files are recorded in the journal
+CHUNK_FILES = 10000
+CHUNK_BYTES = 100 * 1000 ** 3
+
+
+class ResumePolicy:
+    """
+    The :class:`ResumePolicy <ResumePolicy>` object decides for each file whether it has to be transferred and how
+    ascp resumes it:
+
+    - files that the journal confirms as uploaded and that have not changed since are skipped
+    - files that have changed since they were uploaded are transferred again as a whole (-k0). Resuming them by
+      their attributes would skip a file that was rewritten with the same size, as ascp only compares the size, and
+      a checksum would be computed only to find that the file differs
+    - the other files may have been partly transferred by an interrupted run and are resumed with the chosen check
+
+    The files are transferred in chunks and each chunk is recorded in the journal once ascp has transferred it, so an
+    interrupted transfer loses at most one chunk of progress.
+    """
+
+    def __init__(self, journal, check='full', chunk_files=CHUNK_FILES, chunk_bytes=CHUNK_BYTES):
+        """
+        :param journal: Manifest object with the uploaded files by their location in the data directory of the entry
+        :param check: how ascp resumes the files that are not in the journal: attributes, sparse or full
+        :param chunk_files: the maximum number of files in a chunk
+        :param chunk_bytes: the maximum size of a chunk in bytes
+        """
+        self.journal = journal
+        self.check = check
+        self.chunk_files = chunk_files
+        self.chunk_bytes = chunk_bytes
+
+    def get_level(self, destination, size, mtime):
+        """
+        :param destination: the location of the file in the data directory of the entry
+        :param size: the size of the file
+        :param mtime: the modification time of the file
+        :return: the value of the -k option of ascp or None if the file is skipped
+        """
+        record = self.journal.get(destination)
+        if record is None:
+            return RESUME_LEVELS[self.check]
+        if record['size'] == size and record['mtime'] == mtime:
+            return None
+        return RETRANSFER_LEVEL
+
+    def plan(self, files):
+        """
+        Group the files into chunks that are transferred by one run of ascp each
+        :param files: list of (source, destination, size, mtime) tuples
+        :return: list of (resume level, files) tuples and the list of the skipped files
+        """
+        levels = {}
+        skipped = []
+        for source, destination, size, mtime in files:
+            level = self.get_level(destination, size, mtime)
+            if level is None:
+                skipped.append((source, destination, size, mtime))
+            else:
+                levels.setdefault(level, []).append((source, destination, size, mtime))
+
+        chunks = []
+        for level in sorted(levels):
+            chunk = []
+            chunk_size = 0
+            for f in levels[level]:
+                if chunk and (len(chunk) >= self.chunk_files or chunk_size + f[2] > self.chunk_bytes):
+                    chunks.append((level, chunk))
+                    chunk = []
+                    chunk_size = 0
+                chunk.append(f)
+                chunk_size += f[2]
+            chunks.append((level, chunk))
+        return chunks, skipped
+
+    def record(self, files):
+        """
+        Record the files that have been transferred
+        :param files: list of (source, destination, size, mtime) tuples
+        """
+        self.journal.add([(destination, size, mtime) for source, destination, size, mtime in files])
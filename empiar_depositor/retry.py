@@ -0,0 +1,292 @@
+# encoding: utf-8
+"""
+retry.py
+
+Retry policy shared by all requests to the EMPIAR deposition API.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email.utils import parsedate_tz, mktime_tz
+
+import requests
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# Responses that tell that the server has not processed the request and that it is safe to send it again
+REJECTED_STATUS_CODES = (429, 503)
+# Responses from the gateway that may have been produced after the request has reached the server
+GATEWAY_STATUS_CODES = (502, 504)
+# The longest wait in seconds that is honoured from the Retry-After header
+MAX_RETRY_AFTER = 600
+
+
+def get_host(url):
+    """
+    Get the host part of the url that is used to share the concurrency budget
+    :param url: the url of the request
+    :return: host name with port or an empty string if the url is not known
+    """
+    if not url:
+        return ''
+    return urlparse(url).netloc
+
+
+def parse_retry_after(response, now=None):
+    """
+    Get the number of seconds the server asked to wait before the next request
+    :param response: Response object of requests Python module
+    :param now: current time as seconds since epoch, used for HTTP date values
+    :return: non-negative number of seconds or None if the header is not present or is not valid
+    """
+    headers = getattr(response, 'headers', None)
+    if not hasattr(headers, 'get'):
+        return None
+
+    retry_after = headers.get('Retry-After')
+    if not retry_after or not isinstance(retry_after, str):
+        return None
+
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+
+    parsed_date = parsedate_tz(retry_after)
+    if parsed_date is None:
+        return None
+
+    if now is None:
+        now = time.time()
+    return max(0.0, mktime_tz(parsed_date) - now)
+
+
+class HostConcurrencyBudget:
+    """
+    The :class:`HostConcurrencyBudget <HostConcurrencyBudget>` object limits the number of simultaneous requests to
+    each host and keeps the time before which no requests should be sent to a host that has asked to slow down
+    """
+
+    def __init__(self, max_concurrent=4):
+        self.max_concurrent = max_concurrent
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.not_before = {}
+
+    def get_semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_concurrent)
+            return self.semaphores[host]
+
+    def defer(self, host, seconds):
+        """
+        Ask all requests to the host to wait
+        :param host: the host that asked to slow down
+        :param seconds: for how long the requests have to wait
+        """
+        with self.lock:
+            self.not_before[host] = max(self.not_before.get(host, 0), time.time() + seconds)
+
+    def wait_time(self, host):
+        """
+        :param host: host name
+        :return: the number of seconds the requests to the host still have to wait
+        """
+        with self.lock:
+            return max(0.0, self.not_before.get(host, 0) - time.time())
+
+    @contextmanager
+    def slot(self, host):
+        """
+        Hold one of the request slots of the host for the duration of the request
+        :param host: host name
+        """
+        semaphore = self.get_semaphore(host)
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+# Budget shared by all depositions in the same process, e.g. in batch runs or in the daemon
+default_budget = HostConcurrencyBudget()
+
+
+class RetryPolicy:
+    """
+    The :class:`RetryPolicy <RetryPolicy>` object, which is used to repeat the requests that failed because of server
+    overload or transient connection problems. Waits grow exponentially with full jitter so that several clients do not
+    retry at the same time, and the Retry-After header is always honoured.
+    """
+
+    def __init__(self, max_attempts=5, backoff_base=1.0, backoff_max=60.0, budget=None, log=None):
+        self.max_attempts = max(1, max_attempts)
+        self.log = log if log is not None else sys.stdout.write
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget if budget is not None else default_budget
+
+    def backoff(self, attempt):
+        """
+        :param attempt: the number of the attempt that has just failed, starting from 1
+        :return: the number of seconds to wait before the next attempt
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def is_retryable_status(response, idempotent):
+        """
+        :param response: Response object of requests Python module
+        :param idempotent: True if the request can be safely repeated even if the server has processed it
+        :return: True if the request should be repeated
+        """
+        status_code = getattr(response, 'status_code', None)
+        if status_code in REJECTED_STATUS_CODES:
+            return True
+        return idempotent and status_code in GATEWAY_STATUS_CODES
+
+    @staticmethod
+    def is_retryable_exception(exception, idempotent):
+        """
+        :param exception: the exception raised by requests
+        :param idempotent: True if the request can be safely repeated even if the server has processed it
+        :return: True if the request should be repeated
+        """
+        # The connection has not been established so the server could not have received the request
+        if isinstance(exception, requests.exceptions.ConnectTimeout):
+            return True
+        ambiguous = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                     requests.exceptions.ChunkedEncodingError)
+        return idempotent and isinstance(exception, ambiguous)
+
+    def call(self, send, url=None, idempotent=True):
+        """
+        Send the request until it succeeds, fails permanently or the attempts are exhausted
+        :param send: function without arguments that sends the request and returns the response
+        :param url: the url of the request, used to share the budget between the requests to the same host
+        :param idempotent: True if the request can be repeated even if the server might have already processed it
+        :return: the last response
+        """
+        host = get_host(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            wait = self.budget.wait_time(host)
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                with self.budget.slot(host):
+                    response = send()
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.max_attempts or not self.is_retryable_exception(e, idempotent):
+                    raise
+                delay = self.backoff(attempt)
+                self.log("Request to %s failed (%s). Retrying in %.1f s (attempt %d of %d)...\n" %
+                         (host, e.__class__.__name__, delay, attempt + 1, self.max_attempts))
+                time.sleep(delay)
+                continue
+
+            if attempt >= self.max_attempts or not self.is_retryable_status(response, idempotent):
+                return response
+
+            retry_after = parse_retry_after(response)
+            if retry_after is not None:
+                retry_after = min(retry_after, MAX_RETRY_AFTER)
+            delay = retry_after if retry_after is not None else self.backoff(attempt)
+            self.log("The server at %s is busy (status code %s). Retrying in %.1f s (attempt %d of %d)...\n" %
+                     (host, response.status_code, delay, attempt + 1, self.max_attempts))
+            if retry_after is not None:
+                # The server asked every client to slow down, so the other requests to it wait as well. The wait
+                # happens at the start of the next attempt.
+                self.budget.defer(host, retry_after)
+            else:
+                time.sleep(delay)
+
+
+class IdempotencyJournal:
+    """
+    The :class:`IdempotencyJournal <IdempotencyJournal>` object keeps the idempotency keys of deposition creations
+    whose outcome is not known, e.g. because the POST timed out. The deposition of the same JSON is not created again
+    while its key is kept, unless it is forced, in which case the same key is sent again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.pending = json.load(f)
+            except ValueError:
+                self.pending = {}
+
+    @staticmethod
+    def deposition_hash(server_root, json_bytes):
+        """
+        :param server_root: the root url of the server the deposition is created on
+        :param json_bytes: the contents of the deposition JSON
+        :return: the hash that identifies the deposition
+        """
+        return hashlib.sha256(server_root.encode('utf8') + b'\0' + json_bytes).hexdigest()
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.pending, f)
+        os.rename(tmp_path, self.path)
+
+    def get_key(self, deposition_hash):
+        """
+        Get the idempotency key of a pending deposition creation or start a new one
+        :param deposition_hash: the hash of the deposition
+        :return: idempotency key
+        """
+        with self.lock:
+            if deposition_hash not in self.pending:
+                self.pending[deposition_hash] = str(uuid.uuid4())
+                self.save()
+            return self.pending[deposition_hash]
+
+    def is_pending(self, deposition_hash):
+        with self.lock:
+            return deposition_hash in self.pending
+
+    def complete(self, deposition_hash):
+        """
+        Forget the key once the server has confirmed that the deposition has been created
+        :param deposition_hash: the hash of the deposition
+        """
+        with self.lock:
+            if self.pending.pop(deposition_hash, None) is not None:
+                self.save()
@@ -0,0 +1,157 @@
+# encoding: utf-8
+"""
+schedule.py
+
+Transfer rates that depend on the time of day and the day of week.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import re
+import time
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+PAUSE = 'pause'
+RATE_UNITS = {'': 1, 'M': 1, 'G': 1000}
+# Seconds between the checks of the schedule while the transfers are paused
+SCHEDULE_POLL_INTERVAL = 30
+
+WINDOW_RE = re.compile(r'^\s*(\S+)\s+(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s+(\S+)\s*$')
+RATE_RE = re.compile(r'^(\d+)([MG]?)(?:bps)?$', re.IGNORECASE)
+
+
+def parse_days(value):
+    """
+    Parse the days of a window such as Mon-Fri, Sat,Sun or *
+    :param value: comma separated days or ranges of days, * for every day
+    :return: set of the numbers of the days, Monday is 0
+    """
+    if value == '*':
+        return set(range(7))
+
+    days = set()
+    for part in value.lower().split(','):
+        first, _, last = part.partition('-')
+        if first[:3] not in DAYS or (last and last[:3] not in DAYS):
+            raise ValueError("Invalid day: %s" % part)
+        first_day = DAYS.index(first[:3])
+        last_day = DAYS.index(last[:3]) if last else first_day
+        day = first_day
+        days.add(day)
+        while day != last_day:
+            day = (day + 1) % 7
+            days.add(day)
+    return days
+
+
+def parse_rate(value):
+    """
+    :param value: rate in Mbps with an optional M or G suffix, or pause
+    :return: the rate in Mbps, 0 if the transfers are paused
+    """
+    if value.lower() == PAUSE:
+        return 0
+    match = RATE_RE.match(value)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError("Invalid rate: %s" % value)
+    return int(match.group(1)) * RATE_UNITS[match.group(2).upper()]
+
+
+class RateWindow:
+    """
+    The :class:`RateWindow <RateWindow>` object is a period of the week with its transfer rate. A window that ends
+    before it starts goes on over midnight into the next day
+    """
+
+    def __init__(self, days, start, end, rate):
+        """
+        :param days: set of the days the window starts on, Monday is 0
+        :param start: the start of the window in minutes after midnight
+        :param end: the end of the window in minutes after midnight
+        :param rate: the rate in Mbps, 0 if the transfers are paused
+        """
+        self.days = days
+        self.start = start
+        self.end = end
+        self.rate = rate
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Parse a window such as 'Mon-Fri 08:00-18:00 300', '* 22:00-06:00 2G' or 'Sun 02:00-04:00 pause'
+        :param value: days, times and the rate separated by spaces
+        :return: RateWindow object
+        """
+        match = WINDOW_RE.match(value)
+        if not match:
+            raise ValueError("Invalid rate window: %s" % value)
+        days, start_hour, start_minute, end_hour, end_minute, rate = match.groups()
+        start = int(start_hour) * 60 + int(start_minute)
+        end = int(end_hour) * 60 + int(end_minute)
+        if start >= 24 * 60 or end > 24 * 60:
+            raise ValueError("Invalid time in the rate window: %s" % value)
+        return cls(parse_days(days), start, end, parse_rate(rate))
+
+    def contains(self, weekday, minute):
+        """
+        :param weekday: the day of week, Monday is 0
+        :param minute: minutes after midnight
+        :return: True if the time is within the window
+        """
+        if self.start < self.end:
+            return weekday in self.days and self.start <= minute < self.end
+        return (weekday in self.days and minute >= self.start) or \
+            ((weekday - 1) % 7 in self.days and minute < self.end)
+
+
+class RateSchedule:
+    """
+    The :class:`RateSchedule <RateSchedule>` object gives the transfer rate at a local time. The first window that
+    contains the time applies. Outside of the windows the rate is not limited by the schedule
+    """
+
+    def __init__(self, windows):
+        """
+        :param windows: list of RateWindow objects
+        """
+        self.windows = windows
+
+    def get_rate(self, now=None):
+        """
+        :param now: current time as seconds since epoch
+        :return: the rate in Mbps, 0 if the transfers are paused, or None if no window applies
+        """
+        local_time = time.localtime(now)
+        minute = local_time.tm_hour * 60 + local_time.tm_min
+        for window in self.windows:
+            if window.contains(local_time.tm_wday, minute):
+                return window.rate
+        return None
+
+    def is_paused(self, now=None):
+        return self.get_rate(now) == 0
+
+    def next_change(self, now=None):
+        """
+        :param now: current time as seconds since epoch
+        :return: the time the rate changes next as seconds since epoch or None if it does not change within a week
+        """
+        if now is None:
+            now = time.time()
+        rate = self.get_rate(now)
+        minute_start = now - now % 60
+        for minutes in range(1, 7 * 24 * 60 + 1):
+            if self.get_rate(minute_start + minutes * 60) != rate:
+                return minute_start + minutes * 60
+        return None
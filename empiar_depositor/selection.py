@@ -0,0 +1,125 @@
+# encoding: utf-8
+"""
+selection.py
+
+Selection of the files that are uploaded: the image set directories and the workflow file of the deposition JSON,
+narrowed down by include and exclude patterns.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import fnmatch
+import json
+import os
+import re
+
+from empiar_depositor.staging import get_entry_directory
+
+
+def translate_glob(pattern):
+    """
+    :param pattern: shell-style pattern as in fnmatch, where * also matches /
+    :return: regular expression that matches the whole string
+    """
+    regex = fnmatch.translate(pattern)
+    if regex.endswith('(?ms)'):
+        # Python 2 puts the flags at the end, which cannot be part of a larger expression
+        regex = regex[:-len('(?ms)')]
+    return '(?:%s)' % regex
+
+
+def compile_globs(patterns):
+    """
+    Compile the patterns into a single regular expression, so that each path is matched once against all of them.
+    Patterns that contain / are matched against the path relative to the data directory of the entry, the others
+    against the name of the file
+    :param patterns: list of shell-style patterns
+    :return: tuple of the compiled expressions for the names and for the paths, None if there are no such patterns
+    """
+    name_patterns = [translate_glob(p) for p in patterns if '/' not in p]
+    path_patterns = [translate_glob(p.strip('/')) for p in patterns if '/' in p]
+    return (re.compile('|'.join(name_patterns), re.S) if name_patterns else None,
+            re.compile('|'.join(path_patterns), re.S) if path_patterns else None)
+
+
+def get_selected_paths(json_input):
+    """
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :return: the image set directories and the workflow file, relative to the data directory of the entry
+    """
+    with open(json_input) as f:
+        deposition = json.load(f)
+
+    paths = [imageset.get('directory') for imageset in deposition.get('imagesets') or []]
+    paths.append((deposition.get('workflow_file') or {}).get('path'))
+    return sorted(set(get_entry_directory(path) for path in paths if path and get_entry_directory(path)))
+
+
+class Selection:
+    """
+    The :class:`Selection <Selection>` object decides which files of the data are uploaded. A file is selected if it
+    is located in one of the selected paths, matches one of the include patterns and does not match any of the exclude
+    patterns
+    """
+
+    def __init__(self, paths=None, include=None, exclude=None):
+        """
+        :param paths: the directories and files relative to the data directory of the entry, all files by default
+        :param include: list of patterns of the files to upload, all files by default
+        :param exclude: list of patterns of the files not to upload
+        """
+        self.paths = paths
+        self.include = include or []
+        self.exclude = exclude or []
+        self.path_regex = None
+        if paths is not None:
+            # No paths select no files
+            self.path_regex = re.compile('(?:%s)(?:/|$)' % '|'.join(re.escape(p) for p in paths) if paths else '(?!)')
+        self.include_regexes = compile_globs(self.include)
+        self.exclude_regexes = compile_globs(self.exclude)
+
+    @staticmethod
+    def match_globs(regexes, path):
+        name_regex, path_regex = regexes
+        return bool((name_regex is not None and name_regex.match(path.rpartition('/')[2])) or
+                    (path_regex is not None and path_regex.match(path)))
+
+    def matches(self, path):
+        """
+        :param path: the path of a file relative to the data directory of the entry
+        :return: True if the file is selected
+        """
+        if self.path_regex is not None and not self.path_regex.match(path):
+            return False
+        if self.include and not self.match_globs(self.include_regexes, path):
+            return False
+        return not (self.exclude and self.match_globs(self.exclude_regexes, path))
+
+    def select(self, files, base):
+        """
+        :param files: list of (path, size, mtime) tuples
+        :param base: the local directory that corresponds to the data directory of the entry
+        :return: the list of the selected files and the list of the excluded ones
+        """
+        base = os.path.abspath(base)
+        prefix = base.rstrip(os.path.sep) + os.path.sep
+        selected = []
+        excluded = []
+        for f in files:
+            path = f[0][len(prefix):] if f[0].startswith(prefix) else os.path.relpath(f[0], base)
+            if self.matches(path.replace(os.path.sep, '/')):
+                selected.append(f)
+            else:
+                excluded.append(f)
+        return selected, excluded
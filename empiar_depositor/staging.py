@@ -0,0 +1,134 @@
+# encoding: utf-8
+"""
+staging.py
+
+Staging of data from several locations into the layout of the image set directories, without copying the files.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import errno
+import os
+
+from empiar_depositor.filelist import walk_tree
+
+# pairs gives the transfer the location of each file, the other modes build a tree of links in the staging directory
+STAGING_MODES = ('pairs', 'hardlink', 'symlink')
+
+
+def get_entry_directory(directory):
+    """
+    :param directory: image set directory, such as data/micrographs as in the deposition JSON or micrographs
+    :return: the directory relative to the data directory of the entry
+    """
+    directory = directory.replace(os.path.sep, '/').strip('/')
+    if directory == 'data' or directory.startswith('data/'):
+        directory = directory[len('data'):].strip('/')
+    return directory
+
+
+def parse_mapping(value):
+    """
+    :param value: mapping in the form SOURCE=DIRECTORY
+    :return: the location of the source and the image set directory relative to the data directory of the entry
+    """
+    source, separator, directory = value.rpartition('=')
+    if not separator or not source or not get_entry_directory(directory):
+        raise ValueError("Invalid staging mapping, expected SOURCE=DIRECTORY: %s" % value)
+    return source, get_entry_directory(directory)
+
+
+class Staging:
+    """
+    The :class:`Staging <Staging>` object maps files from several source locations to image set directories. The
+    upload either gets the source and the destination of each file or a tree of hard or symbolic links that has the
+    layout of the entry, so no data is copied in either case
+    """
+
+    def __init__(self, mappings, mode='pairs', root=None):
+        """
+        :param mappings: list of (source, directory) tuples, the directories are relative to the data directory of
+        the entry
+        :param mode: 'pairs', 'hardlink' or 'symlink'
+        :param root: the directory where the tree of links is built
+        """
+        if mode not in STAGING_MODES:
+            raise ValueError("Unknown staging mode: %s" % mode)
+        if mode != 'pairs' and not root:
+            raise ValueError("The staging directory is required to build a tree of links")
+        self.mappings = [(os.path.abspath(source), directory) for source, directory in mappings]
+        self.mode = mode
+        self.root = os.path.abspath(root) if root else None
+
+    def file_pairs(self):
+        """
+        List the files of all sources
+        :return: sorted list of (source, destination) tuples, the destinations are relative to the data directory of
+        the entry
+        """
+        pairs = {}
+        for source, directory in self.mappings:
+            if os.path.isfile(source):
+                files = [(directory + '/' + os.path.basename(source), source)]
+            else:
+                files = [(directory + '/' + os.path.relpath(path, source).replace(os.path.sep, '/'), path)
+                         for directory_files in walk_tree(source) for path, size, mtime in directory_files]
+            for destination, path in files:
+                if pairs.get(destination, path) != path:
+                    raise ValueError("Both %s and %s are staged as %s" % (pairs[destination], path, destination))
+                pairs[destination] = path
+        return sorted((path, destination) for destination, path in pairs.items())
+
+    def link(self, pairs):
+        """
+        Build the tree of links in the staging directory. Links from a previous staging are kept if they still point
+        to the same files
+        :param pairs: list of (source, destination) tuples
+        :return: the locations of the links
+        """
+        links = []
+        for source, destination in pairs:
+            link = os.path.join(self.root, destination.replace('/', os.path.sep))
+            links.append(link)
+            if os.path.lexists(link):
+                if self.is_linked(source, link):
+                    continue
+                os.remove(link)
+            directory = os.path.dirname(link)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            if self.mode == 'symlink':
+                os.symlink(source, link)
+                continue
+            try:
+                os.link(source, link)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # Hard links cannot cross file systems
+                os.symlink(source, link)
+        return links
+
+    @staticmethod
+    def is_linked(source, link):
+        """
+        :return: True if the link points to the source
+        """
+        if os.path.islink(link):
+            return os.readlink(link) == source
+        try:
+            return os.path.samefile(source, link)
+        except OSError:
+            return False
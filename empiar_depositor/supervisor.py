@@ -0,0 +1,108 @@
+# encoding: utf-8
+"""
+supervisor.py
+
+Classification of the failures of ascp and detection of stalled transfers.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import re
+import threading
+import time
+
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+STALLED = 'stalled'
+UNKNOWN = 'unknown'
+
+# Errors that another attempt will not fix
+FATAL_ERRORS = re.compile(r'failed to authenticate|authentication fail|permission denied|access denied|'
+                          r'no such file or directory|not a directory|invalid (option|argument)|unknown option|'
+                          r'license|disk quota|no space left|file name too long|command not found', re.IGNORECASE)
+# Errors of the network or of the session that usually go away after a while
+TRANSIENT_ERRORS = re.compile(r'network|connection (lost|refused|reset|closed|timed out)|timed? ?out|unreachable|'
+                              r'could not resolve|failed to connect|session (stop|timeout)|no route to host|'
+                              r'broken pipe|data transfer stalled|udp session', re.IGNORECASE)
+# Exit codes for an ascp that is missing or not executable
+FATAL_RETURN_CODES = (126, 127)
+# The number of restarts in a row after errors that are not recognised, which may or may not go away
+UNKNOWN_MAX_RESTARTS = 2
+# A failed attempt that has run for this number of seconds does not count towards the limit of restarts
+STABLE_RUN = 600
+STALL_CHECK_INTERVAL = 10
+
+
+def classify_ascp_failure(returncode, output):
+    """
+    Decide whether a failed ascp run is worth restarting. The errors that are known to be transient are, the errors
+    that are known to fail again in the same way are not. The errors that are not recognised are restarted a few times
+    :param returncode: ascp return code
+    :param output: the last lines of the output of ascp
+    :return: TRANSIENT, FATAL or UNKNOWN and the line that tells the error or None
+    """
+    if returncode in FATAL_RETURN_CODES:
+        return FATAL, None
+
+    transient_line = None
+    last_line = None
+    for line in output:
+        if FATAL_ERRORS.search(line):
+            return FATAL, line.strip()
+        if transient_line is None and TRANSIENT_ERRORS.search(line):
+            transient_line = line.strip()
+        if line.strip():
+            last_line = line.strip()
+    if transient_line is not None:
+        return TRANSIENT, transient_line
+    return UNKNOWN, last_line
+
+
+class StallDetector(threading.Thread):
+    """
+    The :class:`StallDetector <StallDetector>` thread interrupts a transfer that has not written anything for too long
+    """
+
+    def __init__(self, timeout, interrupt):
+        """
+        :param timeout: the number of seconds without any output after which the transfer is considered stalled
+        :param interrupt: function that stops the transfer
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.timeout = timeout
+        self.interrupt = interrupt
+        self.last_activity = time.time()
+        self.stalled = False
+        self.finished = threading.Event()
+
+    def touch(self):
+        """
+        Record that the transfer has made progress
+        """
+        self.last_activity = time.time()
+
+    def run(self):
+        while not self.finished.wait(min(STALL_CHECK_INTERVAL, self.timeout)):
+            if time.time() - self.last_activity > self.timeout:
+                self.stalled = True
+                self.interrupt()
+                return
+
+    def finish(self):
+        """
+        Stop the detection once the transfer has ended
+        """
+        self.finished.set()
+        self.join()
@@ -1,19 +1,19 @@
 import unittest
 from empiar_depositor.empiar_depositor import EmpiarDepositor
-from empiar_depositor.tests.testutils import EmpiarDepositorTest
-from mock import patch
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess
+from mock import Mock, patch
 
 
 class TestAsperaUpload(EmpiarDepositorTest):
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_failed_upload(self, mock_popen):
-        mock_popen.return_value.stdout.readline.return_value = b''
-        mock_popen.return_value.returncode = 1
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_failed_upload(self, mock_process):
+        mock_process.side_effect = lambda *args, **kwargs: FakeProcess(returncode=1)
 
         emp_dep = EmpiarDepositor("ABC123",
                                   self.json_path, "",
                                   "ascp", entry_id=1,
                                   entry_directory='DIR')
+        emp_dep.ascp_restart_policy.backoff = Mock(return_value=0)
 
         c = emp_dep.aspera_upload()
         self.assertEqual(c, 1)
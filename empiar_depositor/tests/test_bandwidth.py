@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from empiar_depositor.bandwidth import BandwidthScheduler
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess
+from mock import Mock, patch
+
+
+@unittest.skipUnless(BandwidthScheduler.is_available(), "file locks are not available")
+class TestBandwidth(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = os.path.join(self.tmp_dir, 'bandwidth.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_share_by_priority(self):
+        scheduler = BandwidthScheduler(900, registry=self.registry)
+        high_priority = BandwidthScheduler(900, priority=2, registry=self.registry)
+
+        first_id, first_rate = scheduler.register()
+        self.assertEqual(first_rate, 900)
+        second_id, second_rate = high_priority.register()
+        self.assertEqual(second_rate, 600)
+        self.assertEqual(scheduler.heartbeat(first_id), 300)
+
+        high_priority.unregister(second_id)
+        self.assertEqual(scheduler.heartbeat(first_id), 900)
+
+    def test_finished_transfers_dropped(self):
+        with open(self.registry, 'w') as f:
+            json.dump({'exited': {'pid': 2 ** 22 + 1, 'priority': 1, 'heartbeat': time.time()},
+                       'stale': {'pid': os.getpid(), 'priority': 1, 'heartbeat': time.time() - 3600}}, f)
+
+        scheduler = BandwidthScheduler(100, registry=self.registry)
+        transfer_id, rate = scheduler.register()
+        self.assertEqual(rate, 100)
+        with open(self.registry) as f:
+            self.assertEqual(list(json.load(f)), [transfer_id])
+
+    def test_registry_shared_by_users(self):
+        old_umask = os.umask(0o022)
+        try:
+            BandwidthScheduler(100, registry=self.registry).register()
+        finally:
+            os.umask(old_umask)
+        self.assertEqual(os.stat(self.registry).st_mode & 0o777, 0o666)
+
+    def test_registry_not_usable(self):
+        scheduler = BandwidthScheduler(100, registry=os.path.join(self.tmp_dir, 'missing', 'bandwidth.json'))
+        log = Mock()
+
+        self.assertEqual(scheduler.register(log=log), (None, 100))
+        scheduler.unregister('transfer', log=log)
+        self.assertEqual(log.call_count, 2)
+
+    def test_needs_restart(self):
+        self.assertFalse(BandwidthScheduler.needs_restart(100, 95, 0, now=3600))
+        self.assertFalse(BandwidthScheduler.needs_restart(100, 50, 3590, now=3600))
+        self.assertTrue(BandwidthScheduler.needs_restart(100, 50, 0, now=3600))
+
+    @patch('empiar_depositor.bandwidth.MIN_RESTART_INTERVAL', 0)
+    @patch('empiar_depositor.bandwidth.HEARTBEAT_INTERVAL', 0.05)
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_rebalanced_transfer(self, mock_process):
+        scheduler = BandwidthScheduler(100, registry=self.registry)
+        other_transfer = []
+        mock_process.side_effect = [FakeProcess(on_start=lambda: other_transfer.append(scheduler.register())),
+                                    FakeProcess(returncode=0)]
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, bandwidth=scheduler)
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertEqual(mock_process.call_count, 2)
+        self.assertTrue('100M' in mock_process.call_args_list[0][0][0])
+        self.assertTrue('50M' in mock_process.call_args_list[1][0][0])
+        with open(self.registry) as f:
+            self.assertEqual(list(json.load(f)), [other_transfer[0][0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
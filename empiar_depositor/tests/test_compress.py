@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from empiar_depositor.compress import MRC_HEADER_TAG, CompressionStage, compress_file, update_imageset_formats
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+from empiar_depositor.watch import list_files
+from mock import Mock
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+
+
+def write_mrc(path, frames, pixel_size=None, extended_header=b''):
+    """
+    Write a minimal MRC file
+    :param path: the location of the file
+    :param frames: int16 numpy array of frames
+    :param pixel_size: the pixel size in Å
+    :param extended_header: the extended header
+    """
+    nz, ny, nx = frames.shape
+    header = bytearray(1024)
+    header[0:16] = struct.pack('<4i', nx, ny, nz, 1)
+    if pixel_size:
+        header[28:52] = struct.pack('<3i3f', nx, ny, nz, nx * pixel_size, ny * pixel_size, nz * pixel_size)
+    header[92:96] = struct.pack('<i', len(extended_header))
+    header[212:214] = b'\x44\x44'
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        f.write(extended_header)
+        f.write(frames.astype('<i2').tobytes())
+
+
+@unittest.skipUnless(numpy is not None and tifffile is not None, "numpy and tifffile are required")
+class TestCompress(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        self.staging_dir = os.path.join(self.tmp_dir, 'staging')
+        os.makedirs(self.data)
+        # Sparse counts, as in counting mode movies
+        self.frames = (numpy.random.RandomState(0).poisson(0.1, (4, 64, 64))).astype('int16')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_mrc_to_tiff(self):
+        source = os.path.join(self.data, 'movie.mrc')
+        destination = os.path.join(self.staging_dir, 'movie.tif')
+        write_mrc(source, self.frames)
+
+        source_size, destination_size = compress_file(source, destination)
+        self.assertTrue(destination_size < source_size)
+        with tifffile.TiffFile(destination) as tiff:
+            self.assertEqual(len(tiff.pages), 4)
+            self.assertTrue(numpy.array_equal(numpy.stack([page.asarray() for page in tiff.pages]), self.frames))
+
+    def test_mrc_metadata(self):
+        source = os.path.join(self.data, 'movie.mrc')
+        destination = os.path.join(self.staging_dir, 'movie.tif')
+        write_mrc(source, self.frames, pixel_size=0.5, extended_header=b'\x01' * 256)
+
+        compress_file(source, destination)
+        with open(source, 'rb') as f:
+            header = f.read(1024 + 256)
+        with tifffile.TiffFile(destination) as tiff:
+            page = tiff.pages[0]
+            self.assertEqual(page.tags[MRC_HEADER_TAG].value, header)
+            self.assertEqual(json.loads(page.description), {'mrc': {'pixel_size': [0.5, 0.5, 0.5]}})
+            self.assertEqual(page.tags['XResolution'].value, (200000000, 1))
+            self.assertTrue(numpy.array_equal(tiff.pages[3].asarray(), self.frames[3]))
+
+    def test_compressed_tiff_skipped(self):
+        source = os.path.join(self.data, 'movie.tif')
+        tifffile.imwrite(source, self.frames, compression='zlib', photometric='minisblack')
+
+        self.assertEqual(compress_file(source, os.path.join(self.staging_dir, 'movie.tif')), None)
+
+    def test_update_imageset_formats(self):
+        json_output = os.path.join(self.tmp_dir, 'deposition.json')
+
+        write_mrc(os.path.join(self.data, 'movie.mrc'), self.frames)
+        self.assertEqual(update_imageset_formats(self.json_path, self.data, json_output), [self.data])
+        with open(json_output) as f:
+            imageset = json.load(f)['imagesets'][0]
+        self.assertEqual((imageset['data_format'], imageset['header_format']), ("('T3', '')", "('T3', '')"))
+
+        # An image set is left as it is if any of its MRC files cannot be converted
+        with open(os.path.join(self.data, 'movie_2.mrc'), 'wb') as f:
+            f.write(b'truncated')
+        self.assertEqual(update_imageset_formats(self.json_path, self.data, json_output), [])
+        with open(self.json_path) as f:
+            original = json.load(f)['imagesets'][0]
+        with open(json_output) as f:
+            imageset = json.load(f)['imagesets'][0]
+        self.assertEqual(imageset['data_format'], original['data_format'])
+
+    def test_streaming_upload(self):
+        movies = []
+        for i in range(3):
+            movies.append(os.path.join(self.data, 'movie_%d.mrc' % i))
+            write_mrc(movies[-1], self.frames)
+        gain = os.path.join(self.data, 'gain.dm4')
+        with open(gain, 'wb') as f:
+            f.write(b'gain')
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True)
+        staged = []
+        emp_dep.transfer_files = Mock(side_effect=lambda paths, base=None: staged.append(
+            (sorted(os.path.relpath(path, base or emp_dep.data_base) for path in paths),
+             all(os.path.exists(path) for path in paths))) or 0)
+
+        stage = CompressionStage([self.data], self.staging_dir, workers=1, batch_size=2)
+        self.assertEqual(stage.upload_files(emp_dep, list_files(self.data), emp_dep.transfer_files), 0)
+        self.assertEqual(staged, [(['micrographs/gain.dm4'], True),
+                                  (['micrographs/movie_0.tif', 'micrographs/movie_1.tif'], True),
+                                  (['micrographs/movie_2.tif'], True)])
+        self.assertFalse(os.path.exists(os.path.join(self.staging_dir, 'micrographs', 'movie_0.tif')))
+
+    def test_compressed_files_pass_next_stages(self):
+        write_mrc(os.path.join(self.data, 'movie.mrc'), self.frames)
+
+        packer = Mock(upload_files=Mock(return_value=0))
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, compressor=CompressionStage([self.data], self.staging_dir, workers=1),
+                                  packer=packer)
+
+        self.assertEqual(emp_dep.upload_files(list_files(self.data)), 0)
+        args, kwargs = packer.upload_files.call_args
+        self.assertEqual(args[1], [os.path.join(self.staging_dir, 'micrographs', 'movie.tif')])
+        self.assertEqual(kwargs['base'], self.staging_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
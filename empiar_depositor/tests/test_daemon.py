@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from empiar_depositor.client import main as client_main
+from empiar_depositor.daemon import DaemonServer, JobManager
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.results import DepositionResult
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, capture
+from mock import Mock, patch
+
+
+class TestJobManager(EmpiarDepositorTest):
+    def setUp(self):
+        self.manager = JobManager(workers=0)
+
+    def run_job(self, job, session=None):
+        job.state = 'running'
+        self.manager.run(job, session)
+
+    def test_failed_job_output(self):
+        job = self.manager.submit(["ABC123", "THIS DOES NOT EXIST", "", "-aascp"], os.getcwd())
+
+        self.run_job(job)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.log()[0], ['The specified JSON file does not exist\n'])
+
+    @patch('empiar_depositor.daemon.prepare_deposition')
+    def test_jobs_in_parallel(self, mock_prepare):
+        # Each job writes to its own output, while sys.stdout is left alone
+        jobs = [self.manager.submit(["ABC123", self.json_path, "", "-aascp"], os.getcwd()) for i in range(2)]
+        sessions = [Mock(), Mock()]
+
+        def prepare(args, toolchain=None, session=None, transfer_pass=None, output=None):
+            output.write("Session %d\n" % sessions.index(session))
+            return 1
+
+        def run_jobs():
+            threads = [threading.Thread(target=self.run_job, args=(job, session))
+                       for job, session in zip(jobs, sessions)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        mock_prepare.side_effect = prepare
+        with capture(run_jobs) as output:
+            self.assertEqual(output, '')
+        self.assertEqual(jobs[0].log()[0], ['Session 0\n'])
+        self.assertEqual(jobs[1].log()[0], ['Session 1\n'])
+
+    def test_invalid_arguments(self):
+        r = self.manager.handle({'command': 'submit', 'args': ['--no-such-option'], 'cwd': os.getcwd()})
+        self.assertFalse(r['ok'])
+
+    def test_password_needs_ask_password(self):
+        r = self.manager.handle({'command': 'submit', 'args': ["ABC123", self.json_path, "", "-aascp", "-p"],
+                                 'cwd': os.getcwd()})
+        self.assertFalse(r['ok'])
+        self.assertEqual(self.manager.jobs, {})
+
+        job = self.manager.submit(["ABC123", self.json_path, "", "-aascp", "-p"], os.getcwd(), password='secret')
+        self.assertEqual(self.manager.parse_args(job).password, 'secret')
+
+    def test_pause_resume_cancel_queued(self):
+        job = self.manager.submit(["ABC123", self.json_path, "", "-aascp"], os.getcwd())
+
+        self.assertEqual(self.manager.pause(job.id).state, 'paused')
+        self.assertEqual(self.manager.resume(job.id).state, 'queued')
+        self.assertEqual(self.manager.cancel(job.id).state, 'cancelled')
+        self.assertFalse(self.manager.handle({'command': 'resume', 'job_id': job.id})['ok'])
+
+    @patch('empiar_depositor.daemon.prepare_deposition')
+    def test_paused_job_resumes_entry(self, mock_prepare):
+        job = self.manager.submit(["ABC123", self.json_path, "", "-aascp"], os.getcwd())
+        emp_dep = Mock(spec=EmpiarDepositor, entry_id=5, entry_directory='DIR')
+
+        def deposit():
+            self.manager.pause(job.id)
+            return DepositionResult([], 1, entry_id=5, entry_directory='DIR')
+
+        emp_dep.deposit.side_effect = deposit
+        mock_prepare.return_value = emp_dep
+
+        self.run_job(job)
+        self.assertEqual(job.state, 'paused')
+        self.assertTrue(emp_dep.stop.called)
+        self.assertEqual(mock_prepare.call_args[1]['output'], job)
+        self.assertEqual(self.manager.parse_args(job).resume, [5, 'DIR'])
+
+    @patch('empiar_depositor.daemon.prepare_deposition')
+    def test_plan_job(self, mock_prepare):
+        job = self.manager.submit(["ABC123", self.json_path, self.current_dir, "-g", "endpoint", "--plan",
+                                   "--state-dir", self.current_dir], os.getcwd())
+
+        with patch('empiar_depositor.empiar_depositor.make_plan', return_value={}), \
+                patch('empiar_depositor.empiar_depositor.format_plan', return_value="Transfer plan\n"):
+            self.run_job(job)
+        self.assertFalse(mock_prepare.called)
+        self.assertEqual(job.state, 'finished')
+        self.assertEqual(job.log()[0], ["Transfer plan\n"])
+
+    def test_relative_paths(self):
+        job = self.manager.submit(["ABC123", "dep.json", "micrographs", "-aascp", "--result-json", "result.json",
+                                   "--state-dir", "state", "--hsm-recall-command", "./recall.sh -q"], "/home/user")
+
+        args = self.manager.parse_args(job)
+        self.assertEqual(args.json_input, "/home/user/dep.json")
+        self.assertEqual(args.data, "/home/user/micrographs")
+        self.assertEqual(args.result_json, "/home/user/result.json")
+        self.assertEqual(args.state_dir, "/home/user/state")
+        self.assertEqual(args.hsm_recall_command, "/home/user/recall.sh -q")
+
+    @patch('empiar_depositor.daemon.prepare_deposition')
+    def test_result_json(self, mock_prepare):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            job = self.manager.submit(["ABC123", self.json_path, "", "-aascp", "--result-json", "result.json"],
+                                      tmp_dir)
+            emp_dep = Mock(spec=EmpiarDepositor, entry_id=5, entry_directory='DIR')
+            emp_dep.deposit.return_value = DepositionResult([], 0, entry_id=5, entry_directory='DIR')
+            mock_prepare.return_value = emp_dep
+
+            self.run_job(job)
+            with open(os.path.join(tmp_dir, 'result.json')) as f:
+                self.assertEqual(json.load(f)['entry_id'], 5)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestDaemonServer(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'daemon.sock')
+        self.manager = JobManager(workers=0)
+        self.server = DaemonServer(self.socket_path, self.manager)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+
+    def test_submit_and_status(self):
+        with capture(client_main, ["--socket", self.socket_path, "submit", "ABC123", self.json_path, "",
+                                   "-aascp"]) as output:
+            self.assertEqual(output, "Submitted job 1\n")
+
+        with capture(client_main, ["--socket", self.socket_path, "status"]) as output:
+            self.assertTrue(output.startswith("1\tqueued\t"))
+
+    def test_unknown_job(self):
+        with capture(client_main, ["--socket", self.socket_path, "cancel", "7"]) as output:
+            self.assertEqual(output, "There is no job 7\n")
+
+    def test_no_daemon(self):
+        with capture(client_main, ["--socket", os.path.join(self.tmp_dir, 'none.sock'), "status"]) as output:
+            self.assertTrue("Could not connect to the EMPIAR depositor daemon" in output)
+
+
+if __name__ == '__main__':
+    unittest.main()
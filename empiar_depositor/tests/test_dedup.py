@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.dedup import PARTIAL_HASH_SIZE, count_by_imageset, find_duplicates
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.filelist import scan_tree
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+from mock import patch
+
+
+class TestDedup(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        large = b'm' * (3 * PARTIAL_HASH_SIZE)
+        # Same size, same beginning and end, different middle
+        similar = large[:PARTIAL_HASH_SIZE] + b'x' * PARTIAL_HASH_SIZE + large[-PARTIAL_HASH_SIZE:]
+        for name, content in (('gain.dm4', b'g' * 100), ('grid_1/gain.dm4', b'g' * 100), ('grid_2/gain.dm4', b'g' * 100),
+                              ('grid_2/other.dm4', b'o' * 100), ('movie_1.tif', large), ('raw/movie_1.tif', large),
+                              ('movie_2.tif', similar), ('small.txt', b's'), ('grid_1/small.txt', b's')):
+            path = os.path.join(self.data, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.data, name)
+
+    def test_find_duplicates(self):
+        duplicates = find_duplicates(scan_tree(self.data), min_size=10, workers=2)
+        self.assertEqual(duplicates, [
+            ([self.path('gain.dm4'), self.path('grid_1/gain.dm4'), self.path('grid_2/gain.dm4')], 100),
+            ([self.path('movie_1.tif'), self.path('raw/movie_1.tif')], 3 * PARTIAL_HASH_SIZE)])
+        self.assertEqual(len(find_duplicates(scan_tree(self.data), min_size=1)), 3)
+        self.assertEqual(find_duplicates(scan_tree(self.data), min_size=1000), [(duplicates[1][0], duplicates[1][1])])
+
+        self.assertEqual(list(count_by_imageset(duplicates, self.tmp_dir, ['micrographs/raw']).items()),
+                         [(None, (2, 200)), ('micrographs/raw', (1, 3 * PARTIAL_HASH_SIZE))])
+
+    @patch('empiar_depositor.empiar_depositor.EmpiarDepositor.transfer_files')
+    def test_upload_once(self, mock_transfer):
+        transferred = []
+
+        def transfer(paths, base=None):
+            transferred.append([os.path.relpath(path, base or self.tmp_dir) for path in paths])
+            if paths[0].endswith('.tsv'):
+                with open(paths[0]) as f:
+                    transferred.append(f.read().splitlines())
+            return 0
+
+        mock_transfer.side_effect = transfer
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, dedup='once', dedup_min_size=10)
+        self.assertEqual(emp_dep.upload_data(), 0)
+        self.assertFalse('micrographs/grid_1/gain.dm4' in transferred[0])
+        self.assertFalse('micrographs/raw/movie_1.tif' in transferred[0])
+        self.assertTrue('micrographs/gain.dm4' in transferred[0])
+        self.assertTrue('micrographs/grid_1/small.txt' in transferred[0])
+        self.assertEqual(transferred[1], ['empiar_depositor_duplicates.tsv'])
+        self.assertEqual(transferred[2][1:], ['micrographs/grid_1/gain.dm4\tmicrographs/gain.dm4',
+                                              'micrographs/grid_2/gain.dm4\tmicrographs/gain.dm4',
+                                              'micrographs/raw/movie_1.tif\tmicrographs/movie_1.tif'])
+
+        del transferred[:]
+        emp_dep.dedup = 'warn'
+        self.assertEqual(emp_dep.upload_data(), 0)
+        self.assertEqual(len(transferred), 1)
+        self.assertEqual(len(transferred[0]), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import requests
+from empiar_depositor.empiar_depositor import EmpiarDepositor, write_result_json
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, capture, json_response
+from mock import patch
+
+created_json = {'deposition': True, 'directory': 'DIR', 'entry_id': 1}
+submitted_json = {'submission': True, 'empiar_id': 'EMPIAR-10001'}
+
+
+class TestDeposit(EmpiarDepositorTest):
+    def mock_aspera(self, mock_process, returncode=0):
+        mock_process.return_value = FakeProcess(returncode=returncode,
+                                                output=[b'Completed: 10K bytes transferred in 1 seconds\n'])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_successful_deposition(self, mock_post, mock_process):
+        mock_post.side_effect = [json_response(200, created_json), json_response(200, submitted_json)]
+        self.mock_aspera(mock_process)
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", quiet=True)
+
+        r = emp_dep.deposit()
+        self.assertTrue(r.ok)
+        self.assertEqual(r.return_value, 0)
+        self.assertEqual((r.entry_id, r.entry_directory, r.empiar_id), (1, 'DIR', 'EMPIAR-10001'))
+        self.assertEqual([step.step for step in r.steps], ['create_deposition', 'aspera_upload', 'submit_deposition'])
+        self.assertEqual(r.step('create_deposition').response, created_json)
+        self.assertEqual(r.step('create_deposition').status_code, 200)
+        self.assertEqual(r.step('aspera_upload').bytes, 10240)
+        self.assertTrue(all(step.duration is not None for step in r.steps))
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_quiet(self, mock_post, mock_process):
+        mock_post.side_effect = [json_response(200, created_json), json_response(200, submitted_json)]
+        self.mock_aspera(mock_process)
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", quiet=True)
+
+        with capture(emp_dep.deposit) as output:
+            self.assertEqual(output, '')
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_failed_upload(self, mock_post, mock_process):
+        mock_post.side_effect = [json_response(200, created_json)]
+        self.mock_aspera(mock_process, returncode=1)
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", quiet=True, ascp_max_restarts=0)
+
+        r = emp_dep.deposit()
+        self.assertFalse(r.ok)
+        self.assertEqual(r.step('aspera_upload').status, 'failed')
+        self.assertEqual(r.step('submit_deposition'), None)
+        self.assertEqual(r.errors, ['The Aspera transfer has failed 1 times in a row, giving up',
+                                    'The deposition of the entry was not successful.'])
+
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_unauthorized(self, mock_post):
+        mock_post.return_value = json_response(401, {'detail': 'Invalid token.'})
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", quiet=True)
+
+        r = emp_dep.deposit()
+        step = r.step('create_deposition')
+        self.assertEqual((step.status, step.status_code), ('failed', 401))
+        self.assertEqual(step.response, {'detail': 'Invalid token.'})
+        self.assertTrue(step.errors[0].startswith('The creation of an EMPIAR deposition was not successful.'))
+
+    @patch('empiar_depositor.retry.time.sleep')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_request_exception(self, mock_post, mock_sleep):
+        mock_post.side_effect = requests.exceptions.ReadTimeout("Read timed out")
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", quiet=True)
+
+        r = emp_dep.deposit()
+        self.assertFalse(r.ok)
+        self.assertEqual(r.step('create_deposition').status, 'failed')
+        self.assertEqual(r.errors, ['Read timed out', 'The deposition of the entry was not successful: Read timed out'])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_result_json(self, mock_post, mock_process):
+        mock_post.side_effect = [json_response(200, created_json), json_response(200, submitted_json)]
+        self.mock_aspera(mock_process)
+        tmp_dir = tempfile.mkdtemp()
+        result_path = os.path.join(tmp_dir, 'result.json')
+
+        try:
+            write_result_json(EmpiarDepositor("ABC123", self.json_path, "", "ascp", quiet=True).deposit(),
+                              result_path)
+            with open(result_path) as f:
+                result_json = json.load(f)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(result_json['empiar_id'], 'EMPIAR-10001')
+        self.assertEqual(result_json['steps'][1]['bytes'], 10240)
+
+
+if __name__ == '__main__':
+    unittest.main()
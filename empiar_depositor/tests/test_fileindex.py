@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.fileindex import FileIndex
+from empiar_depositor.filelist import scan_index
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+
+
+class TestFileIndex(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index = FileIndex('/data')
+        for path, size in (('micrographs/grid_2/b.tif', 2), ('particles/a.star', 3), ('micrographs/grid_1/a.tif', 1),
+                           ('micrographs/gain.dm4', 4), ('micrographs-2/a.tif', 5), ('notes.txt', 6)):
+            self.index.add(path, size, 1.5, digest=b'd' * 32 if size == 4 else None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_order(self):
+        self.assertEqual([r.path for r in self.index],
+                         ['notes.txt', 'micrographs/gain.dm4', 'micrographs/grid_1/a.tif', 'micrographs/grid_2/b.tif',
+                          'micrographs-2/a.tif', 'particles/a.star'])
+        self.assertEqual(self.index.total_size, 21)
+
+    def test_lookup(self):
+        self.assertEqual(self.index.get('micrographs/grid_1/a.tif').size, 1)
+        self.assertEqual(self.index.get('micrographs/gain.dm4').digest, b'd' * 32)
+        self.assertEqual(self.index.get('micrographs/grid_2/b.tif').digest, None)
+        self.assertTrue('notes.txt' in self.index)
+        self.assertFalse('micrographs/grid_1/b.tif' in self.index)
+        self.assertFalse('movies/a.tif' in self.index)
+
+    def test_iter_directory(self):
+        self.assertEqual([r.path for r in self.index.iter_directory('micrographs')],
+                         ['micrographs/gain.dm4', 'micrographs/grid_1/a.tif', 'micrographs/grid_2/b.tif'])
+        self.assertEqual([r.path for r in self.index.iter_directory('micrographs/grid_2/')],
+                         ['micrographs/grid_2/b.tif'])
+        self.assertEqual(list(self.index.iter_directory('movies')), [])
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp_dir, 'index', 'data.idx')
+        self.index.save(path)
+        index = FileIndex.load(path)
+        self.assertEqual(index.root, '/data')
+        self.assertEqual([(r.path, r.size, r.mtime, r.digest) for r in index],
+                         [(r.path, r.size, r.mtime, r.digest) for r in self.index])
+        self.assertEqual(index.get('micrographs/gain.dm4').digest, b'd' * 32)
+        self.assertTrue(index.same_files(self.index))
+        with self.assertRaises(ValueError):
+            index.add('a.tif', 1, 1.0)
+
+        FileIndex('/data').save(path)
+        self.assertEqual(len(FileIndex.load(path)), 0)
+
+    def test_scan_index(self):
+        data = os.path.join(self.tmp_dir, 'micrographs')
+        for name in ('grid_1/a.tif', 'grid_1/b.tif.part', 'a.tif'):
+            path = os.path.join(data, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(b'data')
+        index = scan_index(data, self.tmp_dir, workers=2)
+        self.assertEqual([r.path for r in index], ['micrographs/a.tif', 'micrographs/grid_1/a.tif'])
+        self.assertEqual(index.root, self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
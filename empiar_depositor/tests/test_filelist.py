@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.filelist import get_file_pairs, scan_tree
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, get_file_pair_list
+from empiar_depositor.watch import list_files
+from mock import patch
+
+
+class TestFileList(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        for name in ('movies/movie_1.tif', 'movies/movie_2.tif', 'gain/gain.dm4', 'movies/movie_3.tif.part',
+                     '.hidden/file', 'notes.txt'):
+            path = os.path.join(self.data, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(b'data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scan_tree(self):
+        files = scan_tree(self.data, workers=2)
+        self.assertEqual([path for path, size, mtime in files], sorted(list_files(self.data)))
+        self.assertEqual(files[0][1], 4)
+
+    def test_file_pairs(self):
+        self.assertEqual(get_file_pairs([os.path.join(self.data, 'movies', 'movie_1.tif')], self.tmp_dir),
+                         [(os.path.join(self.data, 'movies', 'movie_1.tif'), 'micrographs/movies/movie_1.tif')])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_aspera_upload(self, mock_process):
+        file_lists = []
+
+        def process(command, **kwargs):
+            with open(get_file_pair_list(command)) as f:
+                file_lists.append(f.read().splitlines())
+            return FakeProcess(returncode=0)
+
+        mock_process.side_effect = process
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, ascp_file_list=True)
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertEqual(file_lists[0][1::2], ['micrographs/gain/gain.dm4', 'micrographs/movies/movie_1.tif',
+                                               'micrographs/movies/movie_2.tif', 'micrographs/notes.txt'])
+        self.assertTrue('-d' in mock_process.call_args[0][0])
+        self.assertTrue(mock_process.call_args[0][0][-1].endswith(':upload/DIR/data'))
+
+
+if __name__ == '__main__':
+    unittest.main()
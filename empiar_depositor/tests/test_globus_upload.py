@@ -1,7 +1,7 @@
 import unittest
 from mock import patch
 from empiar_depositor.empiar_depositor import EmpiarDepositor
-from empiar_depositor.tests.testutils import capture, EmpiarDepositorTest
+from empiar_depositor.tests.testutils import capture, EmpiarDepositorTest, FakeProcess
 
 missing_id_json_str = b'{\n  "DATA_TYPE": "transfer_result",\n  "code": "Accepted",\n  "message": "The transfer has ' \
                       b'been accepted and a task has been created and queued for execution",\n  "request_id": "abc",' \
@@ -11,10 +11,9 @@ missing_id_json_str = b'{\n  "DATA_TYPE": "transfer_result",\n  "code": "Accepte
 
 
 class TestGlobusUpload(EmpiarDepositorTest):
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_failed_init_stdout(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = ("Task ID: 123", "")
-        mock_popen.return_value.returncode = 1
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_failed_init_stdout(self, mock_run):
+        mock_run.return_value = ("Task ID: 123", "", 1)
 
         emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
                                   {"is_dir": False, "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir")
@@ -22,10 +21,9 @@ class TestGlobusUpload(EmpiarDepositorTest):
         with capture(emp_dep.globus_upload) as output:
             self.assertTrue('Globus transfer initiation was not successful. Return code:' in output)
 
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_failed_init_return(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = (None, None)
-        mock_popen.return_value.returncode = 1
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_failed_init_return(self, mock_run):
+        mock_run.return_value = (None, None, 1)
 
         emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
                                   {"is_dir": False, "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir")
@@ -33,11 +31,10 @@ class TestGlobusUpload(EmpiarDepositorTest):
         c = emp_dep.globus_upload()
         self.assertEqual(c, 1)
 
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_invalid_json_stdout(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = (b'The transfer has been accepted and a task has been '
-                                                            b'created and queued for execution. Task ID: 123', None)
-        mock_popen.return_value.returncode = 0
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_invalid_json_stdout(self, mock_run):
+        mock_run.return_value = (b'The transfer has been accepted and a task has been created and queued for '
+                                 b'execution. Task ID: 123', None, 0)
 
         emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
                                   {"is_dir": False, "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir")
@@ -45,11 +42,10 @@ class TestGlobusUpload(EmpiarDepositorTest):
         c = emp_dep.globus_upload()
         self.assertEqual(c, 1)
 
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_invalid_json_return(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = (b'The transfer has been accepted and a task has been '
-                                                            b'created and queued for execution. Task ID: 123', None)
-        mock_popen.return_value.returncode = 0
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_invalid_json_return(self, mock_run):
+        mock_run.return_value = (b'The transfer has been accepted and a task has been created and queued for '
+                                 b'execution. Task ID: 123', None, 0)
 
         emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
                                   {"is_dir": False, "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir")
@@ -58,10 +54,9 @@ class TestGlobusUpload(EmpiarDepositorTest):
             self.assertTrue('Error while processing transfer initiation result - the string does not contain a valid '
                             'JSON. Return code' in output)
 
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_missing_id_json_stdout(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = (missing_id_json_str, None)
-        mock_popen.return_value.returncode = 0
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_missing_id_json_stdout(self, mock_run):
+        mock_run.return_value = (missing_id_json_str, None, 0)
 
         emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
                                   {"is_dir": False, "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir")
@@ -69,10 +64,9 @@ class TestGlobusUpload(EmpiarDepositorTest):
         c = emp_dep.globus_upload()
         self.assertEqual(c, 1)
 
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_missing_id_json_return(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = (missing_id_json_str, None)
-        mock_popen.return_value.returncode = 0
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_missing_id_json_return(self, mock_run):
+        mock_run.return_value = (missing_id_json_str, None, 0)
 
         emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
                                   {"is_dir": False, "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir")
@@ -81,11 +75,9 @@ class TestGlobusUpload(EmpiarDepositorTest):
             self.assertTrue('Globus JSON transfer initiation result does not have a valid structure of '
                             'JSON[\'task_id\']. Return code:' in output)
 
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_failed_wait_upload(self, mock_popen):
-        mock_popen.return_value.communicate.return_value = ("Waiting", None)
-        mock_popen.return_value.stdout.readline.return_value = b''
-        mock_popen.return_value.returncode = 1
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_failed_wait_upload(self, mock_process):
+        mock_process.return_value = FakeProcess(returncode=1, output=[b'Waiting\n'])
 
         task_id = "Task123"
 
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from empiar_depositor.hsm import RecallStage, split_shards
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+from mock import Mock, patch
+
+
+class TestRecallStage(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(6):
+            self.paths.append(os.path.join(self.tmp_dir, 'movie_%d.tif' % i))
+            with open(self.paths[-1], 'wb') as f:
+                f.write(b'd' * 10)
+        self.released = set(self.paths[2:5])
+        self.depositor = Mock(stop_event=threading.Event())
+        self.forwarded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def forward(self, paths):
+        self.forwarded.append(list(paths))
+        return 0
+
+    def is_offline(self, st):
+        return any(os.stat(path).st_ino == st.st_ino for path in list(self.released))
+
+    def test_split_shards(self):
+        self.assertEqual(split_shards([('a', 5), ('b', 5), ('c', 1), ('d', 20), ('e', 1)], 10),
+                         [[('a', 5), ('b', 5)], [('c', 1)], [('d', 20)], [('e', 1)]])
+
+    @patch('empiar_depositor.hsm.read_first_byte')
+    @patch('empiar_depositor.hsm.is_offline')
+    def test_recall_by_reading(self, mock_is_offline, mock_read):
+        mock_is_offline.side_effect = self.is_offline
+        mock_read.side_effect = self.released.discard
+        stage = RecallStage(shard_size=20, poll_interval=0.01)
+        self.assertEqual(stage.upload_files(self.depositor, self.paths, self.forward), 0)
+        self.assertEqual(sorted(p for batch in self.forwarded for p in batch), self.paths)
+        self.assertEqual(self.forwarded[0], self.paths[:2])
+        self.assertEqual(sorted(call[0][0] for call in mock_read.call_args_list), self.paths[2:5])
+
+    @patch('empiar_depositor.hsm.Process')
+    @patch('empiar_depositor.hsm.is_offline')
+    def test_recall_command(self, mock_is_offline, mock_process):
+        mock_is_offline.side_effect = self.is_offline
+
+        def process(argv, **kwargs):
+            self.released.difference_update(argv[2:])
+            return Mock(returncode=0, error=None, **{'poll.return_value': 0})
+
+        mock_process.side_effect = process
+        stage = RecallStage(['dmget', '-q'], shard_size=100, poll_interval=0.01, batch_size=30)
+        self.assertEqual(stage.upload_files(self.depositor, self.paths, self.forward), 0)
+        # All released files of the shard are recalled with one command
+        self.assertEqual(mock_process.call_args_list[0][0][0], ['dmget', '-q'] + self.paths[2:5])
+        self.assertEqual(self.forwarded, [self.paths[:2] + [self.paths[5]], self.paths[2:5]])
+
+    @patch('empiar_depositor.hsm.read_first_byte')
+    @patch('empiar_depositor.hsm.is_offline')
+    def test_batches(self, mock_is_offline, mock_read):
+        mock_is_offline.side_effect = self.is_offline
+        recalled = threading.Event()
+
+        def read_first_byte(path):
+            recalled.wait()
+            self.released.discard(path)
+
+        mock_read.side_effect = read_first_byte
+        # The files that are online wait for the released ones until the batch is large enough
+        stage = RecallStage(shard_size=100, poll_interval=0.01)
+        threading.Timer(0.1, recalled.set).start()
+        self.assertEqual(stage.upload_files(self.depositor, self.paths, self.forward), 0)
+        self.assertEqual(len(self.forwarded), 1)
+        self.assertEqual(sorted(self.forwarded[0]), self.paths)
+
+        # Or until the first of them has waited long enough
+        self.released = set(self.paths[2:5])
+        self.forwarded = []
+        recalled.clear()
+        stage = RecallStage(shard_size=100, poll_interval=0.01, batch_wait=0.05)
+        threading.Timer(0.5, recalled.set).start()
+        self.assertEqual(stage.upload_files(self.depositor, self.paths, self.forward), 0)
+        self.assertEqual(self.forwarded[0], self.paths[:2] + [self.paths[5]])
+        self.assertEqual(sorted(p for batch in self.forwarded for p in batch), self.paths)
+
+    @patch('empiar_depositor.hsm.Process')
+    @patch('empiar_depositor.hsm.is_offline')
+    def test_timeout(self, mock_is_offline, mock_process):
+        mock_is_offline.side_effect = self.is_offline
+        mock_process.return_value.poll.return_value = None
+        mock_process.return_value.error = None
+        stage = RecallStage(['dmget'], poll_interval=0.01, timeout=0.05, batch_size=0)
+        self.assertEqual(stage.upload_files(self.depositor, self.paths, self.forward), 1)
+        self.assertEqual(self.forwarded, [self.paths[:2] + [self.paths[5]]])
+        self.assertTrue(mock_process.return_value.close.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.hybrid import HybridTransfer, WorkQueue
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+from empiar_depositor.watch import list_files
+from mock import Mock
+
+
+class TestHybrid(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        os.makedirs(self.data)
+        for i in range(10):
+            with open(os.path.join(self.data, 'micrograph_%d.mrc' % i), 'wb') as f:
+                f.write(b'\0' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_depositor(self):
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", "globusid", entry_id=1,
+                                  entry_directory='DIR', quiet=True, state_dir=self.tmp_dir,
+                                  hybrid=HybridTransfer(batch_duration=1))
+        emp_dep.uploaded = {'aspera': [], 'globus': []}
+        return emp_dep
+
+    def test_work_queue(self):
+        work = WorkQueue([('a', 600), ('b', 600), ('c', 100), ('d', 2000)])
+        self.assertEqual(work.take(1000), [('a', 600)])
+        batch = work.take(1000)
+        self.assertEqual(batch, [('b', 600), ('c', 100)])
+        work.finish(batch, failed=True)
+        self.assertEqual(work.take(100), [('b', 600)])
+        self.assertEqual(len(work), 2)
+
+    def test_work_queue_waits_for_failed_batch(self):
+        work = WorkQueue([('a', 1)])
+        batch = work.take(1)
+        taken = []
+        waiting = threading.Thread(target=lambda: taken.append(work.take(1)))
+        waiting.start()
+        work.finish(batch, failed=True)
+        waiting.join(5)
+        self.assertEqual(taken, [[('a', 1)]])
+
+    def test_both_backends(self):
+        emp_dep = self.get_depositor()
+        # Aspera has been measured as four times faster than the default rate of Globus
+        emp_dep.rate_cache.record('aspera', 100 * 1000 ** 2, 1)
+        emp_dep.hybrid.batch_duration = 40.0 / 1000 ** 2
+        started = threading.Barrier(2) if hasattr(threading, 'Barrier') else None
+
+        def upload(backend):
+            def upload_files(paths, base=None):
+                if started and not emp_dep.uploaded[backend]:
+                    started.wait(5)
+                emp_dep.uploaded[backend].append(len(paths))
+                return 0
+            return upload_files
+
+        emp_dep.aspera_upload_files = Mock(side_effect=upload('aspera'))
+        emp_dep.globus_upload_files = Mock(side_effect=upload('globus'))
+
+        self.assertEqual(emp_dep.upload_data(), 0)
+        self.assertEqual(sum(emp_dep.uploaded['aspera']) + sum(emp_dep.uploaded['globus']), 10)
+        self.assertEqual(emp_dep.uploaded['aspera'][0], 4)
+        self.assertEqual(emp_dep.uploaded['globus'][0], 1)
+
+    def test_failed_backend(self):
+        emp_dep = self.get_depositor()
+        emp_dep.aspera_upload_files = Mock(return_value=1)
+        emp_dep.globus_upload_files = Mock(side_effect=lambda paths, base=None: emp_dep.uploaded['globus'].extend(
+            paths) or 0)
+
+        self.assertEqual(emp_dep.transfer_files(list_files(self.data)), 0)
+        self.assertEqual(sorted(emp_dep.uploaded['globus']), sorted(list_files(self.data)))
+        self.assertEqual(emp_dep.aspera_upload_files.call_count, 1)
+
+        emp_dep.globus_upload_files = Mock(return_value=2)
+        self.assertNotEqual(emp_dep.transfer_files(list_files(self.data)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
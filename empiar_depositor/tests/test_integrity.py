@@ -0,0 +1,112 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.integrity import CORRUPT, EMPTY, OK, TRUNCATED, UNCHECKED, check_file, check_files
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+from mock import patch
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+
+
+def write_mrc(path, nx, ny, nz, mode=1, byte_order='<', data_size=None):
+    """
+    Write an MRC file with the header of nx x ny x nz voxels and data_size bytes of data
+    """
+    header = bytearray(1024)
+    header[0:16] = struct.pack(byte_order + '4i', nx, ny, nz, mode)
+    header[212:214] = b'\x11\x11' if byte_order == '>' else b'\x44\x44'
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        f.write(b'\0' * (nx * ny * nz * 2 if data_size is None else data_size))
+
+
+def truncate(path, size):
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+
+
+class TestIntegrity(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_mrc(self):
+        path = os.path.join(self.tmp_dir, 'movie.mrc')
+        write_mrc(path, 4, 4, 3)
+        self.assertEqual(check_file(path), (OK, None))
+        write_mrc(path, 4, 4, 3, byte_order='>')
+        self.assertEqual(check_file(path), (OK, None))
+        write_mrc(path, 5, 4, 3, mode=101, data_size=3 * 4 * 3)
+        self.assertEqual(check_file(path), (OK, None))
+
+        write_mrc(path, 4, 4, 3, data_size=60)
+        status, description = check_file(path)
+        self.assertEqual(status, TRUNCATED)
+        self.assertTrue('implies 1120 bytes' in description)
+        truncate(path, 100)
+        self.assertEqual(check_file(path)[0], TRUNCATED)
+        write_mrc(path, 4, 4, 3, mode=7)
+        self.assertEqual(check_file(path)[0], CORRUPT)
+
+    def test_empty(self):
+        for name in ('movie.tif', 'notes.txt'):
+            path = os.path.join(self.tmp_dir, name)
+            open(path, 'wb').close()
+            self.assertEqual(check_file(path)[0], EMPTY)
+
+    @unittest.skipUnless(numpy is not None and tifffile is not None, "numpy and tifffile are required")
+    def test_tiff(self):
+        for name, bigtiff in (('movie.tif', False), ('movie.eer', True)):
+            path = os.path.join(self.tmp_dir, name)
+            tifffile.imwrite(path, numpy.ones((5, 16, 16), 'uint16'), bigtiff=bigtiff, rowsperstrip=4)
+            self.assertEqual(check_file(path), (OK, None))
+            self.assertEqual(check_file(path, read_budget=64)[0], UNCHECKED)
+
+            # tifffile writes the IFDs of the later frames after the data
+            size = os.path.getsize(path)
+            truncate(path, size - 50)
+            self.assertEqual(check_file(path)[0], TRUNCATED)
+            truncate(path, size // 2)
+            self.assertEqual(check_file(path)[0], TRUNCATED)
+            truncate(path, 4)
+            self.assertEqual(check_file(path)[0], TRUNCATED)
+
+        path = os.path.join(self.tmp_dir, 'corrupt.tif')
+        with open(path, 'wb') as f:
+            f.write(b'XX*\0' + b'\0' * 100)
+        self.assertEqual(check_file(path)[0], CORRUPT)
+
+    def test_check_files(self):
+        paths = []
+        for i, data_size in enumerate((32, 32, 10, 32)):
+            paths.append(os.path.join(self.tmp_dir, 'movie_%d.mrcs' % i))
+            write_mrc(paths[-1], 4, 4, 1, data_size=data_size)
+        self.assertEqual([(path, status) for path, status, description in check_files(paths, workers=2)],
+                         [(paths[2], TRUNCATED)])
+
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_deposit(self, mock_post):
+        data = os.path.join(self.tmp_dir, 'micrographs')
+        os.makedirs(data)
+        write_mrc(os.path.join(data, 'movie_1.mrc'), 4, 4, 2)
+        write_mrc(os.path.join(data, 'movie_2.mrc'), 4, 4, 2, data_size=40)
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, data, "ascp", quiet=True, integrity_check=True)
+        r = emp_dep.deposit()
+        self.assertEqual(r.return_value, 1)
+        self.assertEqual([step.step for step in r.steps], ['check_integrity'])
+        self.assertTrue(any('movie_2.mrc is truncated' in error for error in r.errors))
+        self.assertFalse(mock_post.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import unittest
+from empiar_depositor.empiar_depositor import globus_check_data, globus_find_endpoint
+from empiar_depositor.jsonstream import JsonArrayReader
+from empiar_depositor.tests.testutils import capture, EmpiarDepositorTest, FakeProcess
+from mock import patch
+
+
+def split(data, size=3):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonArrayReader(EmpiarDepositorTest):
+    def test_items(self):
+        document = json.dumps({'DATA_TYPE': 'file_list', 'path': '/data/', 'length': [1, 2.5e3],
+                               'DATA': [{'name': u'movie_é.tif', 'type': 'file'}, 12345, 'a\\"b'],
+                               'total': 3}).encode('utf-8')
+        reader = JsonArrayReader(split(document))
+        self.assertEqual(list(reader.items()), [{'name': u'movie_é.tif', 'type': 'file'}, 12345, 'a\\"b'])
+
+    def test_missing_array(self):
+        self.assertFalse(JsonArrayReader([b'{"code": "Error", ', b'"DATA": null}']).find())
+        self.assertFalse(JsonArrayReader([b'{ }']).find())
+        self.assertEqual(list(JsonArrayReader([b'{"DATA": [ ]}']).items()), [])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            JsonArrayReader([b"Globus CLI Error: 'data' is not a directory"]).find()
+        with self.assertRaises(ValueError):
+            list(JsonArrayReader([b'{"DATA": [{"name": "a"}, {"name"']).items())
+
+    def test_early_termination(self):
+        read = []
+
+        def chunks():
+            yield b'{"DATA": ['
+            for i in range(1000000):
+                read.append(i)
+                yield b'{"name": "file_%d", "type": "file"},' % i
+
+        reader = JsonArrayReader(chunks())
+        self.assertTrue(reader.find())
+        self.assertEqual(read, [])
+        self.assertEqual(next(reader.items())['name'], 'file_0')
+        self.assertEqual(len(read), 1)
+
+
+class TestGlobusListing(EmpiarDepositorTest):
+    @staticmethod
+    def set_output(mock_process, outputs, returncodes):
+        processes = [FakeProcess(returncode=returncode, output=split(output, 5))
+                     for output, returncode in zip(outputs, returncodes)]
+        mock_process.side_effect = processes
+        return processes
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_directory(self, mock_process):
+        processes = self.set_output(mock_process, [b'{"DATA": [' + b'{"name": "a", "type": "file"}, ' * 100000], [0])
+        self.assertEqual(globus_check_data('endpoint', '/data/micrographs'),
+                         {'is_dir': '-r', 'obj_name': 'micrographs'})
+        # Only the start of the listing has been read
+        self.assertTrue(len(processes[0].output_lines) > len(processes[0].stdout) // 5 - 5)
+        self.assertTrue(processes[0].killed)
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_file(self, mock_process):
+        self.set_output(mock_process, [b"Globus CLI Error: '/data/movie.tif' is not a directory\n",
+                                       b'{"DATA": [{"name": "movie.tif", "type": "file"}]}'], [1, 0])
+        self.assertEqual(globus_check_data('endpoint', '/data/movie.tif'),
+                         {'is_dir': False, 'obj_name': 'movie.tif'})
+        self.assertEqual(mock_process.call_args[0][0][3:5], ['--filter', '=movie.tif'])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_missing(self, mock_process):
+        self.set_output(mock_process, [b"Globus CLI Error: '/data/movie.tif' is not a directory\n",
+                                       b'{"DATA": []}'], [1, 0])
+        with capture(globus_check_data, 'endpoint', '/data/movie.tif') as output:
+            self.assertTrue('Error while checking the existence of the object' in output)
+
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_find_endpoint(self, mock_process, mock_run):
+        self.set_output(mock_process, [b'{"DATA": [{"id": "1", "display_name": "other"}, '
+                                       b'{"id": "2", "display_name": "mine"}, {"id": "3", "display_name": "mine"}]}'],
+                        [0])
+        mock_run.return_value = (b'{"code": "AutoActivated.GlobusOnlineCredential", "message": "Endpoint is already '
+                                 b'activated"}', None, 0)
+        self.assertEqual(globus_find_endpoint('mine'), '2')
+        self.assertEqual(mock_run.call_args[0][0][:4], ['globus', 'endpoint', 'activate', '2'])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_endpoint_not_found(self, mock_process):
+        self.set_output(mock_process, [b'{"DATA": [{"id": "1", "display_name": "other"}]}'], [0])
+        with capture(globus_find_endpoint, 'mine') as output:
+            self.assertTrue('Globus endpoint could not be found' in output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,12 +34,11 @@ class TestMain(EmpiarDepositorTest):
             self.assertTrue("The specified ascp does not work." in output)
 
     @patch('empiar_depositor.empiar_depositor.os.path.isfile')
-    @patch('empiar_depositor.empiar_depositor.subprocess.Popen')
-    def test_aspera_does_work_globus_login_does_not(self, mock_popen, mock_isfile):
+    @patch('empiar_depositor.empiar_depositor.run_command')
+    def test_aspera_does_work_globus_login_does_not(self, mock_run, mock_isfile):
         mock_isfile.return_value = True
 
-        mock_popen.return_value.communicate.return_value = (b'Usage: ascp', b'')
-        mock_popen.return_value.returncode = 112
+        mock_run.return_value = (b'Usage: ascp', None, 112)
 
         with capture(empiar_depositor_main, ["ABC123", self.json_path,
                                              "-aascp.exe", "img/entry_thumbnail.gif",
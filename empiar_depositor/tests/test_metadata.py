@@ -0,0 +1,109 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.metadata import diff_sections, gzip_payload
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, json_response
+from mock import patch
+
+redeposited_json = {'deposition': True, 'directory': 'DIR', 'entry_id': 1}
+
+
+class TestMetadata(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_dir = os.path.join(self.tmp_dir, 'state')
+        self.json_input = os.path.join(self.tmp_dir, 'deposition.json')
+        shutil.copy(self.json_path, self.json_input)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_depositor(self, **kwargs):
+        return EmpiarDepositor("ABC123", self.json_input, "", entry_id=1, entry_directory='DIR', quiet=True,
+                               state_dir=self.state_dir, **kwargs)
+
+    def change_title(self, title):
+        with open(self.json_input) as f:
+            document = json.load(f)
+        document['title'] = title
+        with open(self.json_input, 'w') as f:
+            json.dump(document, f)
+
+    def test_diff_sections(self):
+        self.assertEqual(diff_sections({'a': 1, 'b': [1, 2], 'c': 3}, {'a': 1, 'b': [2, 1], 'd': 4}), ['b', 'c', 'd'])
+        self.assertEqual(diff_sections({'a': {'b': 1}}, {'a': {'b': 1}}), [])
+
+    def test_gzip_payload(self):
+        payload = b'{"title": "' + b'a' * 10000 + b'"}'
+        compressed = gzip_payload(payload)
+        self.assertTrue(len(compressed) < 200)
+        self.assertEqual(compressed, gzip_payload(payload))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed)).read(), payload)
+
+    @patch('empiar_depositor.empiar_depositor.requests.put')
+    def test_unchanged(self, mock_put):
+        mock_put.return_value = json_response(200, redeposited_json)
+        self.assertEqual(self.get_depositor().redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.state_dir, 'metadata', 'www.ebi.ac.uk', '1.json')))
+
+        self.assertEqual(self.get_depositor().redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 1)
+
+        # The same entry ID on another server and the full metadata are not skipped
+        self.assertEqual(self.get_depositor(dev=True).redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 2)
+        self.assertEqual(self.get_depositor(full_metadata=True).redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 3)
+        self.assertEqual(self.get_depositor().redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 3)
+
+        self.change_title('New title')
+        self.assertEqual(self.get_depositor().redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 4)
+        self.assertEqual(json.loads(mock_put.call_args[1]['data'].decode('utf-8'))['title'], 'New title')
+
+    @patch('empiar_depositor.empiar_depositor.requests.patch')
+    @patch('empiar_depositor.empiar_depositor.requests.put')
+    def test_patch(self, mock_put, mock_patch):
+        mock_put.return_value = json_response(200, redeposited_json)
+        mock_patch.return_value = json_response(200, redeposited_json)
+        self.assertEqual(self.get_depositor(patch_metadata=True).redeposit(), 0)
+        self.assertFalse(mock_patch.called)
+
+        self.change_title('New title')
+        self.assertEqual(self.get_depositor(patch_metadata=True).redeposit(), 0)
+        self.assertEqual(json.loads(mock_patch.call_args[1]['data'].decode('utf-8')),
+                         {'title': 'New title', 'entry_id': 1})
+        self.assertEqual(mock_put.call_count, 1)
+
+        # The whole JSON is sent if the server does not support PATCH
+        mock_patch.return_value = json_response(405, {'detail': 'Method "PATCH" not allowed.'})
+        self.change_title('Another title')
+        self.assertEqual(self.get_depositor(patch_metadata=True).redeposit(), 0)
+        self.assertEqual(mock_put.call_count, 2)
+        self.assertTrue('imagesets' in json.loads(mock_put.call_args[1]['data'].decode('utf-8')))
+
+    @patch('empiar_depositor.empiar_depositor.requests.put')
+    def test_gzip(self, mock_put):
+        mock_put.return_value = json_response(200, redeposited_json)
+        self.assertEqual(self.get_depositor(gzip_requests=True).redeposit(), 0)
+        self.assertEqual(mock_put.call_args[1]['headers']['Content-Encoding'], 'gzip')
+        data = gzip.GzipFile(fileobj=io.BytesIO(mock_put.call_args[1]['data'])).read()
+        self.assertEqual(json.loads(data.decode('utf-8'))['entry_id'], 1)
+
+        # Uncompressed JSON is sent if the server does not accept it
+        mock_put.side_effect = [json_response(415, {'detail': 'Unsupported media type'}),
+                                json_response(200, redeposited_json)]
+        self.change_title('New title')
+        self.assertEqual(self.get_depositor(gzip_requests=True).redeposit(), 0)
+        self.assertFalse('Content-Encoding' in mock_put.call_args[1]['headers'])
+
+
+if __name__ == '__main__':
+    unittest.main()
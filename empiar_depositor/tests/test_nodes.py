@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.nodes import AsperaNode, rank_nodes
+from empiar_depositor.pack import PackingStage
+from empiar_depositor.plan import RateCache
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess
+from mock import Mock, patch
+
+
+class TestNodes(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.nodes = [AsperaNode.parse('emp_dep@node-1.example.org'),
+                      AsperaNode.parse('emp_dep@node-2.example.org:33002'),
+                      AsperaNode.parse('emp_dep@node-3.example.org')]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse(self):
+        self.assertEqual(str(self.nodes[0]), 'emp_dep@node-1.example.org:33001')
+        self.assertEqual(self.nodes[1].port, 33002)
+        with self.assertRaises(ValueError):
+            AsperaNode.parse('node-1.example.org')
+
+    def test_rank_nodes(self):
+        latencies = {'node-1.example.org': None, 'node-2.example.org': 0.05, 'node-3.example.org': 0.01}
+        ranking = rank_nodes(self.nodes, probe=lambda node: latencies[node.host])
+        self.assertEqual([n['node'] for n in ranking], [self.nodes[2], self.nodes[1], self.nodes[0]])
+
+        # A node with a known rate goes before the nodes that have only been probed
+        rate_cache = RateCache(os.path.join(self.tmp_dir, 'rates.json'))
+        rate_cache.record(self.nodes[1].rate_key, 100 * 1000 ** 2, 10)
+        ranking = rank_nodes(self.nodes, rate_cache, probe=lambda node: latencies[node.host])
+        self.assertEqual([n['node'] for n in ranking], [self.nodes[1], self.nodes[2], self.nodes[0]])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_failover(self, mock_process):
+        mock_process.side_effect = [FakeProcess(returncode=1, output=[b'ascp: failed to connect\n']),
+                                    FakeProcess(returncode=0)]
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, aspera_nodes=self.nodes[:2], ascp_max_restarts=0)
+        emp_dep.aspera_node_order = list(self.nodes[:2])
+
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertTrue(mock_process.call_args_list[0][0][0][-1].startswith('emp_dep@node-1.example.org:'))
+        self.assertTrue('33002' in mock_process.call_args_list[1][0][0])
+        self.assertTrue(mock_process.call_args_list[1][0][0][-1].startswith('emp_dep@node-2.example.org:'))
+        self.assertEqual(emp_dep.get_aspera_nodes(), [self.nodes[1], self.nodes[0]])
+
+    def test_spread_shards(self):
+        data = os.path.join(self.tmp_dir, 'particles')
+        os.makedirs(data)
+        small_files = []
+        for i in range(6):
+            small_files.append(os.path.join(data, 'particle_%d.png' % i))
+            with open(small_files[-1], 'wb') as f:
+                f.write(os.urandom(100))
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, aspera_nodes=self.nodes[:2])
+        emp_dep.aspera_node_order = list(self.nodes[:2])
+        failed = threading.Event()
+        transferred = []
+
+        def aspera_upload_files(paths, base=None, node=None):
+            if node == self.nodes[0]:
+                failed.set()
+                return 1
+            # The second node is still busy when the first node takes a shard
+            failed.wait(5)
+            transferred.append(os.path.basename(paths[0]))
+            return 0
+
+        emp_dep.aspera_upload_files = Mock(side_effect=aspera_upload_files)
+        emp_dep.transfer_files = Mock(return_value=0)
+
+        stage = PackingStage(os.path.join(self.tmp_dir, 'staging'), shard_size=200, min_files=3, spread=True)
+        self.assertEqual(stage.upload_files(emp_dep, small_files, Mock()), 0)
+        # The shard of the failed node has been moved to the other node, or transferred after it if the other node
+        # has already finished
+        transferred.extend(os.path.basename(call[0][0][0]) for call in emp_dep.transfer_files.call_args_list)
+        self.assertEqual(len(transferred), 3)
+        self.assertEqual(len(set(transferred)), 3)
+        self.assertEqual(emp_dep.get_aspera_nodes(), [self.nodes[1], self.nodes[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
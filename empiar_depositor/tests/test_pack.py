@@ -0,0 +1,104 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.pack import PackingStage, pack_shard, parse_size, verify_shard
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+from mock import Mock
+
+
+class TestPack(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'particles')
+        self.staging_dir = os.path.join(self.tmp_dir, 'staging')
+        os.makedirs(os.path.join(self.data, 'stack_1'))
+        os.makedirs(os.path.join(self.data, 'stack_2'))
+        self.small_files = [self.create_file('stack_1/particle_%d.png' % i, 100 + i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_file(self, name, size):
+        path = os.path.join(self.data, name)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        return path
+
+    def get_files(self, paths):
+        return [(path, os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('1M'), 1024 ** 2)
+        self.assertEqual(parse_size('2GiB'), 2 * 1024 ** 3)
+        with self.assertRaises(ValueError):
+            parse_size('1X')
+
+    def test_pack_and_verify(self):
+        directory = os.path.join(self.data, 'stack_1')
+        shard_path = os.path.join(self.tmp_dir, 'shard.tar')
+
+        index = pack_shard(self.get_files(self.small_files), directory, shard_path)
+        self.assertEqual(verify_shard(shard_path), [])
+        with tarfile.open(shard_path) as tar:
+            self.assertEqual(tar.getnames(), [m['name'] for m in index['members']])
+            with open(self.small_files[0], 'rb') as f:
+                self.assertEqual(tar.extractfile('particle_0.png').read(), f.read())
+
+        # The same files produce the same shard
+        self.assertEqual(pack_shard(self.get_files(self.small_files), directory, shard_path)['sha256'],
+                         index['sha256'])
+
+        with open(shard_path, 'r+b') as f:
+            f.seek(index['members'][2]['offset'])
+            f.write(b'X')
+        self.assertEqual(len(verify_shard(shard_path)), 2)
+
+    def test_upload(self):
+        big_file = self.create_file('stack_1/micrograph.mrc', 2000)
+        few_files = [self.create_file('stack_2/particle_%d.png' % i, 100) for i in range(2)]
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True)
+        transferred = []
+
+        def transfer_files(paths, base=None):
+            transferred.append([os.path.relpath(path, base) for path in paths])
+            self.assertEqual(verify_shard(paths[0], paths[1]), [])
+            return 0
+
+        emp_dep.transfer_files = Mock(side_effect=transfer_files)
+        forward = Mock(return_value=0)
+
+        stage = PackingStage(self.staging_dir, threshold=1000, min_files=3)
+        self.assertEqual(stage.upload_files(emp_dep, self.small_files + [big_file] + few_files, forward), 0)
+        forward.assert_called_once_with([big_file] + few_files)
+        self.assertEqual(len(transferred), 1)
+        shard = transferred[0][0]
+        self.assertTrue(shard.startswith('particles/stack_1/stack_1_shard_') and shard.endswith('.tar'))
+        self.assertEqual(transferred[0][1], shard + '.index.json')
+        self.assertFalse(os.path.exists(os.path.join(self.staging_dir, shard)))
+
+    def test_shard_size(self):
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True)
+        shards, unpacked = PackingStage(self.staging_dir, shard_size=250, min_files=3).plan_shards(
+            emp_dep, self.get_files(self.small_files))
+        self.assertEqual([len(files) for directory, shard_path, files in shards], [2, 2, 1])
+        self.assertEqual(unpacked, [])
+
+    def test_failed_transfer(self):
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True)
+        emp_dep.transfer_files = Mock(return_value=1)
+
+        stage = PackingStage(self.staging_dir, shard_size=250, min_files=3)
+        self.assertEqual(stage.upload_files(emp_dep, self.small_files, Mock()), 1)
+        self.assertEqual(emp_dep.transfer_files.call_count, 1)
+        self.assertEqual([files for root, dirs, files in os.walk(self.staging_dir) if files], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
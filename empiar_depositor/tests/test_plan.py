@@ -0,0 +1,95 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor, main
+from empiar_depositor.plan import RateCache, make_plan, scan_sizes, spans_weekend, summarise_imagesets
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, capture
+from mock import patch
+
+
+class TestPlan(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        for name, size in (('movies/movie_1.tif', 2000000), ('movies/movie_2.tif', 2000000),
+                           ('particles/p_1.png', 100), ('particles/p_2.png', 100), ('particles/p_3.png', 100),
+                           ('notes.txt', 10)):
+            path = os.path.join(self.data, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(b'\0' * size)
+
+        self.plan_json = os.path.join(self.tmp_dir, 'deposition.json')
+        with open(self.plan_json, 'w') as f:
+            json.dump({'imagesets': [{'name': 'Movies', 'directory': 'data/micrographs/movies'},
+                                     {'name': 'Particles', 'directory': '/data/micrographs/particles'}]}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_rate_cache(self):
+        cache = RateCache(os.path.join(self.tmp_dir, 'rates.json'))
+
+        self.assertEqual(cache.record('aspera', 1000, 1), None)
+        self.assertEqual(cache.get('aspera'), None)
+        self.assertEqual(cache.record('aspera', 100 * 1000 ** 2, 10), 10 * 1000 ** 2)
+        self.assertEqual(cache.record('aspera', 100 * 1000 ** 2, 5), 15 * 1000 ** 2)
+        self.assertEqual(RateCache(cache.path).get('aspera')['rate'], 15 * 1000 ** 2)
+        self.assertEqual(cache.get('globus'), None)
+
+    def test_imageset_summary(self):
+        summary = summarise_imagesets(self.plan_json, self.data, scan_sizes(self.data, workers=2))
+        totals = dict((name, (totals.files, totals.bytes, totals.small_files)) for name, directory, totals in summary)
+
+        self.assertEqual(totals, {'Movies': (2, 4000000, 0), 'Particles': (3, 300, 3), None: (1, 10, 1)})
+
+    def test_plan(self):
+        rates = {'aspera': {'rate': 1000, 'source': 'probe'}, 'globus': None}
+        friday_evening = datetime.datetime(2026, 10, 16, 17, 0)
+
+        plan = make_plan(self.plan_json, self.data, rates, now=friday_evening)
+        self.assertEqual(plan['total']['files'], 6)
+        self.assertEqual(plan['recommended_backend'], 'aspera')
+        self.assertEqual(plan['backends']['globus']['rate'], None)
+        self.assertTrue(plan['backends']['aspera']['duration'] > 4000)
+        self.assertTrue(any('--compress' in recommendation for recommendation in plan['recommendations']))
+
+        plan = make_plan(self.plan_json, self.data, {'aspera': {'rate': 100, 'source': 'probe'}},
+                         now=friday_evening)
+        self.assertEqual(len(plan['warnings']), 2)
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_probe_aspera(self, mock_process):
+        probes = []
+
+        def process(command, **kwargs):
+            probes.append((command[-1], os.path.getsize(command[-2])))
+            return FakeProcess(returncode=0)
+
+        mock_process.side_effect = process
+        emp_dep = EmpiarDepositor("ABC123", self.plan_json, self.data, "ascp", quiet=True,
+                                  state_dir=os.path.join(self.tmp_dir, 'state'))
+        self.assertTrue(emp_dep.probe_aspera(size=1000) > 0)
+        # The whole file is written before the upload and the server discards it
+        self.assertEqual(probes, [('emp_dep@hx-fasp-1.ebi.ac.uk:faux://', 1000)])
+        self.assertEqual([step.step for step in emp_dep.results], ['rate_probe'])
+
+    def test_spans_weekend(self):
+        self.assertTrue(spans_weekend(datetime.datetime(2026, 10, 16, 17, 0), 18 * 3600))
+        self.assertFalse(spans_weekend(datetime.datetime(2026, 10, 13, 17, 0), 18 * 3600))
+
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_plan_does_not_deposit(self, mock_post):
+        with capture(main, ["ABC123", self.plan_json, self.data, "-g", "endpoint", "--plan",
+                            "--state-dir", self.tmp_dir]) as output:
+            self.assertTrue(output.startswith("Transfer plan for %s\n" % self.data))
+            self.assertTrue("Globus: the transfer rate is not known" in output)
+        self.assertFalse(mock_post.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
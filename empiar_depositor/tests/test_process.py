@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from empiar_depositor.process import KILL_GRACE, NOT_STARTED, BoundedBuffer, Process, run_command
+from empiar_depositor.tests.testutils import EmpiarDepositorTest
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class TestProcess(EmpiarDepositorTest):
+    def test_run_command(self):
+        out, err, returncode = run_command(python('import sys; sys.stdout.write("out"); sys.stdout.flush(); '
+                                                  'sys.stderr.write("err"); sys.exit(3)'), merge_stderr=False)
+        self.assertEqual((out, err, returncode), (b'out', b'err', 3))
+
+        # The arguments reach the program as they are, without a shell
+        argument = 'a "b" $HOME; echo c'
+        out, err, returncode = run_command(python('import sys; sys.stdout.write(sys.argv[1])') + [argument])
+        self.assertEqual((out, err, returncode), (argument.encode('utf-8'), None, 0))
+
+    def test_not_started(self):
+        out, err, returncode = run_command([os.path.join(self.current_dir, 'missing_program')])
+        self.assertEqual(returncode, NOT_STARTED)
+        self.assertTrue(b'missing_program' in out)
+
+    def test_both_outputs(self):
+        # Neither pipe fills up while the other one is read
+        process = Process(python('import sys\nfor i in range(2000):\n    sys.stderr.write("e" * 1000)\n'
+                                 '    sys.stdout.write("o" * 1000)'), output_limit=4096)
+        lengths = {'stdout': 0, 'stderr': 0}
+        for name, data in process.outputs():
+            lengths[name] += len(data)
+        self.assertEqual(process.close(), 0)
+        self.assertEqual(lengths, {'stdout': 2000000, 'stderr': 2000000})
+        self.assertTrue(len(process.output('stderr')) < 4200)
+        self.assertTrue(process.output('stderr').startswith(b'e' * 2048))
+
+    def test_lines(self):
+        process = Process(python('import sys\nfor i in range(3):\n    sys.stdout.write("line %d\\n" % i)\n'
+                                 'sys.stdout.write("end")'))
+        self.assertEqual(list(process.lines()), [b'line 0\n', b'line 1\n', b'line 2\n', b'end'])
+
+        # Progress redrawn in place ends with a carriage return only
+        process = Process(python('import sys, time\nfor i in range(3):\n    sys.stdout.write("%d%%\\r" % i)\n'
+                                 '    sys.stdout.flush()\n    time.sleep(0.05)\nsys.stdout.write("\\r\\ndone\\r\\n")'))
+        self.assertEqual(list(process.lines()), [b'0%\r', b'1%\r', b'2%\r', b'\r\n', b'done\r\n'])
+
+    @unittest.skipUnless(os.name == 'posix', "process groups are POSIX")
+    def test_timeout(self):
+        # The child of the program keeps the output open until it is terminated together with the program
+        started = time.time()
+        process = Process(python('import subprocess, sys, time\n'
+                                 'subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+                                 'time.sleep(60)'), timeout=1)
+        out, err = process.communicate()
+        self.assertTrue(process.timed_out)
+        self.assertNotEqual(process.returncode, 0)
+        self.assertTrue(time.time() - started < KILL_GRACE)
+
+    def test_stop_event(self):
+        stop_event = threading.Event()
+        process = Process(python('import time; time.sleep(60)'), stop_event=stop_event)
+        threading.Timer(0.2, stop_event.set).start()
+        started = time.time()
+        process.communicate()
+        self.assertNotEqual(process.returncode, 0)
+        self.assertTrue(time.time() - started < 30)
+
+    def test_close(self):
+        # A program whose output is not read to the end is killed
+        process = Process(python('import sys\nwhile True:\n    sys.stdout.write("x" * 1000)'))
+        self.assertTrue(next(process.chunks()))
+        self.assertEqual(process.close(), None)
+
+    def test_bounded_buffer(self):
+        buf = BoundedBuffer(10)
+        for i in range(10):
+            buf.write(b'%d' % i * 3)
+        self.assertEqual(buf.getvalue(), b'00011\n[20 bytes omitted]\n88999')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.manifest import Manifest
+from empiar_depositor.resume import ResumePolicy
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, get_file_pair_list
+from mock import Mock, patch
+
+
+class TestResumePolicy(EmpiarDepositorTest):
+    def test_plan(self):
+        journal = Manifest()
+        journal.add([('data/a.tif', 10, 1.0), ('data/b.tif', 10, 1.0)])
+        policy = ResumePolicy(journal, check='sparse', chunk_files=2)
+        files = [('/d/a.tif', 'data/a.tif', 10, 1.0), ('/d/b.tif', 'data/b.tif', 12, 2.0),
+                 ('/d/c.tif', 'data/c.tif', 5, 1.0), ('/d/d.tif', 'data/d.tif', 5, 1.0),
+                 ('/d/e.tif', 'data/e.tif', 5, 1.0)]
+        chunks, skipped = policy.plan(files)
+        self.assertEqual(skipped, files[:1])
+        self.assertEqual(chunks, [(0, files[1:2]), (2, files[2:4]), (2, files[4:])])
+
+    def test_chunk_bytes(self):
+        policy = ResumePolicy(Manifest(), chunk_bytes=10)
+        files = [('/d/a', 'a', 6, 1.0), ('/d/b', 'b', 6, 1.0), ('/d/c', 'c', 20, 1.0)]
+        chunks, skipped = policy.plan(files)
+        self.assertEqual(chunks, [(3, files[:1]), (3, files[1:2]), (3, files[2:])])
+
+
+class TestResumeUpload(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        os.makedirs(self.data)
+        for name in ('movie_1.tif', 'movie_2.tif'):
+            with open(os.path.join(self.data, name), 'wb') as f:
+                f.write(b'data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_depositor(self):
+        return EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                               quiet=True, state_dir=os.path.join(self.tmp_dir, 'state'), resume_check='attributes')
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_resume(self, mock_process):
+        file_lists = []
+
+        def process(command, **kwargs):
+            with open(get_file_pair_list(command)) as f:
+                file_lists.append((command, f.read().splitlines()[1::2]))
+            return FakeProcess(returncode=0)
+
+        mock_process.side_effect = process
+
+        self.assertEqual(self.get_depositor().aspera_upload(), 0)
+        self.assertTrue('-k1' in file_lists[0][0])
+        self.assertEqual(file_lists[0][1], ['micrographs/movie_1.tif', 'micrographs/movie_2.tif'])
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, 'state', 'journals', 'DIR.jsonl')))
+
+        # Only the new file is transferred when the upload is run again
+        with open(os.path.join(self.data, 'movie_3.tif'), 'wb') as f:
+            f.write(b'data')
+        self.assertEqual(self.get_depositor().aspera_upload(), 0)
+        self.assertEqual(file_lists[1][1], ['micrographs/movie_3.tif'])
+
+        # Nothing is left to transfer
+        self.assertEqual(self.get_depositor().aspera_upload(), 0)
+        self.assertEqual(len(file_lists), 2)
+
+        # A file rewritten with the same size is transferred again as a whole, as ascp would compare only the size
+        path = os.path.join(self.data, 'movie_1.tif')
+        with open(path, 'wb') as f:
+            f.write(b'DATA')
+        os.utime(path, (1000000000, 1000000000))
+        self.assertEqual(self.get_depositor().aspera_upload(), 0)
+        self.assertTrue('-k0' in file_lists[2][0])
+        self.assertEqual(file_lists[2][1], ['micrographs/movie_1.tif'])
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_failed_chunk(self, mock_process):
+        mock_process.side_effect = lambda *args, **kwargs: FakeProcess(returncode=1)
+
+        emp_dep = self.get_depositor()
+        emp_dep.ascp_restart_policy.backoff = Mock(return_value=0)
+        self.assertEqual(emp_dep.aspera_upload(), 1)
+        self.assertEqual(len(emp_dep.get_resume_policy().journal), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+import requests
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.retry import MAX_RETRY_AFTER, HostConcurrencyBudget, IdempotencyJournal, RetryPolicy, \
+    parse_retry_after
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, json_response
+from mock import Mock, patch
+
+
+class TestRetryPolicy(EmpiarDepositorTest):
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, budget=HostConcurrencyBudget())
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_retry_on_service_unavailable(self, mock_sleep):
+        send = Mock(side_effect=[json_response(503), json_response(200)])
+
+        r = self.policy.call(send, url="https://www.ebi.ac.uk/empiar/", idempotent=False)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(send.call_count, 2)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_give_up_after_max_attempts(self, mock_sleep):
+        send = Mock(return_value=json_response(429))
+
+        r = self.policy.call(send, url="https://www.ebi.ac.uk/empiar/")
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(send.call_count, 3)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_retry_after_is_honoured(self, mock_sleep):
+        send = Mock(side_effect=[json_response(429, headers={'Retry-After': '30'}), json_response(200)])
+
+        self.policy.call(send, url="https://www.ebi.ac.uk/empiar/")
+        waited = sum(c[0][0] for c in mock_sleep.call_args_list)
+        self.assertTrue(29 < waited <= 30)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_retry_after_is_limited(self, mock_sleep):
+        send = Mock(side_effect=[json_response(503, headers={'Retry-After': '864000'}), json_response(200)])
+
+        self.policy.call(send, url="https://www.ebi.ac.uk/empiar/")
+        waited = sum(c[0][0] for c in mock_sleep.call_args_list)
+        self.assertTrue(waited <= MAX_RETRY_AFTER)
+
+    def test_parse_retry_after_date(self):
+        response = json_response(503, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        self.assertEqual(parse_retry_after(response, now=1445412470), 10)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_ambiguous_failure_not_repeated_for_non_idempotent(self, mock_sleep):
+        send = Mock(side_effect=requests.exceptions.ReadTimeout())
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.policy.call(send, idempotent=False)
+        self.assertEqual(send.call_count, 1)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_connect_timeout_repeated_for_non_idempotent(self, mock_sleep):
+        send = Mock(side_effect=[requests.exceptions.ConnectTimeout(), json_response(200)])
+
+        r = self.policy.call(send, idempotent=False)
+        self.assertEqual(r.status_code, 200)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    def test_gateway_timeout_not_repeated_for_non_idempotent(self, mock_sleep):
+        send = Mock(return_value=json_response(504))
+
+        self.policy.call(send, idempotent=False)
+        self.assertEqual(send.call_count, 1)
+
+
+class TestIdempotentCreation(EmpiarDepositorTest):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    @patch('empiar_depositor.retry.time.sleep')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_same_key_when_busy(self, mock_post, mock_sleep):
+        mock_post.side_effect = [json_response(503),
+                                 json_response(200, {'deposition': True, 'directory': 'DIR', 'entry_id': 1})]
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", state_dir=self.state_dir)
+
+        c = emp_dep.create_new_deposition()
+        self.assertEqual(c, 0)
+        keys = [kwargs['headers']['Idempotency-Key'] for args, kwargs in mock_post.call_args_list]
+        self.assertEqual(len(keys), 2)
+        self.assertEqual(keys[0], keys[1])
+
+    @patch('empiar_depositor.retry.time.sleep')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_not_repeated_after_timeout(self, mock_post, mock_sleep):
+        # The server may have created the entry before the reply was lost
+        mock_post.side_effect = requests.exceptions.ReadTimeout()
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", state_dir=self.state_dir)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            emp_dep.create_new_deposition()
+        self.assertEqual(mock_post.call_count, 1)
+
+        # The entry may exist, so the deposition stops until the user checks it
+        mock_post.side_effect = None
+        mock_post.return_value = json_response(200, {'deposition': True, 'directory': 'DIR', 'entry_id': 1})
+        self.assertEqual(emp_dep.create_new_deposition(), 1)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertTrue('--force-create' in emp_dep.results[-1].errors[0])
+
+    @patch('empiar_depositor.retry.time.sleep')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_forced_after_timeout(self, mock_post, mock_sleep):
+        mock_post.side_effect = requests.exceptions.ReadTimeout()
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", state_dir=self.state_dir)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            emp_dep.create_new_deposition()
+        first_key = mock_post.call_args[1]['headers']['Idempotency-Key']
+
+        mock_post.side_effect = None
+        mock_post.return_value = json_response(200, {'deposition': True, 'directory': 'DIR', 'entry_id': 1})
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", state_dir=self.state_dir)
+        self.assertEqual(emp_dep.create_new_deposition(), 1)
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", state_dir=self.state_dir, force_create=True)
+        self.assertEqual(emp_dep.create_new_deposition(), 0)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_post.call_args[1]['headers']['Idempotency-Key'], first_key)
+
+        journal = IdempotencyJournal(os.path.join(self.state_dir, 'pending_depositions.json'))
+        self.assertEqual(journal.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
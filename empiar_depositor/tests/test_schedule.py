@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.schedule import RateSchedule, RateWindow, parse_days
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess
+from mock import patch
+
+
+def local_time(day, hour, minute=0):
+    """
+    :param day: the day of October 2026, the 19th is a Monday
+    :return: the local time as seconds since epoch
+    """
+    return time.mktime((2026, 10, day, hour, minute, 0, 0, 0, -1))
+
+
+class FakeSchedule:
+    """
+    Schedule whose rate is changed by the test
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def get_rate(self, now=None):
+        return self.rate
+
+    def is_paused(self, now=None):
+        return self.rate == 0
+
+    def next_change(self, now=None):
+        return None
+
+
+class TestSchedule(EmpiarDepositorTest):
+    def setUp(self):
+        self.schedule = RateSchedule([RateWindow.parse('Sun 02:00-04:00 pause'),
+                                      RateWindow.parse('Mon-Fri 08:00-18:00 300'),
+                                      RateWindow.parse('* 22:00-06:00 2G')])
+
+    def test_parse(self):
+        self.assertEqual(parse_days('Fri-Mon'), set([4, 5, 6, 0]))
+        self.assertEqual(parse_days('sat,sun'), set([5, 6]))
+        for value in ('Mon-Fri 08:00-18:00', 'Xyz 08:00-18:00 300', 'Mon 25:00-18:00 300', 'Mon 08:00-18:00 fast'):
+            with self.assertRaises(ValueError):
+                RateWindow.parse(value)
+
+    def test_get_rate(self):
+        self.assertEqual(self.schedule.get_rate(local_time(19, 9)), 300)
+        self.assertEqual(self.schedule.get_rate(local_time(19, 19)), None)
+        # The window of Monday night goes on into Tuesday morning
+        self.assertEqual(self.schedule.get_rate(local_time(20, 5, 59)), 2000)
+        self.assertEqual(self.schedule.get_rate(local_time(25, 3)), 0)
+        self.assertEqual(self.schedule.get_rate(local_time(25, 4)), 2000)
+
+    def test_next_change(self):
+        self.assertEqual(self.schedule.next_change(local_time(19, 9, 30)), local_time(19, 18))
+        self.assertEqual(RateSchedule([]).next_change(local_time(19, 9)), None)
+
+    @patch('empiar_depositor.empiar_depositor.SCHEDULE_POLL_INTERVAL', 0.01)
+    @patch('empiar_depositor.bandwidth.HEARTBEAT_INTERVAL', 0.02)
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_paused_aspera_transfer(self, mock_process):
+        schedule = FakeSchedule(300)
+
+        def pause():
+            schedule.rate = 0
+            threading.Timer(0.2, setattr, (schedule, 'rate', 2000)).start()
+
+        mock_process.side_effect = [FakeProcess(on_start=pause), FakeProcess(returncode=0)]
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, rate_schedule=schedule)
+
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertTrue('300M' in mock_process.call_args_list[0][0][0])
+        self.assertTrue('2000M' in mock_process.call_args_list[1][0][0])
+        self.assertTrue(emp_dep.results[0].paused > 0)
+
+    @patch('empiar_depositor.empiar_depositor.SCHEDULE_POLL_INTERVAL', 0.01)
+    @patch('empiar_depositor.bandwidth.HEARTBEAT_INTERVAL', 0.02)
+    def test_paused_globus_transfer(self):
+        schedule = FakeSchedule(None)
+        commands = []
+
+        def run_globus_task(command, batch_file=None):
+            commands.append(command)
+            if len(commands) == 1:
+                schedule.rate = 0
+                threading.Timer(0.2, setattr, (schedule, 'rate', None)).start()
+                time.sleep(0.1)
+                return 1
+            return 0
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "globus_obj", "", "globusid",
+                                  {"is_dir": "", "obj_name": "globus_obj"}, entry_id=1, entry_directory="entry_dir",
+                                  quiet=True, rate_schedule=schedule)
+        emp_dep.run_globus_task = run_globus_task
+        emp_dep.cancel_globus_task = lambda: None
+
+        self.assertEqual(emp_dep.globus_upload(), 0)
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[1][:6], ['globus', 'transfer', '--sync-level', 'mtime', '--format', 'json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
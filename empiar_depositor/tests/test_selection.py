@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.filelist import scan_index
+from empiar_depositor.selection import Selection, get_selected_paths
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, capture
+from mock import patch
+
+
+class TestSelection(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        for name, size in (('movie_1.tif', 10), ('movie_2.tif', 10), ('motioncorr.log', 3), ('scratch/movie_1.mrc', 5)):
+            path = os.path.join(self.data, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(b'd' * size)
+        self.selection = Selection(['micrographs', 'workflow.json'], exclude=['*.log', 'micrographs/scratch/*'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_selected_paths(self):
+        self.assertEqual(get_selected_paths(self.json_path), ['micrographs', 'workflow.json'])
+
+    def test_matches(self):
+        self.assertTrue(self.selection.matches('micrographs/movie_1.tif'))
+        self.assertTrue(self.selection.matches('micrographs/grid_1/movie_1.tif'))
+        self.assertTrue(self.selection.matches('workflow.json'))
+        self.assertFalse(self.selection.matches('micrographs-2/movie_1.tif'))
+        self.assertFalse(self.selection.matches('workflow.json.bak'))
+        self.assertFalse(self.selection.matches('micrographs/grid_1/motioncorr.log'))
+        self.assertFalse(self.selection.matches('micrographs/scratch/movie_1.tif'))
+
+        selection = Selection(include=['*.tif', '/particles/*.star'], exclude=['movie_2.*'])
+        self.assertTrue(selection.matches('micrographs/movie_1.tif'))
+        self.assertTrue(selection.matches('particles/a.star'))
+        self.assertFalse(selection.matches('a.star'))
+        self.assertFalse(selection.matches('micrographs/movie_2.tif'))
+        self.assertFalse(Selection([]).matches('micrographs/movie_1.tif'))
+
+    def test_select(self):
+        index = scan_index(self.data, self.tmp_dir, selection=self.selection)
+        self.assertEqual([r.path for r in index], ['micrographs/movie_1.tif', 'micrographs/movie_2.tif'])
+
+    @patch('empiar_depositor.empiar_depositor.EmpiarDepositor.transfer_files')
+    def test_upload_selected_data(self, mock_transfer):
+        mock_transfer.return_value = 0
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  selection=self.selection)
+        with capture(emp_dep.upload_data) as output:
+            self.assertTrue('Selected 2 files, 20 B, excluded 2 files, 8 B' in output)
+        self.assertEqual(mock_transfer.call_args[0][0], [os.path.join(self.data, 'movie_1.tif'),
+                                                         os.path.join(self.data, 'movie_2.tif')])
+
+        emp_dep.quiet = True
+        emp_dep.selection = Selection(['particles'])
+        self.assertEqual(emp_dep.upload_data(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.staging import Staging, parse_mapping
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, get_file_pair_list
+from mock import patch
+
+
+class TestStaging(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stage_dir = os.path.join(self.tmp_dir, 'stage')
+        for name in ('run_1/movies/a.tif', 'run_1/movies/b.tif', 'run_2/c.tif', 'gain/gain.dm4'):
+            path = os.path.join(self.tmp_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(name.encode('utf-8'))
+        self.mappings = [parse_mapping(os.path.join(self.tmp_dir, 'run_1') + '=data/movies'),
+                         parse_mapping(os.path.join(self.tmp_dir, 'run_2') + '=/data/movies/run_2'),
+                         parse_mapping(os.path.join(self.tmp_dir, 'gain', 'gain.dm4') + '=gain')]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_mapping(self):
+        self.assertEqual(parse_mapping('/a=b/c=data/micrographs'), ('/a=b/c', 'micrographs'))
+        with self.assertRaises(ValueError):
+            parse_mapping('/a')
+        with self.assertRaises(ValueError):
+            parse_mapping('/a=data')
+
+    def test_file_pairs(self):
+        pairs = Staging(self.mappings).file_pairs()
+        self.assertEqual(sorted(destination for source, destination in pairs),
+                         ['gain/gain.dm4', 'movies/movies/a.tif', 'movies/movies/b.tif', 'movies/run_2/c.tif'])
+        self.assertTrue((os.path.join(self.tmp_dir, 'run_2', 'c.tif'), 'movies/run_2/c.tif') in pairs)
+
+        os.makedirs(os.path.join(self.tmp_dir, 'run_3'))
+        with open(os.path.join(self.tmp_dir, 'run_3', 'c.tif'), 'wb') as f:
+            f.write(b'other')
+        with self.assertRaises(ValueError):
+            Staging(self.mappings + [(os.path.join(self.tmp_dir, 'run_3'), 'movies/run_2')]).file_pairs()
+
+    def test_links(self):
+        for mode in ('hardlink', 'symlink'):
+            root = os.path.join(self.stage_dir, mode)
+            staging = Staging(self.mappings, mode=mode, root=root)
+            pairs = staging.file_pairs()
+            links = staging.link(pairs)
+            self.assertEqual(staging.link(pairs), links)
+            for (source, destination), link in zip(pairs, links):
+                self.assertEqual(link, os.path.join(root, destination))
+                self.assertTrue(os.path.samefile(source, link))
+                self.assertEqual(os.path.islink(link), mode == 'symlink')
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_upload_file_pairs(self, mock_process):
+        file_lists = []
+
+        def process(command, **kwargs):
+            with open(get_file_pair_list(command)) as f:
+                file_lists.append(f.read().splitlines())
+            return FakeProcess(returncode=0)
+
+        mock_process.side_effect = process
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.stage_dir, "ascp", entry_id=1,
+                                  entry_directory='DIR', quiet=True, staging=Staging(self.mappings))
+        self.assertEqual(emp_dep.upload_data(), 0)
+        self.assertEqual(file_lists[0][0::2], [source for source, destination in Staging(self.mappings).file_pairs()])
+        self.assertEqual(file_lists[0][1::2], [destination for source, destination in
+                                               Staging(self.mappings).file_pairs()])
+        self.assertFalse(os.path.exists(self.stage_dir))
+
+    @patch('empiar_depositor.empiar_depositor.EmpiarDepositor.run_globus_transfer')
+    def test_globus_file_pairs(self, mock_transfer):
+        batches = []
+
+        def transfer(command, batch_file):
+            with open(batch_file) as f:
+                batches.append((command, f.read().splitlines()))
+            return 0
+
+        mock_transfer.side_effect = transfer
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.stage_dir, globus="endpoint", entry_id=1,
+                                  entry_directory='DIR', quiet=True, staging=Staging(self.mappings))
+        self.assertEqual(emp_dep.upload_data(), 0)
+        self.assertEqual(batches[0][0][:6], ['globus', 'transfer', '--format', 'json', '--batch',
+                                             'endpoint:%s' % self.tmp_dir])
+        self.assertTrue('run_2/c.tif movies/run_2/c.tif' in batches[0][1])
+
+    @patch('empiar_depositor.empiar_depositor.EmpiarDepositor.transfer_files')
+    def test_upload_links(self, mock_transfer):
+        mock_transfer.return_value = 0
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.stage_dir, "ascp", entry_id=1,
+                                  entry_directory='DIR', quiet=True,
+                                  staging=Staging(self.mappings, mode='hardlink', root=self.stage_dir))
+        self.assertEqual(emp_dep.upload_data(), 0)
+        paths, base = mock_transfer.call_args[0]
+        self.assertEqual(base, self.stage_dir)
+        self.assertTrue(os.path.join(self.stage_dir, 'gain', 'gain.dm4') in paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.nodes import AsperaNode
+from empiar_depositor.process import Process
+from empiar_depositor.supervisor import FATAL, TRANSIENT, UNKNOWN, classify_ascp_failure
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess
+from mock import Mock, patch
+
+NETWORK_ERROR = b'Session Stop  (Error: Network connectivity failure)\n'
+AUTHENTICATION_ERROR = b'ascp: Failed to authenticate, exiting.\n'
+
+
+class TestSupervisor(EmpiarDepositorTest):
+    def get_depositor(self, **kwargs):
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "", "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, **kwargs)
+        emp_dep.ascp_restart_policy.backoff = Mock(return_value=0)
+        return emp_dep
+
+    def test_classify(self):
+        self.assertEqual(classify_ascp_failure(1, ['Completed: 0K bytes', NETWORK_ERROR.decode()]),
+                         (TRANSIENT, 'Session Stop  (Error: Network connectivity failure)'))
+        self.assertEqual(classify_ascp_failure(1, [NETWORK_ERROR.decode(), AUTHENTICATION_ERROR.decode()])[0], FATAL)
+        self.assertEqual(classify_ascp_failure(1, ['Something unexpected', '']), (UNKNOWN, 'Something unexpected'))
+        self.assertEqual(classify_ascp_failure(127, [NETWORK_ERROR.decode()]), (FATAL, None))
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_transient_error(self, mock_process):
+        mock_process.side_effect = [FakeProcess(returncode=1, output=[NETWORK_ERROR]), FakeProcess(returncode=0)]
+        emp_dep = self.get_depositor()
+
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertEqual(mock_process.call_count, 2)
+        self.assertTrue('-k3' in mock_process.call_args_list[1][0][0])
+        emp_dep.ascp_restart_policy.backoff.assert_called_once_with(1)
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_restart_limit(self, mock_process):
+        mock_process.side_effect = lambda *args, **kwargs: FakeProcess(returncode=1, output=[NETWORK_ERROR])
+        emp_dep = self.get_depositor(ascp_max_restarts=2)
+
+        self.assertEqual(emp_dep.aspera_upload(), 1)
+        self.assertEqual(mock_process.call_count, 3)
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_unknown_error(self, mock_process):
+        mock_process.side_effect = lambda *args, **kwargs: FakeProcess(returncode=1, output=[b'Something new\n'])
+        emp_dep = self.get_depositor()
+
+        self.assertEqual(emp_dep.aspera_upload(), 1)
+        self.assertEqual(mock_process.call_count, 3)
+
+    @patch('empiar_depositor.supervisor.STALL_CHECK_INTERVAL', 0.01)
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_stall(self, mock_process):
+        mock_process.side_effect = [FakeProcess(), FakeProcess(returncode=0)]
+        emp_dep = self.get_depositor(ascp_stall_timeout=0.05)
+
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertEqual(mock_process.call_count, 2)
+
+    @patch('empiar_depositor.supervisor.STALL_CHECK_INTERVAL', 0.01)
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_progress_without_line_feeds(self, mock_process):
+        # ascp redraws its progress in place, so its output has no line feeds while the transfer runs
+        progress = 'import sys, time\nfor i in range(10):\n    sys.stdout.write("Completed: %dK bytes\\r" % i)\n' \
+                   '    sys.stdout.flush()\n    time.sleep(0.1)'
+        mock_process.side_effect = lambda command, **kwargs: Process([sys.executable, '-c', progress], **kwargs)
+        emp_dep = self.get_depositor(ascp_stall_timeout=0.5)
+
+        self.assertEqual(emp_dep.aspera_upload(), 0)
+        self.assertEqual(mock_process.call_count, 1)
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_fatal_error(self, mock_process):
+        mock_process.side_effect = [FakeProcess(returncode=1, output=[AUTHENTICATION_ERROR]), FakeProcess(returncode=0)]
+        emp_dep = self.get_depositor(aspera_nodes=[AsperaNode.parse('emp_dep@node-1.example.org'),
+                                                   AsperaNode.parse('emp_dep@node-2.example.org')])
+        emp_dep.aspera_node_order = list(emp_dep.aspera_nodes)
+
+        self.assertEqual(emp_dep.aspera_upload(), 1)
+        self.assertEqual(mock_process.call_count, 1)
+        self.assertEqual(emp_dep.results[0].errors, ['The Aspera transfer has failed: ascp: Failed to authenticate, '
+                                                     'exiting.'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, mock_response
+from empiar_depositor.thumbnail import PNG_SIGNATURE, encode_png, find_representative_image, make_thumbnail, \
+    prepare_thumbnail, read_image
+from mock import patch
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+
+
+def write_mrc(path, frames):
+    nz, ny, nx = frames.shape
+    header = bytearray(1024)
+    header[0:16] = struct.pack('<4i', nx, ny, nz, 2)
+    header[212:214] = b'\x44\x44'
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        f.write(frames.astype('<f4').tobytes())
+
+
+def decode_png(data):
+    """
+    Decode a greyscale PNG with the Sub filter
+    """
+    chunks = {}
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+        chunks[chunk_type] = data[offset + 8:offset + 8 + length]
+        offset += length + 12
+    width, height = struct.unpack('>II', chunks[b'IHDR'][:8])
+    rows = numpy.frombuffer(zlib.decompress(chunks[b'IDAT']), numpy.uint8).reshape(height, width + 1)
+    return numpy.cumsum(rows[:, 1:], axis=1, dtype=numpy.uint64).astype(numpy.uint8)
+
+
+@unittest.skipUnless(numpy is not None and tifffile is not None, "numpy and tifffile are required")
+class TestThumbnail(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        os.makedirs(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_make_thumbnail(self):
+        image = numpy.arange(1000 * 1500, dtype=numpy.float32).reshape(1000, 1500)
+        thumbnail = make_thumbnail(image)
+        self.assertEqual(thumbnail.shape, (500, 500))
+        self.assertEqual(thumbnail.dtype, numpy.uint8)
+        self.assertEqual((thumbnail.min(), thumbnail.max()), (0, 255))
+        self.assertEqual(make_thumbnail(numpy.ones((100, 120))).shape, (400, 400))
+        with self.assertRaises(ValueError):
+            make_thumbnail(numpy.ones((0, 120)))
+
+    def test_encode_png(self):
+        image = numpy.random.RandomState(0).randint(0, 256, (40, 30)).astype(numpy.uint8)
+        data = encode_png(image)
+        self.assertTrue(data.startswith(PNG_SIGNATURE))
+        self.assertTrue(numpy.array_equal(decode_png(data), image))
+
+    def test_read_image(self):
+        frames = numpy.zeros((40, 8, 8), numpy.float32)
+        frames[12:28] = 1
+        path = os.path.join(self.data, 'movie.mrc')
+        write_mrc(path, frames)
+        self.assertTrue(numpy.array_equal(read_image(path), numpy.ones((8, 8))))
+
+        path = os.path.join(self.data, 'movie.tif')
+        tifffile.imwrite(path, frames.astype(numpy.uint16), compression='zlib')
+        self.assertTrue(numpy.array_equal(read_image(path), numpy.ones((8, 8))))
+
+    def test_find_representative_image(self):
+        for i in range(5):
+            write_mrc(os.path.join(self.data, 'movie_%d.mrc' % i), numpy.zeros((1, 8, 8)))
+        self.assertEqual(find_representative_image(self.json_path, self.data)[0],
+                         os.path.join(self.data, 'movie_2.mrc'))
+
+    def test_prepare_thumbnail(self):
+        self.assertEqual(prepare_thumbnail(self.thumbnail_path), None)
+
+        path = os.path.join(self.tmp_dir, 'thumbnail.tif')
+        tifffile.imwrite(path, numpy.random.RandomState(0).randint(0, 4096, (1200, 1200)).astype(numpy.uint16))
+        self.assertEqual(decode_png(prepare_thumbnail(path)).shape, (400, 400))
+
+        with self.assertRaises(ValueError):
+            prepare_thumbnail(None, self.json_path, self.data)
+
+        # A truncated PNG is reported instead of crashing
+        path = os.path.join(self.tmp_dir, 'truncated.png')
+        with open(path, 'wb') as f:
+            f.write(PNG_SIGNATURE + b'\0\0\0\x0dIHDR')
+        with self.assertRaises(ValueError):
+            prepare_thumbnail(path)
+
+    def test_empty_image_skipped(self):
+        # The image in the middle has no pixels, so the next candidate is used
+        for i, shape in enumerate(((1, 8, 8), (1, 8, 8), (1, 0, 8), (1, 8, 8), (1, 8, 8))):
+            write_mrc(os.path.join(self.data, 'movie_%d.mrc' % i), numpy.zeros(shape))
+        self.assertEqual(decode_png(prepare_thumbnail(None, self.json_path, self.data)).shape, (400, 400))
+
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_auto_thumbnail(self, mock_post):
+        mock_post = mock_response(mock_post, status_code=200, headers={'content-type': 'application/json'},
+                                  json={'thumbnail_upload': True})
+        uploaded = []
+        mock_post.side_effect = lambda *args, **kwargs: uploaded.append(
+            (kwargs['files']['file'][0], kwargs['files']['file'][1].read())) or mock_post.return_value
+
+        write_mrc(os.path.join(self.data, 'micrograph.mrc'), numpy.ones((1, 800, 800)))
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, quiet=True, auto_thumbnail=True)
+        self.assertEqual(emp_dep.thumbnail_upload(), 0)
+        self.assertEqual(uploaded[0][0], 'entry_thumbnail.png')
+        self.assertEqual(decode_png(uploaded[0][1]).shape, (400, 400))
+
+        # Without any image in the data the image of the EMDB entry is used
+        os.remove(os.path.join(self.data, 'micrograph.mrc'))
+        self.assertEqual(emp_dep.thumbnail_upload(), 0)
+        self.assertEqual(len(uploaded), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
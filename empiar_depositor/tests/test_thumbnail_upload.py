@@ -1,7 +1,7 @@
 import unittest
 from empiar_depositor.empiar_depositor import EmpiarDepositor
 from mock import patch
-from empiar_depositor.tests.testutils import EmpiarDepositorTest, capture, mock_response
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, capture, json_response, mock_response
 
 
 class TestThumbnailUpload(EmpiarDepositorTest):
@@ -61,6 +61,22 @@ class TestThumbnailUpload(EmpiarDepositorTest):
         c = emp_dep.thumbnail_upload()
         self.assertEqual(c, 0)
 
+    @patch('empiar_depositor.retry.time.sleep')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    def test_retry_sends_whole_file(self, mock_post, mock_sleep):
+        uploaded = []
+        responses = [json_response(503), json_response(200, {'thumbnail_upload': True})]
+        mock_post.side_effect = lambda *args, **kwargs: uploaded.append(kwargs['files']['file'][1].read()) or \
+            responses.pop(0)
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, "",
+                                  entry_thumbnail=self.thumbnail_path)
+
+        c = emp_dep.thumbnail_upload()
+        self.assertEqual(c, 0)
+        with open(self.thumbnail_path, 'rb') as f:
+            self.assertEqual(uploaded, [f.read()] * 2)
+
 
 if __name__ == '__main__':
     unittest.main()
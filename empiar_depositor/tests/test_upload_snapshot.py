@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.filelist import scan_index
+from empiar_depositor.manifest import UploadSnapshot
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, json_response
+from mock import patch
+
+redeposited_json = {'deposition': True, 'directory': 'DIR', 'entry_id': 1}
+submitted_json = {'submission': True, 'empiar_id': 'EMPIAR-10001'}
+
+
+class TestUploadSnapshot(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_dir = os.path.join(self.tmp_dir, 'state')
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        os.makedirs(self.data)
+        for name in ('movie_1.tif', 'movie_2.tif'):
+            with open(os.path.join(self.data, name), 'wb') as f:
+                f.write(b'data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches(self):
+        snapshot = UploadSnapshot(os.path.join(self.state_dir, 'uploads', 'DIR.idx'))
+        index = scan_index(self.data, self.tmp_dir)
+        self.assertFalse(snapshot.matches(index))
+        snapshot.save(index)
+        self.assertTrue(snapshot.matches(scan_index(self.data, self.tmp_dir)))
+        self.assertFalse(snapshot.matches(scan_index(self.data, self.data)))
+
+        os.utime(os.path.join(self.data, 'movie_1.tif'), (1, 1))
+        self.assertFalse(snapshot.matches(scan_index(self.data, self.tmp_dir)))
+
+    def redeposit(self, mock_put, mock_post, mock_process, redeposit_data='auto', ascp_file_list=False):
+        mock_put.return_value = json_response(200, redeposited_json)
+        mock_post.return_value = json_response(200, submitted_json)
+        mock_process.side_effect = lambda *args, **kwargs: FakeProcess(returncode=0)
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True, state_dir=self.state_dir, redeposit_data=redeposit_data,
+                                  ascp_file_list=ascp_file_list)
+        return emp_dep.deposit()
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    @patch('empiar_depositor.empiar_depositor.requests.put')
+    def test_unchanged_data(self, mock_put, mock_post, mock_process):
+        r = self.redeposit(mock_put, mock_post, mock_process)
+        self.assertEqual([step.step for step in r.steps], ['redeposit', 'aspera_upload', 'submit_deposition'])
+        self.assertTrue(os.path.isfile(os.path.join(self.state_dir, 'uploads', 'DIR.idx')))
+
+        r = self.redeposit(mock_put, mock_post, mock_process)
+        self.assertEqual(r.return_value, 0)
+        self.assertEqual([step.step for step in r.steps], ['redeposit', 'submit_deposition'])
+        self.assertEqual(mock_process.call_count, 1)
+
+        # A changed file makes the data upload again
+        with open(os.path.join(self.data, 'movie_3.tif'), 'wb') as f:
+            f.write(b'data')
+        r = self.redeposit(mock_put, mock_post, mock_process)
+        self.assertEqual([step.step for step in r.steps], ['redeposit', 'aspera_upload', 'submit_deposition'])
+
+        r = self.redeposit(mock_put, mock_post, mock_process, redeposit_data='upload')
+        self.assertEqual([step.step for step in r.steps], ['redeposit', 'aspera_upload', 'submit_deposition'])
+
+    @patch('empiar_depositor.empiar_depositor.scan_index')
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    @patch('empiar_depositor.empiar_depositor.requests.put')
+    def test_snapshot_from_file_list(self, mock_put, mock_post, mock_process, mock_scan_index):
+        # Without a snapshot the data is not scanned and the snapshot is made from the list of files of the upload
+        r = self.redeposit(mock_put, mock_post, mock_process, ascp_file_list=True)
+        self.assertEqual(r.return_value, 0)
+        self.assertFalse(mock_scan_index.called)
+
+        snapshot = UploadSnapshot(os.path.join(self.state_dir, 'uploads', 'DIR.idx'))
+        self.assertTrue(snapshot.matches(scan_index(self.data, self.tmp_dir)))
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    @patch('empiar_depositor.empiar_depositor.requests.post')
+    @patch('empiar_depositor.empiar_depositor.requests.put')
+    def test_skip(self, mock_put, mock_post, mock_process):
+        r = self.redeposit(mock_put, mock_post, mock_process, redeposit_data='skip')
+        self.assertEqual(r.return_value, 0)
+        self.assertEqual([step.step for step in r.steps], ['redeposit', 'submit_deposition'])
+        self.assertFalse(mock_process.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
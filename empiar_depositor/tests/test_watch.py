@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from empiar_depositor.empiar_depositor import EmpiarDepositor
+from empiar_depositor.manifest import Manifest
+from empiar_depositor.watch import DataWatcher, StabilityTracker, get_imageset_directories, get_watched_paths
+from empiar_depositor.tests.testutils import EmpiarDepositorTest, FakeProcess, get_file_pair_list
+from mock import Mock, patch
+
+
+class TestWatch(EmpiarDepositorTest):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp_dir, 'micrographs')
+        os.makedirs(os.path.join(self.data, 'movies'))
+        self.manifest_path = os.path.join(self.tmp_dir, 'manifest.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_file(self, name, size=10, age=3600):
+        path = os.path.join(self.data, name)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def get_depositor(self):
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True)
+        emp_dep.upload_files = Mock(return_value=0)
+        return emp_dep
+
+    def test_imageset_directories(self):
+        self.assertEqual(get_imageset_directories(self.json_path, self.data), [self.data])
+        self.assertEqual(get_imageset_directories(self.json_path, os.path.join(self.data, 'movies')),
+                         [os.path.join(self.data, 'movies')])
+
+    def test_watched_paths(self):
+        json_path = os.path.join(self.tmp_dir, 'deposition.json')
+        with open(json_path, 'w') as f:
+            json.dump({'workflow_file': {'path': 'data/micrographs/workflow.json'},
+                       'imagesets': [{'directory': 'data/micrographs/movies'}]}, f)
+        workflow_path = self.create_file('workflow.json')
+        self.create_file('notes.txt')
+        self.create_file('movies/a.tif')
+
+        paths = get_watched_paths(json_path, self.data)
+        self.assertEqual(paths, [os.path.join(self.data, 'movies'), workflow_path])
+
+        emp_dep = self.get_depositor()
+        self.assertEqual(DataWatcher(paths, self.manifest_path, idle_timeout=0).upload(emp_dep), 0)
+        uploaded = sorted(path for args, kwargs in emp_dep.upload_files.call_args_list for path in args[0])
+        self.assertEqual(uploaded, [os.path.join(self.data, 'movies', 'a.tif'), workflow_path])
+
+    def test_stability(self):
+        tracker = StabilityTracker(settle_time=60)
+        now = time.time()
+        old_file = ('old.tif', 10, now - 120)
+
+        self.assertEqual(tracker.update([old_file], now), [])
+        self.assertEqual(tracker.update([old_file, ('new.tif', 10, now)], now + 1), [old_file])
+        self.assertEqual(tracker.update([old_file, ('new.tif', 20, now + 1)], now + 2), [old_file])
+
+    def test_manifest(self):
+        manifest = Manifest(self.manifest_path)
+        manifest.add([('micrographs/a.tif', 10, 1.5)], batch=1)
+        with open(self.manifest_path, 'a') as f:
+            f.write('{"path": "micrographs/b.t')
+
+        manifest = Manifest(self.manifest_path)
+        self.assertTrue(manifest.is_uploaded('micrographs/a.tif', 10, 1.5))
+        self.assertFalse(manifest.is_uploaded('micrographs/a.tif', 20, 1.5))
+        self.assertFalse('micrographs/b.tif' in manifest)
+
+    def test_reconcile_in_batches(self):
+        for name in ('a.tif', 'b.tif', 'movies/c.tif', '.hidden', 'd.tif.part'):
+            self.create_file(name)
+        emp_dep = self.get_depositor()
+
+        watcher = DataWatcher([self.data], self.manifest_path, poll_interval=0, idle_timeout=0, batch_size=2)
+        self.assertEqual(watcher.upload(emp_dep), 0)
+        self.assertEqual(emp_dep.upload_files.call_count, 2)
+        uploaded = sorted(path for args, kwargs in emp_dep.upload_files.call_args_list for path in args[0])
+        self.assertEqual(uploaded, [os.path.join(self.data, name) for name in ('a.tif', 'b.tif', 'movies/c.tif')])
+
+        manifest = Manifest(self.manifest_path)
+        self.assertEqual(len(manifest), 3)
+        self.assertEqual(manifest.get('micrographs/movies/c.tif')['batch'], 2)
+
+        # Nothing is uploaded again after a restart
+        emp_dep = self.get_depositor()
+        self.assertEqual(DataWatcher([self.data], self.manifest_path, idle_timeout=0).upload(emp_dep), 0)
+        self.assertFalse(emp_dep.upload_files.called)
+
+    def test_upload_while_acquiring(self):
+        self.create_file('a.tif')
+        emp_dep = self.get_depositor()
+        emp_dep.stop_event = Mock()
+        emp_dep.stop_event.is_set.return_value = False
+        # The acquisition finishes during the first wait between the scans
+        emp_dep.stop_event.wait.side_effect = lambda timeout: self.create_file('DONE')
+
+        watcher = DataWatcher([self.data], self.manifest_path, settle_time=60, idle_timeout=None,
+                              complete_file='DONE')
+        self.assertEqual(watcher.upload(emp_dep), 0)
+        emp_dep.upload_files.assert_called_once_with([os.path.join(self.data, 'a.tif')])
+
+    def test_failed_batch(self):
+        self.create_file('a.tif')
+        emp_dep = self.get_depositor()
+        emp_dep.upload_files.return_value = 1
+
+        self.assertEqual(DataWatcher([self.data], self.manifest_path, idle_timeout=0).upload(emp_dep), 1)
+        self.assertEqual(len(Manifest(self.manifest_path)), 0)
+
+    @patch('empiar_depositor.empiar_depositor.Process')
+    def test_aspera_file_list(self, mock_process):
+        file_lists = []
+
+        def process(command, **kwargs):
+            file_list = get_file_pair_list(command)
+            with open(file_list) as f:
+                file_lists.append(f.read())
+            return FakeProcess(returncode=0)
+
+        mock_process.side_effect = process
+        path = self.create_file('a.tif')
+
+        emp_dep = EmpiarDepositor("ABC123", self.json_path, self.data, "ascp", entry_id=1, entry_directory='DIR',
+                                  quiet=True)
+        self.assertEqual(emp_dep.aspera_upload_files([path]), 0)
+        self.assertTrue(mock_process.call_args[0][0][-1].endswith(':upload/DIR/data'))
+        self.assertEqual(file_lists, [path + '\n' + os.path.basename(self.data) + '/a.tif\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
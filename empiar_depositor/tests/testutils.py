@@ -1,6 +1,7 @@
 import os
 import unittest
 import sys
+import time
 from contextlib import contextmanager
 from mock import Mock, PropertyMock
 from requests.models import Response
@@ -62,3 +63,79 @@ def mock_response(mocked_response=None, status_code=None, headers=None, json=Non
         mocked_response.return_value.json.return_value = json
 
     return mocked_response
+
+
+def json_response(status_code, json=None, headers=None):
+    """
+    Create a mock of a response with JSON content type
+    :param status_code: mock status code of the response
+    :param json: mock returned JSON from the response
+    :param headers: additional headers of the response
+    :return: Mocked response
+    """
+    response = Mock(spec=Response)
+    response.status_code = status_code
+    response.headers = {'content-type': 'application/json'}
+    if headers:
+        response.headers.update(headers)
+    response.json.return_value = json
+    return response
+
+
+def get_file_pair_list(command):
+    """
+    :param command: argv of ascp
+    :return: the location of the file pair list that is passed to ascp
+    """
+    return [arg for arg in command if arg.startswith('--file-pair-list=')][0].split('=', 1)[1]
+
+
+class FakeProcess:
+    """
+    Program that runs until it is terminated or finishes once its output has been read with the given return code
+    """
+
+    def __init__(self, returncode=None, on_start=None, output=None):
+        self.returncode = returncode
+        self.on_start = on_start
+        self.output_lines = list(output or [])
+        self.stdout = b''.join(self.output_lines)
+        self.error = None
+        self.finished = False
+        self.killed = False
+
+    def lines(self):
+        if self.on_start:
+            self.on_start()
+            self.on_start = None
+        while self.output_lines:
+            yield self.output_lines.pop(0)
+        while self.returncode is None:
+            time.sleep(0.01)
+        self.finished = True
+
+    def chunks(self):
+        return self.lines()
+
+    def output(self):
+        return self.stdout
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+
+    def close(self, drain=False):
+        if drain:
+            for line in self.lines():
+                pass
+        if not self.finished:
+            self.killed = True
+            return None
+        return self.returncode
+
+    def communicate(self):
+        for line in self.lines():
+            pass
+        return self.stdout, None
@@ -0,0 +1,247 @@
+# encoding: utf-8
+"""
+thumbnail.py
+
+Thumbnails of the entries: made from a representative micrograph or tomogram slice of the data, or from the image
+provided by the user, as PNG of the size that EMPIAR accepts.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import io
+import os
+import struct
+import zlib
+
+from empiar_depositor.compress import MRC_EXTENSIONS, TIFF_EXTENSIONS, Movie
+from empiar_depositor.watch import get_imageset_directories, scan_files
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# The smallest width and height that EMPIAR accepts
+THUMBNAIL_SIZE = 400
+# Provided thumbnails that are larger, in bytes or pixels, or are not PNG are converted
+THUMBNAIL_MAX_BYTES = 1024 ** 2
+THUMBNAIL_MAX_SIZE = 2 * THUMBNAIL_SIZE
+# The number of the central frames or slices that are averaged, which brings out the contrast of movies and tomograms
+THUMBNAIL_FRAMES = 16
+# The number of the image files listed to pick the one in the middle
+THUMBNAIL_CANDIDATES = 101
+# The contrast is stretched between these percentiles
+CONTRAST_PERCENTILES = (1, 99)
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def thumbnail_available():
+    """
+    :return: None if the thumbnails can be made from the data, otherwise the list of missing Python modules
+    """
+    return None if numpy is not None else ['numpy']
+
+
+def read_image(path, frames=THUMBNAIL_FRAMES):
+    """
+    Read the average of the central frames or slices of an MRC or TIFF file. MRC files are memory mapped, so only the
+    central frames are read
+    :param path: the location of the file
+    :param frames: the number of the central frames that are averaged
+    :return: 2D float32 numpy array
+    :raises ValueError: if the file cannot be read
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in MRC_EXTENSIONS:
+        stack = Movie.open_mrc(path)
+        if stack.shape[0] == 0:
+            raise ValueError("%s has no images" % path)
+        start = max(0, (stack.shape[0] - frames) // 2)
+        return stack[start:start + frames].astype(numpy.float32).mean(axis=0)
+
+    if extension in TIFF_EXTENSIONS and tifffile is not None:
+        with tifffile.TiffFile(path) as tiff:
+            pages = tiff.pages
+            start = max(0, (len(pages) - frames) // 2)
+            image = None
+            for i in range(start, min(len(pages), start + frames)):
+                page = pages[i].asarray().astype(numpy.float32)
+                if page.ndim != 2:
+                    raise ValueError("%s is not a greyscale image" % path)
+                image = page if image is None else image + page
+            if image is None:
+                raise ValueError("%s has no images" % path)
+            return image / (i - start + 1)
+    raise ValueError("%s cannot be read" % path)
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """
+    Bin the image, crop it to a square and stretch its contrast
+    :param image: 2D numpy array
+    :param size: the smallest width and height of the thumbnail
+    :return: 2D uint8 numpy array, square with a side of at least size and less than twice size
+    :raises ValueError: if the image is empty
+    """
+    height, width = image.shape
+    side = min(height, width)
+    if side == 0:
+        raise ValueError("The image of %d x %d pixels is empty" % (width, height))
+    if side < size:
+        # Small images are enlarged by repeating their pixels
+        factor = -(-size // side)
+        image = numpy.repeat(numpy.repeat(image, factor, axis=0), factor, axis=1)
+        height, width = image.shape
+        side = min(height, width)
+
+    factor = side // size
+    side = side // factor * factor
+    top = (height - side) // 2
+    left = (width - side) // 2
+    image = image[top:top + side, left:left + side]
+    if factor > 1:
+        image = image.reshape(side // factor, factor, side // factor, factor).mean(axis=(1, 3))
+
+    # The percentiles of a subsample are close enough and much faster for large images
+    step = max(1, image.shape[0] // 256)
+    low, high = numpy.percentile(image[::step, ::step], CONTRAST_PERCENTILES)
+    if high <= low:
+        return numpy.full(image.shape, 128, numpy.uint8)
+    image = (image - low) * (255.0 / (high - low))
+    return numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + \
+        struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def encode_png(image):
+    """
+    Encode a greyscale image as PNG. Each row is stored as the differences of the neighbouring pixels (the Sub
+    filter), which compresses well for micrographs
+    :param image: 2D uint8 numpy array
+    :return: bytes of the PNG file
+    """
+    height, width = image.shape
+    filtered = numpy.empty((height, width + 1), numpy.uint8)
+    filtered[:, 0] = 1
+    filtered[:, 1] = image[:, 0]
+    filtered[:, 2:] = image[:, 1:] - image[:, :-1]
+    return PNG_SIGNATURE + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) + \
+        png_chunk(b'IDAT', zlib.compress(filtered.tobytes(), 9)) + png_chunk(b'IEND', b'')
+
+
+def find_representative_image(json_input, data):
+    """
+    Pick a representative micrograph or tomogram from the image sets: the one in the middle of the first MRC or TIFF
+    files, which are less likely to be test exposures than the very first one
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :return: the locations of the candidate images, the most representative first
+    """
+    if os.path.isfile(data):
+        return [data]
+
+    candidates = []
+    for path, size, mtime in scan_files(get_imageset_directories(json_input, data)):
+        if size and os.path.splitext(path)[1].lower() in MRC_EXTENSIONS + TIFF_EXTENSIONS:
+            candidates.append(path)
+            if len(candidates) >= THUMBNAIL_CANDIDATES:
+                break
+    middle = len(candidates) // 2
+    return [path for i, path in sorted(enumerate(candidates), key=lambda candidate: abs(candidate[0] - middle))]
+
+
+def is_acceptable(path):
+    """
+    :param path: the location of the provided thumbnail
+    :return: True if the thumbnail is a PNG that is small enough to be uploaded as it is
+    :raises ValueError: if the PNG is too short to have a header
+    """
+    if os.path.getsize(path) > THUMBNAIL_MAX_BYTES:
+        return False
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if header[:8] != PNG_SIGNATURE:
+        return False
+    if len(header) < 24:
+        raise ValueError("%s is a truncated PNG file" % path)
+    width, height = struct.unpack('>II', header[16:24])
+    return max(width, height) <= THUMBNAIL_MAX_SIZE
+
+
+def convert_image(path):
+    """
+    Resize a provided image with Pillow so that its smaller side is the thumbnail size and recompress it as PNG
+    :param path: the location of the image
+    :return: bytes of the PNG file
+    """
+    image = Image.open(path)
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+    scale = float(THUMBNAIL_SIZE) / min(image.size)
+    if scale < 1:
+        image = image.resize((max(THUMBNAIL_SIZE, int(round(image.size[0] * scale))),
+                              max(THUMBNAIL_SIZE, int(round(image.size[1] * scale)))), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def prepare_thumbnail(path=None, json_input=None, data=None):
+    """
+    Make the PNG thumbnail that is uploaded. A provided PNG that is small enough is used as it is, MRC and TIFF files
+    are converted like the data and other images are converted with Pillow
+    :param path: the location of the provided thumbnail or None to make one from the data
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :return: bytes of the PNG file or None if the provided file can be uploaded as it is
+    :raises ValueError: if no thumbnail can be made
+    """
+    if path is None:
+        if numpy is None:
+            raise ValueError("numpy is required to make the thumbnail from the data")
+        for candidate in find_representative_image(json_input, data):
+            try:
+                return encode_png(make_thumbnail(read_image(candidate)))
+            except (ValueError, IOError, OSError):
+                continue
+        raise ValueError("No MRC or TIFF image of the image sets can be read to make the thumbnail")
+
+    if is_acceptable(path):
+        return None
+    if numpy is not None and os.path.splitext(path)[1].lower() in MRC_EXTENSIONS + TIFF_EXTENSIONS:
+        try:
+            return encode_png(make_thumbnail(read_image(path)))
+        except ValueError:
+            # An RGB TIFF is converted with Pillow
+            if Image is None:
+                raise
+    if Image is not None:
+        return convert_image(path)
+    if os.path.getsize(path) > THUMBNAIL_MAX_BYTES:
+        raise ValueError("%s is larger than %d bytes, please install Pillow to convert it to a PNG thumbnail" %
+                         (path, THUMBNAIL_MAX_BYTES))
+    return None
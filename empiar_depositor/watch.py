@@ -0,0 +1,327 @@
+# encoding: utf-8
+"""
+watch.py
+
+Watch mode: upload the data to EMPIAR while the acquisition is still running.
+
+Copyright [2026] EMBL - European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in
+compliance with the License. You may obtain a copy of
+the License at
+http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied. See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+import json
+import os
+import time
+
+from empiar_depositor.manifest import Manifest
+
+# Acquisition software often writes to a temporary name and renames the file once it is complete
+TEMPORARY_SUFFIXES = ('.tmp', '.part', '.partial', '.swp', '~')
+# The number of reconciliation passes after which files that keep changing are reported as an error
+MAX_RECONCILIATION_PASSES = 3
+
+
+def is_temporary(name):
+    """
+    :param name: file name
+    :return: True if the file is hidden or is being written under a temporary name
+    """
+    return name.startswith('.') or name.endswith(TEMPORARY_SUFFIXES)
+
+
+def get_local_directory(directory, data):
+    """
+    Find the local directory of an image set. The data is uploaded into the data directory of the entry, so an image
+    set directory data/micrographs corresponds to the micrographs directory next to or within the data
+    :param directory: the image set directory from the deposition JSON
+    :param data: the location of the data
+    :return: the local directory
+    """
+    data_base = os.path.dirname(os.path.abspath(data))
+    directory = (directory or '').strip('/')
+    if directory == 'data' or directory.startswith('data/'):
+        directory = directory[len('data'):].strip('/')
+    return os.path.normpath(os.path.join(data_base, directory))
+
+
+def is_within(path, directory):
+    """
+    :return: True if the path is the directory or is located in it
+    """
+    return path == directory or path.startswith(directory + os.path.sep)
+
+
+def get_imageset_directories(json_input, data, imageset_filter=None):
+    """
+    Find the local directories of the image sets specified in the deposition JSON
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :param imageset_filter: function that selects the image sets by their JSON, all image sets by default
+    :return: list of existing or future image set directories within the data or the data itself if none are found
+    """
+    data = os.path.abspath(data)
+    with open(json_input) as f:
+        deposition = json.load(f)
+
+    directories = []
+    for imageset in deposition.get('imagesets') or []:
+        if not imageset.get('directory') or (imageset_filter and not imageset_filter(imageset)):
+            continue
+
+        local_directory = get_local_directory(imageset['directory'], data)
+        if is_within(local_directory, data):
+            directories.append(local_directory)
+        elif is_within(data, local_directory):
+            directories.append(data)
+
+    # Nested directories are watched as part of their parents
+    directories = sorted(set(directories))
+    directories = [d for d in directories if not any(d.startswith(p + os.path.sep) for p in directories)]
+    if imageset_filter:
+        return directories
+    return directories or [data]
+
+
+def get_watched_paths(json_input, data):
+    """
+    Find the local paths that are uploaded in watch mode: the image set directories and the workflow file
+    :param json_input: the location of the JSON with EMPIAR deposition information
+    :param data: the location of the data
+    :return: list of directories and files within the data
+    """
+    data = os.path.abspath(data)
+    paths = get_imageset_directories(json_input, data)
+    with open(json_input) as f:
+        deposition = json.load(f)
+
+    workflow_path = (deposition.get('workflow_file') or {}).get('path')
+    if workflow_path:
+        local_path = get_local_directory(workflow_path, data)
+        if is_within(local_path, data) and not any(is_within(local_path, path) for path in paths):
+            paths.append(local_path)
+    return paths
+
+
+def scan_files(directories, exclude=()):
+    """
+    List the files in the directories
+    :param directories: list of directories and files
+    :param exclude: names of the files that are not part of the data
+    :return: generator of (path, size, mtime) tuples
+    """
+    for directory in directories:
+        if os.path.isfile(directory):
+            st = os.stat(directory)
+            yield directory, st.st_size, st.st_mtime
+            continue
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                if is_temporary(name) or name in exclude:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # The file has been renamed or removed since the directory was listed
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+
+def list_files(data):
+    """
+    :param data: the location of the data
+    :return: the locations of all files of the data
+    """
+    data = os.path.abspath(data)
+    if os.path.isfile(data):
+        return [data]
+    return [path for path, size, mtime in scan_files([data])]
+
+
+class StabilityTracker:
+    """
+    The :class:`StabilityTracker <StabilityTracker>` object decides which files have been completely written. A file
+    is stable once its size and modification time have not changed between two scans and it has not been modified for
+    at least settle_time seconds.
+    """
+
+    def __init__(self, settle_time=60):
+        self.settle_time = settle_time
+        self.seen = {}
+        self.last_change = time.time()
+
+    def update(self, files, now=None):
+        """
+        :param files: list of (path, size, mtime) tuples from the current scan
+        :param now: the time of the scan
+        :return: list of (path, size, mtime) tuples of the stable files
+        """
+        if now is None:
+            now = time.time()
+
+        stable = []
+        seen = {}
+        for path, size, mtime in files:
+            previous = self.seen.get(path)
+            seen[path] = (size, mtime)
+            if previous != (size, mtime):
+                self.last_change = now
+            elif now - mtime >= self.settle_time:
+                stable.append((path, size, mtime))
+
+        self.seen = seen
+        return stable
+
+
+class DataWatcher:
+    """
+    The :class:`DataWatcher <DataWatcher>` object uploads the files of the watched paths in rolling batches
+    as soon as they are stable, records them in the manifest and, once the acquisition has finished, makes a final
+    reconciliation pass that uploads everything that is missing or has changed since its upload
+    """
+
+    def __init__(self, directories, manifest_path=None, settle_time=60, poll_interval=30, idle_timeout=3600,
+                 complete_file=None, batch_size=1000):
+        """
+        :param directories: the directories and files to watch
+        :param manifest_path: the location of the manifest, by default in the manifests directory of the state
+        directory of the depositor
+        :param settle_time: the number of seconds a file has to remain unchanged before it is uploaded
+        :param poll_interval: the number of seconds between the scans of the directories
+        :param idle_timeout: the acquisition is considered finished if no files have appeared or changed for this
+        number of seconds
+        :param complete_file: the name of the file within the data that marks the end of the acquisition
+        :param batch_size: the maximum number of files uploaded in one transfer
+        """
+        self.directories = directories
+        self.manifest_path = manifest_path
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.complete_file = complete_file
+        self.batch_size = max(1, batch_size)
+        self.batch = 0
+
+    def get_manifest(self, depositor):
+        manifest_path = self.manifest_path
+        if manifest_path is None and depositor.state_dir:
+            manifest_path = os.path.join(depositor.state_dir, 'manifests', '%s.jsonl' % depositor.entry_id)
+        manifest = Manifest(manifest_path)
+        self.batch = max([record.get('batch') or 0 for record in manifest.files.values()] or [0])
+        return manifest
+
+    def is_complete(self, depositor, tracker, now):
+        """
+        :return: True if the acquisition has finished
+        """
+        if self.complete_file:
+            complete_path = self.complete_file
+            if not os.path.isabs(complete_path):
+                complete_path = os.path.join(depositor.data, complete_path)
+            if os.path.exists(complete_path):
+                depositor.log("Found %s, the acquisition has finished.\n" % complete_path)
+                return True
+
+        if self.idle_timeout is not None and now - tracker.last_change >= self.idle_timeout:
+            depositor.log("No new files for %d seconds, the acquisition is considered finished.\n" %
+                          self.idle_timeout)
+            return True
+
+        return False
+
+    def pending_files(self, depositor, manifest, files):
+        """
+        :return: the files that have not been uploaded in their current version
+        """
+        return [(path, size, mtime) for path, size, mtime in files
+                if not manifest.is_uploaded(os.path.relpath(path, depositor.data_base), size, mtime)]
+
+    def upload_batches(self, depositor, manifest, files):
+        """
+        Upload the files in batches and record them in the manifest
+        :param depositor: EmpiarDepositor object
+        :param manifest: Manifest object
+        :param files: list of (path, size, mtime) tuples
+        :return: 0 if all files have been uploaded
+        """
+        for i in range(0, len(files), self.batch_size):
+            if depositor.stop_event.is_set():
+                return 1
+
+            batch_files = files[i:i + self.batch_size]
+            self.batch += 1
+            depositor.log("Uploading batch %d: %d files, %d bytes...\n" %
+                          (self.batch, len(batch_files), sum(size for path, size, mtime in batch_files)))
+            upload_code = depositor.upload_files([path for path, size, mtime in batch_files])
+            if upload_code != 0:
+                depositor.log("The upload of batch %d was not successful.\n" % self.batch, error=True)
+                return upload_code
+
+            manifest.add([(os.path.relpath(path, depositor.data_base), size, mtime)
+                          for path, size, mtime in batch_files], batch=self.batch)
+
+        return 0
+
+    def reconcile(self, depositor, manifest):
+        """
+        Upload all files that are missing from the manifest or have changed since their upload
+        :param depositor: EmpiarDepositor object
+        :param manifest: Manifest object
+        :return: 0 if all files of the data have been uploaded
+        """
+        depositor.log("Reconciling the uploaded files with the data...\n")
+        exclude = (os.path.basename(self.complete_file),) if self.complete_file else ()
+        for reconciliation_pass in range(MAX_RECONCILIATION_PASSES):
+            pending = self.pending_files(depositor, manifest, scan_files(self.directories, exclude))
+            if not pending:
+                depositor.log("All %d files have been uploaded, %d bytes in total.\n" % (len(manifest), manifest.size))
+                return 0
+
+            upload_code = self.upload_batches(depositor, manifest, pending)
+            if upload_code != 0:
+                return upload_code
+
+        depositor.log("Files keep changing after the end of the acquisition, the upload is not complete.\n",
+                      error=True)
+        return 1
+
+    def upload(self, depositor):
+        """
+        Watch the directories and upload the stable files until the acquisition has finished, then reconcile
+        :param depositor: EmpiarDepositor object whose deposition has been created
+        :return: 0 if all files have been uploaded
+        """
+        manifest = self.get_manifest(depositor)
+        tracker = StabilityTracker(self.settle_time)
+        exclude = (os.path.basename(self.complete_file),) if self.complete_file else ()
+        depositor.log("Watching %s for new files. %d files have been uploaded before.\n" %
+                      (', '.join(self.directories), len(manifest)))
+        if os.path.abspath(depositor.data) not in self.directories:
+            depositor.log("Only the image set directories and the workflow file are uploaded in watch mode, other "
+                          "files in %s have to be uploaded separately.\n" % depositor.data)
+
+        while not depositor.stop_event.is_set():
+            now = time.time()
+            stable = tracker.update(scan_files(self.directories, exclude), now)
+            pending = self.pending_files(depositor, manifest, stable)
+            if pending:
+                upload_code = self.upload_batches(depositor, manifest, pending)
+                if upload_code != 0:
+                    return upload_code
+
+            if self.is_complete(depositor, tracker, now):
+                return self.reconcile(depositor, manifest)
+
+            depositor.stop_event.wait(self.poll_interval)
+
+        return 1
@@ -21,6 +21,10 @@ setup(
     keywords="EMPIAR, deposition, microscopy",
     include_package_data=True,
     install_requires=["requests"],
+    extras_require={
+        'compress': ["numpy", "tifffile"],
+        'thumbnail': ["numpy", "tifffile", "Pillow"],
+    },
     classifiers=[
         # maturity
         'Development Status :: 4 - Beta',
@@ -36,6 +40,8 @@ setup(
         'Programming Language :: Python :: 3.7',
     ],
     entry_points={
-        'console_scripts': ['empiar-depositor = empiar_depositor.empiar_depositor:main'],
+        'console_scripts': ['empiar-depositor = empiar_depositor.empiar_depositor:main',
+                            'empiar-depositor-daemon = empiar_depositor.daemon:main',
+                            'empiar-depositor-client = empiar_depositor.client:main'],
     }
 )